@@ -3,10 +3,17 @@ import os, time
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
 import models 
-import crud, schemas
+import crud, crud_async, schemas
 import config
-from database import SessionLocal
+from database import SessionLocal, SessionLectura
+from database_async import get_async_db
 import websocket_manager
+import reproduccion_automatica
+import precarga_pitch
+import servicio_puntuacion
+import cache_audio
+import escritor_unico
+import reportes
 from security import api_key_auth, MASTER_API_KEY
 
 router = APIRouter(dependencies=[Depends(api_key_auth)])
@@ -30,6 +37,14 @@ def get_db():
     finally:
         db.close()
 
+def get_db_lectura():
+    # Pool de solo lectura: no espera al escritor
+    db = SessionLectura()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # --- Auth Endpoints (Logging In) ---
 @public_router.post("/auth/login", response_model=schemas.AdminLoginResponse, summary="Iniciar sesión como administrador")
 def admin_login(login_data: schemas.AdminLoginRequest, db: Session = Depends(get_db)):
@@ -112,6 +127,70 @@ async def reset_night(background_tasks: BackgroundTasks, db: Session = Depends(g
     
     return Response(status_code=204)
 
+@router.post("/consumos/reconciliar-totales", status_code=200, summary="Recalcular los totales de consumo de mesas y cuentas")
+def reconciliar_totales_consumo(db: Session = Depends(get_db)):
+    """
+    **[Admin]** Recalcula desde la tabla de consumos el total acumulado de cada mesa
+    y cuenta, y corrige los que estén desincronizados. Devuelve los IDs corregidos.
+    """
+    return crud.reconciliar_totales_consumo(db)
+
+@router.get("/websocket/metricas", summary="Ver los contadores de envíos por WebSocket")
+def ver_metricas_websocket():
+    """
+    **[Admin]** Conexiones activas y avisos de cola solicitados frente a los
+    realmente enviados (los demás se agruparon o no traían cambios).
+    """
+    return websocket_manager.manager.metricas()
+
+@router.get("/player/metricas", summary="Ver el estado del autoplay y el silencio entre canciones")
+def ver_metricas_reproduccion():
+    """
+    **[Admin]** Canción que controla el temporizador del servidor, avances
+    automáticos y segundos de silencio entre el fin de una canción y la siguiente.
+    """
+    return reproduccion_automatica.temporizador.metricas()
+
+@router.get("/puntuacion-ia/metricas", summary="Ver la cola de puntuaciones por IA")
+def ver_metricas_puntuacion_ia():
+    """
+    **[Admin]** Trabajos de `scoring_jobs` por estado (backlog), puntuaciones
+    completadas en la última hora y su duración media, y reintentos.
+    """
+    return servicio_puntuacion.servicio.metricas()
+
+@router.get("/precarga-pitch/metricas", summary="Ver la precarga del pitch original y su tasa de aciertos")
+def ver_metricas_precarga_pitch():
+    """
+    **[Admin]** Canciones en proceso, precargas completadas o fallidas y cuántas
+    canciones empezaron a sonar con su pitch ya preparado (aciertos) o sin él (fallos).
+    """
+    return precarga_pitch.precarga.metricas()
+
+@router.get("/escritor/metricas", summary="Ver el escritor único y sus commits agrupados")
+def ver_metricas_escritor():
+    """
+    **[Admin]** Comandos de escritura atendidos, lotes confirmados (comandos por
+    commit), comandos que fallaron y tiempo medio en cola.
+    """
+    return escritor_unico.escritor.metricas()
+
+@router.get("/cache-audio/metricas", summary="Ver el uso de disco de las cachés de audio")
+def ver_metricas_cache_audio():
+    """
+    **[Admin]** Tamaño de las cachés de audio (descargas, pistas de Demucs y pitch)
+    frente al presupuesto, aciertos y fallos de la caché de pitch y expulsiones por categoría.
+    """
+    return cache_audio.cache.estadisticas()
+
+@router.post("/cache-audio/recortar", summary="Recortar ahora las cachés de audio al presupuesto")
+def recortar_cache_audio(db: Session = Depends(get_db)):
+    """
+    **[Admin]** Expulsa por antigüedad de uso (primero las pistas de Demucs) hasta
+    quedar dentro del presupuesto, sin tocar las canciones en cola o sonando.
+    """
+    return {"expulsadas": cache_audio.cache.recortar_con_cola(db)}
+
 @router.post("/set-closing-time", status_code=200, summary="Establecer la hora de cierre")
 def set_closing_time(closing_time: schemas.ClosingTimeUpdate, db: Session = Depends(get_db)):
     """
@@ -538,19 +617,19 @@ def get_inactive_users_report(db: Session = Depends(get_db)):
     return inactive_users
 
 @router.post("/songs/{cancion_id}/move-to-top", status_code=200, summary="Mover una canción al principio de la cola")
-async def move_song_to_top_endpoint(cancion_id: int, db: Session = Depends(get_db)):
+async def move_song_to_top_endpoint(cancion_id: int, db=Depends(get_async_db)):
     """
     **[Admin]** Mueve una canción específica al principio de la cola,
     dándole la máxima prioridad manual.
     """
-    cancion_movida = crud.move_song_to_top(db, cancion_id=cancion_id)
+    cancion_movida = await crud_async.move_song_to_top(db, cancion_id=cancion_id)
     if not cancion_movida:
         raise HTTPException(
             status_code=404,
             detail="La canción no fue encontrada o no está en estado 'aprobado'."
         )
     
-    crud.create_admin_log_entry(db, action="MOVE_SONG_TOP", details=f"Canción '{cancion_movida.titulo}' (ID: {cancion_id}) movida al principio.")
+    await crud_async.create_admin_log_entry(db, action="MOVE_SONG_TOP", details=f"Canción '{cancion_movida.titulo}' (ID: {cancion_id}) movida al principio.")
     await websocket_manager.manager.broadcast_queue_update()
     return {"mensaje": f"La canción '{cancion_movida.titulo}' ha sido movida al principio de la cola."}
 
@@ -559,6 +638,7 @@ async def restart_current_song(db: Session = Depends(get_db)):
     """
     **[Admin]** Reinicia la canción que se está reproduciendo actualmente.
     """
+    reproduccion_automatica.temporizador.reiniciar()
     await websocket_manager.manager.broadcast_restart_song()
     crud.create_admin_log_entry(db, action="RESTART_SONG", details="Canción actual reiniciada.")
     return {"mensaje": "Canción reiniciada."}
@@ -568,6 +648,7 @@ async def pause_playback(db: Session = Depends(get_db)):
     """
     **[Admin]** Pausa la reproducción en el player.
     """
+    reproduccion_automatica.temporizador.pausar()
     await websocket_manager.manager.broadcast_pause()
     crud.create_admin_log_entry(db, action="PAUSE_PLAYBACK", details="Reproducción pausada por admin.")
     return {"mensaje": "Reproducción pausada."}
@@ -577,6 +658,7 @@ async def resume_playback(db: Session = Depends(get_db)):
     """
     **[Admin]** Reanuda la reproducción en el player.
     """
+    reproduccion_automatica.temporizador.reanudar()
     await websocket_manager.manager.broadcast_resume()
     crud.create_admin_log_entry(db, action="RESUME_PLAYBACK", details="Reproducción reanudada por admin.")
     return {"mensaje": "Reproducción reanudada."}
@@ -589,152 +671,84 @@ def get_pending_songs(db: Session = Depends(get_db), api_key: str = Depends(api_
     return crud.get_canciones_pendientes_por_aprobar(db)
 
 @router.post("/canciones/{cancion_id}/approve", response_model=schemas.Cancion, summary="Aprobar una canción pendiente")
-async def approve_pending_song(cancion_id: int, db: Session = Depends(get_db), api_key: str = Depends(api_key_auth)):
+async def approve_pending_song(cancion_id: int, db=Depends(get_async_db), api_key: str = Depends(api_key_auth)):
     """
     **[Admin]** Aprueba una canción que está en estado 'pendiente'.
     """
-    db_cancion = crud.approve_song_by_admin(db, cancion_id)
+    db_cancion = await crud_async.approve_song_by_admin(db, cancion_id)
     if not db_cancion:
         raise HTTPException(status_code=404, detail="Canción no encontrada o no está pendiente.")
     
-    crud.create_admin_log_entry(db, action="APPROVE_SONG", details=f"Canción '{db_cancion.titulo}' aprobada manualmente.")
+    await crud_async.create_admin_log_entry(db, action="APPROVE_SONG", details=f"Canción '{db_cancion.titulo}' aprobada manualmente.")
     await websocket_manager.manager.broadcast_queue_update()
     return db_cancion
 
 @router.post("/canciones/pending/{cancion_id}/move-up", status_code=200, summary="Mover canción pendiente hacia arriba")
-async def move_pending_song_up(cancion_id: int, db: Session = Depends(get_db), api_key: str = Depends(api_key_auth)):
+async def move_pending_song_up(cancion_id: int, db=Depends(get_async_db), api_key: str = Depends(api_key_auth)):
     """
     **[Admin]** Mueve una canción pendiente una posición hacia arriba en la cola.
     """
-    db_cancion = db.query(models.Cancion).filter(
-        models.Cancion.id == cancion_id,
-        models.Cancion.estado == 'pendiente'
-    ).first()
-    
+    db_cancion = await crud_async.mover_en_cola(db, cancion_id, estado="pendiente", hacia_arriba=True)
     if not db_cancion:
         raise HTTPException(status_code=404, detail="Canción pendiente no encontrada.")
     
-    # Obtener la canción anterior en la cola pendiente
-    previous_song = db.query(models.Cancion).filter(
-        models.Cancion.estado == 'pendiente',
-        models.Cancion.created_at < db_cancion.created_at
-    ).order_by(models.Cancion.created_at.desc()).first()
-    
-    if previous_song:
-        # Intercambiar los tiempos de creación para mantener el orden
-        temp_created = db_cancion.created_at
-        db_cancion.created_at = previous_song.created_at
-        previous_song.created_at = temp_created
-        db.commit()
-    
-    crud.create_admin_log_entry(db, action="MOVE_PENDING_UP", details=f"Canción '{db_cancion.titulo}' movida hacia arriba en cola pendiente.")
+    await crud_async.create_admin_log_entry(db, action="MOVE_PENDING_UP", details=f"Canción '{db_cancion.titulo}' movida hacia arriba en cola pendiente.")
     await websocket_manager.manager.broadcast_queue_update()
     return {"mensaje": "Canción movida hacia arriba."}
 
 @router.post("/canciones/pending/{cancion_id}/move-down", status_code=200, summary="Mover canción pendiente hacia abajo")
-async def move_pending_song_down(cancion_id: int, db: Session = Depends(get_db), api_key: str = Depends(api_key_auth)):
+async def move_pending_song_down(cancion_id: int, db=Depends(get_async_db), api_key: str = Depends(api_key_auth)):
     """
     **[Admin]** Mueve una canción pendiente una posición hacia abajo en la cola.
     """
-    db_cancion = db.query(models.Cancion).filter(
-        models.Cancion.id == cancion_id,
-        models.Cancion.estado == 'pendiente'
-    ).first()
-    
+    db_cancion = await crud_async.mover_en_cola(db, cancion_id, estado="pendiente", hacia_arriba=False)
     if not db_cancion:
         raise HTTPException(status_code=404, detail="Canción pendiente no encontrada.")
     
-    # Obtener la canción siguiente en la cola pendiente
-    next_song = db.query(models.Cancion).filter(
-        models.Cancion.estado == 'pendiente',
-        models.Cancion.created_at > db_cancion.created_at
-    ).order_by(models.Cancion.created_at.asc()).first()
-    
-    if next_song:
-        # Intercambiar los tiempos de creación para mantener el orden
-        temp_created = db_cancion.created_at
-        db_cancion.created_at = next_song.created_at
-        next_song.created_at = temp_created
-        db.commit()
-    
-    crud.create_admin_log_entry(db, action="MOVE_PENDING_DOWN", details=f"Canción '{db_cancion.titulo}' movida hacia abajo en cola pendiente.")
+    await crud_async.create_admin_log_entry(db, action="MOVE_PENDING_DOWN", details=f"Canción '{db_cancion.titulo}' movida hacia abajo en cola pendiente.")
     await websocket_manager.manager.broadcast_queue_update()
     return {"mensaje": "Canción movida hacia abajo."}
 
 # ===================== LAZY QUEUE MOVEMENT ENDPOINTS =====================
 
 @router.post("/canciones/lazy/{cancion_id}/move-up", status_code=200, summary="Mover canción lazy hacia arriba")
-async def move_lazy_song_up(cancion_id: int, db: Session = Depends(get_db), api_key: str = Depends(api_key_auth)):
+async def move_lazy_song_up(cancion_id: int, db=Depends(get_async_db), api_key: str = Depends(api_key_auth)):
     """
     **[Admin]** Mueve una canción en la cola lazy una posición hacia arriba.
     """
-    db_cancion = db.query(models.Cancion).filter(
-        models.Cancion.id == cancion_id,
-        models.Cancion.estado == 'pendiente_lazy'
-    ).first()
-    
+    db_cancion = await crud_async.mover_en_cola(db, cancion_id, estado="pendiente_lazy", hacia_arriba=True)
     if not db_cancion:
         raise HTTPException(status_code=404, detail="Canción lazy no encontrada.")
     
-    # Obtener la canción anterior en la cola lazy
-    previous_song = db.query(models.Cancion).filter(
-        models.Cancion.estado == 'pendiente_lazy',
-        models.Cancion.created_at < db_cancion.created_at
-    ).order_by(models.Cancion.created_at.desc()).first()
-    
-    if previous_song:
-        # Intercambiar los tiempos de creación para mantener el orden
-        temp_created = db_cancion.created_at
-        db_cancion.created_at = previous_song.created_at
-        previous_song.created_at = temp_created
-        db.commit()
-    
-    crud.create_admin_log_entry(db, action="MOVE_LAZY_UP", details=f"Canción '{db_cancion.titulo}' movida hacia arriba en cola lazy.")
+    await crud_async.create_admin_log_entry(db, action="MOVE_LAZY_UP", details=f"Canción '{db_cancion.titulo}' movida hacia arriba en cola lazy.")
     await websocket_manager.manager.broadcast_queue_update()
     return {"mensaje": "Canción movida hacia arriba."}
 
 @router.post("/canciones/lazy/{cancion_id}/move-down", status_code=200, summary="Mover canción lazy hacia abajo")
-async def move_lazy_song_down(cancion_id: int, db: Session = Depends(get_db), api_key: str = Depends(api_key_auth)):
+async def move_lazy_song_down(cancion_id: int, db=Depends(get_async_db), api_key: str = Depends(api_key_auth)):
     """
     **[Admin]** Mueve una canción en la cola lazy una posición hacia abajo.
     """
-    db_cancion = db.query(models.Cancion).filter(
-        models.Cancion.id == cancion_id,
-        models.Cancion.estado == 'pendiente_lazy'
-    ).first()
-    
+    db_cancion = await crud_async.mover_en_cola(db, cancion_id, estado="pendiente_lazy", hacia_arriba=False)
     if not db_cancion:
         raise HTTPException(status_code=404, detail="Canción lazy no encontrada.")
     
-    # Obtener la canción siguiente en la cola lazy
-    next_song = db.query(models.Cancion).filter(
-        models.Cancion.estado == 'pendiente_lazy',
-        models.Cancion.created_at > db_cancion.created_at
-    ).order_by(models.Cancion.created_at.asc()).first()
-    
-    if next_song:
-        # Intercambiar los tiempos de creación para mantener el orden
-        temp_created = db_cancion.created_at
-        db_cancion.created_at = next_song.created_at
-        next_song.created_at = temp_created
-        db.commit()
-    
-    crud.create_admin_log_entry(db, action="MOVE_LAZY_DOWN", details=f"Canción '{db_cancion.titulo}' movida hacia abajo en cola lazy.")
+    await crud_async.create_admin_log_entry(db, action="MOVE_LAZY_DOWN", details=f"Canción '{db_cancion.titulo}' movida hacia abajo en cola lazy.")
     await websocket_manager.manager.broadcast_queue_update()
     return {"mensaje": "Canción movida hacia abajo."}
 
 
 @router.post("/canciones/lazy/approve-next", status_code=200, summary="Aprobar siguiente canción lazy")
-async def approve_next_lazy_song(db: Session = Depends(get_db), api_key: str = Depends(api_key_auth)):
+async def approve_next_lazy_song(db=Depends(get_async_db), api_key: str = Depends(api_key_auth)):
     """
     **[Admin]** Aprueba la siguiente canción en la cola lazy (pendiente_lazy).
     Útil para forzar que siempre haya una canción disponible en la cola aprobada.
     """
-    siguiente = crud.aprobar_siguiente_cancion_lazy(db)
+    siguiente = await crud_async.aprobar_siguiente_cancion_lazy(db)
     if not siguiente:
         raise HTTPException(status_code=404, detail="No hay canciones en cola lazy para aprobar.")
 
-    crud.create_admin_log_entry(db, action="APPROVE_LAZY_NEXT", details=f"Canción '{siguiente.titulo}' aprobada manualmente desde admin.")
+    await crud_async.create_admin_log_entry(db, action="APPROVE_LAZY_NEXT", details=f"Canción '{siguiente.titulo}' aprobada manualmente desde admin.")
     await websocket_manager.manager.broadcast_queue_update()
     return siguiente
 
@@ -1067,15 +1081,15 @@ def get_single_table_payment_status(mesa_id: int, db: Session = Depends(get_db))
         raise HTTPException(status_code=404, detail="Mesa no encontrada.")
     return status
 @router.post("/pagos", response_model=schemas.PagoView, summary="Registrar un nuevo pago para una mesa", tags=["Cuentas"])
-async def create_pago_endpoint(pago: schemas.PagoCreate, db: Session = Depends(get_db)):
+async def create_pago_endpoint(pago: schemas.PagoCreate, db=Depends(get_async_db)):
     """
     **[Admin]** Registra un nuevo pago para una mesa específica.
     """
-    db_pago = crud.create_pago_for_mesa(db, pago=pago)
+    db_pago = await crud_async.create_pago_for_mesa(db, pago=pago)
     if not db_pago:
         raise HTTPException(status_code=404, detail="La mesa especificada no fue encontrada.")
     
-    crud.create_admin_log_entry(db, action="CREATE_PAGO", details=f"Registrado pago de ${pago.monto} para la mesa ID {pago.mesa_id}.")
+    await crud_async.create_admin_log_entry(db, action="CREATE_PAGO", details=f"Registrado pago de ${pago.monto} para la mesa ID {pago.mesa_id}.")
     
     # Podríamos emitir un evento por WebSocket si quisiéramos actualizar la vista en tiempo real
     # await websocket_manager.manager.broadcast_payment_update(pago.mesa_id)
@@ -1171,6 +1185,24 @@ def get_top_points_users_report(db: Session = Depends(get_db), limit: int = 10):
     top_users = crud.get_ranking_puntos_usuarios(db, limit=limit)
     return top_users
 
+@router.get("/reports/bundle", response_model=Dict[str, Any], summary="Obtener varios reportes en una sola respuesta")
+def get_reports_bundle(names: str = None, db: Session = Depends(get_db_lectura)):
+    """
+    **[Admin]** Calcula en una sola pasada los reportes indicados en `names`
+    (separados por comas, p. ej. `top-songs,total-income`; todos si se omite),
+    cargando canciones, consumos, pagos y usuarios una única vez.
+    Devuelve un objeto con cada reporte bajo su nombre; cada uno tiene el mismo
+    formato que su endpoint `/reports/...` con los parámetros por defecto.
+    """
+    nombres = [nombre.strip() for nombre in names.split(",") if nombre.strip()] if names else list(reportes.REPORTES)
+    desconocidos = [nombre for nombre in nombres if nombre not in reportes.REPORTES]
+    if desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Reportes desconocidos: {', '.join(desconocidos)}. Disponibles: {', '.join(reportes.REPORTES)}."
+        )
+    return reportes.calcular(db, nombres)
+
 @router.get("/tables/{mesa_id}/consumption-history", response_model=List[schemas.ConsumoHistorial], summary="Obtener historial de consumo de una mesa")
 def get_table_consumption_history(mesa_id: int, db: Session = Depends(get_db)):
     """
@@ -0,0 +1,41 @@
+"""Agregar totales de consumo desnormalizados a mesas y cuentas
+
+Revision ID: add_consumo_total_mesas_cuentas
+Revises: consolidate_consumos_mesa
+Create Date: 2026-10-16
+
+Cambios:
+1. Agregar columna consumo_total a mesas y cuentas
+2. Calcular el valor inicial a partir de la tabla consumos
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_consumo_total_mesas_cuentas'
+down_revision = 'consolidate_consumos_mesa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('mesas', sa.Column('consumo_total', sa.Numeric(10, 2), server_default='0', nullable=True))
+    op.add_column('cuentas', sa.Column('consumo_total', sa.Numeric(10, 2), server_default='0', nullable=True))
+
+    # Inicializar los totales con lo que ya está registrado en consumos
+    op.execute("""
+        UPDATE mesas
+        SET consumo_total = COALESCE(
+            (SELECT SUM(valor_total) FROM consumos WHERE consumos.mesa_id = mesas.id), 0
+        )
+    """)
+    op.execute("""
+        UPDATE cuentas
+        SET consumo_total = COALESCE(
+            (SELECT SUM(valor_total) FROM consumos WHERE consumos.cuenta_id = cuentas.id), 0
+        )
+    """)
+
+
+def downgrade():
+    op.drop_column('cuentas', 'consumo_total')
+    op.drop_column('mesas', 'consumo_total')
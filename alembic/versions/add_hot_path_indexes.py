@@ -0,0 +1,46 @@
+"""Índices para las consultas calientes (cola, aprobación automática, consumos, pagos y cuentas)
+
+Revision ID: add_hot_path_indexes
+Revises: add_scoring_jobs
+Create Date: 2026-10-17
+
+Cambios:
+1. Índices compuestos en canciones (estado, created_at) y (usuario_id, estado)
+2. Índices en consumos por usuario (con fecha), mesa y cuenta, y uno parcial de pedidos por despachar
+3. Índices en pagos por mesa y cuenta (con fecha), cuentas (mesa_id, is_active) y usuarios (mesa_id)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_hot_path_indexes'
+down_revision = 'add_scoring_jobs'
+branch_labels = None
+depends_on = None
+
+INDICES = [
+    ('ix_canciones_estado_created_at', 'canciones', ['estado', 'created_at']),
+    ('ix_canciones_usuario_estado', 'canciones', ['usuario_id', 'estado']),
+    ('ix_consumos_usuario_created_at', 'consumos', ['usuario_id', 'created_at']),
+    ('ix_consumos_mesa_id', 'consumos', ['mesa_id']),
+    ('ix_consumos_cuenta_id', 'consumos', ['cuenta_id']),
+    ('ix_pagos_mesa_created_at', 'pagos', ['mesa_id', 'created_at']),
+    ('ix_pagos_cuenta_created_at', 'pagos', ['cuenta_id', 'created_at']),
+    ('ix_cuentas_mesa_activa', 'cuentas', ['mesa_id', 'is_active']),
+    ('ix_usuarios_mesa_id', 'usuarios', ['mesa_id']),
+]
+
+
+def upgrade():
+    for nombre, tabla, columnas in INDICES:
+        op.create_index(nombre, tabla, columnas, if_not_exists=True)
+    # Parcial: solo los pedidos sin entregar, que es lo que consulta la pantalla del bar
+    op.create_index(
+        'ix_consumos_por_despachar', 'consumos', ['created_at'], if_not_exists=True,
+        sqlite_where=sa.text('is_dispatched = 0'), postgresql_where=sa.text('NOT is_dispatched'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_consumos_por_despachar', table_name='consumos')
+    for nombre, tabla, _ in reversed(INDICES):
+        op.drop_index(nombre, table_name=tabla)
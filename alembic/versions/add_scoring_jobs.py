@@ -0,0 +1,48 @@
+"""Crear la tabla scoring_jobs (cola persistente de puntuaciones por IA)
+
+Revision ID: add_scoring_jobs
+Revises: add_consumo_total_mesas_cuentas
+Create Date: 2026-10-17
+
+Cambios:
+1. Crear la tabla scoring_jobs con estado, prioridad, intentos y concesión del trabajador
+2. Índices por canción y por estado (el trabajador busca los trabajos en cola)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_scoring_jobs'
+down_revision = 'add_consumo_total_mesas_cuentas'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scoring_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('cancion_id', sa.Integer(), sa.ForeignKey('canciones.id'), nullable=True),
+        sa.Column('youtube_id', sa.String(), nullable=True),
+        sa.Column('ruta_audio', sa.String(), nullable=True),
+        sa.Column('estado', sa.String(), server_default='en_cola', nullable=True),
+        sa.Column('prioridad', sa.Integer(), server_default='0', nullable=True),
+        sa.Column('intentos', sa.Integer(), server_default='0', nullable=True),
+        sa.Column('disponible_desde', sa.DateTime(), nullable=True),
+        sa.Column('trabajador', sa.String(), nullable=True),
+        sa.Column('lease_hasta', sa.DateTime(), nullable=True),
+        sa.Column('puntuacion', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_scoring_jobs_id', 'scoring_jobs', ['id'])
+    op.create_index('ix_scoring_jobs_cancion_id', 'scoring_jobs', ['cancion_id'])
+    op.create_index('ix_scoring_jobs_estado', 'scoring_jobs', ['estado'])
+
+
+def downgrade():
+    op.drop_index('ix_scoring_jobs_estado', table_name='scoring_jobs')
+    op.drop_index('ix_scoring_jobs_cancion_id', table_name='scoring_jobs')
+    op.drop_index('ix_scoring_jobs_id', table_name='scoring_jobs')
+    op.drop_table('scoring_jobs')
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script para aplicar la migración de totales de consumo (mesas y cuentas)
+directamente a la base de datos
+"""
+import sqlite3
+
+TABLAS = {
+    'mesas': 'mesa_id',
+    'cuentas': 'cuenta_id',
+}
+
+def apply_migration():
+    # Conectar a la base de datos
+    conn = sqlite3.connect('karaoke.db')
+    cursor = conn.cursor()
+
+    try:
+        for tabla, columna_fk in TABLAS.items():
+            # Verificar si la columna ya existe
+            cursor.execute(f"PRAGMA table_info({tabla})")
+            columns = [column[1] for column in cursor.fetchall()]
+
+            if 'consumo_total' in columns:
+                print(f"La columna 'consumo_total' ya existe en la tabla {tabla}")
+                continue
+
+            cursor.execute(f"""
+                ALTER TABLE {tabla}
+                ADD COLUMN consumo_total NUMERIC(10, 2) DEFAULT 0
+            """)
+
+            # Inicializar el total con los consumos ya registrados
+            cursor.execute(f"""
+                UPDATE {tabla}
+                SET consumo_total = COALESCE(
+                    (SELECT SUM(valor_total) FROM consumos WHERE consumos.{columna_fk} = {tabla}.id), 0
+                )
+            """)
+            print(f"OK - Columna 'consumo_total' agregada e inicializada en la tabla {tabla}")
+
+        conn.commit()
+
+    except Exception as e:
+        print(f"ERROR - {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    print("Aplicando migracion: agregar totales de consumo a mesas y cuentas...")
+    print("")
+    apply_migration()
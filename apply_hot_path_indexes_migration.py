@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script para aplicar la migración de índices de las consultas calientes
+(cola, aprobación automática, consumos, pagos y cuentas) directamente a la base de datos
+"""
+import sqlite3
+
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS ix_canciones_estado_created_at ON canciones (estado, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_canciones_usuario_estado ON canciones (usuario_id, estado)",
+    "CREATE INDEX IF NOT EXISTS ix_consumos_usuario_created_at ON consumos (usuario_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_consumos_mesa_id ON consumos (mesa_id)",
+    "CREATE INDEX IF NOT EXISTS ix_consumos_cuenta_id ON consumos (cuenta_id)",
+    "CREATE INDEX IF NOT EXISTS ix_consumos_por_despachar ON consumos (created_at) WHERE is_dispatched = 0",
+    "CREATE INDEX IF NOT EXISTS ix_pagos_mesa_created_at ON pagos (mesa_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_pagos_cuenta_created_at ON pagos (cuenta_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_cuentas_mesa_activa ON cuentas (mesa_id, is_active)",
+    "CREATE INDEX IF NOT EXISTS ix_usuarios_mesa_id ON usuarios (mesa_id)",
+]
+
+def apply_migration():
+    # Conectar a la base de datos
+    conn = sqlite3.connect('karaoke.db')
+    cursor = conn.cursor()
+
+    try:
+        for sentencia in INDICES:
+            cursor.execute(sentencia)
+            print(f"OK - {sentencia.split(' ON ')[0].split()[-1]}")
+
+        # Actualizar las estadísticas para que el planificador elija bien entre los índices
+        cursor.execute("ANALYZE")
+        conn.commit()
+
+    except Exception as e:
+        print(f"ERROR - {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    print("Aplicando migracion: indices de las consultas calientes...")
+    print("")
+    apply_migration()
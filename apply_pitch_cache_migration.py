@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script para convertir las cachés de pitch antiguas (processed_songs/{id}_pitch.json,
+listas de nombres de nota) al formato binario de cache_pitch (.npy con mmap)
+"""
+import sys
+
+import cache_pitch
+
+def apply_migration(borrar=False):
+    resultado = cache_pitch.migrar_json(cache_pitch.DIRECTORIO, borrar=borrar)
+    print(f"OK - Convertidas: {resultado['convertidas']}, ya migradas: {resultado['ya_migradas']}, errores: {resultado['errores']}")
+    if borrar:
+        print("Los JSON migrados se han eliminado")
+
+if __name__ == "__main__":
+    # --borrar elimina los JSON ya convertidos
+    apply_migration(borrar="--borrar" in sys.argv)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script para aplicar la migración de la cola persistente de puntuaciones
+(tabla scoring_jobs) directamente a la base de datos
+"""
+import sqlite3
+
+def apply_migration():
+    # Conectar a la base de datos
+    conn = sqlite3.connect('karaoke.db')
+    cursor = conn.cursor()
+
+    try:
+        # Verificar si la tabla ya existe
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='scoring_jobs'")
+        if cursor.fetchone():
+            print("La tabla 'scoring_jobs' ya existe")
+            return
+
+        cursor.execute("""
+            CREATE TABLE scoring_jobs (
+                id INTEGER NOT NULL PRIMARY KEY,
+                cancion_id INTEGER REFERENCES canciones (id),
+                youtube_id VARCHAR,
+                ruta_audio VARCHAR,
+                estado VARCHAR DEFAULT 'en_cola',
+                prioridad INTEGER DEFAULT 0,
+                intentos INTEGER DEFAULT 0,
+                disponible_desde DATETIME,
+                trabajador VARCHAR,
+                lease_hasta DATETIME,
+                puntuacion INTEGER,
+                error TEXT,
+                created_at DATETIME,
+                started_at DATETIME,
+                finished_at DATETIME
+            )
+        """)
+        cursor.execute("CREATE INDEX ix_scoring_jobs_id ON scoring_jobs (id)")
+        cursor.execute("CREATE INDEX ix_scoring_jobs_cancion_id ON scoring_jobs (cancion_id)")
+        cursor.execute("CREATE INDEX ix_scoring_jobs_estado ON scoring_jobs (estado)")
+
+        conn.commit()
+        print("OK - Tabla 'scoring_jobs' creada")
+
+    except Exception as e:
+        print(f"ERROR - {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    print("Aplicando migracion: crear la cola persistente de puntuaciones (scoring_jobs)...")
+    print("")
+    apply_migration()
@@ -0,0 +1,217 @@
+"""
+Programador de la aprobación automática de canciones pendientes.
+
+Antes, `auto_approve_songs_after_10_minutes` se ejecutaba en cada lectura de la
+cola (GET y broadcasts por WebSocket). Ahora una tarea asyncio, arrancada al
+inicio de la aplicación, mantiene un min-heap de las canciones 'pendiente'
+ordenado por su vencimiento (created_at + 10 minutos), duerme hasta el primero
+y aprueba justo cuando vence. Tras aprobar pide un único broadcast agrupado.
+
+El heap se mantiene al día observando los commits a través del motor de la
+cola justa (`MotorColaJusta.observar`): cada canción que entra en 'pendiente'
+se programa y cada una que sale se descarta. Si al vencer no hay cupo en la
+cola de aprobadas, la tarea espera al siguiente cambio de canciones para
+reintentar. Las consultas y el commit de la aprobación se hacen en un hilo
+(`asyncio.to_thread`), nunca en el event loop.
+"""
+import asyncio
+import datetime
+import heapq
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import cola_justa
+import crud
+import models
+from database import SessionLocal
+from timezone_utils import now_bogota
+
+logger = logging.getLogger(__name__)
+
+ESPERA_APROBACION = datetime.timedelta(minutes=10)
+
+
+def _ahora() -> datetime.datetime:
+    # SQLite guarda created_at sin zona horaria (hora de Bogotá)
+    return now_bogota().replace(tzinfo=None)
+
+
+def _sin_zona(fecha: datetime.datetime) -> datetime.datetime:
+    return fecha.replace(tzinfo=None)
+
+
+async def _broadcast_cola(aprobadas: List[models.Cancion]):
+    import websocket_manager
+    await websocket_manager.manager.broadcast_queue_update()
+
+
+class ProgramadorAprobaciones:
+    """
+    Min-heap de canciones pendientes por vencimiento. `reloj` y `dormir` se
+    pueden sustituir (p. ej. por un reloj falso en las pruebas).
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        espera: datetime.timedelta = ESPERA_APROBACION,
+        reloj: Callable[[], datetime.datetime] = _ahora,
+        dormir: Callable[[float], Awaitable] = asyncio.sleep,
+        al_aprobar: Optional[Callable[[List[models.Cancion]], Awaitable]] = _broadcast_cola,
+    ):
+        self.session_factory = session_factory
+        self.espera = espera
+        self.reloj = reloj
+        self.dormir = dormir
+        self.al_aprobar = al_aprobar
+
+        self._lock = threading.Lock()
+        self._heap = []                      # [(vencimiento, cancion_id)]; puede tener entradas obsoletas
+        self._vencimientos: Dict[int, datetime.datetime] = {}  # Entradas vigentes
+        self._recargar = True
+        self._hay_cambios: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._motor: Optional[cola_justa.MotorColaJusta] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self.aprobadas = 0
+        self.revisiones = 0  # Pasadas completas del bucle
+
+    # --- Estado del heap ---
+
+    def programar(self, cancion_id: int, created_at: Optional[datetime.datetime]):
+        if created_at is None:
+            return
+        vencimiento = _sin_zona(created_at) + self.espera
+        with self._lock:
+            if self._vencimientos.get(cancion_id) == vencimiento:
+                return
+            self._vencimientos[cancion_id] = vencimiento
+            heapq.heappush(self._heap, (vencimiento, cancion_id))
+
+    def descartar(self, cancion_id: int):
+        with self._lock:
+            # La entrada del heap queda obsoleta y se ignora al llegar arriba
+            self._vencimientos.pop(cancion_id, None)
+
+    def proximo_vencimiento(self) -> Optional[datetime.datetime]:
+        with self._lock:
+            while self._heap:
+                vencimiento, cancion_id = self._heap[0]
+                if self._vencimientos.get(cancion_id) == vencimiento:
+                    return vencimiento
+                heapq.heappop(self._heap)
+            return None
+
+    def cargar(self, db):
+        """Programa todas las canciones que están pendientes en la base de datos."""
+        with self._lock:
+            self._heap = []
+            self._vencimientos = {}
+            self._recargar = False
+        pendientes = db.query(models.Cancion.id, models.Cancion.created_at).filter(
+            models.Cancion.estado == "pendiente"
+        )
+        for cancion_id, created_at in pendientes:
+            self.programar(cancion_id, created_at)
+
+    def _observar_cambios(self, cambios: List[tuple]):
+        """Recibe los cambios de cada commit (desde cualquier hilo)."""
+        for cambio in cambios:
+            if cambio[0] == "invalidar":
+                self._recargar = True
+            elif cambio[0] == "cancion":
+                cancion_id, estado, created_at = cambio[1], cambio[3], cambio[6]
+                if estado == "pendiente":
+                    self.programar(cancion_id, created_at)
+                else:
+                    self.descartar(cancion_id)
+            elif cambio[0] == "cancion_borrada":
+                self.descartar(cambio[1])
+        # Cualquier cambio puede liberar el cupo de aprobadas: despertamos la tarea
+        if self._loop is not None and self._hay_cambios is not None:
+            self._loop.call_soon_threadsafe(self._hay_cambios.set)
+
+    # --- Aprobación ---
+
+    def procesar_vencidas(self) -> List[models.Cancion]:
+        """
+        Aprueba las canciones vencidas si hay cupo. Solo toca la base de datos si algo
+        venció (o hay que recargar el heap). Es síncrona: el bucle la ejecuta en un hilo.
+        """
+        db = self.session_factory()
+        try:
+            if self._recargar:
+                self.cargar(db)
+            vencimiento = self.proximo_vencimiento()
+            if vencimiento is None or vencimiento > self.reloj():
+                return []
+            aprobadas = crud.auto_approve_songs_after_10_minutes(db, ahora=self.reloj())
+            for cancion in aprobadas:
+                self.descartar(cancion.id)
+            self.aprobadas += len(aprobadas)
+            return aprobadas
+        finally:
+            db.close()
+
+    def segundos_hasta_vencimiento(self) -> Optional[float]:
+        """
+        Segundos hasta el próximo vencimiento; None si no hay nada programado o si
+        lo vencido está esperando cupo (hay que esperar a un cambio de canciones).
+        """
+        vencimiento = self.proximo_vencimiento()
+        if vencimiento is None:
+            return None
+        segundos = (vencimiento - self.reloj()).total_seconds()
+        return segundos if segundos > 0 else None
+
+    async def ejecutar(self):
+        """Bucle principal: aprueba lo vencido y duerme hasta el siguiente vencimiento o cambio."""
+        while True:
+            # Limpiamos antes de leer el estado para no perder avisos que lleguen mientras tanto
+            self._hay_cambios.clear()
+            try:
+                aprobadas = await asyncio.to_thread(self.procesar_vencidas)
+                if aprobadas and self.al_aprobar:
+                    await self.al_aprobar(aprobadas)
+            except Exception:
+                logger.exception("Error en la aprobación automática de canciones")
+            self.revisiones += 1
+            await self._esperar(self.segundos_hasta_vencimiento())
+
+    async def _esperar(self, segundos: Optional[float]):
+        cambio = asyncio.ensure_future(self._hay_cambios.wait())
+        esperas = {cambio}
+        if segundos is not None:
+            esperas.add(asyncio.ensure_future(self.dormir(segundos)))
+        try:
+            await asyncio.wait(esperas, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for espera in esperas:
+                espera.cancel()
+
+    def iniciar(self):
+        """Arranca la tarea en el loop actual y empieza a observar los commits."""
+        if self._tarea is not None:
+            return self._tarea
+        self._loop = asyncio.get_running_loop()
+        self._hay_cambios = asyncio.Event()
+        db = self.session_factory()
+        try:
+            self._motor = cola_justa.motor_para(db)
+        finally:
+            db.close()
+        self._motor.observar(self._observar_cambios)
+        self._recargar = True
+        self._tarea = asyncio.create_task(self.ejecutar())
+        return self._tarea
+
+    def detener(self):
+        if self._motor is not None:
+            self._motor.dejar_de_observar(self._observar_cambios)
+        if self._tarea is not None:
+            self._tarea.cancel()
+        self._tarea = None
+
+
+programador = ProgramadorAprobaciones()
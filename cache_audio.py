@@ -0,0 +1,224 @@
+"""
+Presupuesto de disco para las cachés de audio de la puntuación por IA.
+
+ia_scorer deja para siempre las descargas en `temp_audio/{youtube_id}.mp3`, las
+pistas de Demucs en `processed_songs/htdemucs/{youtube_id}/` y el pitch en
+`processed_songs/{youtube_id}_pitch.npy` (+ .meta.json). Noche tras noche eso
+llena el disco del equipo del local. Este módulo:
+
+- registra en un índice SQLite (`processed_songs/cache_index.sqlite`, seguro
+  entre los procesos del pool) el último acceso de cada canción y los aciertos
+  y fallos de la caché de pitch;
+- recorta las cachés hasta CACHE_AUDIO_PRESUPUESTO_MB expulsando por LRU, por
+  fases: primero las pistas de Demucs (solo sirven para recalcular el pitch),
+  luego las descargas y, solo si no basta, los arrays de pitch;
+- nunca toca las canciones que están en cola o sonando, ni las que tienen una
+  puntuación pendiente o en curso (se puntúan ya 'cantada', con la descarga y
+  las pistas en uso).
+
+Las grabaciones de los cantantes (`temp_audio/user_recording_{id}.wav`) comparten
+directorio pero no son caché ni cuentan en el presupuesto: las borra el propio
+flujo de puntuación (`servicio_puntuacion.borrar_grabacion`) al guardar la
+puntuación en vivo, al descartar la sesión o al terminar su trabajo por lotes.
+"""
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import cache_pitch
+import config
+import models
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_DESCARGAS = "temp_audio"
+DIRECTORIO_PROCESADAS = cache_pitch.DIRECTORIO
+MODELO_DEMUCS = "htdemucs"
+ESTADOS_FIJADOS = ("pendiente", "aprobado", "pendiente_lazy", "reproduciendo")
+ESTADOS_TRABAJO_FIJADOS = ("en_cola", "en_curso")
+# Orden de expulsión: lo más caro de guardar y lo más barato de perder primero
+CATEGORIAS = ("pistas", "descargas", "pitch")
+
+
+def _tamano(ruta: str) -> int:
+    if os.path.isdir(ruta):
+        total = 0
+        for raiz, _, archivos in os.walk(ruta):
+            for archivo in archivos:
+                try:
+                    total += os.path.getsize(os.path.join(raiz, archivo))
+                except OSError:
+                    pass
+        return total
+    try:
+        return os.path.getsize(ruta)
+    except OSError:
+        return 0
+
+
+class CacheAudio:
+    def __init__(self, descargas: str = DIRECTORIO_DESCARGAS, procesadas: str = DIRECTORIO_PROCESADAS,
+                 presupuesto_bytes: Optional[int] = None):
+        self.descargas = descargas
+        self.procesadas = procesadas
+        self._presupuesto = presupuesto_bytes
+
+    @property
+    def presupuesto(self) -> int:
+        if self._presupuesto is not None:
+            return self._presupuesto
+        return config.settings.CACHE_AUDIO_PRESUPUESTO_MB * 1024 * 1024
+
+    # --- Índice ---
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        """Conexión al índice que confirma los cambios y se cierra al salir."""
+        os.makedirs(self.procesadas, exist_ok=True)
+        conexion = sqlite3.connect(os.path.join(self.procesadas, "cache_index.sqlite"), timeout=10)
+        try:
+            with conexion:
+                conexion.execute("CREATE TABLE IF NOT EXISTS accesos (youtube_id TEXT PRIMARY KEY, ultimo_acceso REAL NOT NULL)")
+                conexion.execute("CREATE TABLE IF NOT EXISTS contadores (nombre TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+                yield conexion
+        finally:
+            conexion.close()
+
+    def _sumar(self, conexion: sqlite3.Connection, nombre: str, cantidad: int = 1):
+        conexion.execute(
+            "INSERT INTO contadores (nombre, valor) VALUES (?, ?) "
+            "ON CONFLICT(nombre) DO UPDATE SET valor = valor + excluded.valor",
+            (nombre, cantidad),
+        )
+
+    def registrar_acceso(self, youtube_id: str, acierto: Optional[bool] = None):
+        """
+        Anota que se usó la caché de una canción. `acierto` indica si el pitch ya
+        estaba calculado (True) o hubo que calcularlo (False); None solo actualiza el acceso.
+        """
+        try:
+            with self._conectar() as conexion:
+                conexion.execute(
+                    "INSERT INTO accesos (youtube_id, ultimo_acceso) VALUES (?, ?) "
+                    "ON CONFLICT(youtube_id) DO UPDATE SET ultimo_acceso = excluded.ultimo_acceso",
+                    (youtube_id, time.time()),
+                )
+                if acierto is not None:
+                    self._sumar(conexion, "aciertos" if acierto else "fallos")
+        except sqlite3.Error as e:
+            # El índice es orientativo: un fallo no debe impedir puntuar
+            logger.warning(f"No se pudo actualizar el índice de la caché de audio: {e}")
+
+    def _ultimos_accesos(self, conexion: sqlite3.Connection) -> Dict[str, float]:
+        return dict(conexion.execute("SELECT youtube_id, ultimo_acceso FROM accesos"))
+
+    # --- Inventario ---
+
+    def entradas(self) -> List[Tuple[str, str, List[str]]]:
+        """(categoría, youtube_id, rutas) de todo lo que hay en disco."""
+        resultado = []
+        directorio_pistas = os.path.join(self.procesadas, MODELO_DEMUCS)
+        if os.path.isdir(directorio_pistas):
+            for nombre in os.listdir(directorio_pistas):
+                resultado.append(("pistas", nombre, [os.path.join(directorio_pistas, nombre)]))
+        if os.path.isdir(self.descargas):
+            for nombre in os.listdir(self.descargas):
+                # Las grabaciones de los cantantes (user_recording_*) no son caché: se borran al puntuarse
+                if nombre.endswith(".mp3") and not nombre.startswith("user_recording_"):
+                    resultado.append(("descargas", nombre[:-4], [os.path.join(self.descargas, nombre)]))
+        if os.path.isdir(self.procesadas):
+            for nombre in os.listdir(self.procesadas):
+                if nombre.endswith("_pitch.npy"):
+                    youtube_id = nombre[: -len("_pitch.npy")]
+                    rutas = [os.path.join(self.procesadas, nombre)]
+                    meta = os.path.join(self.procesadas, f"{youtube_id}_pitch.meta.json")
+                    if os.path.exists(meta):
+                        rutas.append(meta)
+                    resultado.append(("pitch", youtube_id, rutas))
+        return resultado
+
+    # --- Recorte ---
+
+    def recortar(self, fijadas: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        Expulsa por LRU hasta quedar dentro del presupuesto, por fases (pistas,
+        descargas, pitch), sin tocar las canciones fijadas. Devuelve las
+        expulsiones por categoría.
+        """
+        fijadas: Set[str] = set(fijadas)
+        entradas = [(categoria, youtube_id, rutas, sum(_tamano(r) for r in rutas))
+                    for categoria, youtube_id, rutas in self.entradas()]
+        total = sum(tamano for *_, tamano in entradas)
+        expulsadas = {categoria: 0 for categoria in CATEGORIAS}
+        if total <= self.presupuesto:
+            return expulsadas
+
+        with self._conectar() as conexion:
+            accesos = self._ultimos_accesos(conexion)
+
+            def antiguedad(entrada):
+                categoria, youtube_id, rutas, _ = entrada
+                # Sin acceso registrado: se usa la fecha del archivo (0 si ya no está en disco)
+                return accesos.get(youtube_id) or min(
+                    (os.path.getmtime(r) for r in rutas if os.path.exists(r)), default=0.0
+                )
+
+            for categoria in CATEGORIAS:
+                candidatas = sorted(
+                    (e for e in entradas if e[0] == categoria and e[1] not in fijadas), key=antiguedad
+                )
+                for _, youtube_id, rutas, tamano in candidatas:
+                    if total <= self.presupuesto:
+                        break
+                    for ruta in rutas:
+                        if os.path.isdir(ruta):
+                            shutil.rmtree(ruta, ignore_errors=True)
+                        elif os.path.exists(ruta):
+                            os.remove(ruta)
+                    total -= tamano
+                    expulsadas[categoria] += 1
+                    logger.info(f"Caché de audio: expulsado {categoria} de {youtube_id} ({tamano} bytes)")
+            for categoria, cantidad in expulsadas.items():
+                if cantidad:
+                    self._sumar(conexion, f"expulsiones_{categoria}", cantidad)
+        return expulsadas
+
+    def recortar_con_cola(self, db) -> Dict[str, int]:
+        """Recorta fijando las canciones que están en cola o sonando y las que se están puntuando."""
+        fijadas = {
+            youtube_id for (youtube_id,) in
+            db.query(models.Cancion.youtube_id).filter(models.Cancion.estado.in_(ESTADOS_FIJADOS)).distinct()
+        }
+        fijadas.update(
+            youtube_id for (youtube_id,) in
+            db.query(models.TrabajoPuntuacion.youtube_id)
+            .filter(models.TrabajoPuntuacion.estado.in_(ESTADOS_TRABAJO_FIJADOS)).distinct()
+        )
+        return self.recortar(fijadas)
+
+    # --- Estadísticas ---
+
+    def estadisticas(self) -> dict:
+        por_categoria = {categoria: {"entradas": 0, "bytes": 0} for categoria in CATEGORIAS}
+        for categoria, _, rutas in self.entradas():
+            por_categoria[categoria]["entradas"] += 1
+            por_categoria[categoria]["bytes"] += sum(_tamano(r) for r in rutas)
+        with self._conectar() as conexion:
+            contadores = dict(conexion.execute("SELECT nombre, valor FROM contadores"))
+        aciertos, fallos = contadores.get("aciertos", 0), contadores.get("fallos", 0)
+        return {
+            "presupuesto_bytes": self.presupuesto,
+            "tamano_bytes": sum(c["bytes"] for c in por_categoria.values()),
+            "por_categoria": por_categoria,
+            "aciertos": aciertos,
+            "fallos": fallos,
+            "tasa_aciertos": round(aciertos / (aciertos + fallos), 3) if aciertos + fallos else None,
+            "expulsiones": {categoria: contadores.get(f"expulsiones_{categoria}", 0) for categoria in CATEGORIAS},
+        }
+
+
+cache = CacheAudio()
@@ -0,0 +1,158 @@
+"""
+Caché binaria del pitch de las canciones (voz original).
+
+Antes `processed_songs/{youtube_id}_pitch.json` guardaba una lista de nombres de
+nota ("C#4") generada con un bucle de `librosa.hz_to_note` por frame: lenta de
+escribir y de leer y varias veces más grande de lo necesario. Ahora cada canción
+se guarda como:
+
+- `{youtube_id}_pitch.npy`: array estructurado con `midi` (float32, pitch en
+  semitonos MIDI; 0 en los frames sin voz) y `sonoro` (bool, máscara de voz).
+  Se abre con `mmap_mode="r"`, sin copiarlo a memoria.
+- `{youtube_id}_pitch.meta.json`: frames por segundo y origen del dato.
+
+La puntuación (puntuacion_dtw) trabaja directamente sobre los arrays, sin pasar
+por cadenas.
+Este módulo solo depende de NumPy: el migrador de las cachés JSON antiguas
+(`apply_pitch_cache_migration.py`) no necesita librosa.
+"""
+import json
+import logging
+import os
+import re
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO = "processed_songs"
+DTYPE = np.dtype([("midi", "<f4"), ("sonoro", "?")])
+VERSION = 1
+
+
+class SeriePitch(NamedTuple):
+    midi: np.ndarray        # float32, semitonos MIDI (0 donde no hay voz)
+    sonoro: np.ndarray      # bool, frames con voz
+    frame_rate: float       # frames por segundo (0 si se desconoce)
+
+    def notas(self) -> np.ndarray:
+        """Nota MIDI entera de cada frame con voz (equivale a comparar nombres de nota)."""
+        return np.round(self.midi[self.sonoro]).astype(np.int16)
+
+
+def ruta(youtube_id: str, directorio: str = DIRECTORIO) -> str:
+    return os.path.join(directorio, f"{youtube_id}_pitch.npy")
+
+
+def _ruta_meta(youtube_id: str, directorio: str) -> str:
+    return os.path.join(directorio, f"{youtube_id}_pitch.meta.json")
+
+
+def _ruta_json(youtube_id: str, directorio: str) -> str:
+    return os.path.join(directorio, f"{youtube_id}_pitch.json")
+
+
+def existe(youtube_id: str, directorio: str = DIRECTORIO) -> bool:
+    return os.path.exists(ruta(youtube_id, directorio))
+
+
+def guardar(youtube_id: str, serie: SeriePitch, directorio: str = DIRECTORIO, origen: str = "pyin"):
+    """
+    Escribe la caché de una canción. El .npy se escribe el último y con un
+    renombrado atómico: si existe, la entrada está completa.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    datos = np.empty(len(serie.midi), dtype=DTYPE)
+    datos["midi"] = np.where(serie.sonoro, serie.midi, 0)
+    datos["sonoro"] = serie.sonoro
+
+    with open(_ruta_meta(youtube_id, directorio), "w") as f:
+        json.dump({"version": VERSION, "frame_rate": float(serie.frame_rate), "origen": origen}, f)
+
+    destino = ruta(youtube_id, directorio)
+    temporal = destino + ".tmp"
+    with open(temporal, "wb") as f:
+        np.save(f, datos)
+    os.replace(temporal, destino)
+
+
+def cargar(youtube_id: str, directorio: str = DIRECTORIO) -> Optional[SeriePitch]:
+    """Abre la caché de una canción en modo mmap; None si no existe."""
+    destino = ruta(youtube_id, directorio)
+    if not os.path.exists(destino):
+        return None
+    datos = np.load(destino, mmap_mode="r")
+    frame_rate = 0.0
+    try:
+        with open(_ruta_meta(youtube_id, directorio)) as f:
+            frame_rate = float(json.load(f).get("frame_rate") or 0.0)
+    except (OSError, ValueError):
+        pass
+    return SeriePitch(datos["midi"], datos["sonoro"], frame_rate)
+
+
+def desde_frecuencias(f0: np.ndarray, sonoro: Optional[np.ndarray], frame_rate: float) -> SeriePitch:
+    """Convierte la salida de pYIN (Hz con NaN donde no hay voz) a semitonos MIDI de forma vectorizada."""
+    f0 = np.asarray(f0, dtype=np.float64)
+    mascara = np.isfinite(f0) & (f0 > 0)
+    if sonoro is not None:
+        mascara &= np.asarray(sonoro, dtype=bool)
+    midi = np.zeros(len(f0), dtype=np.float32)
+    midi[mascara] = 12 * np.log2(f0[mascara] / 440.0) + 69
+    return SeriePitch(midi, mascara, frame_rate)
+
+
+# --- Migración de las cachés JSON antiguas ---
+
+_NOTA = re.compile(r"^([A-Ga-g])([#♯b♭!]*)(-?\d+)$")
+_SEMITONO = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+_ALTERACION = {"#": 1, "♯": 1, "b": -1, "♭": -1, "!": -1}
+
+
+def nota_a_midi(nota: str) -> Optional[int]:
+    """'C#4' o 'C♯4' -> 61 (mismo resultado que librosa.note_to_midi para notas enteras)."""
+    coincidencia = _NOTA.match(nota.strip())
+    if not coincidencia:
+        return None
+    letra, alteraciones, octava = coincidencia.groups()
+    semitono = _SEMITONO[letra.upper()] + sum(_ALTERACION[a] for a in alteraciones)
+    return 12 * (int(octava) + 1) + semitono
+
+
+def desde_notas(notas: List[str]) -> SeriePitch:
+    """
+    Convierte una lista antigua de nombres de nota. Solo contenía los frames con voz
+    y no guardaba el ritmo de frames, así que todos quedan sonoros y frame_rate=0.
+    """
+    midis = [nota_a_midi(n) for n in notas]
+    midi = np.array([m if m is not None else 0 for m in midis], dtype=np.float32)
+    sonoro = np.array([m is not None for m in midis], dtype=bool)
+    return SeriePitch(midi, sonoro, 0.0)
+
+
+def migrar_json(directorio: str = DIRECTORIO, borrar: bool = False) -> dict:
+    """Convierte cada `{id}_pitch.json` que aún no tenga su .npy."""
+    resultado = {"convertidas": 0, "ya_migradas": 0, "errores": 0}
+    if not os.path.isdir(directorio):
+        return resultado
+    for nombre in sorted(os.listdir(directorio)):
+        if not nombre.endswith("_pitch.json"):
+            continue
+        youtube_id = nombre[: -len("_pitch.json")]
+        origen = _ruta_json(youtube_id, directorio)
+        if existe(youtube_id, directorio):
+            resultado["ya_migradas"] += 1
+        else:
+            try:
+                with open(origen) as f:
+                    notas = json.load(f)
+                guardar(youtube_id, desde_notas(notas), directorio, origen="json")
+                resultado["convertidas"] += 1
+            except (OSError, ValueError, TypeError) as e:
+                logger.error(f"No se pudo migrar la caché de pitch {origen}: {e}")
+                resultado["errores"] += 1
+                continue
+        if borrar:
+            os.remove(origen)
+    return resultado
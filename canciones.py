@@ -1,14 +1,15 @@
 ﻿import os
 import datetime
 import asyncio
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-import crud, schemas, models, config
+import crud, crud_async, schemas, models, config
 from database import SessionLocal # get_db se importará desde aquí
+from database_async import get_async_db
 import websocket_manager
 from security import api_key_auth
 
@@ -29,7 +30,7 @@ def get_db():
     responses={204: {"description": "No hay más canciones en la cola."}},
     summary="Avanzar la cola y obtener la siguiente canción para reproducir"
 )
-async def avanzar_cola(db: Session = Depends(get_db)):
+async def avanzar_cola(db=Depends(get_async_db)):
     """
     Avanza la cola a la siguiente canción.
     """
@@ -57,12 +58,12 @@ async def avanzar_cola(db: Session = Depends(get_db)):
 async def anadir_cancion(
     usuario_id: int,
     cancion: schemas.CancionCreate,
-    db: Session = Depends(get_db)
+    db=Depends(get_async_db)
 ):
     """
     Añade una nueva canción a la lista personal de un usuario, si hay tiempo disponible.
     """
-    db_usuario = crud.get_usuario_by_id(db, usuario_id=usuario_id)
+    db_usuario = await crud_async.get_usuario_by_id(db, usuario_id=usuario_id)
     if not db_usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado.")
     if db_usuario.is_silenced:
@@ -85,7 +86,7 @@ async def anadir_cancion(
 
     # Verificar duración proyectada
     tiempo_restante_segundos = (hora_cierre - ahora).total_seconds()
-    duracion_cola_actual = crud.get_duracion_total_cola_aprobada(db)
+    duracion_cola_actual = await crud_async.get_duracion_total_cola_aprobada(db)
     duracion_total_proyectada = duracion_cola_actual + (cancion.duracion_seconds or 0)
 
     if duracion_total_proyectada > tiempo_restante_segundos:
@@ -95,29 +96,24 @@ async def anadir_cancion(
         )
 
     # Verificar duplicados a nivel de mesa (evita que usuarios de la misma mesa agreguen la misma canción)
-    cancion_existente = crud.check_if_song_in_user_list(db, usuario_id=usuario_id, youtube_id=cancion.youtube_id)
+    cancion_existente = await crud_async.check_if_song_in_user_list(db, usuario_id=usuario_id, youtube_id=cancion.youtube_id)
     if cancion_existente:
         raise HTTPException(
             status_code=409,
             detail=f"Esta canción ya está en la cola de tu mesa. '{cancion.titulo}' fue agregada por otro usuario de tu mesa."
         )
 
-    # Crear canción
-    db_cancion = crud.create_cancion_para_usuario(db=db, cancion=cancion, usuario_id=usuario_id)
-    
     # LAZY APPROVAL: Solo aprobar si no hay más de 1 canción aprobada en espera
     # Si ya hay 1 o más canciones aprobadas (más la que suena), la nueva va a pendiente_lazy
-    approved_count = db.query(models.Cancion).filter(models.Cancion.estado == "aprobado").count()
-    
-    if approved_count >= 1:
-        # Ya hay una canción aprobada esperando, poner en cola lazy
-        cancion_final = crud.update_cancion_estado(db, cancion_id=db_cancion.id, nuevo_estado="pendiente_lazy")
-    else:
-        # Primera canción, aprobar inmediatamente
-        cancion_final = crud.update_cancion_estado(db, cancion_id=db_cancion.id, nuevo_estado="aprobado")
+    approved_count = await crud_async.contar_canciones(db, "aprobado")
+    estado = "pendiente_lazy" if approved_count >= 1 else "aprobado"
+
+    # Crear canción, ya en su estado final (un solo commit)
+    cancion_final = await crud_async.create_cancion_para_usuario(db=db, cancion=cancion, usuario_id=usuario_id, estado=estado)
+    if estado == "aprobado":
         # Si autoplay está activo, iniciar reproducción si la cola estaba vacía
         await crud.start_next_song_if_autoplay_and_idle(db)
-    
+
     await websocket_manager.manager.broadcast_queue_update()
 
     return cancion_final
@@ -131,11 +127,11 @@ def ver_canciones_pendientes(db: Session = Depends(get_db), api_key: str = Depen
     return crud.get_canciones_pendientes(db=db)
 
 @router.post("/{cancion_id}/aprobar", response_model=schemas.Cancion, summary="Aprobar una canción")
-async def aprobar_cancion(cancion_id: int, db: Session = Depends(get_db), api_key: str = Depends(api_key_auth)):
-    db_cancion = crud.update_cancion_estado(db, cancion_id=cancion_id, nuevo_estado="aprobado")
+async def aprobar_cancion(cancion_id: int, db=Depends(get_async_db), api_key: str = Depends(api_key_auth)):
+    db_cancion = await crud_async.update_cancion_estado(db, cancion_id=cancion_id, nuevo_estado="aprobado")
     if not db_cancion:
         raise HTTPException(status_code=404, detail="Canción no encontrada")
-    crud.create_admin_log_entry(db, action="APPROVE_SONG", details=f"Canción '{db_cancion.titulo}' aprobada.")
+    await crud_async.create_admin_log_entry(db, action="APPROVE_SONG", details=f"Canción '{db_cancion.titulo}' aprobada.")
     await crud.start_next_song_if_autoplay_and_idle(db)
     await websocket_manager.manager.broadcast_queue_update()
     return db_cancion
@@ -180,13 +176,34 @@ async def admin_anadir_cancion(cancion: schemas.CancionCreate, db: Session = Dep
     return cancion_final
 
 
+def _respuesta_cola_versionada(request: Request, db: Session, vista: str, construir) -> Response:
+    """
+    Sirve una vista de la cola con ETag fuerte por versión: 304 si el cliente ya
+    tiene la versión actual, y el JSON serializado en caché si no.
+    """
+    etag, version, cuerpo = crud.get_instantanea_cola(db, vista, construir)
+    headers = {"ETag": etag, "X-Cola-Version": str(version), "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+        if etag in etiquetas or "*" in etiquetas:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+
 @router.get("/cola", response_model=schemas.ColaView, summary="Ver la cola de canciones")
-def ver_cola_de_canciones(db: Session = Depends(get_db)):
-    cola_data = crud.get_cola_completa(db)
-    return schemas.ColaView(now_playing=cola_data["now_playing"], upcoming=cola_data["upcoming"])
+def ver_cola_de_canciones(request: Request, db: Session = Depends(get_db)):
+    def construir(version):
+        cola_data = crud.get_cola_completa(db)
+        return schemas.ColaView(
+            now_playing=cola_data["now_playing"], upcoming=cola_data["upcoming"],
+            version=version,
+        ).model_dump_json()
+    return _respuesta_cola_versionada(request, db, "cola", construir)
 
 @router.get("/cola/extended", response_model=schemas.ColaViewExtended, summary="Ver la cola de canciones con lazy queue")
-def ver_cola_extendida(db: Session = Depends(get_db)):
+def ver_cola_extendida(request: Request, db: Session = Depends(get_db)):
     """
     Retorna la cola completa incluyendo:
     - now_playing: Canción actual
@@ -194,14 +211,27 @@ def ver_cola_extendida(db: Session = Depends(get_db)):
     - lazy_queue: Canciones en espera de aprobación lazy
     - pending: Canciones pendientes de aprobación manual
     """
-    cola_data = crud.get_cola_completa_con_lazy(db)
-    return schemas.ColaViewExtended(
-        now_playing=cola_data["now_playing"],
-        upcoming=cola_data["upcoming"],
-        lazy_queue=cola_data["lazy_queue"],
-        pending=cola_data["pending"]
-    )
-
+    def construir(version):
+        cola_data = crud.get_cola_completa_con_lazy(db)
+        return schemas.ColaViewExtended(
+            now_playing=cola_data["now_playing"],
+            upcoming=cola_data["upcoming"],
+            lazy_queue=cola_data["lazy_queue"],
+            pending=cola_data["pending"],
+            version=version,
+        ).model_dump_json()
+    return _respuesta_cola_versionada(request, db, "cola_extendida", construir)
+
+
+@router.get("/tiempos-espera", response_model=schemas.TiemposEsperaView, summary="Calcular tiempos de espera de un usuario o mesa")
+def calcular_tiempos_espera(usuario_id: Optional[int] = None, mesa_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Devuelve en una sola llamada el tiempo de espera de todas las canciones aprobadas
+    del usuario y/o de la mesa indicados, en el orden en que sonarán.
+    """
+    if usuario_id is None and mesa_id is None:
+        raise HTTPException(status_code=400, detail="Indica usuario_id o mesa_id.")
+    return crud.get_tiempos_espera(db, usuario_id=usuario_id, mesa_id=mesa_id)
 
 @router.get("/{cancion_id}/tiempo-espera", response_model=dict, summary="Calcular tiempo de espera")
 def calcular_tiempo_espera(cancion_id: int, db: Session = Depends(get_db)):
@@ -0,0 +1,413 @@
+"""
+Puntuación en vivo: el dispositivo del cantante envía su audio mientras canta.
+
+Hasta ahora la puntuación esperaba un `temp_audio/user_recording_{id}.wav` ya
+terminado que nada en la API subía. Ahora el dispositivo abre
+`/ws/canto/{cancion_id}` y envía trozos de PCM (16 bits, mono, little-endian)
+durante la canción. Por cada trozo:
+
+- `EstimadorPitch` calcula el pitch de los frames completos con YIN,
+  vectorizado con NumPy sobre todos los frames del trozo a la vez;
+- se compara con el pitch de referencia en caché (`cache_pitch`) alrededor del
+  mismo instante de la canción (la sesión se alinea con la posición del player
+  al conectar o reconectar el dispositivo), y cada segundo de audio se emite
+  `live_score` al topic del player con la precisión acumulada y la del último
+  segundo.
+
+Al terminar la canción la puntuación final sale al momento de alinear con DTW lo
+ya calculado, sin procesar nada en lote. El gestor observa los commits (como los
+temporizadores de reproducción): cualquier camino que saque la canción de
+'reproduciendo' (el avance automático, /siguiente, /play de otra canción...)
+cierra su sesión; si pasó a 'cantada' se puntúa, si no se descarta. El audio se
+guarda además como WAV: si la canción no tenía su referencia en caché, se puntúa
+con el servicio por lotes de siempre (que lo borra al terminar el trabajo); si se
+puntúa en vivo o se descarta, se borra al cerrar la sesión.
+"""
+import asyncio
+import logging
+import os
+import threading
+import wave
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+import cache_pitch
+import cola_justa
+import crud
+import models
+import puntuacion_dtw
+import servicio_puntuacion
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+FPS_OBJETIVO = 50          # Frames de pitch por segundo del estimador
+FMIN, FMAX = 65.0, 2093.0  # C2 - C7, el mismo rango que pYIN en ia_scorer
+UMBRAL_YIN = 0.15
+RMS_SILENCIO = 0.01        # Por debajo (en escala -1..1) el frame se considera sin voz
+VENTANA_REFERENCIA = 0.5   # Segundos de margen al comparar con la referencia en vivo
+TOLERANCIA_SEMITONOS = puntuacion_dtw.TOLERANCIA_SEMITONOS
+
+
+class EstimadorPitch:
+    """
+    Estimador YIN por frames para audio que llega a trozos. Guarda las muestras
+    que aún no completan un frame y devuelve solo el pitch de los frames nuevos.
+    """
+
+    def __init__(self, sr: int):
+        self.sr = sr
+        self.hop = max(1, sr // FPS_OBJETIVO)
+        self.frame_rate = sr / self.hop
+        self.tau_min = max(2, int(sr / FMAX))
+        self.tau_max = int(np.ceil(sr / FMIN))
+        # Ventana de análisis: potencia de dos con espacio para tres periodos de la nota más grave
+        self.ventana = 1 << int(np.ceil(np.log2(3 * self.tau_max)))
+        self._pendiente = np.zeros(0, dtype=np.float32)
+
+    def procesar(self, muestras: np.ndarray) -> tuple:
+        """Añade muestras (float -1..1) y devuelve (midi, sonoro) de los frames completados."""
+        self._pendiente = np.concatenate([self._pendiente, muestras.astype(np.float32)])
+        disponibles = len(self._pendiente) - self.ventana
+        if disponibles < 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=bool)
+        frames = disponibles // self.hop + 1
+        indices = np.arange(frames)[:, None] * self.hop + np.arange(self.ventana)[None, :]
+        midi, sonoro = self._yin(self._pendiente[indices])
+        self._pendiente = self._pendiente[frames * self.hop:]
+        return midi, sonoro
+
+    def _yin(self, x: np.ndarray) -> tuple:
+        w = self.ventana
+        x = x - x.mean(axis=1, keepdims=True)
+        rms = np.sqrt(np.mean(x ** 2, axis=1))
+
+        # Función de diferencia d(tau) = E[0:w-tau] + E[tau:w] - 2 r(tau), con r por FFT
+        espectro = np.fft.rfft(x, n=2 * w, axis=1)
+        r = np.fft.irfft(espectro * np.conj(espectro), axis=1)[:, : self.tau_max + 2]
+        energia = np.concatenate([np.zeros((len(x), 1)), np.cumsum(x ** 2, axis=1)], axis=1)
+        tau = np.arange(self.tau_max + 2)
+        d = energia[:, w - tau] + (energia[:, [w]] - energia[:, tau]) - 2 * r
+
+        # Diferencia normalizada por la media acumulada
+        acumulada = np.cumsum(d[:, 1:], axis=1)
+        cmnd = np.ones_like(d)
+        cmnd[:, 1:] = d[:, 1:] * tau[1:] / np.maximum(acumulada, 1e-12)
+
+        # Primer mínimo local por debajo del umbral dentro del rango de notas
+        rango = cmnd[:, self.tau_min: self.tau_max + 1]
+        minimo_local = (rango[:, 1:-1] <= rango[:, :-2]) & (rango[:, 1:-1] <= rango[:, 2:])
+        candidatos = minimo_local & (rango[:, 1:-1] < UMBRAL_YIN)
+        hay = candidatos.any(axis=1)
+        t = np.argmax(candidatos, axis=1) + self.tau_min + 1
+
+        # Interpolación parabólica alrededor del mínimo
+        filas = np.arange(len(x))
+        a, b, c = cmnd[filas, t - 1], cmnd[filas, t], cmnd[filas, t + 1]
+        denominador = a - 2 * b + c
+        ajuste = 0.5 * (a - c) / np.where(np.abs(denominador) > 1e-12, denominador, np.inf)
+        periodo = t + np.clip(ajuste, -1, 1)
+
+        sonoro = hay & (rms > RMS_SILENCIO)
+        serie = cache_pitch.desde_frecuencias(np.where(sonoro, self.sr / periodo, np.nan), sonoro, self.frame_rate)
+        return serie.midi, serie.sonoro
+
+
+class SesionCanto:
+    """Audio y pitch acumulados de una canción mientras se canta."""
+
+    def __init__(self, cancion_id: int, youtube_id: str, sr: int,
+                 referencia: Optional[cache_pitch.SeriePitch], ruta_wav: Optional[str] = None):
+        self.cancion_id = cancion_id
+        self.youtube_id = youtube_id
+        self.referencia = referencia
+        self.estimador = EstimadorPitch(sr)
+        self._midi: List[np.ndarray] = []
+        self._sonoro: List[np.ndarray] = []
+        self.frames = 0
+        self.evaluados = 0
+        self.en_tono = 0
+        self._reciente = [0, 0]  # [en_tono, evaluados] desde el último aviso
+        self._ultimo_aviso = 0
+        self.ruta_wav = ruta_wav
+        self._wav = None
+        if ruta_wav:
+            os.makedirs(os.path.dirname(ruta_wav) or ".", exist_ok=True)
+            self._wav = wave.open(ruta_wav, "wb")
+            self._wav.setnchannels(1)
+            self._wav.setsampwidth(2)
+            self._wav.setframerate(sr)
+
+    def alinear(self, posicion_segundos: float):
+        """
+        El dispositivo conecta (o reconecta) con la canción ya en `posicion_segundos`:
+        lo que no llegó cuenta como silencio, para que el siguiente frame caiga en
+        ese instante de la referencia (en vivo, en el DTW final y en el WAV).
+        """
+        # Las muestras pendientes eran de la conexión anterior
+        self.estimador = EstimadorPitch(self.estimador.sr)
+        hueco = int(round(posicion_segundos * self.estimador.frame_rate)) - self.frames
+        if hueco <= 0:
+            return
+        self._midi.append(np.zeros(hueco, dtype=np.float32))
+        self._sonoro.append(np.zeros(hueco, dtype=bool))
+        self.frames += hueco
+        self._ultimo_aviso = self.frames
+        if self._wav is not None:
+            self._wav.writeframes(bytes(2 * hueco * self.estimador.hop))
+
+    def agregar(self, pcm: bytes) -> Optional[dict]:
+        """Procesa un trozo de PCM. Devuelve el aviso de precisión si ya toca enviarlo."""
+        if self._wav is not None:
+            self._wav.writeframes(pcm)
+        muestras = np.frombuffer(pcm[: len(pcm) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+        midi, sonoro = self.estimador.procesar(muestras)
+        if len(midi) == 0:
+            return None
+        primero = self.frames
+        self._midi.append(midi)
+        self._sonoro.append(sonoro)
+        self.frames += len(midi)
+
+        self._comparar(primero, midi, sonoro)
+        if self.frames - self._ultimo_aviso < self.estimador.frame_rate:
+            return None
+        self._ultimo_aviso = self.frames
+        return self.aviso()
+
+    def _comparar(self, primero: int, midi: np.ndarray, sonoro: np.ndarray):
+        """
+        Compara los frames nuevos con voz con la referencia en el mismo instante
+        (± VENTANA_REFERENCIA, para no castigar un pequeño desfase).
+        """
+        ref = self.referencia
+        if ref is None or not ref.frame_rate or not sonoro.any():
+            return
+        tiempos = (primero + np.flatnonzero(sonoro)) / self.estimador.frame_rate
+        margen = int(VENTANA_REFERENCIA * ref.frame_rate)
+        centro = np.round(tiempos * ref.frame_rate).astype(np.int64)
+        indices = centro[:, None] + np.arange(-margen, margen + 1)[None, :]
+        validos = (indices >= 0) & (indices < len(ref.midi))
+        indices = np.clip(indices, 0, len(ref.midi) - 1)
+        ref_sonoro = np.asarray(ref.sonoro)[indices] & validos
+        d = np.abs(np.asarray(ref.midi)[indices] - midi[sonoro][:, None])
+        d = np.minimum(np.mod(d, 12.0), 12.0 - np.mod(d, 12.0))
+        en_tono = ((d <= TOLERANCIA_SEMITONOS) & ref_sonoro).any(axis=1)
+        # Solo cuentan los instantes en que el original también canta
+        evaluables = ref_sonoro.any(axis=1)
+        evaluados, acertados = int(evaluables.sum()), int((en_tono & evaluables).sum())
+        self.evaluados += evaluados
+        self.en_tono += acertados
+        self._reciente[0] += acertados
+        self._reciente[1] += evaluados
+
+    def aviso(self) -> dict:
+        acertados, evaluados = self._reciente
+        self._reciente = [0, 0]
+        ultimo = self._midi[-1][self._sonoro[-1]] if self._midi else np.zeros(0)
+        return {
+            "cancion_id": self.cancion_id,
+            "segundos": round(self.frames / self.estimador.frame_rate, 1),
+            "precision": round(100 * self.en_tono / self.evaluados) if self.evaluados else None,
+            "precision_reciente": round(100 * acertados / evaluados) if evaluados else None,
+            "nota": int(round(float(ultimo[-1]))) if len(ultimo) else None,
+        }
+
+    def serie(self) -> cache_pitch.SeriePitch:
+        if not self._midi:
+            return cache_pitch.SeriePitch(np.zeros(0, dtype=np.float32), np.zeros(0, dtype=bool), self.estimador.frame_rate)
+        return cache_pitch.SeriePitch(np.concatenate(self._midi), np.concatenate(self._sonoro), self.estimador.frame_rate)
+
+    def cerrar_audio(self):
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+
+
+def _posicion_reproduccion(cancion: models.Cancion) -> float:
+    """Segundos de la canción que ya sonaron, según el player (o started_at)."""
+    import websocket_manager
+    estado = websocket_manager.manager.estado_reproduccion(
+        {"id": cancion.id, "youtube_id": cancion.youtube_id, "started_at": cancion.started_at}
+    )
+    return estado["posicion_segundos"] if estado else 0.0
+
+
+async def _broadcast_aviso(aviso: dict):
+    import websocket_manager
+    await websocket_manager.manager.broadcast_live_score(aviso)
+
+
+async def _broadcast_puntuacion(cancion: models.Cancion):
+    import websocket_manager
+    await websocket_manager.manager.broadcast_song_scored(cancion)
+
+
+class GestorCanto:
+    """Sesiones de canto abiertas, una por canción."""
+
+    def __init__(self, session_factory=SessionLocal, directorio_cache: str = cache_pitch.DIRECTORIO,
+                 guardar_wav: bool = True, al_avisar=_broadcast_aviso, al_puntuar=_broadcast_puntuacion,
+                 posicion=_posicion_reproduccion):
+        self.session_factory = session_factory
+        self.directorio_cache = directorio_cache
+        self.guardar_wav = guardar_wav
+        self.al_avisar = al_avisar
+        self.al_puntuar = al_puntuar
+        self.posicion = posicion
+        self.sesiones: Dict[int, SesionCanto] = {}
+        self._lock = threading.Lock()
+        # Canciones cuya sesión ya se cerró al terminar (para no puntuarlas también por lotes)
+        self._terminadas = deque(maxlen=64)
+        self._tareas: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._motor: Optional[cola_justa.MotorColaJusta] = None
+
+    def abrir(self, cancion: models.Cancion, sr: int) -> SesionCanto:
+        with self._lock:
+            sesion = self.sesiones.get(cancion.id)
+        if sesion is None:
+            referencia = cache_pitch.cargar(cancion.youtube_id, self.directorio_cache)
+            ruta_wav = servicio_puntuacion.ruta_grabacion(cancion.id) if self.guardar_wav else None
+            sesion = SesionCanto(cancion.id, cancion.youtube_id, sr, referencia, ruta_wav)
+            with self._lock:
+                sesion = self.sesiones.setdefault(cancion.id, sesion)
+        # El audio que llega empieza donde va la canción, no en 0:00
+        sesion.alinear(self.posicion(cancion))
+        return sesion
+
+    def activa(self, cancion_id: int) -> bool:
+        return cancion_id in self.sesiones
+
+    def cantada_en_vivo(self, cancion_id: int) -> bool:
+        """True si la canción tiene (o acaba de cerrar) una sesión en vivo."""
+        with self._lock:
+            return cancion_id in self.sesiones or cancion_id in self._terminadas
+
+    async def recibir(self, cancion_id: int, pcm: bytes) -> bool:
+        """Procesa un trozo de PCM. Devuelve False si la canción ya no tiene sesión abierta."""
+        sesion = self.sesiones.get(cancion_id)
+        if sesion is None:
+            return False
+        aviso = sesion.agregar(pcm)
+        if aviso is not None and self.al_avisar:
+            await self.al_avisar(aviso)
+        return True
+
+    def _sacar(self, cancion_id: int) -> Optional[SesionCanto]:
+        with self._lock:
+            sesion = self.sesiones.pop(cancion_id, None)
+            if sesion is not None:
+                self._terminadas.append(cancion_id)
+        return sesion
+
+    async def finalizar(self, cancion_id: int) -> Optional[puntuacion_dtw.Desglose]:
+        """Cierra la sesión al terminar la canción y guarda la puntuación final."""
+        sesion = self._sacar(cancion_id)
+        if sesion is None:
+            return None
+        return await self._puntuar(sesion)
+
+    def descartar(self, cancion_id: int):
+        """Cierra sin puntuar la sesión de una canción que salió de la cola sin cantarse."""
+        sesion = self._sacar(cancion_id)
+        if sesion is not None:
+            self._cerrar_sin_puntuar(sesion)
+
+    def _cerrar_sin_puntuar(self, sesion: SesionCanto):
+        sesion.cerrar_audio()
+        servicio_puntuacion.borrar_grabacion(sesion.ruta_wav)
+
+    async def desconectar(self, cancion_id: int):
+        """
+        El dispositivo cerró /ws/canto: se cierra el WAV y, si la canción ya no
+        suena (terminó justo mientras se abría la sesión), se cierra la sesión. Si
+        sigue sonando, lo cantado se puntúa al terminar la canción.
+        """
+        sesion = self.sesiones.get(cancion_id)
+        if sesion is None:
+            return
+        sesion.cerrar_audio()
+        estado = await asyncio.to_thread(self._estado, cancion_id)
+        if estado == "cantada":
+            await self.finalizar(cancion_id)
+        elif estado != "reproduciendo":
+            self.descartar(cancion_id)
+
+    def _estado(self, cancion_id: int) -> Optional[str]:
+        db = self.session_factory()
+        try:
+            return db.query(models.Cancion.estado).filter(models.Cancion.id == cancion_id).scalar()
+        finally:
+            db.close()
+
+    async def _puntuar(self, sesion: SesionCanto) -> Optional[puntuacion_dtw.Desglose]:
+        cancion_id = sesion.cancion_id
+        sesion.cerrar_audio()
+        if sesion.referencia is None:
+            # Sin referencia en caché: la grabación se puntúa por lotes como antes
+            if sesion.ruta_wav:
+                await servicio_puntuacion.servicio.enviar(cancion_id, sesion.youtube_id, sesion.ruta_wav)
+            return None
+
+        # El DTW sobre lo ya calculado tarda décimas de segundo: fuera del loop igualmente
+        desglose = await asyncio.to_thread(puntuacion_dtw.puntuar, sesion.referencia, sesion.serie())
+        db = self.session_factory()
+        try:
+            cancion = crud.registrar_puntuacion_ia(db, cancion_id, desglose.total)
+            # Puntuada en vivo: la grabación ya no hace falta
+            servicio_puntuacion.borrar_grabacion(sesion.ruta_wav)
+            if cancion is not None and self.al_puntuar:
+                await self.al_puntuar(cancion)
+        finally:
+            db.close()
+        return desglose
+
+    # --- Fin de la canción, observado en los commits ---
+
+    def _observar_cambios(self, cambios: List[tuple]):
+        """Recibe los cambios de cada commit (desde cualquier hilo)."""
+        for cambio in cambios:
+            if cambio[0] == "cancion" and cambio[3] != "reproduciendo":
+                cancion_id, estado = cambio[1], cambio[3]
+            elif cambio[0] == "cancion_borrada":
+                cancion_id, estado = cambio[1], None
+            else:
+                continue
+            if cancion_id not in self.sesiones:
+                continue
+            # Se saca ya, en el hilo del commit: desde aquí no se acepta más audio
+            sesion = self._sacar(cancion_id)
+            if sesion is None:
+                continue
+            if estado == "cantada":
+                self._loop.call_soon_threadsafe(self._lanzar, sesion)
+            else:
+                self._cerrar_sin_puntuar(sesion)
+
+    def _lanzar(self, sesion: SesionCanto):
+        tarea = asyncio.create_task(self._puntuar(sesion))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    def iniciar(self):
+        """Empieza a observar los commits para cerrar las sesiones al terminar cada canción."""
+        if self._motor is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        db = self.session_factory()
+        try:
+            self._motor = cola_justa.motor_para(db)
+        finally:
+            db.close()
+        self._motor.observar(self._observar_cambios)
+
+    def detener(self):
+        if self._motor is not None:
+            self._motor.dejar_de_observar(self._observar_cambios)
+        self._motor = None
+
+
+gestor = GestorCanto()
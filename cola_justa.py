@@ -0,0 +1,619 @@
+"""
+Algoritmo y motor en memoria de la "Cola Justa".
+
+Este módulo es el único lugar donde se implementa el reparto ORO/PLATA/BRONCE:
+- `ordenar_cola` es el núcleo puro: recibe tuplas compactas de canciones y los
+  totales de consumo por mesa y devuelve el orden.
+- `PoliticaCola` agrupa los parámetros (umbrales, cupos, trato de la mesa 0 del
+  DJ y clave de llegada). `POLITICAS` define la de cada cola.
+- `MotorColaJusta` mantiene esas mismas estructuras vivas entre peticiones.
+
+En lugar de recalcular la cola (consulta con join + SUM de consumos por mesa +
+round robin) en cada lectura, mantenemos un objeto de larga vida por base de
+datos con:
+- Los deques de canciones de cada mesa (ordenados por llegada).
+- El orden de turnos de las mesas (hora de llegada de su primera canción).
+- El consumo total de cada mesa (columna desnormalizada `Mesa.consumo_total`),
+  del que se deriva su categoría (tier) con una lectura O(1) de diccionario.
+
+El motor se actualiza de forma incremental escuchando los eventos de la sesión
+de SQLAlchemy: cada commit que añade, aprueba, rechaza, borra, reordena o
+reproduce una canción, o que cambia el total de consumo de una mesa, se aplica sobre estas
+estructuras. Las operaciones masivas (query.update/delete) y los cambios de
+esquema invalidan el motor, que se recarga completo en la siguiente lectura.
+
+Leer las primeras k canciones de la cola cuesta O(k + número de mesas) y no
+toca la base de datos.
+Junto al orden se guarda un índice de sumas prefijas de duración, de modo que el
+tiempo de espera de cualquier canción es una consulta O(1) al diccionario.
+
+Cada commit aplicado sube `MotorColaJusta.version`; las vistas serializadas de la
+cola se guardan por versión (`instantanea`) para no reconstruirlas si no cambió.
+"""
+import datetime
+import threading
+import time
+import weakref
+from bisect import bisect_left, insort
+from collections import namedtuple
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+import database
+import models
+from database import Base
+
+# Estados de canción que el motor ordena con el algoritmo de cola justa
+ESTADOS_COLA = ("aprobado", "pendiente_lazy")
+
+# Las canciones de usuarios sin mesa (ej. DJ) se agrupan en la mesa ficticia 0
+MESA_SIN_MESA = 0
+
+_SESSION_KEY = "cola_justa_cambios"
+
+# Tupla compacta que consume el algoritmo: la llegada es la clave de orden dentro de la mesa
+CancionCola = namedtuple("CancionCola", ["id", "mesa_id", "orden_manual", "llegada"])
+
+Entrada = namedtuple("Entrada", ["id", "usuario_id", "mesa_id", "estado", "orden_manual", "duracion", "created_at"])
+
+
+class PoliticaCola:
+    """
+    Parámetros del algoritmo de "Cola Justa".
+    - Umbrales de consumo por mesa (ORO / PLATA / BRONCE) y el cupo de cada categoría.
+    - Cupo de la mesa ficticia 0 (DJ / Sin Mesa).
+    - Clave de llegada: "id" (orden de inserción) o "created_at" (la que ajustan
+      los endpoints de admin que mueven canciones arriba/abajo).
+    """
+
+    def __init__(
+        self,
+        umbral_oro=150000,
+        umbral_plata=50000,
+        cupo_oro: int = 3,
+        cupo_plata: int = 2,
+        cupo_bronce: int = 1,
+        cupo_sin_mesa: int = 3,
+        llegada: str = "id",
+    ):
+        if llegada not in ("id", "created_at"):
+            raise ValueError(f"Clave de llegada no soportada: {llegada}")
+        self.umbral_oro = umbral_oro
+        self.umbral_plata = umbral_plata
+        self.cupo_oro = cupo_oro
+        self.cupo_plata = cupo_plata
+        self.cupo_bronce = cupo_bronce
+        self.cupo_sin_mesa = cupo_sin_mesa
+        self.llegada = llegada
+
+    def cupo(self, mesa_id: int, total) -> int:
+        """Cupo de canciones por turno según el consumo total de la mesa."""
+        # Vamos a darle trato de ORO al DJ si se usa para poner música activamente.
+        if mesa_id == MESA_SIN_MESA:
+            return self.cupo_sin_mesa
+        if total >= self.umbral_oro:
+            return self.cupo_oro
+        if total >= self.umbral_plata:
+            return self.cupo_plata
+        return self.cupo_bronce
+
+    def clave_llegada(self, cancion_id: int, created_at):
+        if self.llegada == "id":
+            return cancion_id
+        # SQLite devuelve fechas sin zona horaria; now_bogota() las crea con zona.
+        if created_at is None:
+            return datetime.datetime.min
+        return created_at.replace(tzinfo=None)
+
+
+# Aprobadas: orden de llegada por ID. Lazy: por created_at, que es lo que
+# intercambian los endpoints /canciones/lazy/{id}/move-up|move-down.
+POLITICAS = {
+    "aprobado": PoliticaCola(llegada="id"),
+    "pendiente_lazy": PoliticaCola(llegada="created_at"),
+}
+
+
+class _Cola:
+    """Estructuras ordenadas de una cola, actualizables canción a canción."""
+
+    def __init__(self):
+        self.manual = []     # [(orden_manual, cancion_id)] ordenada
+        self.por_mesa = {}   # {mesa_id: [(llegada, cancion_id), ...]} ordenada
+        self.turnos = []     # [((llegada, cancion_id), mesa_id)] ordenada por la primera canción
+        self.orden = None    # Caché de la cola completa (tupla de ids)
+        self.espera = None   # Caché {cancion_id: segundos de cola por delante} (sumas prefijas de `orden`)
+
+    def descartar_orden(self):
+        self.orden = None
+        self.espera = None
+
+    def agregar(self, cancion: CancionCola):
+        self.descartar_orden()
+        if cancion.orden_manual is not None:
+            insort(self.manual, (cancion.orden_manual, cancion.id))
+            return
+
+        clave = (cancion.llegada, cancion.id)
+        claves = self.por_mesa.get(cancion.mesa_id)
+        if claves is None:
+            self.por_mesa[cancion.mesa_id] = [clave]
+            insort(self.turnos, (clave, cancion.mesa_id))
+            return
+
+        primera_anterior = claves[0]
+        insort(claves, clave)
+        if claves[0] != primera_anterior:
+            self._mover_turno(cancion.mesa_id, primera_anterior, claves[0])
+
+    def quitar(self, cancion: CancionCola):
+        self.descartar_orden()
+        if cancion.orden_manual is not None:
+            clave = (cancion.orden_manual, cancion.id)
+            pos = bisect_left(self.manual, clave)
+            if pos < len(self.manual) and self.manual[pos] == clave:
+                del self.manual[pos]
+            return
+
+        claves = self.por_mesa.get(cancion.mesa_id)
+        if not claves:
+            return
+        clave = (cancion.llegada, cancion.id)
+        pos = bisect_left(claves, clave)
+        if pos >= len(claves) or claves[pos] != clave:
+            return
+
+        primera_anterior = claves[0]
+        del claves[pos]
+        if not claves:
+            del self.por_mesa[cancion.mesa_id]
+            self.turnos.remove((primera_anterior, cancion.mesa_id))
+        elif claves[0] != primera_anterior:
+            self._mover_turno(cancion.mesa_id, primera_anterior, claves[0])
+
+    def _mover_turno(self, mesa_id: int, primera_anterior, primera_nueva):
+        self.turnos.remove((primera_anterior, mesa_id))
+        insort(self.turnos, (primera_nueva, mesa_id))
+
+    def iterar(self, cupos: Dict[int, int]) -> Iterator[int]:
+        """
+        Genera los ids de la cola en orden: primero el orden manual y luego el
+        round robin por mesas (ordenadas por la llegada de su primera canción),
+        tomando en cada turno tantas canciones como el cupo de la mesa.
+        """
+        for _, cancion_id in self.manual:
+            yield cancion_id
+
+        activas = [(self.por_mesa[mesa_id], cupos.get(mesa_id, 1)) for _, mesa_id in self.turnos]
+        ronda = 0
+        while activas:
+            siguientes = []
+            for claves, cupo in activas:
+                inicio = ronda * cupo
+                for _, cancion_id in claves[inicio:inicio + cupo]:
+                    yield cancion_id
+                if inicio + cupo < len(claves):
+                    siguientes.append((claves, cupo))
+            activas = siguientes
+            ronda += 1
+
+
+def ordenar_cola(
+    canciones: Iterable[CancionCola],
+    totales_mesa: Dict[int, object],
+    politica: Optional[PoliticaCola] = None,
+    limite: Optional[int] = None,
+) -> List[int]:
+    """
+    Núcleo puro del algoritmo de "Cola Justa".
+
+    Recibe tuplas (id, mesa_id, orden_manual, llegada) y el consumo total de cada
+    mesa, y devuelve los ids en orden (solo los primeros `limite` si se indica):
+    1. Orden Manual: prioridad absoluta, ordenadas por `orden_manual`.
+    2. El resto se agrupa por mesa y se reparte por turnos (round robin), con el
+       cupo por turno que la política asigna según el consumo de la mesa.
+    """
+    politica = politica or PoliticaCola()
+    cola = _Cola()
+    for cancion in canciones:
+        cola.agregar(CancionCola(*cancion))
+    cupos = {mesa_id: politica.cupo(mesa_id, totales_mesa.get(mesa_id, 0)) for mesa_id in cola.por_mesa}
+    return list(islice(cola.iterar(cupos), limite))
+
+
+class MotorColaJusta:
+    """
+    Estado en memoria de las colas de una base de datos.
+    Es seguro usarlo desde los hilos del threadpool de FastAPI.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Versión de la cola: sube con cada commit que toca canciones, usuarios o
+        # mesas. `epoca` distingue las versiones de un proceso de las de otro.
+        self.version = 0
+        self.epoca = format(time.time_ns(), "x")
+        self._instantaneas = {}
+        self._observadores = []
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.cargado = False
+        self.canciones: Dict[int, Entrada] = {}
+        self.mesa_de_usuario: Dict[int, int] = {}
+        self.totales_mesa: Dict[int, object] = {}
+        self.colas = {estado: _Cola() for estado in ESTADOS_COLA}
+
+    def _nueva_version(self):
+        self.version += 1
+        self._instantaneas.clear()
+
+    # --- Carga e invalidación ---
+
+    def invalidar(self):
+        """Descarta el estado; la siguiente lectura lo recarga desde la base de datos."""
+        with self._lock:
+            self._reiniciar()
+            self._nueva_version()
+
+    def _cargar(self, db: Session):
+        self._reiniciar()
+
+        for usuario_id, mesa_id in db.query(models.Usuario.id, models.Usuario.mesa_id):
+            self.mesa_de_usuario[usuario_id] = mesa_id or MESA_SIN_MESA
+
+        for mesa_id, total in db.query(models.Mesa.id, models.Mesa.consumo_total):
+            self.totales_mesa[mesa_id] = total or 0
+
+        canciones = db.query(
+            models.Cancion.id,
+            models.Cancion.usuario_id,
+            models.Cancion.estado,
+            models.Cancion.orden_manual,
+            models.Cancion.duracion_seconds,
+            models.Cancion.created_at,
+        ).filter(models.Cancion.estado.in_(ESTADOS_COLA))
+        for fila in canciones:
+            self._poner_cancion(*fila)
+
+        self.cargado = True
+
+    # --- Cambios incrementales ---
+
+    def observar(self, funcion: Callable[[List[tuple]], None]):
+        """
+        Registra una función que recibe los cambios de cada commit (las mismas
+        operaciones que aplica el motor), para otros componentes en memoria.
+        Se llama desde el hilo que hizo el commit.
+        """
+        self._observadores.append(funcion)
+
+    def dejar_de_observar(self, funcion: Callable[[List[tuple]], None]):
+        if funcion in self._observadores:
+            self._observadores.remove(funcion)
+
+    def notificar(self, cambios: List[tuple]):
+        for funcion in list(self._observadores):
+            funcion(cambios)
+
+    def aplicar(self, cambios: List[tuple]):
+        """Aplica los cambios registrados por una transacción confirmada."""
+        self._aplicar(cambios)
+        self.notificar(cambios)
+
+    def _aplicar(self, cambios: List[tuple]):
+        with self._lock:
+            self._nueva_version()
+            if not self.cargado:
+                return
+            for cambio in cambios:
+                tipo = cambio[0]
+                if tipo == "invalidar":
+                    self.invalidar()
+                    return
+                elif tipo == "usuario":
+                    _, usuario_id, mesa_id = cambio
+                    self.mesa_de_usuario[usuario_id] = mesa_id or MESA_SIN_MESA
+                elif tipo == "usuario_borrado":
+                    self.mesa_de_usuario.pop(cambio[1], None)
+                elif tipo == "total_mesa":
+                    _, mesa_id, total = cambio
+                    self.totales_mesa[mesa_id] = total or 0
+                    for cola in self.colas.values():
+                        cola.descartar_orden()
+                elif tipo == "cancion":
+                    usuario_id = cambio[2]
+                    if usuario_id is not None and usuario_id not in self.mesa_de_usuario:
+                        self.invalidar()
+                        return
+                    self._poner_cancion(*cambio[1:])
+                elif tipo == "cancion_borrada":
+                    self._quitar_cancion(cambio[1])
+
+    def _poner_cancion(self, cancion_id, usuario_id, estado, orden_manual, duracion, created_at):
+        self._quitar_cancion(cancion_id)
+        # Igual que el join con Usuario de la consulta original: sin usuario no entra en la cola
+        if estado not in self.colas or usuario_id not in self.mesa_de_usuario:
+            return
+        entrada = Entrada(
+            cancion_id, usuario_id, self.mesa_de_usuario[usuario_id], estado,
+            orden_manual, duracion or 0, created_at,
+        )
+        self.canciones[cancion_id] = entrada
+        self.colas[estado].agregar(self._para_cola(entrada))
+
+    def _quitar_cancion(self, cancion_id):
+        entrada = self.canciones.pop(cancion_id, None)
+        if entrada:
+            self.colas[entrada.estado].quitar(self._para_cola(entrada))
+
+    @staticmethod
+    def _para_cola(entrada: Entrada) -> CancionCola:
+        llegada = POLITICAS[entrada.estado].clave_llegada(entrada.id, entrada.created_at)
+        return CancionCola(entrada.id, entrada.mesa_id, entrada.orden_manual, llegada)
+
+    # --- Lecturas ---
+
+    def _cupos(self, estado: str) -> Dict[int, int]:
+        politica = POLITICAS[estado]
+        return {
+            mesa_id: politica.cupo(mesa_id, self.totales_mesa.get(mesa_id, 0))
+            for mesa_id in self.colas[estado].por_mesa
+        }
+
+    def ids_en_orden(self, db: Session, estado: str, limite: Optional[int] = None) -> List[int]:
+        """Devuelve los ids de la cola `estado` en orden justo (las primeras `limite` si se indica)."""
+        with self._lock:
+            if not self.cargado:
+                self._cargar(db)
+            cola = self.colas[estado]
+            if cola.orden is None and limite is not None:
+                return list(islice(cola.iterar(self._cupos(estado)), limite))
+            if cola.orden is None:
+                cola.orden = tuple(cola.iterar(self._cupos(estado)))
+            return list(cola.orden[:limite])
+
+    def duracion(self, cancion_id: int) -> int:
+        entrada = self.canciones.get(cancion_id)
+        return entrada.duracion if entrada else 0
+
+    def instantanea(self, clave, construir: Callable[[int], object]) -> Tuple[int, object]:
+        """
+        Devuelve (version, valor) de la instantánea `clave` para la versión actual,
+        construyéndola con `construir(version)` solo la primera vez. Si la cola cambia
+        mientras se construye, el resultado se devuelve pero no se guarda.
+        """
+        with self._lock:
+            version = self.version
+            guardada = self._instantaneas.get(clave)
+        if guardada is not None:
+            return version, guardada
+        valor = construir(version)
+        with self._lock:
+            if self.version == version:
+                self._instantaneas[clave] = valor
+        return version, valor
+
+    def _indice_espera(self, db: Session, estado: str) -> Dict[int, int]:
+        """
+        Índice de sumas prefijas sobre el orden de la cola: para cada canción, la
+        duración acumulada de las que van por delante. Se construye una vez por
+        versión de la cola y se descarta junto con `orden`.
+        """
+        if not self.cargado:
+            self._cargar(db)
+        cola = self.colas[estado]
+        if cola.espera is None:
+            if cola.orden is None:
+                cola.orden = tuple(cola.iterar(self._cupos(estado)))
+            espera, acumulado = {}, 0
+            for cancion_id in cola.orden:
+                espera[cancion_id] = acumulado
+                acumulado += self.canciones[cancion_id].duracion
+            cola.espera = espera
+        return cola.espera
+
+    def espera_en_cola(self, db: Session, estado: str, cancion_id: int) -> Optional[int]:
+        """Segundos de cola por delante de la canción, o None si no está en la cola `estado`."""
+        with self._lock:
+            return self._indice_espera(db, estado).get(cancion_id)
+
+    def esperas(
+        self,
+        db: Session,
+        estado: str,
+        usuario_id: Optional[int] = None,
+        mesa_id: Optional[int] = None,
+    ) -> List[Tuple[int, int, int]]:
+        """
+        Devuelve (cancion_id, posicion, segundos por delante) de las canciones de la
+        cola `estado` que pertenecen al usuario y/o a la mesa indicados, en orden.
+        """
+        with self._lock:
+            espera = self._indice_espera(db, estado)
+            resultado = []
+            for posicion, cancion_id in enumerate(self.colas[estado].orden):
+                entrada = self.canciones[cancion_id]
+                if usuario_id is not None and entrada.usuario_id != usuario_id:
+                    continue
+                if mesa_id is not None and entrada.mesa_id != mesa_id:
+                    continue
+                resultado.append((cancion_id, posicion, espera[cancion_id]))
+            return resultado
+
+
+_motores = weakref.WeakKeyDictionary()
+_motores_lock = threading.Lock()
+
+
+def _engine_de(bind):
+    # Una sesión puede estar ligada a un Engine o a una Connection
+    return getattr(bind, "engine", bind)
+
+
+def motor_para(db: Session) -> MotorColaJusta:
+    """Obtiene (o crea) el motor asociado a la base de datos de la sesión."""
+    engine = _engine_de(db.get_bind())
+    with _motores_lock:
+        motor = _motores.get(engine)
+        if motor is None:
+            motor = _motores[engine] = MotorColaJusta()
+        return motor
+
+
+def compartir_motor(engine, con) -> MotorColaJusta:
+    """
+    Hace que `engine` use el mismo motor que `con` (p. ej. el `sync_engine` de la
+    capa asíncrona y el engine síncrono, que apuntan a la misma base).
+    """
+    engine, con = _engine_de(engine), _engine_de(con)
+    with _motores_lock:
+        motor = _motores.get(con)
+        if motor is None:
+            motor = _motores[con] = MotorColaJusta()
+        _motores[engine] = motor
+        return motor
+
+
+# --- Integración con la sesión de SQLAlchemy ---
+
+_MODELOS_DEL_MOTOR = (models.Cancion, models.Usuario, models.Mesa)
+_CAMPOS_CANCION = ("usuario_id", "estado", "orden_manual", "duracion_seconds", "created_at")
+
+
+def _valor(obj, atributo):
+    """Lee un atributo ya cargado sin disparar consultas (None si no está cargado)."""
+    return inspect(obj).dict.get(atributo)
+
+
+def _id(obj):
+    identidad = inspect(obj).identity
+    return identidad[0] if identidad else _valor(obj, "id")
+
+
+def _datos_cancion(session: Session, obj) -> Optional[tuple]:
+    """Campos que usa el motor; si el objeto estaba expirado se leen de la fila ya escrita."""
+    datos = inspect(obj).dict
+    if all(campo in datos for campo in _CAMPOS_CANCION):
+        return tuple(datos[campo] for campo in _CAMPOS_CANCION)
+    return session.execute(
+        select(*(getattr(models.Cancion, campo) for campo in _CAMPOS_CANCION))
+        .where(models.Cancion.id == _id(obj))
+    ).one_or_none()
+
+
+def _cambio(obj, atributo) -> bool:
+    return inspect(obj).attrs[atributo].history.has_changes()
+
+
+def _total_mesa(session: Session, mesa_id: int):
+    """
+    Lee el total acumulado ya escrito en esta transacción. crud lo actualiza con
+    una expresión SQL (consumo_total + delta), así que el objeto queda expirado.
+    """
+    return session.execute(
+        select(models.Mesa.consumo_total).where(models.Mesa.id == mesa_id)
+    ).scalar() or 0
+
+
+@event.listens_for(Session, "after_flush")
+def _registrar_cambios(session: Session, flush_context):
+    usuarios, canciones, totales = [], [], []
+    invalidar = False
+
+    for obj in session.new | session.dirty:
+        if isinstance(obj, models.Cancion):
+            datos = _datos_cancion(session, obj)
+            if datos is not None:
+                canciones.append(("cancion", _id(obj), *datos))
+        elif isinstance(obj, models.Usuario):
+            if obj in session.new:
+                usuarios.append(("usuario", _id(obj), _valor(obj, "mesa_id")))
+            elif _cambio(obj, "mesa_id"):
+                # Cambiar de mesa mueve todas sus canciones a otra mesa: recarga completa
+                invalidar = True
+            else:
+                # El nick sale en la cola: basta con subir la versión
+                usuarios.append(("version",))
+        elif isinstance(obj, models.Mesa):
+            mesa_id = _id(obj)
+            totales.append(("total_mesa", mesa_id, _total_mesa(session, mesa_id)))
+
+    for obj in session.deleted:
+        if isinstance(obj, models.Cancion):
+            canciones.append(("cancion_borrada", _id(obj)))
+        elif isinstance(obj, models.Usuario):
+            usuarios.append(("usuario_borrado", _id(obj)))
+        elif isinstance(obj, models.Mesa):
+            totales.append(("total_mesa", _id(obj), 0))
+
+    cambios = session.info.setdefault(_SESSION_KEY, [])
+    if invalidar:
+        cambios.append(("invalidar",))
+    # Los usuarios van primero para que sus canciones encuentren la mesa
+    cambios.extend(usuarios)
+    cambios.extend(totales)
+    cambios.extend(canciones)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _registrar_operacion_masiva(orm_execute_state):
+    # query.update()/delete() no pasan por el flush: recargamos el motor tras el commit
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ not in _MODELOS_DEL_MOTOR:
+            # Tablas que el motor no lee (p. ej. scoring_jobs): no hace falta recargar
+            return
+        session = orm_execute_state.session
+        session.info.setdefault(_SESSION_KEY, []).append(("invalidar",))
+
+
+def marca_cambios(session: Session) -> int:
+    """Cuántos cambios hay anotados en la sesión (al abrir un SAVEPOINT, ver `descartar_cambios_desde`)."""
+    return len(session.info.get(_SESSION_KEY, ()))
+
+
+def descartar_cambios_desde(session: Session, marca: int):
+    """
+    Olvida los cambios anotados desde `marca`: los de un SAVEPOINT deshecho
+    (escritor_unico) no deben llegar al motor ni a sus observadores en el commit.
+    """
+    cambios = session.info.get(_SESSION_KEY)
+    if cambios is not None:
+        del cambios[marca:]
+
+
+@event.listens_for(Session, "after_commit")
+def _aplicar_cambios(session: Session):
+    # También se emite al liberar un SAVEPOINT: sus cambios esperan al commit de verdad
+    if session.in_nested_transaction():
+        return
+    cambios = session.info.pop(_SESSION_KEY, None)
+    if cambios:
+        motor_para(session).aplicar(cambios)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_cambios(session: Session):
+    # Un SAVEPOINT deshecho solo descarta lo suyo (descartar_cambios_desde), no lo de toda la transacción
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_SESSION_KEY, None)
+
+
+def _invalidar_por_ddl(target, connection, **kw):
+    with _motores_lock:
+        motor = _motores.get(_engine_de(connection))
+    if motor is not None:
+        motor.invalidar()
+        motor.notificar([("invalidar",)])
+
+
+event.listen(Base.metadata, "after_create", _invalidar_por_ddl)
+event.listen(Base.metadata, "after_drop", _invalidar_por_ddl)
+
+# El pool de solo lectura ve la misma base que el engine principal
+compartir_motor(database.engine_lectura, database.engine)
@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 load_dotenv() # Carga las variables del archivo .env
@@ -9,5 +10,39 @@ class AppSettings:
     """
     def __init__(self):
         self.KARAOKE_CIERRE = os.getenv("KARAOKE_CIERRE", "02:00") # Leemos del .env, con un valor por defecto
+        # Cada cuántos minutos se recalculan los totales de consumo de mesas y cuentas (0 = sólo al arrancar)
+        self.RECONCILIACION_TOTALES_MINUTOS = int(os.getenv("RECONCILIACION_TOTALES_MINUTOS", "30"))
+        # Agrupación de los avisos de cola por WebSocket: ventana de espera y retraso máximo garantizado
+        self.COLA_BROADCAST_VENTANA_MS = int(os.getenv("COLA_BROADCAST_VENTANA_MS", "100"))
+        self.COLA_BROADCAST_ESPERA_MAXIMA_MS = int(os.getenv("COLA_BROADCAST_ESPERA_MAXIMA_MS", "500"))
+        # Cola de salida de cada WebSocket: mensajes pendientes y segundos por envío antes de expulsar al cliente
+        self.WS_MAX_MENSAJES_PENDIENTES = int(os.getenv("WS_MAX_MENSAJES_PENDIENTES", "100"))
+        self.WS_TIMEOUT_ENVIO_SEGUNDOS = float(os.getenv("WS_TIMEOUT_ENVIO_SEGUNDOS", "5"))
+        # Autoplay del servidor: segundos de transición entre canciones y fracción de la canción
+        # en la que se aprueba la siguiente lazy (0.5 = a mitad de canción)
+        self.AUTOPLAY_TRANSICION_SEGUNDOS = float(os.getenv("AUTOPLAY_TRANSICION_SEGUNDOS", "5"))
+        self.AUTOPLAY_PROGRESO_LAZY = float(os.getenv("AUTOPLAY_PROGRESO_LAZY", "0.5"))
+        # Procesos dedicados a la puntuación por IA (Demucs y librosa consumen mucha CPU y memoria)
+        self.PUNTUACION_IA_PROCESOS = int(os.getenv("PUNTUACION_IA_PROCESOS", "1"))
+        # Cola persistente de puntuaciones: intentos por trabajo y duración de la concesión de un trabajador
+        self.PUNTUACION_IA_INTENTOS = int(os.getenv("PUNTUACION_IA_INTENTOS", "3"))
+        self.PUNTUACION_IA_CONCESION_SEGUNDOS = int(os.getenv("PUNTUACION_IA_CONCESION_SEGUNDOS", "120"))
+        # Precarga del pitch original: procesos simultáneos y cuántas canciones de la cola mirar por delante
+        self.PRECARGA_PITCH_CONCURRENCIA = int(os.getenv("PRECARGA_PITCH_CONCURRENCIA", "1"))
+        self.PRECARGA_PITCH_VENTANA = int(os.getenv("PRECARGA_PITCH_VENTANA", "10"))
+        # Trabajador persistente de Demucs: activado, dirección local, hilos de torch y clave de la conexión.
+        # Sin clave en el .env se genera una por ejecución y se deja en el entorno para los procesos hijos.
+        self.DEMUCS_TRABAJADOR = os.getenv("DEMUCS_TRABAJADOR", "1") == "1"
+        self.DEMUCS_DIRECCION = os.getenv("DEMUCS_DIRECCION", "127.0.0.1:47311")
+        self.DEMUCS_HILOS = int(os.getenv("DEMUCS_HILOS", str(max(1, (os.cpu_count() or 2) // 2))))
+        self.DEMUCS_CLAVE = os.environ.setdefault("DEMUCS_CLAVE", secrets.token_hex(16))
+        # Presupuesto de disco de las cachés de audio (descargas, pistas de Demucs y pitch) y cada
+        # cuántos minutos se recortan (0 = solo a mano desde el panel de admin)
+        self.CACHE_AUDIO_PRESUPUESTO_MB = int(os.getenv("CACHE_AUDIO_PRESUPUESTO_MB", "4096"))
+        self.CACHE_AUDIO_REVISION_MINUTOS = int(os.getenv("CACHE_AUDIO_REVISION_MINUTOS", "10"))
+        # Escritor único: las mutaciones calientes pasan por un hilo que agrupa hasta
+        # ESCRITOR_LOTE_MAXIMO comandos en un solo commit (0 = cada sesión escribe por su cuenta)
+        self.ESCRITOR_UNICO = os.getenv("ESCRITOR_UNICO", "1") == "1"
+        self.ESCRITOR_LOTE_MAXIMO = int(os.getenv("ESCRITOR_LOTE_MAXIMO", "32"))
 
 settings = AppSettings()
\ No newline at end of file
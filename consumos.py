@@ -2,8 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 
-import crud, schemas
+import crud, crud_async, schemas
 from database import SessionLocal
+from database_async import get_async_db
 import websocket_manager
 from security import api_key_auth
 import asyncio
@@ -47,6 +48,7 @@ async def registrar_consumo(
             'producto_nombre': db_consumo.producto.nombre if db_consumo.producto else None,
             'usuario_nick': db_consumo.usuario.nick if db_consumo.usuario else None,
             'mesa_nombre': mesa_nombre,
+            'mesa_id': db_consumo.mesa_id,
             'created_at': db_consumo.created_at.isoformat()
             # 'is_single_item': True is implied by 'type': 'single_consumo'
         } 
@@ -86,6 +88,7 @@ async def usuario_pide_producto(
             'producto_nombre': db_consumo.producto.nombre if db_consumo.producto else None,
             'usuario_nick': db_consumo.usuario.nick if db_consumo.usuario else None,
             'mesa_nombre': mesa_nombre,
+            'mesa_id': db_consumo.mesa_id,
             'created_at': db_consumo.created_at.isoformat()
                 # 'is_single_item': True is implied by 'type': 'single_consumo'
             } 
@@ -96,7 +99,7 @@ async def usuario_pide_producto(
 
 @router.post("/pedir/carrito/{usuario_id}", response_model=List[schemas.Consumo], summary="Un usuario pide un carrito de compras completo")
 async def usuario_pide_carrito(
-    usuario_id: int, carrito: schemas.CarritoCreate, db: Session = Depends(get_db)
+    usuario_id: int, carrito: schemas.CarritoCreate, db=Depends(get_async_db)
 ):
     """
     **[Público]** Permite que un usuario envíe un pedido consolidado (carrito).
@@ -106,7 +109,7 @@ async def usuario_pide_carrito(
         raise HTTPException(status_code=400, detail="El carrito no puede estar vacío.")
 
     # La nueva función crud maneja la transacción completa
-    consumos_creados, error_detail = crud.create_pedido_from_carrito(db=db, carrito=carrito, usuario_id=usuario_id)
+    consumos_creados, error_detail = await crud_async.create_pedido_from_carrito(db=db, carrito=carrito, usuario_id=usuario_id)
 
     if error_detail:
         raise HTTPException(status_code=400, detail=error_detail)
@@ -126,6 +129,7 @@ async def usuario_pide_carrito(
                 'consumo_ids': [c.id for c in consumos_creados], # IDs para acciones
                 'usuario_nick': primer_consumo.usuario.nick if primer_consumo.usuario else 'Desconocido',
                 'mesa_nombre': mesa_nombre,
+                'mesa_id': primer_consumo.mesa_id,
                 'created_at': primer_consumo.created_at.isoformat(),
                 'items': [
                     {'producto_nombre': c.producto.nombre, 'cantidad': c.cantidad} for c in consumos_creados
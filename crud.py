@@ -5,6 +5,9 @@ import secrets
 from typing import List, Optional
 import datetime
 import models, schemas
+import cola_justa
+import escritor_unico
+from database import hora_del_dia, mayor, segundos_entre
 from timezone_utils import now_bogota
 from decimal import Decimal # Importar Decimal
 
@@ -104,7 +107,7 @@ def update_cancion_estado(db: Session, cancion_id: int, nuevo_estado: str):
         db.refresh(db_cancion)
     return db_cancion
 
-def get_cola_priorizada(db: Session):
+def get_cola_priorizada(db: Session, limite: Optional[int] = None):
     """
     Obtiene la lista de canciones aprobadas, ordenadas por el algoritmo de "Cola Justa".
     
@@ -117,129 +120,25 @@ def get_cola_priorizada(db: Session):
         - BRONCE (<= $50.000): Cupo de 1 canciÃÂ³n por turno.
     4. Round Robin: Se iteran las mesas (ordenadas por la hora de llegada de su primera canciÃÂ³n pendiente)
        y se toman N canciones (segÃÂºn su cupo) en cada turno.
+    5. El orden se calcula en memoria con el motor de `cola_justa`, que se mantiene
+       actualizado con cada commit; aquí solo se cargan las canciones resultantes.
+       Si se indica `limite`, solo se devuelven las primeras `limite` canciones.
     """
-    from collections import deque
-    
-    # 1. Obtener todas las canciones aprobadas
-    # Ordenamos por ID ascendente para respetar el orden de llegada "natural" dentro de cada mesa
-    todas_canciones = (
+    ids = cola_justa.motor_para(db).ids_en_orden(db, "aprobado", limite)
+    return _canciones_por_ids(db, ids)
+
+def _canciones_por_ids(db: Session, ids: List[int]):
+    """Carga las canciones indicadas (con usuario y mesa) respetando el orden de `ids`."""
+    if not ids:
+        return []
+    canciones = (
         db.query(models.Cancion)
-        .join(models.Usuario, models.Cancion.usuario_id == models.Usuario.id)
-        .filter(models.Cancion.estado == "aprobado")
-        .order_by(models.Cancion.orden_manual.asc().nulls_last(), models.Cancion.id.asc())
+        .options(joinedload(models.Cancion.usuario).joinedload(models.Usuario.mesa))
+        .filter(models.Cancion.id.in_(ids))
         .all()
     )
-
-    # 2. Separar canciones con orden manual (Prioridad Absoluta)
-    cola_manual = []
-    cola_pool = []
-    
-    for cancion in todas_canciones:
-        if cancion.orden_manual is not None:
-            # Insertar respetando el valor de orden_manual si es posible, o simplemente al principio
-            cola_manual.append(cancion)
-        else:
-            cola_pool.append(cancion)
-            
-    # Si solo hay canciones manuales, retornamos
-    if not cola_pool:
-        return cola_manual
-
-    # 3. Agrupar canciones por Mesa
-    match_mesa_canciones = {} # {mesa_id: deque([canciones])}
-    mesa_arrival_time = {} # {mesa_id: primer_id_cancion} para ordenar turnos
-    
-    mesas_involucradas_ids = set()
-
-    for cancion in cola_pool:
-        mesa_id = cancion.usuario.mesa_id
-        if not mesa_id:
-            # Si un usuario no tiene mesa (ej. DJ), lo tratamos como una mesa "ficticia" con ID negativo
-            # o lo agrupamos en un grupo especial. Asumamos ID 0 para "Sin Mesa"
-            mesa_id = 0
-            
-        if mesa_id not in match_mesa_canciones:
-            match_mesa_canciones[mesa_id] = deque()
-            mesa_arrival_time[mesa_id] = cancion.id # El ID mÃÂ¡s bajo es el primero que llegÃÂ³
-            mesas_involucradas_ids.add(mesa_id)
-            
-        match_mesa_canciones[mesa_id].append(cancion)
-
-    # 4. Calcular CategorÃÂ­a (Tier) de cada Mesa
-    # Necesitamos el consumo total de cada mesa involucrada
-    # Definimos umbrales
-    UMBRAL_ORO = 150000
-    UMBRAL_PLATA = 50000
-    
-    mesa_tiers = {} # {mesa_id: 'oro'|'plata'|'bronce'}
-    mesa_quotas = {} # {mesa_id: int}
-    
-    if mesas_involucradas_ids:
-        # Consulta eficiente para obtener consumos de las mesas relevantes
-        # Excluimos la mesa 0 (sin mesa/DJ) de la consulta de base de datos
-        ids_reales = [mid for mid in mesas_involucradas_ids if mid != 0]
-        
-        consumos_mesas = {}
-        if ids_reales:
-            rows = (
-                db.query(
-                    models.Usuario.mesa_id,
-                    func.sum(models.Consumo.valor_total)
-                )
-                .join(models.Consumo, models.Usuario.id == models.Consumo.usuario_id)
-                .filter(models.Usuario.mesa_id.in_(ids_reales))
-                .group_by(models.Usuario.mesa_id)
-                .all()
-            )
-            for mid, total in rows:
-                consumos_mesas[mid] = total or 0
-        
-        # Asignar quotas
-        for mid in mesas_involucradas_ids:
-            total = consumos_mesas.get(mid, 0)
-            
-            # DJ / Sin Mesa (ID 0) recibe trato Preferencial o EstÃÂ¡ndar?
-            # Vamos a darle trato de ORO al DJ si se usa para poner mÃÂºsica activamente.
-            if mid == 0: 
-                quota = 3 
-            elif total >= UMBRAL_ORO:
-                quota = 3
-            elif total >= UMBRAL_PLATA:
-                quota = 2
-            else:
-                quota = 1
-                
-            mesa_quotas[mid] = quota
-
-    # 5. Construir la Cola Round-Robin
-    cola_justa = []
-    
-    # Ordenamos las mesas por orden de llegada (quiÃÂ©n puso canciÃÂ³n primero)
-    orden_turnos_mesas = sorted(mesas_involucradas_ids, key=lambda mid: mesa_arrival_time[mid])
-    
-    # Bucle Round Robin
-    while match_mesa_canciones:
-        # Iterar sobre una copia de la lista de mesas para poder borrar claves del diccionario principal
-        for mesa_id in orden_turnos_mesas:
-            if mesa_id not in match_mesa_canciones:
-                continue
-                
-            queue_de_mesa = match_mesa_canciones[mesa_id]
-            cupo = mesa_quotas.get(mesa_id, 1)
-            
-            # Tomar hasta 'cupo' canciones
-            tomadas = 0
-            while tomadas < cupo and queue_de_mesa:
-                cancion = queue_de_mesa.popleft()
-                cola_justa.append(cancion)
-                tomadas += 1
-            
-            # Si la mesa se queda sin canciones, la eliminamos del diccionario
-            if not queue_de_mesa:
-                del match_mesa_canciones[mesa_id]
-    
-    # 6. Fusionar: Manual + Justa
-    return cola_manual + cola_justa
+    por_id = {cancion.id: cancion for cancion in canciones}
+    return [por_id[cancion_id] for cancion_id in ids if cancion_id in por_id]
 
 def get_producto_by_nombre(db: Session, nombre: str):
     """Busca un producto por su nombre."""
@@ -327,11 +226,14 @@ def create_consumo_para_usuario(db: Session, consumo: schemas.ConsumoCreate, usu
     # 6. Otorgar puntos al usuario individual (ej: 1 punto por cada 10 de moneda gastados)
     db_usuario.puntos += int(valor_total_transaccion / 10)
 
+    # 7. Acumular en los totales de la mesa y de la cuenta (misma transacción)
+    acumular_consumo_en_totales(db, db_usuario.mesa_id, active_cuenta.id, valor_total_transaccion)
+
     db.add(db_consumo)
     db.commit()
     db.refresh(db_consumo)
 
-    # 7. Actualizar el nivel del usuario basado en su consumo individual
+    # 8. Actualizar el nivel del usuario basado en su consumo individual
     total_consumido_usuario = db.query(func.sum(models.Consumo.valor_total)).filter(
         models.Consumo.usuario_id == usuario_id
     ).scalar() or 0
@@ -405,6 +307,9 @@ def create_pedido_from_carrito(db: Session, carrito: schemas.CarritoCreate, usua
             # Descontamos el stock
             db_producto.stock -= item.cantidad
 
+            # Acumulamos en los totales de la mesa y de la cuenta
+            acumular_consumo_en_totales(db, db_usuario.mesa_id, active_cuenta.id, valor_linea)
+
         # Si todo fue bien, actualizamos los puntos y el nivel del usuario INDIVIDUAL
         db_usuario.puntos += int(valor_total_pedido / 10)
         total_consumido_historico = (db.query(func.sum(models.Consumo.valor_total)).filter(
@@ -426,50 +331,51 @@ def create_pedido_from_carrito(db: Session, carrito: schemas.CarritoCreate, usua
 
 def marcar_cancion_actual_como_cantada(db: Session):
     """
-    Busca la canciÃÂ³n que se estÃÂ¡ reproduciendo, la marca como 'cantada' y le da puntos al usuario.
-    Simula una puntuaciÃÂ³n de IA.
+    Busca la canción que se está reproduciendo, la marca como 'cantada' y le da
+    los puntos base al usuario. Si el cantante la cantó en vivo (`canto_en_vivo`)
+    o subió su grabación, `puntuacion_ia` queda en None hasta que se calcula y se
+    guarda con `registrar_puntuacion_ia`. Sin audio, la puntuación es 0.
     """
     import os
-    import ia_scorer # Importamos nuestro nuevo mÃÂ³dulo de IA
+    import servicio_puntuacion
 
-    # 1. Buscar la canciÃÂ³n que estÃÂ¡ actualmente en estado 'reproduciendo'
     cancion_actual = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
-    
     if not cancion_actual:
-        return None  # No hay ninguna canciÃÂ³n reproduciÃÂ©ndose
-    
-    # --- INICIO DE LA INTEGRACIÃÂN CON IA ---
-    # 2. Calcular el puntaje usando el mÃÂ³dulo de IA.
-    #    Asumimos que el audio del usuario se sube a una carpeta temporal con el ID de la canciÃÂ³n.
-    #    Este es un paso que el frontend deberÃÂ¡ implementar en el futuro.
-    user_audio_path = os.path.join(ia_scorer.TEMP_DIR, f"user_recording_{cancion_actual.id}.wav")
-    
-    if os.path.exists(user_audio_path):
-        puntuacion = ia_scorer.calculate_score(cancion_actual.youtube_id, user_audio_path)
-        # Opcional: eliminar el audio del usuario despuÃÂ©s de procesarlo
-        # os.remove(user_audio_path)
+        return None  # No hay ninguna canción reproduciéndose
+
+    import canto_en_vivo
+
+    if canto_en_vivo.gestor.activa(cancion_actual.id) or os.path.exists(servicio_puntuacion.ruta_grabacion(cancion_actual.id)):
+        cancion_actual.puntuacion_ia = None  # Pendiente de calcular
     else:
-        # Si no se subiÃÂ³ audio, la puntuaciÃÂ³n es 0.
-        puntuacion = 0
-    # --- FIN DE LA INTEGRACIÃÂN CON IA ---
-    
-    cancion_actual.puntuacion_ia = puntuacion
+        cancion_actual.puntuacion_ia = 0
 
-    # 3. Actualizar el estado de la canciÃÂ³n a 'cantada'
     cancion_actual.estado = "cantada"
     cancion_actual.finished_at = now_bogota()
 
-    # 4. Dar puntos al usuario por cantar (puntos base + puntaje de IA)
+    # 10 puntos base por cantar; el puntaje de la IA se suma al calcularlo
     if cancion_actual.usuario:
-        cancion_actual.usuario.puntos += (10 + puntuacion) # 10 puntos base + el puntaje de la IA
+        cancion_actual.usuario.puntos += 10
 
     db.commit()
     db.refresh(cancion_actual)
     return cancion_actual
 
+def registrar_puntuacion_ia(db: Session, cancion_id: int, puntuacion: int):
+    """Guarda la puntuación calculada por la IA y se la suma a los puntos del usuario."""
+    cancion = db.query(models.Cancion).filter(models.Cancion.id == cancion_id).first()
+    if not cancion:
+        return None
+    cancion.puntuacion_ia = puntuacion
+    if cancion.usuario:
+        cancion.usuario.puntos = (cancion.usuario.puntos or 0) + puntuacion
+    db.commit()
+    db.refresh(cancion)
+    return cancion
+
 def marcar_siguiente_como_reproduciendo(db: Session):
     """Busca la siguiente canciÃÂ³n en la cola y la marca como 'reproduciendo'."""
-    siguiente_cancion = get_cola_priorizada(db)
+    siguiente_cancion = get_cola_priorizada(db, limite=1)
     if not siguiente_cancion:
         return None
     
@@ -479,34 +385,43 @@ def marcar_siguiente_como_reproduciendo(db: Session):
     db.refresh(siguiente_cancion[0])
     return siguiente_cancion[0]
 
+def _tiempo_restante_reproduccion(db: Session) -> float:
+    """Segundos que le quedan a la canción que se está reproduciendo (0 si no hay)."""
+    cancion_actual = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
+    if not cancion_actual or not cancion_actual.started_at:
+        return 0
+    # SQLite devuelve started_at sin zona horaria (hora de Bogotá): comparamos sin zona
+    inicio = cancion_actual.started_at.replace(tzinfo=None)
+    tiempo_transcurrido = (now_bogota().replace(tzinfo=None) - inicio).total_seconds()
+    return max(0, (cancion_actual.duracion_seconds or 0) - tiempo_transcurrido)
+
 def get_tiempo_espera_para_cancion(db: Session, cancion_id: int) -> int:
     """
-    Calcula el tiempo de espera estimado en segundos para una canciÃÂ³n especÃÂ­fica.
+    Calcula el tiempo de espera estimado en segundos para una canción específica:
+    lo que le queda a la canción actual más la duración acumulada de las aprobadas
+    que van por delante (índice de sumas prefijas del motor de la cola justa).
+    Devuelve -1 si la canción no está en la cola (ya se cantó, fue rechazada, etc.).
     """
-    # 1. Obtener la canciÃÂ³n que se estÃÂ¡ reproduciendo
-    cancion_actual = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
-    
-    tiempo_espera_total = 0
-    if cancion_actual:
-        tiempo_transcurrido = (now_bogota() - cancion_actual.started_at).total_seconds()
-        tiempo_restante_actual = max(0, cancion_actual.duracion_seconds - tiempo_transcurrido)
-        tiempo_espera_total += tiempo_restante_actual
-
-    # 2. Obtener la cola de canciones aprobadas
-    cola_aprobada = get_cola_priorizada(db)
-
-    # 3. Sumar la duraciÃÂ³n de las canciones que estÃÂ¡n antes de la nuestra
-    for cancion_en_cola in cola_aprobada:
-        if cancion_en_cola.id == cancion_id:
-            # Llegamos a nuestra canciÃÂ³n, dejamos de sumar
-            break
-        tiempo_espera_total += cancion_en_cola.duracion_seconds
-    else:
-        # Si la canciÃÂ³n no se encuentra en la cola (ya se cantÃÂ³, fue rechazada, etc.)
-        # devolvemos -1 para indicar que no hay tiempo de espera.
+    en_cola = cola_justa.motor_para(db).espera_en_cola(db, "aprobado", cancion_id)
+    if en_cola is None:
         return -1
+    return int(_tiempo_restante_reproduccion(db) + en_cola)
 
-    return int(tiempo_espera_total)
+def get_tiempos_espera(db: Session, usuario_id: Optional[int] = None, mesa_id: Optional[int] = None) -> dict:
+    """
+    Tiempos de espera de todas las canciones aprobadas de un usuario y/o una mesa
+    en una sola llamada. El tiempo restante de la canción actual se calcula una
+    sola vez para todo el lote.
+    """
+    restante = _tiempo_restante_reproduccion(db)
+    esperas = cola_justa.motor_para(db).esperas(db, "aprobado", usuario_id=usuario_id, mesa_id=mesa_id)
+    return {
+        "tiempo_restante_actual_segundos": int(restante),
+        "canciones": [
+            {"cancion_id": cancion_id, "posicion": posicion + 1, "tiempo_espera_segundos": int(restante + en_cola)}
+            for cancion_id, posicion, en_cola in esperas
+        ],
+    }
 
 def get_ranking_usuarios(db: Session):
     """
@@ -533,9 +448,12 @@ def reset_database_for_new_night(db: Session):
     """
     # El orden de borrado es inverso al de creaciÃÂ³n de dependencias
     db.query(models.Consumo).delete()
+    db.query(models.TrabajoPuntuacion).delete()
     db.query(models.Cancion).delete()
     db.query(models.Usuario).delete()
     db.query(models.Mesa).delete()
+    # Sin consumos, los totales acumulados de las cuentas vuelven a cero
+    db.query(models.Cuenta).update({models.Cuenta.consumo_total: 0}, synchronize_session=False)
     
     db.commit()
 
@@ -653,13 +571,19 @@ def reordenar_cola_manual(db: Session, canciones_ids: List[int]):
     """
     Actualiza el orden manual de las canciones en la cola.
     """
+    # Trabajamos con objetos (no con query.update) para que el motor de la cola
+    # reciba los cambios de forma incremental al hacer commit.
+    nuevo_orden = {cancion_id: i + 1 for i, cancion_id in enumerate(canciones_ids)}
+
     # Primero, reseteamos el orden manual de todas las canciones aprobadas
-    db.query(models.Cancion).filter(models.Cancion.estado == 'aprobado').update({"orden_manual": None})
-    
+    for cancion in db.query(models.Cancion).filter(models.Cancion.estado == 'aprobado'):
+        cancion.orden_manual = None
+
     # Luego, asignamos el nuevo orden
-    for i, cancion_id in enumerate(canciones_ids):
-        db.query(models.Cancion).filter(models.Cancion.id == cancion_id).update({"orden_manual": i + 1})
-    
+    if nuevo_orden:
+        for cancion in db.query(models.Cancion).filter(models.Cancion.id.in_(list(nuevo_orden))):
+            cancion.orden_manual = nuevo_orden[cancion.id]
+
     db.commit()
 
 def get_usuarios_sin_consumo(db: Session):
@@ -808,6 +732,16 @@ def delete_usuario(db: Session, usuario_id: int):
     if not db_usuario:
         return None
 
+    # Descontar sus consumos de los totales de mesas y cuentas
+    consumos_usuario = (
+        db.query(models.Consumo.mesa_id, models.Consumo.cuenta_id, func.sum(models.Consumo.valor_total))
+        .filter(models.Consumo.usuario_id == usuario_id)
+        .group_by(models.Consumo.mesa_id, models.Consumo.cuenta_id)
+        .all()
+    )
+    for mesa_id, cuenta_id, total in consumos_usuario:
+        acumular_consumo_en_totales(db, mesa_id, cuenta_id, -(total or 0))
+
     # Borrar datos dependientes primero para evitar errores de clave forÃÂ¡nea
     db.query(models.Consumo).filter(models.Consumo.usuario_id == usuario_id).delete(synchronize_session=False)
     db.query(models.Cancion).filter(models.Cancion.usuario_id == usuario_id).delete(synchronize_session=False)
@@ -827,7 +761,7 @@ def get_ingresos_promedio_por_usuario_por_mesa(db: Session):
             models.Mesa.nombre,
             (
                 func.coalesce(func.sum(models.Consumo.valor_total), 0) / 
-                func.greatest(func.count(func.distinct(models.Usuario.id)), 1)
+                mayor(func.count(func.distinct(models.Usuario.id)), 1)
             ).label("ingresos_promedio")
         )
         .select_from(models.Mesa)
@@ -868,9 +802,8 @@ def get_tiempo_promedio_espera(db: Session):
     """
     Calcula el tiempo promedio en segundos desde que una canciÃÂ³n se aÃÂ±ade hasta que se canta.
     """
-    # Para SQLite, usamos julianday para calcular la diferencia en dÃÂ­as y luego convertimos a segundos.
-    # Para PostgreSQL, serÃÂ­a: func.avg(func.extract('epoch', models.Cancion.finished_at - models.Cancion.created_at))
-    avg_seconds = db.query(func.avg((func.julianday(models.Cancion.finished_at) - func.julianday(models.Cancion.created_at)) * 86400)).filter(
+    # segundos_entre se compila a julianday en SQLite y a EXTRACT(EPOCH ...) en PostgreSQL
+    avg_seconds = db.query(func.avg(segundos_entre(models.Cancion.created_at, models.Cancion.finished_at))).filter(
         models.Cancion.estado == "cantada",
         models.Cancion.finished_at.isnot(None)
     ).scalar()
@@ -882,13 +815,12 @@ def get_actividad_por_hora(db: Session):
     """
     return (
         db.query(
-            # Usamos strftime para SQLite para extraer la hora.
-            # Para PostgreSQL serÃÂ­a: extract('hour', models.Cancion.started_at)
-            func.strftime('%H', models.Cancion.started_at).label("hora"),
+            # hora_del_dia: strftime('%H') en SQLite, to_char(..., 'HH24') en PostgreSQL
+            hora_del_dia(models.Cancion.started_at).label("hora"),
             func.count(models.Cancion.id).label("canciones_cantadas"),
         )
         .filter(models.Cancion.estado == "cantada", models.Cancion.started_at.isnot(None))
-        .group_by(func.strftime('%H', models.Cancion.started_at))
+        .group_by(hora_del_dia(models.Cancion.started_at))
         .order_by(func.count(models.Cancion.id).desc())
         .all()
     )
@@ -1480,6 +1412,9 @@ def delete_consumo(db: Session, consumo_id: int):
 
     usuario = db_consumo.usuario
 
+    # Descontamos el consumo de los totales de la mesa y de la cuenta
+    acumular_consumo_en_totales(db, db_consumo.mesa_id, db_consumo.cuenta_id, -db_consumo.valor_total)
+
     # Borramos el registro de consumo
     db.delete(db_consumo)
     db.commit()
@@ -1498,6 +1433,64 @@ def delete_consumo(db: Session, consumo_id: int):
 
     return True
 
+def acumular_consumo_en_totales(db: Session, mesa_id: Optional[int], cuenta_id: Optional[int], delta):
+    """
+    Suma `delta` (negativo al borrar) a los totales acumulados de la mesa y de la cuenta.
+    No hace commit: debe confirmarse en la misma transacción que el consumo.
+    La suma se hace en SQL (consumo_total = consumo_total + delta) para no perder
+    actualizaciones concurrentes. Se hace flush al final: sin autoflush, una
+    segunda llamada para la misma mesa o cuenta reemplazaría la expresión
+    pendiente en vez de sumarse a ella.
+    """
+    if mesa_id is not None:
+        db_mesa = db.get(models.Mesa, mesa_id)
+        if db_mesa:
+            db_mesa.consumo_total = func.coalesce(models.Mesa.consumo_total, 0) + delta
+    if cuenta_id is not None:
+        db_cuenta = db.get(models.Cuenta, cuenta_id)
+        if db_cuenta:
+            db_cuenta.consumo_total = func.coalesce(models.Cuenta.consumo_total, 0) + delta
+    db.flush()
+
+def reconciliar_totales_consumo(db: Session) -> dict:
+    """
+    Recalcula desde la tabla de consumos los totales acumulados de mesas y cuentas
+    y corrige los que no coincidan. Devuelve los IDs corregidos.
+    """
+    centavos = Decimal("0.01")
+
+    def _normalizar(valor):
+        return Decimal(str(valor or 0)).quantize(centavos)
+
+    por_mesa = dict(
+        db.query(models.Consumo.mesa_id, func.sum(models.Consumo.valor_total))
+        .filter(models.Consumo.mesa_id.isnot(None))
+        .group_by(models.Consumo.mesa_id)
+        .all()
+    )
+    por_cuenta = dict(
+        db.query(models.Consumo.cuenta_id, func.sum(models.Consumo.valor_total))
+        .filter(models.Consumo.cuenta_id.isnot(None))
+        .group_by(models.Consumo.cuenta_id)
+        .all()
+    )
+
+    corregidas = {"mesas": [], "cuentas": []}
+    for db_mesa in db.query(models.Mesa).all():
+        esperado = _normalizar(por_mesa.get(db_mesa.id))
+        if _normalizar(db_mesa.consumo_total) != esperado:
+            db_mesa.consumo_total = esperado
+            corregidas["mesas"].append(db_mesa.id)
+    for db_cuenta in db.query(models.Cuenta).all():
+        esperado = _normalizar(por_cuenta.get(db_cuenta.id))
+        if _normalizar(db_cuenta.consumo_total) != esperado:
+            db_cuenta.consumo_total = esperado
+            corregidas["cuentas"].append(db_cuenta.id)
+
+    if corregidas["mesas"] or corregidas["cuentas"]:
+        db.commit()
+    return corregidas
+
 def get_config(db: Session, key: str):
     """Obtiene un valor de configuraciÃÂ³n por su clave (clave)."""
     return db.query(models.ConfiguracionGlobal).filter(models.ConfiguracionGlobal.clave == key).first()
@@ -1553,10 +1546,12 @@ def get_canciones_pendientes_por_aprobar(db: Session):
         models.Cancion.estado == 'pendiente'
     ).order_by(models.Cancion.created_at.asc()).all()
 
-def auto_approve_songs_after_10_minutes(db: Session):
+def auto_approve_songs_after_10_minutes(db: Session, ahora=None):
     """
     Aprueba automáticamente canciones pendientes que ya han pasado 10 minutos desde su creación.
     RESPETA EL LÍMITE DE COLA: Solo aprueba si hay espacio en la cola de aprobados (max 1).
+    La ejecuta el programador de `aprobacion_automatica` cuando vence una canción;
+    `ahora` permite usar otro reloj.
     """
     from datetime import timedelta
     
@@ -1569,7 +1564,8 @@ def auto_approve_songs_after_10_minutes(db: Session):
     cupo_disponible = 1 - approved_count # Debería ser 1
     
     # Obtener canciones pendientes que tienen más de 10 minutos
-    time_threshold = now_bogota() - timedelta(minutes=10)
+    ahora = ahora or now_bogota()
+    time_threshold = ahora - timedelta(minutes=10)
     
     songs_to_auto_approve = db.query(models.Cancion).filter(
         models.Cancion.estado == 'pendiente',
@@ -1579,7 +1575,7 @@ def auto_approve_songs_after_10_minutes(db: Session):
     # Aprobar las canciones seleccionadas
     for cancion in songs_to_auto_approve:
         cancion.estado = 'aprobado'
-        cancion.approved_at = now_bogota()
+        cancion.approved_at = ahora
         db.add(cancion)
     
     if songs_to_auto_approve:
@@ -1612,8 +1608,7 @@ def get_cola_completa(db: Session):
     - Cola aprobada (upcoming)
     - Cola pendiente por aprobar
     """
-    # Aplicar aprobaciÃÂ³n automÃÂ¡tica despuÃÂ©s de 10 minutos
-    auto_approve_songs_after_10_minutes(db)
+    # La aprobación automática a los 10 minutos la hace aprobacion_automatica en segundo plano
     
     now_playing = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
     approved_queue = get_cola_priorizada(db)
@@ -1786,45 +1781,92 @@ def get_table_payment_status(db: Session, mesa_id: int) -> Optional[dict]:
          
     return get_cuenta_payment_status(db, active_cuenta.id)
 
-async def start_next_song_if_autoplay_and_idle(db: Session):
+async def _ejecutar(db, fn, *args, **kwargs):
+    """
+    Ejecuta `fn(sesion, ...)` tanto con una Session como con una sesión de
+    database_async (AsyncSession o SesionEnHilo); en el segundo caso pasa por el
+    escritor único y no bloquea el loop.
+    """
+    if isinstance(db, Session):
+        return fn(db, *args, **kwargs)
+    return await escritor_unico.ejecutar(db, fn, *args, **kwargs)
+
+def _marcar_cantada_con_cantante(db: Session):
+    """Como marcar_cancion_actual_como_cantada, dejando cargados usuario y mesa para broadcast_song_finished."""
+    cancion = marcar_cancion_actual_como_cantada(db)
+    if cancion and cancion.usuario:
+        cancion.usuario.mesa
+    return cancion
+
+def _iniciar_si_libre(db: Session):
+    """
+    Marca la siguiente canción como 'reproduciendo' solo si no suena ninguna.
+    Es un único comando del escritor: dos llamadas simultáneas no pueden ver
+    las dos la cola libre e iniciar cada una una canción distinta.
+    """
+    if get_cancion_actual(db):
+        return None
+    return marcar_siguiente_como_reproduciendo(db)
+
+def _avanzar_cola(db: Session, cancion_id: Optional[int] = None):
+    """
+    Marca la actual como 'cantada' y la siguiente como 'reproduciendo' en un
+    solo comando del escritor. Devuelve (cantada, siguiente). Con `cancion_id`
+    solo avanza si esa es la que suena (si no, devuelve None).
+    """
+    if cancion_id is not None:
+        actual = get_cancion_actual(db)
+        if actual is None or actual.id != cancion_id:
+            return None
+    cancion_cantada = _marcar_cantada_con_cantante(db)
+    return cancion_cantada, marcar_siguiente_como_reproduciendo(db)
+
+async def start_next_song_if_autoplay_and_idle(db):
     """
     Verifica si no hay nada sonando y si hay canciones en la cola.
     Si se cumplen las condiciones, inicia la siguiente canciÃÂ³n automÃÂ¡ticamente.
     """
     import websocket_manager
 
-    # Verificamos si ya hay una canciÃÂ³n en estado 'reproduciendo'
-    is_playing = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
-    if is_playing:
-        return
-
-    # Si no hay nada sonando, marcamos la siguiente como 'reproduciendo'
-    next_song = marcar_siguiente_como_reproduciendo(db)
+    # Si no hay nada sonando, marcamos la siguiente como 'reproduciendo' (en un solo paso)
+    next_song = await _ejecutar(db, _iniciar_si_libre)
 
     if next_song:
         # Si se encontrÃÂ³ una siguiente canciÃÂ³n, notificamos a todos los clientes
         # para que la cola se actualice y el reproductor comience a reproducir.
         await websocket_manager.manager.broadcast_queue_update()
         await websocket_manager.manager.broadcast_play_song(next_song.youtube_id, next_song.duracion_seconds or 0)
-        create_admin_log_entry(db, action="AUTO_START", details=f"Iniciada automÃÂ¡ticamente la canciÃÂ³n '{next_song.titulo}'.")
+        await _ejecutar(db, create_admin_log_entry, action="AUTO_START", details=f"Iniciada automÃÂ¡ticamente la canciÃÂ³n '{next_song.titulo}'.")
 
-async def avanzar_cola_automaticamente(db: Session):
+async def avanzar_cola_automaticamente(db, cancion_id: Optional[int] = None):
     """
     FunciÃÂ³n central para avanzar la cola: marca la canciÃÂ³n actual como cantada,
     inicia la siguiente y notifica a todos los clientes.
     Esta funciÃÂ³n es llamada tanto por el autoplay como por el botÃÂ³n manual.
+    Con `cancion_id` (temporizador de fin de canción) solo avanza si esa canción
+    sigue sonando; si no, no hace nada y devuelve None.
     """
     import websocket_manager
 
-    # 1. Marcar la canciÃÂ³n actual como 'cantada' y obtener sus datos
-    cancion_cantada = marcar_cancion_actual_como_cantada(db)
+    # 1 y 2. Marcar la canciÃÂ³n actual como 'cantada' y la siguiente como 'reproduciendo'
+    avance = await _ejecutar(db, _avanzar_cola, cancion_id)
+    if avance is None:
+        return None
+    cancion_cantada, siguiente_cancion = avance
+    if cancion_cantada and cancion_cantada.puntuacion_ia is None:
+        # Al terminar de calcularse se emite `song_scored`
+        import canto_en_vivo, servicio_puntuacion
+        # Cantada en vivo: la sesión se puntúa sola al ver el commit (canto_en_vivo)
+        if not canto_en_vivo.gestor.cantada_en_vivo(cancion_cantada.id):
+            # Grabación subida: se puntúa en otro proceso
+            await servicio_puntuacion.servicio.enviar(
+                cancion_cantada.id, cancion_cantada.youtube_id,
+                servicio_puntuacion.ruta_grabacion(cancion_cantada.id),
+            )
     if cancion_cantada:
         # Notificar a todos que la canciÃÂ³n terminÃÂ³ (para mostrar puntajes, etc.)
         await websocket_manager.manager.broadcast_song_finished(cancion_cantada)
 
-    # 2. Marcar la siguiente canciÃÂ³n como 'reproduciendo'
-    siguiente_cancion = marcar_siguiente_como_reproduciendo(db)
-
     # 3. Notificar a todos los clientes sobre la actualizaciÃÂ³n de la cola
     await websocket_manager.manager.broadcast_queue_update()
 
@@ -1834,11 +1876,11 @@ async def avanzar_cola_automaticamente(db: Session):
 
 
     # 5. Aprobar la siguiente canciÃ³n lazy si es necesario
-    check_and_approve_next_lazy_song(db)
+    await _ejecutar(db, check_and_approve_next_lazy_song)
 
 
     # 5. Aprobar la siguiente canciÃ³n lazy si es necesario
-    check_and_approve_next_lazy_song(db)
+    await _ejecutar(db, check_and_approve_next_lazy_song)
 
     return siguiente_cancion
 
@@ -2022,12 +2064,12 @@ def get_cuenta_payment_status(db: Session, cuenta_id: int) -> Optional[dict]:
     
     mesa = cuenta.mesa
     
-    # 1. Calcular total consumido EN ESTA CUENTA
-    total_consumido = (
-        db.query(func.sum(models.Consumo.valor_total))
-        .filter(models.Consumo.cuenta_id == cuenta.id)
-        .scalar() or Decimal('0.00')
-    )
+    # 1. Consumos de ESTA CUENTA. El total cobrado sale del libro de consumos, no de
+    #    cuenta.consumo_total (ese acumulado es solo para el dashboard y el orden)
+    consumos_detalle = db.query(models.Consumo).filter(
+        models.Consumo.cuenta_id == cuenta.id
+    ).order_by(models.Consumo.created_at.asc()).all()
+    total_consumido = sum((c.valor_total for c in consumos_detalle), Decimal('0.00'))
 
     # 2. Calcular total pagado EN ESTA CUENTA
     total_pagado = (
@@ -2040,10 +2082,6 @@ def get_cuenta_payment_status(db: Session, cuenta_id: int) -> Optional[dict]:
     saldo_pendiente = total_consumido - total_pagado
 
     # 4. Obtener detalles
-    consumos_detalle = db.query(models.Consumo).filter(
-        models.Consumo.cuenta_id == cuenta.id
-    ).order_by(models.Consumo.created_at.asc()).all()
-    
     pagos_detalle = db.query(models.Pago).filter(models.Pago.cuenta_id == cuenta.id).order_by(models.Pago.created_at.asc()).all()
 
     consumos_items = [
@@ -2063,437 +2101,26 @@ def get_cuenta_payment_status(db: Session, cuenta_id: int) -> Optional[dict]:
         saldo_pendiente=saldo_pendiente, 
         consumos=consumos_items, 
         pagos=pagos_detalle
-    ).dict()# CÃÂ³digo para agregar al final de crud.py
-
-
-
-# --- Lazy Approval Queue Functions ---
-
-
-
-def get_cola_lazy(db: Session):
-
-    """
-
-    Obtiene todas las canciones en estado pendiente_lazy, ordenadas por prioridad.
-
-    Usa el mismo algoritmo de cola justa que get_cola_priorizada.
-
-    """
-
-    from collections import deque
-
-    
-
-    # Obtener todas las canciones en estado pendiente_lazy
-
-    todas_canciones = (
-
-        db.query(models.Cancion)
-
-        .join(models.Usuario, models.Cancion.usuario_id == models.Usuario.id)
-
-        .filter(models.Cancion.estado == "pendiente_lazy")
-
-        .order_by(models.Cancion.orden_manual.asc().nulls_last(), models.Cancion.created_at.asc())
-
-        .all()
-
-    )
-
-    
-
-    if not todas_canciones:
-
-        return []
-
-    
-
-    # Aplicar el mismo algoritmo de cola justa
-
-    cola_manual = []
-
-    cola_pool = []
-
-    
-
-    for cancion in todas_canciones:
-
-        if cancion.orden_manual is not None:
-
-            cola_manual.append(cancion)
-
-        else:
-
-            cola_pool.append(cancion)
-
-    
-
-    if not cola_pool:
-
-        return cola_manual
-
-    
-
-    # Agrupar por mesa
-
-    match_mesa_canciones = {}
-
-    mesa_arrival_time = {}
-
-    mesas_involucradas_ids = set()
-
-    
-
-    for cancion in cola_pool:
-
-        mesa_id = cancion.usuario.mesa_id or 0
-
-        if mesa_id not in match_mesa_canciones:
-
-            match_mesa_canciones[mesa_id] = deque()
-
-            mesa_arrival_time[mesa_id] = cancion.created_at
-
-            mesas_involucradas_ids.add(mesa_id)
-
-        match_mesa_canciones[mesa_id].append(cancion)
-
-    
-
-    # Calcular quotas
-
-    UMBRAL_ORO = 150000
-
-    UMBRAL_PLATA = 50000
-
-    mesa_quotas = {}
-
-    
-
-    if mesas_involucradas_ids:
-
-        ids_reales = [mid for mid in mesas_involucradas_ids if mid != 0]
-
-        consumos_mesas = {}
-
-        
-
-        if ids_reales:
-
-            rows = (
-
-                db.query(
-
-                    models.Usuario.mesa_id,
-
-                    func.sum(models.Consumo.valor_total)
-
-                )
-
-                .join(models.Consumo, models.Usuario.id == models.Consumo.usuario_id)
-
-                .filter(models.Usuario.mesa_id.in_(ids_reales))
-
-                .group_by(models.Usuario.mesa_id)
-
-                .all()
-
-            )
-
-            for mid, total in rows:
-
-                consumos_mesas[mid] = total or 0
-
-        
-
-        for mid in mesas_involucradas_ids:
-
-            total = consumos_mesas.get(mid, 0)
-
-            if mid == 0:
-
-                quota = 3
-
-            elif total >= UMBRAL_ORO:
-
-                quota = 3
-
-            elif total >= UMBRAL_PLATA:
-
-                quota = 2
-
-            else:
-
-                quota = 1
-
-            mesa_quotas[mid] = quota
-
-    
-
-    # Round Robin
-
-    cola_justa = []
-
-    orden_turnos_mesas = sorted(mesas_involucradas_ids, key=lambda mid: mesa_arrival_time[mid])
-
-    
-
-    while match_mesa_canciones:
-
-        for mesa_id in orden_turnos_mesas:
-
-            if mesa_id not in match_mesa_canciones:
-
-                continue
-
-            queue_de_mesa = match_mesa_canciones[mesa_id]
-
-            cupo = mesa_quotas.get(mesa_id, 1)
-
-            tomadas = 0
-
-            while tomadas < cupo and queue_de_mesa:
-
-                cancion = queue_de_mesa.popleft()
-
-                cola_justa.append(cancion)
-
-                tomadas += 1
-
-            if not queue_de_mesa:
-
-                del match_mesa_canciones[mesa_id]
-
-    
-
-    return cola_manual + cola_justa
-
-
-
-def aprobar_siguiente_cancion_lazy(db: Session):
-
-    """
-
-    Aprueba la siguiente canciÃÂ³n de la cola lazy.
-
-    Llamada automÃÂ¡ticamente cuando la canciÃÂ³n actual llega al 50%.
-
-    """
-
-    cola_lazy = get_cola_lazy(db)
-
-    if not cola_lazy:
-
-        return None
-
-    
-
-    siguiente = cola_lazy[0]
-
-    siguiente.estado = "aprobado"
-
-    siguiente.approved_at = now_bogota()
-
-    db.commit()
-
-    db.refresh(siguiente)
-
-    
-
-    create_admin_log_entry(db, action="LAZY_APPROVAL", details=f"CanciÃÂ³n '{siguiente.titulo}' aprobada automÃÂ¡ticamente (lazy).")
-
-    return siguiente
-
-
-
-def get_cola_completa_con_lazy(db: Session):
-
-    """
-
-    VersiÃÂ³n extendida de get_cola_completa que incluye la cola lazy.
-
-    Retorna:
-
-    - now_playing: CanciÃÂ³n actual
-
-    - upcoming: Solo la siguiente canciÃÂ³n aprobada (mÃÂ¡ximo 1)
-
-    - lazy_queue: Canciones en pendiente_lazy
-
-    - pending: Canciones pendientes de aprobaciÃÂ³n manual
-
-    """
-
-    # Aplicar aprobaciÃÂ³n automÃÂ¡tica despuÃÂ©s de 10 minutos
-
-    auto_approve_songs_after_10_minutes(db)
-
-    
-
-    now_playing = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
-
-    approved_queue = get_cola_priorizada(db)
-
-    lazy_queue = get_cola_lazy(db)
-
-    pending_queue = get_canciones_pendientes_por_aprobar(db)
-
-    
-
-    # Si la canciÃÂ³n que se estÃÂ¡ reproduciendo sigue en la lista de upcoming, la quitamos
-
-    if now_playing:
-
-        approved_queue = [song for song in approved_queue if song.id != now_playing.id]
-
-    
-
-    # Limitar upcoming a mÃÂ¡ximo 1 canciÃÂ³n (la siguiente)
-
-    upcoming_limited = approved_queue[:1] if approved_queue else []
-
-    
-
-    return {
-
-        "now_playing": now_playing,
-
-        "upcoming": upcoming_limited,
-
-        "lazy_queue": lazy_queue,
-
-        "pending": pending_queue
-
-    }
-
-
-
-def check_and_approve_next_lazy_song(db: Session):
-    """
-    Verifica si hay espacio en la cola de aprobados y aprueba la siguiente lazy.
-    Regla: Mantener MÁXIMO 1 canción aprobada (upcoming) esperando, aparte de la que suena.
-    Esta función es llamada por un background task periódicamente o al avanzar canción.
-    """
-    # Contar cuántas canciones hay en estado 'aprobado'
-    approved_count = db.query(models.Cancion).filter(models.Cancion.estado == "aprobado").count()
-    
-    # Si hay menos de 1 canción aprobada (es decir, 0), aprobamos la siguiente de la lazy
-    if approved_count < 1:
-        return aprobar_siguiente_cancion_lazy(db)
-    
-    return None
-
+    ).dict()
 
 
 # --- Lazy Approval Queue Functions ---
 
-def get_cola_lazy(db: Session):
+def get_cola_lazy(db: Session, limite: Optional[int] = None):
     """
     Obtiene todas las canciones en estado pendiente_lazy, ordenadas por prioridad.
-    Usa el mismo algoritmo de cola justa que get_cola_priorizada.
+    Usa el mismo algoritmo de cola justa (y el mismo motor en memoria) que get_cola_priorizada,
+    con la política de la cola lazy (llegada por created_at).
     """
-    from collections import deque
-    
-    # Obtener todas las canciones en estado pendiente_lazy
-    todas_canciones = (
-        db.query(models.Cancion)
-        .join(models.Usuario, models.Cancion.usuario_id == models.Usuario.id)
-        .filter(models.Cancion.estado == "pendiente_lazy")
-        .order_by(models.Cancion.orden_manual.asc().nulls_last(), models.Cancion.id.asc())
-        .all()
-    )
-    
-    if not todas_canciones:
-        return []
-    
-    # Aplicar el mismo algoritmo de cola justa
-    cola_manual = []
-    cola_pool = []
-    
-    for cancion in todas_canciones:
-        if cancion.orden_manual is not None:
-            cola_manual.append(cancion)
-        else:
-            cola_pool.append(cancion)
-    
-    if not cola_pool:
-        return cola_manual
-    
-    # Agrupar por mesa
-    match_mesa_canciones = {}
-    mesa_arrival_time = {}
-    mesas_involucradas_ids = set()
-    
-    for cancion in cola_pool:
-        mesa_id = cancion.usuario.mesa_id or 0
-        if mesa_id not in match_mesa_canciones:
-            match_mesa_canciones[mesa_id] = deque()
-            mesa_arrival_time[mesa_id] = cancion.id
-            mesas_involucradas_ids.add(mesa_id)
-        match_mesa_canciones[mesa_id].append(cancion)
-    
-    # Calcular quotas
-    UMBRAL_ORO = 150000
-    UMBRAL_PLATA = 50000
-    mesa_quotas = {}
-    
-    if mesas_involucradas_ids:
-        ids_reales = [mid for mid in mesas_involucradas_ids if mid != 0]
-        consumos_mesas = {}
-        
-        if ids_reales:
-            rows = (
-                db.query(
-                    models.Usuario.mesa_id,
-                    func.sum(models.Consumo.valor_total)
-                )
-                .join(models.Consumo, models.Usuario.id == models.Consumo.usuario_id)
-                .filter(models.Usuario.mesa_id.in_(ids_reales))
-                .group_by(models.Usuario.mesa_id)
-                .all()
-            )
-            for mid, total in rows:
-                consumos_mesas[mid] = total or 0
-        
-        for mid in mesas_involucradas_ids:
-            total = consumos_mesas.get(mid, 0)
-            if mid == 0:
-                quota = 3
-            elif total >= UMBRAL_ORO:
-                quota = 3
-            elif total >= UMBRAL_PLATA:
-                quota = 2
-            else:
-                quota = 1
-            mesa_quotas[mid] = quota
-    
-    # Round Robin
-    cola_justa = []
-    orden_turnos_mesas = sorted(mesas_involucradas_ids, key=lambda mid: mesa_arrival_time[mid])
-    
-    while match_mesa_canciones:
-        for mesa_id in orden_turnos_mesas:
-            if mesa_id not in match_mesa_canciones:
-                continue
-            queue_de_mesa = match_mesa_canciones[mesa_id]
-            cupo = mesa_quotas.get(mesa_id, 1)
-            tomadas = 0
-            while tomadas < cupo and queue_de_mesa:
-                cancion = queue_de_mesa.popleft()
-                cola_justa.append(cancion)
-                tomadas += 1
-            if not queue_de_mesa:
-                del match_mesa_canciones[mesa_id]
-    
-    return cola_manual + cola_justa
+    ids = cola_justa.motor_para(db).ids_en_orden(db, "pendiente_lazy", limite)
+    return _canciones_por_ids(db, ids)
 
 def aprobar_siguiente_cancion_lazy(db: Session):
     """
     Aprueba la siguiente canciÃ³n de la cola lazy.
     Llamada automÃ¡ticamente cuando la canciÃ³n actual llega al 50%.
     """
-    cola_lazy = get_cola_lazy(db)
+    cola_lazy = get_cola_lazy(db, limite=1)
     if not cola_lazy:
         return None
     
@@ -2515,11 +2142,11 @@ def get_cola_completa_con_lazy(db: Session):
     - lazy_queue: Canciones en pendiente_lazy
     - pending: Canciones pendientes de aprobaciÃ³n manual
     """
-    # Aplicar aprobaciÃ³n automÃ¡tica despuÃ©s de 10 minutos
-    auto_approve_songs_after_10_minutes(db)
+    # La aprobación automática a los 10 minutos la hace aprobacion_automatica en segundo plano
     
     now_playing = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
-    approved_queue = get_cola_priorizada(db)
+    # Solo mostramos la siguiente; pedimos 2 por si la que suena sigue en la lista
+    approved_queue = get_cola_priorizada(db, limite=2)
     lazy_queue = get_cola_lazy(db)
     pending_queue = get_canciones_pendientes_por_aprobar(db)
     
@@ -2537,6 +2164,19 @@ def get_cola_completa_con_lazy(db: Session):
         "pending": pending_queue
     }
 
+def get_version_cola(db: Session) -> int:
+    """Versión actual de la cola; sube con cada commit que cambia canciones, usuarios o mesas."""
+    return cola_justa.motor_para(db).version
+
+def get_instantanea_cola(db: Session, vista: str, construir) -> tuple:
+    """
+    Devuelve (etag, version, valor) de una vista de la cola, reutilizando la
+    generada para la versión actual si ya existe. `construir(version)` la genera.
+    """
+    motor = cola_justa.motor_para(db)
+    version, valor = motor.instantanea(vista, construir)
+    return f'"{vista}-{motor.epoca}-{version}"', version, valor
+
 def check_and_approve_next_lazy_song(db: Session):
     """
     Verifica si hay espacio en la cola de aprobados y aprueba la siguiente lazy.
@@ -0,0 +1,146 @@
+"""
+Operaciones de crud para las rutas calientes, con una sesión de database_async
+(AsyncSession o SesionEnHilo).
+
+Las lecturas se escriben con select() sobre esa sesión y se esperan sin
+bloquear el loop. Las mutaciones son funciones síncronas `fn(sesion, ...)` que
+se envían al escritor único (escritor_unico), que las agrupa en un solo commit;
+las que tienen lógica ORM (pedidos, pagos, reordenar y aprobar en la cola)
+reutilizan las funciones de crud, para no duplicar las reglas de negocio. Las
+relaciones que luego lee el endpoint se cargan dentro del propio comando.
+"""
+from typing import Optional
+
+from sqlalchemy import func, select
+
+import crud
+import escritor_unico
+import models
+import schemas
+
+
+# --- Usuarios y canciones ---
+
+async def get_usuario_by_id(db, usuario_id: int):
+    """Busca un usuario por su ID."""
+    return await db.get(models.Usuario, usuario_id)
+
+
+async def get_duracion_total_cola_aprobada(db) -> int:
+    """Suma de la duración de las canciones aprobadas."""
+    total = await db.scalar(
+        select(func.sum(models.Cancion.duracion_seconds)).where(models.Cancion.estado == "aprobado")
+    )
+    return total or 0
+
+
+async def contar_canciones(db, estado: str) -> int:
+    """Número de canciones en un estado."""
+    return await db.scalar(select(func.count(models.Cancion.id)).where(models.Cancion.estado == estado))
+
+
+async def check_if_song_in_user_list(db, usuario_id: int, youtube_id: str):
+    """Como crud.check_if_song_in_user_list: la canción ya está en cola para la mesa del usuario."""
+    mesa_id = await db.scalar(select(models.Usuario.mesa_id).where(models.Usuario.id == usuario_id))
+    if not mesa_id:
+        return None
+    return await db.scalar(
+        select(models.Cancion)
+        .join(models.Usuario, models.Cancion.usuario_id == models.Usuario.id)
+        .where(
+            models.Usuario.mesa_id == mesa_id,
+            models.Cancion.youtube_id == youtube_id,
+            models.Cancion.estado.in_(["pendiente", "aprobado", "reproduciendo"]),
+        )
+        .limit(1)
+    )
+
+
+def _crear_cancion(db, cancion: schemas.CancionCreate, usuario_id: int, estado: Optional[str]):
+    db_cancion = models.Cancion(**cancion.dict(), usuario_id=usuario_id)
+    if estado:
+        db_cancion.estado = estado
+    db.add(db_cancion)
+    db.commit()
+    db.refresh(db_cancion)
+    return db_cancion
+
+
+async def create_cancion_para_usuario(db, cancion: schemas.CancionCreate, usuario_id: int,
+                                      estado: Optional[str] = None):
+    """Crea una canción para el usuario; con `estado` se guarda ya en su estado final, en un solo commit."""
+    return await escritor_unico.ejecutar(db, _crear_cancion, cancion, usuario_id, estado)
+
+
+async def update_cancion_estado(db, cancion_id: int, nuevo_estado: str):
+    """Actualiza el estado de una canción."""
+    return await escritor_unico.ejecutar(db, crud.update_cancion_estado, cancion_id, nuevo_estado)
+
+
+def _mover_en_cola(db, cancion_id: int, estado: str, hacia_arriba: bool):
+    db_cancion = db.scalar(
+        select(models.Cancion).where(models.Cancion.id == cancion_id, models.Cancion.estado == estado)
+    )
+    if db_cancion is None:
+        return None
+
+    vecina = select(models.Cancion).where(models.Cancion.estado == estado)
+    if hacia_arriba:
+        vecina = vecina.where(models.Cancion.created_at < db_cancion.created_at).order_by(models.Cancion.created_at.desc())
+    else:
+        vecina = vecina.where(models.Cancion.created_at > db_cancion.created_at).order_by(models.Cancion.created_at.asc())
+    vecina = db.scalar(vecina.limit(1))
+
+    if vecina:
+        db_cancion.created_at, vecina.created_at = vecina.created_at, db_cancion.created_at
+        db.commit()
+    return db_cancion
+
+
+async def mover_en_cola(db, cancion_id: int, estado: str, hacia_arriba: bool):
+    """
+    Mueve una posición una canción de la cola `estado` (pendiente o pendiente_lazy),
+    intercambiando su created_at con el de la vecina. Devuelve la canción, o None
+    si no está en ese estado.
+    """
+    return await escritor_unico.ejecutar(db, _mover_en_cola, cancion_id, estado, hacia_arriba)
+
+
+async def move_song_to_top(db, cancion_id: int):
+    return await escritor_unico.ejecutar(db, crud.move_song_to_top, cancion_id)
+
+
+async def approve_song_by_admin(db, cancion_id: int):
+    return await escritor_unico.ejecutar(db, crud.approve_song_by_admin, cancion_id)
+
+
+async def aprobar_siguiente_cancion_lazy(db):
+    return await escritor_unico.ejecutar(db, crud.aprobar_siguiente_cancion_lazy)
+
+
+# --- Consumos y pagos ---
+
+def _pedido_con_relaciones(db, carrito: schemas.CarritoCreate, usuario_id: int):
+    consumos, error = crud.create_pedido_from_carrito(db, carrito=carrito, usuario_id=usuario_id)
+    # El endpoint y la notificación al admin leen producto y usuario.mesa
+    for consumo in consumos or []:
+        consumo.producto
+        if consumo.usuario:
+            consumo.usuario.mesa
+    return consumos, error
+
+
+async def create_pedido_from_carrito(db, carrito: schemas.CarritoCreate, usuario_id: int):
+    """Como crud.create_pedido_from_carrito: devuelve (consumos, error)."""
+    return await escritor_unico.ejecutar(db, _pedido_con_relaciones, carrito, usuario_id)
+
+
+async def create_pago_for_mesa(db, pago: schemas.PagoCreate):
+    return await escritor_unico.ejecutar(db, crud.create_pago_for_mesa, pago)
+
+
+# --- Log de administración ---
+
+async def create_admin_log_entry(db, action: str, details: Optional[str] = None):
+    """Crea una nueva entrada en el log de administración."""
+    return await escritor_unico.ejecutar(db, crud.create_admin_log_entry, action, details)
@@ -1,18 +1,186 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import BigInteger, Float, String
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Cambiamos a una URL de SQLite. Esto creará un archivo llamado `karaoke.db` en la raíz del proyecto.
-SQLALCHEMY_DATABASE_URL = "sqlite:///./karaoke.db"
+# URL de la base de datos: por defecto el archivo `karaoke.db` en la raíz del proyecto.
+# Con DATABASE_URL se puede apuntar a otro archivo o a un servidor compatible con PostgreSQL.
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or os.getenv("SQLALCHEMY_DATABASE_URL") or "sqlite:///./karaoke.db"
 
-# Para SQLite, es necesario añadir connect_args={"check_same_thread": False} para que funcione con FastAPI
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Perfiles de almacenamiento para SQLite (DB_PERFIL). Con el journal de rollback por defecto
+# cada commit bloquea la base entera y el bar, el panel de admin y los móviles se esperan
+# unos a otros; en WAL los lectores no bloquean al escritor y synchronous=NORMAL ahorra un
+# fsync por commit (en WAL solo se puede perder el último commit si se va la luz, sin corromper).
+PERFILES_SQLITE = {
+    "legado": {},  # Comportamiento original: pragmas por defecto de SQLite
+    "produccion": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,         # ms esperando el bloqueo de escritura antes de fallar
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,     # Negativo = KiB (64 MB)
+        "temp_store": "MEMORY",
+    },
+}
+PERFIL = os.getenv("DB_PERFIL", "produccion")
+# Tamaño del pool de conexiones (conexiones fijas y extra en picos)
+POOL_TAMANO = int(os.getenv("DB_POOL_TAMANO", "10"))
+POOL_EXTRA = int(os.getenv("DB_POOL_EXTRA", "20"))
+
+
+def crear_engine(url: str = SQLALCHEMY_DATABASE_URL, perfil: str = PERFIL,
+                 pool_tamano: int = POOL_TAMANO, pool_extra: int = POOL_EXTRA):
+    """Crea el engine con el perfil de almacenamiento indicado (los pragmas solo aplican a SQLite)."""
+    url_parseada = make_url(url)
+    if url_parseada.get_backend_name() != "sqlite":
+        # Servidor (p. ej. PostgreSQL): pool explícito y comprobación de conexiones caídas
+        return create_engine(url, pool_size=pool_tamano, max_overflow=pool_extra, pool_pre_ping=True)
+
+    # Para SQLite, es necesario añadir connect_args={"check_same_thread": False} para que funcione con FastAPI
+    opciones = {"connect_args": {"check_same_thread": False}}
+    en_memoria = url_parseada.database in (None, "", ":memory:")
+    if not en_memoria:
+        opciones.update(pool_size=pool_tamano, max_overflow=pool_extra)
+    engine = create_engine(url, **opciones)
+
+    aplicar_perfil(engine, perfil, en_memoria)
+    return engine
+
+
+def aplicar_perfil(engine, perfil: str = PERFIL, en_memoria: bool = False):
+    """Aplica los pragmas del perfil a cada conexión nueva del engine (también al `sync_engine` de uno asíncrono)."""
+    pragmas = PERFILES_SQLITE[perfil]
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _aplicar_pragmas(conexion_dbapi, _registro):
+        cursor = conexion_dbapi.cursor()
+        for nombre, valor in pragmas.items():
+            if nombre == "journal_mode" and en_memoria:
+                continue  # Una base en memoria no admite WAL
+            cursor.execute(f"PRAGMA {nombre}={valor}")
+        cursor.close()
+
+
+def aplicar_solo_lectura(engine):
+    """Las conexiones del engine rechazan cualquier escritura (pool de lecturas)."""
+    sqlite = make_url(str(engine.url)).get_backend_name() == "sqlite"
+
+    @event.listens_for(engine, "connect")
+    def _solo_lectura(conexion_dbapi, _registro):
+        cursor = conexion_dbapi.cursor()
+        if sqlite:
+            cursor.execute("PRAGMA query_only=ON")
+        else:
+            cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        cursor.close()
+
+
+def crear_engine_lectura(url: str = SQLALCHEMY_DATABASE_URL, perfil: str = PERFIL,
+                         pool_tamano: int = POOL_TAMANO, pool_extra: int = POOL_EXTRA):
+    """
+    Engine de solo lectura sobre la misma base. En WAL sus conexiones leen en
+    paralelo sin esperar al escritor (escritor_unico). None para una base en
+    memoria, que no se puede abrir dos veces.
+    """
+    url_parseada = make_url(url)
+    if url_parseada.get_backend_name() == "sqlite" and url_parseada.database in (None, "", ":memory:"):
+        return None
+    engine_lectura = crear_engine(url, perfil, pool_tamano, pool_extra)
+    aplicar_solo_lectura(engine_lectura)
+    return engine_lectura
+
+
+engine = crear_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Lecturas (la cola para los WebSockets, las consultas de crud_async): pool aparte y de solo lectura
+engine_lectura = crear_engine_lectura() or engine
+SessionLectura = sessionmaker(autocommit=False, autoflush=False, bind=engine_lectura)
+
+Base = declarative_base()
+
+
+# --- SQL dependiente del motor ---
+# crud usa estas funciones en lugar de julianday/strftime (SQLite) o greatest (PostgreSQL),
+# y cada motor las compila a su propio SQL.
+
+class segundos_entre(FunctionElement):
+    """Segundos transcurridos entre dos columnas de fecha: segundos_entre(inicio, fin)."""
+    type = Float()
+    inherit_cache = True
+    name = "segundos_entre"
+
+
+@compiles(segundos_entre)
+def _segundos_entre_sql(elemento, compilador, **kw):
+    inicio, fin = list(elemento.clauses)
+    return f"EXTRACT(EPOCH FROM ({compilador.process(fin, **kw)} - {compilador.process(inicio, **kw)}))"
+
+
+@compiles(segundos_entre, "sqlite")
+def _segundos_entre_sqlite(elemento, compilador, **kw):
+    inicio, fin = list(elemento.clauses)
+    return f"((julianday({compilador.process(fin, **kw)}) - julianday({compilador.process(inicio, **kw)})) * 86400)"
+
+
+class hora_del_dia(FunctionElement):
+    """Hora (00-23) de una columna de fecha, como texto de dos dígitos."""
+    type = String()
+    inherit_cache = True
+    name = "hora_del_dia"
+
+
+@compiles(hora_del_dia)
+def _hora_del_dia_sql(elemento, compilador, **kw):
+    return f"to_char({compilador.process(elemento.clauses, **kw)}, 'HH24')"
+
+
+@compiles(hora_del_dia, "sqlite")
+def _hora_del_dia_sqlite(elemento, compilador, **kw):
+    return f"strftime('%H', {compilador.process(elemento.clauses, **kw)})"
+
+
+class mayor(FunctionElement):
+    """El mayor de varios valores (greatest en PostgreSQL, max escalar en SQLite)."""
+    inherit_cache = True
+    name = "mayor"
+
+
+@compiles(mayor)
+def _mayor_sql(elemento, compilador, **kw):
+    return f"greatest({compilador.process(elemento.clauses, **kw)})"
+
+
+@compiles(mayor, "sqlite")
+def _mayor_sqlite(elemento, compilador, **kw):
+    return f"max({compilador.process(elemento.clauses, **kw)})"
+
+
+class microsegundos_epoch(FunctionElement):
+    """
+    Una columna de fecha como entero: microsegundos desde 1970-01-01 (la fecha
+    tal cual, sin zona). En SQLite, con la precisión de julianday: milisegundos.
+    """
+    type = BigInteger()
+    inherit_cache = True
+    name = "microsegundos_epoch"
+
+
+@compiles(microsegundos_epoch)
+def _microsegundos_epoch_sql(elemento, compilador, **kw):
+    return f"CAST(EXTRACT(EPOCH FROM {compilador.process(elemento.clauses, **kw)}) * 1000000 AS BIGINT)"
+
 
-Base = declarative_base()
\ No newline at end of file
+@compiles(microsegundos_epoch, "sqlite")
+def _microsegundos_epoch_sqlite(elemento, compilador, **kw):
+    # 2440587.5 es el día juliano de 1970-01-01
+    columna = compilador.process(elemento.clauses, **kw)
+    return f"(CAST(round((julianday({columna}) - 2440587.5) * 86400000) AS INTEGER) * 1000)"
@@ -0,0 +1,133 @@
+"""
+Capa de acceso asíncrona a la base de datos.
+
+Los endpoints `async def` usaban la Session síncrona dentro del loop de eventos:
+mientras SQLite esperaba el bloqueo de escritura o hacía el fsync del commit, se
+quedaban parados también los WebSockets y el resto de peticiones. Este módulo crea
+un engine asíncrono (aiosqlite / asyncpg) sobre la misma URL y el mismo perfil de
+almacenamiento que `database`, y la dependencia `get_async_db` que usan las rutas
+calientes (añadir canción, pedir carrito, pagos, mover la cola). Las mutaciones
+van por el escritor único (escritor_unico); con él activo, estas sesiones son de
+solo lectura.
+
+Si faltan los extras asíncronos de SQLAlchemy (greenlet) o el driver, se usa
+`SesionEnHilo`: la misma interfaz sobre una Session síncrona cuyas operaciones
+se ejecutan en un hilo aparte, así que el loop tampoco se bloquea.
+"""
+import asyncio
+import importlib.util
+import logging
+from typing import AsyncIterator, Callable
+
+from sqlalchemy.engine import make_url
+
+import cola_justa
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+# Driver asíncrono para cada motor
+DRIVERS_ASYNC = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def url_async(url: str) -> str:
+    """Traduce la URL síncrona a su driver asíncrono (sqlite:// -> sqlite+aiosqlite://)."""
+    url_parseada = make_url(url)
+    backend = url_parseada.get_backend_name()
+    if backend in DRIVERS_ASYNC:
+        url_parseada = url_parseada.set(drivername=f"{backend}+{DRIVERS_ASYNC[backend]}")
+    return url_parseada.render_as_string(hide_password=False)
+
+
+def crear_engine_async(url: str = database.SQLALCHEMY_DATABASE_URL, perfil: str = database.PERFIL,
+                       pool_tamano: int = database.POOL_TAMANO, pool_extra: int = database.POOL_EXTRA):
+    """Engine asíncrono con el perfil de `database.crear_engine`; None si faltan dependencias."""
+    # sqlalchemy.ext.asyncio se importa sin greenlet, pero falla al usarlo
+    if importlib.util.find_spec("greenlet") is None:
+        logger.warning("SQLAlchemy asíncrono no disponible (falta greenlet): se usará la sesión síncrona en un hilo")
+        return None
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url_parseada = make_url(url)
+    backend = url_parseada.get_backend_name()
+    driver = DRIVERS_ASYNC.get(backend)
+    if driver is None or importlib.util.find_spec(driver) is None:
+        logger.warning(f"No hay driver asíncrono para '{backend}': se usará la sesión síncrona en un hilo")
+        return None
+
+    if backend != "sqlite":
+        return create_async_engine(url_async(url), pool_size=pool_tamano, max_overflow=pool_extra, pool_pre_ping=True)
+
+    opciones = {}
+    en_memoria = url_parseada.database in (None, "", ":memory:")
+    if not en_memoria:
+        opciones.update(pool_size=pool_tamano, max_overflow=pool_extra)
+    engine = create_async_engine(url_async(url), **opciones)
+    # Los pragmas se aplican sobre el engine síncrono interno
+    database.aplicar_perfil(engine.sync_engine, perfil, en_memoria)
+    return engine
+
+
+class SesionEnHilo:
+    """
+    Lo que usan crud y crud_async de AsyncSession (run_sync, scalar, get, add,
+    commit, rollback, refresh, close) sobre una Session síncrona; cada operación
+    con la base de datos se ejecuta en un hilo del executor por defecto.
+    """
+
+    def __init__(self, session_factory: Callable = database.SessionLocal):
+        self.sync_session = session_factory()
+        # Como AsyncSession: los objetos no caducan al confirmar, para poder leerlos desde el loop
+        self.sync_session.expire_on_commit = False
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await asyncio.to_thread(fn, self.sync_session, *args, **kwargs)
+
+    async def scalar(self, sentencia, *args, **kwargs):
+        return await asyncio.to_thread(self.sync_session.scalar, sentencia, *args, **kwargs)
+
+    async def get(self, modelo, identificador, **kwargs):
+        return await asyncio.to_thread(self.sync_session.get, modelo, identificador, **kwargs)
+
+    def add(self, objeto):
+        self.sync_session.add(objeto)
+
+    async def commit(self):
+        await asyncio.to_thread(self.sync_session.commit)
+
+    async def rollback(self):
+        await asyncio.to_thread(self.sync_session.rollback)
+
+    async def refresh(self, objeto, *args, **kwargs):
+        await asyncio.to_thread(self.sync_session.refresh, objeto, *args, **kwargs)
+
+    async def close(self):
+        await asyncio.to_thread(self.sync_session.close)
+
+
+async_engine = crear_engine_async()
+if async_engine is not None:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    if config.settings.ESCRITOR_UNICO:
+        database.aplicar_solo_lectura(async_engine.sync_engine)
+    # Los cambios confirmados por la capa asíncrona también actualizan el motor de la cola justa
+    cola_justa.compartir_motor(async_engine.sync_engine, database.engine)
+else:
+    AsyncSessionLocal = None
+
+
+def nueva_sesion():
+    """Una AsyncSession si está disponible; si no, una SesionEnHilo (del pool de lectura si escribe el escritor único)."""
+    if AsyncSessionLocal is not None:
+        return AsyncSessionLocal()
+    return SesionEnHilo(database.SessionLectura if config.settings.ESCRITOR_UNICO else database.SessionLocal)
+
+
+async def get_async_db() -> AsyncIterator:
+    db = nueva_sesion()
+    try:
+        yield db
+    finally:
+        await db.close()
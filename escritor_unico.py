@@ -0,0 +1,295 @@
+"""
+Escritor único para la base de datos: un bus de comandos con commit agrupado.
+
+SQLite admite un solo escritor a la vez y la aplicación abría sesiones de
+escritura desde cualquier router: en un pico (varias mesas pidiendo a la vez) los
+commits se esperaban unos a otros o fallaban con "database is locked". Ahora las
+mutaciones calientes (añadir, aprobar y mover canciones, avanzar la cola,
+pedidos, pagos y el log de admin) son comandos `fn(sesion, ...)` que se envían a
+un hilo escritor dedicado:
+
+- el hilo toma todos los comandos que esperan (hasta ESCRITOR_LOTE_MAXIMO, y
+  espera ESPERA_LOTE_SEGUNDOS a que lleguen más) y los ejecuta en una sola
+  transacción con un solo commit (commit agrupado: un fsync para todo el lote);
+- cada comando va en su propio SAVEPOINT, así que uno que falla no tumba a los
+  demás; dentro de un comando, `commit()` solo hace flush y `rollback()` deshace
+  su SAVEPOINT (las funciones de crud se usan tal cual). Los cambios que un
+  SAVEPOINT deshecho anotó para la cola justa se descartan antes del commit;
+- los objetos devueltos quedan separados de la sesión con sus columnas cargadas.
+
+Las lecturas van por `database.SessionLectura`, un pool de solo lectura que en
+WAL no espera al escritor.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+import cola_justa
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+ESPERA_LOTE_SEGUNDOS = 0.002  # Ventana para que se sumen más comandos al mismo commit
+
+
+class SesionDeLote(Session):
+    """Session del escritor: mientras se ejecuta un comando, commit y rollback afectan solo a su SAVEPOINT."""
+
+    punto = None  # SAVEPOINT del comando en curso
+    marca = 0  # Cambios de la cola justa anotados antes de abrirlo
+
+    def abrir_punto(self):
+        self.marca = cola_justa.marca_cambios(self)
+        self.punto = self.begin_nested()
+
+    def deshacer_punto(self):
+        """Deshace el SAVEPOINT en curso junto con los cambios que anotó para la cola justa."""
+        # También tras un fallo en el flush, que deja el SAVEPOINT inactivo pero abierto
+        if self.punto.is_active or self.in_nested_transaction():
+            self.punto.rollback()
+        cola_justa.descartar_cambios_desde(self, self.marca)
+
+    def commit(self):
+        if self.punto is None:
+            return super().commit()
+        self.flush()
+
+    def rollback(self):
+        if self.punto is None:
+            return super().rollback()
+        self.deshacer_punto()
+        # El resto del comando sigue protegido por un SAVEPOINT nuevo
+        self.abrir_punto()
+
+
+class _Comando:
+    __slots__ = ("fn", "args", "kwargs", "futuro", "encolado")
+
+    def __init__(self, fn: Callable, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.futuro: Future = Future()
+        self.encolado = time.perf_counter()
+
+
+class EscritorUnico:
+    def __init__(self, session_factory: Callable[[], Session], lote_maximo: Optional[int] = None,
+                 espera_lote: float = ESPERA_LOTE_SEGUNDOS):
+        self.session_factory = session_factory
+        self._lote_maximo = lote_maximo
+        self.espera_lote = espera_lote
+        self._cola: "queue.Queue[Optional[_Comando]]" = queue.Queue()
+        self._hilo: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Métricas
+        self.comandos = 0
+        self.fallidos = 0
+        self.lotes = 0
+        self.lote_mayor = 0
+        self.lotes_fallidos = 0
+        self._segundos_espera = 0.0
+
+    @property
+    def lote_maximo(self) -> int:
+        if self._lote_maximo is not None:
+            return self._lote_maximo
+        return config.settings.ESCRITOR_LOTE_MAXIMO
+
+    # --- Ciclo de vida ---
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="escritor-unico", daemon=True)
+            self._hilo.start()
+
+    def detener(self, timeout: float = 5):
+        """Termina de escribir lo que ya está en cola y para el hilo."""
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+        if hilo is not None:
+            self._cola.put(None)
+            hilo.join(timeout)
+
+    # --- Envío de comandos ---
+
+    def enviar(self, fn: Callable, *args, **kwargs) -> Future:
+        """Encola `fn(sesion, *args, **kwargs)`; el Future se resuelve tras el commit de su lote."""
+        comando = _Comando(fn, args, kwargs)
+        self.iniciar()
+        self._cola.put(comando)
+        return comando.futuro
+
+    async def ejecutar(self, fn: Callable, *args, **kwargs):
+        """Como `enviar`, esperando el resultado sin bloquear el loop."""
+        return await asyncio.wrap_future(self.enviar(fn, *args, **kwargs))
+
+    # --- Hilo escritor ---
+
+    def _bucle(self):
+        while True:
+            comando = self._cola.get()
+            if comando is None:
+                return
+            lote = [comando]
+            parar = False
+            limite = time.perf_counter() + self.espera_lote
+            while len(lote) < self.lote_maximo:
+                try:
+                    siguiente = self._cola.get(timeout=max(0.0, limite - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if siguiente is None:
+                    parar = True
+                    break
+                lote.append(siguiente)
+            self._ejecutar_lote(lote)
+            if parar:
+                return
+
+    def _ejecutar_lote(self, lote):
+        # Quien lo envió ya no espera el resultado (tarea cancelada): no se ejecuta
+        lote = [comando for comando in lote if comando.futuro.set_running_or_notify_cancel()]
+        if not lote:
+            return
+        resultados = []
+        db = self.session_factory()
+        try:
+            for comando in lote:
+                self._segundos_espera += time.perf_counter() - comando.encolado
+                db.abrir_punto()
+                try:
+                    resultado = comando.fn(db, *comando.args, **comando.kwargs)
+                    db.flush()
+                    db.punto.commit()
+                    resultados.append((comando, resultado, None))
+                except Exception as e:
+                    db.deshacer_punto()
+                    resultados.append((comando, None, e))
+                finally:
+                    db.punto = None
+            db.commit()
+        except Exception as e:
+            # Falló el commit del lote: ningún comando quedó guardado
+            logger.exception("El escritor no pudo confirmar un lote")
+            db.rollback()
+            self.lotes_fallidos += 1
+            resultados = [(comando, None, e) for comando in lote]
+        finally:
+            db.close()
+
+        self.lotes += 1
+        self.lote_mayor = max(self.lote_mayor, len(lote))
+        for comando, resultado, error in resultados:
+            self.comandos += 1
+            if error is not None:
+                self.fallidos += 1
+                comando.futuro.set_exception(error)
+            else:
+                comando.futuro.set_result(resultado)
+
+    def metricas(self) -> dict:
+        return {
+            "activo": self._hilo is not None and self._hilo.is_alive(),
+            "en_cola": self._cola.qsize(),
+            "comandos": self.comandos,
+            "comandos_fallidos": self.fallidos,
+            "lotes": self.lotes,
+            "lotes_fallidos": self.lotes_fallidos,
+            "comandos_por_lote": round(self.comandos / self.lotes, 2) if self.lotes else None,
+            "lote_mayor": self.lote_mayor,
+            "ms_medios_en_cola": round(self._segundos_espera / self.comandos * 1000, 2) if self.comandos else None,
+        }
+
+
+def _engine_escritor(url: str, perfil: str = database.PERFIL, motor_de=None):
+    """
+    Engine con una sola conexión para el hilo escritor. En SQLite, pysqlite no emite
+    BEGIN antes de un SAVEPOINT y cada RELEASE confirmaría su comando por separado:
+    se desactiva su transacción implícita y el lote empieza con BEGIN IMMEDIATE
+    (el bloqueo de escritura se toma al principio, sin esperas a mitad del lote).
+    Comparte el motor de la cola justa con `motor_de` (por defecto, el engine de la
+    aplicación), que debe apuntar a la misma base.
+    """
+    url_parseada = make_url(url)
+    if url_parseada.get_backend_name() != "sqlite":
+        return database.crear_engine(url, perfil, pool_tamano=1, pool_extra=0)
+    if url_parseada.database in (None, "", ":memory:"):
+        # Una base en memoria no se puede abrir dos veces
+        return database.engine
+    engine = database.crear_engine(url, perfil, pool_tamano=1, pool_extra=0)
+
+    @event.listens_for(engine, "connect")
+    def _sin_transaccion_implicita(conexion_dbapi, _registro):
+        conexion_dbapi.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(conexion):
+        conexion.exec_driver_sql("BEGIN IMMEDIATE")
+
+    # Los commits del escritor actualizan el mismo motor de la cola justa
+    cola_justa.compartir_motor(engine, database.engine if motor_de is None else motor_de)
+    return engine
+
+
+def _sesiones_escritor(engine) -> Callable[[], Session]:
+    # expire_on_commit=False: los resultados se leen después del commit, fuera del hilo
+    return sessionmaker(bind=engine, class_=SesionDeLote, autoflush=False, expire_on_commit=False)
+
+
+def _clave(url) -> str:
+    # sqlite+aiosqlite://... y sqlite://... son la misma base
+    url = make_url(str(url))
+    return url.set(drivername=url.get_backend_name()).render_as_string(hide_password=False)
+
+
+escritor = EscritorUnico(_sesiones_escritor(_engine_escritor(database.SQLALCHEMY_DATABASE_URL)))
+_escritores: Dict[str, EscritorUnico] = {_clave(database.engine.url): escritor}
+_escritores_lock = threading.Lock()
+
+
+def escritor_para(db) -> EscritorUnico:
+    """
+    El escritor de la base de datos de una sesión (Session, AsyncSession o
+    SesionEnHilo). Para la base de la aplicación es `escritor`; para otra (p. ej.
+    en los tests) se crea uno con su propio engine síncrono.
+    """
+    sesion = getattr(db, "sync_session", db)
+    bind = getattr(sesion.get_bind(), "engine", sesion.get_bind())
+    clave = _clave(bind.url)
+    with _escritores_lock:
+        existente = _escritores.get(clave)
+        if existente is None:
+            # Sus commits actualizan el motor de la cola justa de esa base, no el de la aplicación
+            existente = _escritores[clave] = EscritorUnico(
+                _sesiones_escritor(_engine_escritor(clave, motor_de=bind))
+            )
+        return existente
+
+
+async def ejecutar(db, fn: Callable, *args, **kwargs):
+    """
+    Ejecuta la mutación `fn(sesion, ...)` para una sesión de database_async: por el
+    escritor único si ESCRITOR_UNICO está activo; si no, en la propia sesión.
+    """
+    if config.settings.ESCRITOR_UNICO:
+        return await escritor_para(db).ejecutar(fn, *args, **kwargs)
+    return await db.run_sync(fn, *args, **kwargs)
+
+
+def detener_todos():
+    with _escritores_lock:
+        escritores = list(_escritores.values())
+    for e in escritores:
+        e.detener()
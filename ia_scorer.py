@@ -2,13 +2,17 @@ import os
 import logging
 import json
 import subprocess
-from typing import List, Tuple
 
 # --- Importaciones de librerías ---
 import librosa
 import numpy as np
 import yt_dlp
 
+import cache_audio
+import cache_pitch
+import puntuacion_dtw
+import separador_demucs
+
 logger = logging.getLogger(__name__)
 
 # --- Rutas para almacenar archivos temporales y procesados ---
@@ -22,6 +26,7 @@ def _download_audio_from_youtube(youtube_id: str) -> str | None:
     output_path = os.path.join(TEMP_DIR, f"{youtube_id}.mp3")
     if os.path.exists(output_path):
         logger.info(f"El audio para {youtube_id} ya existe. Saltando descarga.")
+        cache_audio.cache.registrar_acceso(youtube_id)
         return output_path
 
     ydl_opts = {
@@ -43,40 +48,35 @@ def _download_audio_from_youtube(youtube_id: str) -> str | None:
         logger.error(f"Error al descargar audio de YouTube para {youtube_id}: {e}")
         return None
 
-def _hz_a_nota(frecuencia: float) -> str | None:
-    """Convierte una frecuencia en Hz a una nota musical (ej: A4)."""
-    if not frecuencia or frecuencia <= 0:
-        return None
-    try:
-        return librosa.hz_to_note(frecuencia)
-    except Exception:
-        return None
-
-def _get_pitch_sequence(audio_path: str) -> List[str]:
+def _get_pitch_sequence(audio_path: str) -> cache_pitch.SeriePitch | None:
     """
-    Analiza un archivo de audio con Librosa (usando YIN) y devuelve una secuencia de notas.
+    Analiza un archivo de audio con Librosa (usando pYIN) y devuelve el pitch en
+    semitonos MIDI con su máscara de voz, sin convertir cada frame a nombre de nota.
     """
     if not os.path.exists(audio_path):
-        return []
+        return None
     try:
         y, sr = librosa.load(audio_path, sr=None, mono=True)
         
-        # Obtener el pitch a lo largo del tiempo
-        pitches, _, _ = librosa.pyin(y, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'))
-        
-        # Convertir frecuencias a notas y filtrar Nones
-        notes = [_hz_a_nota(p) for p in pitches if not np.isnan(p)]
-        return [n for n in notes if n is not None]
+        # Obtener el pitch a lo largo del tiempo (hop por defecto de pyin: frame_length // 4 = 512)
+        f0, voiced_flag, _ = librosa.pyin(y, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'))
+        return cache_pitch.desde_frecuencias(f0, voiced_flag, sr / 512)
 
     except Exception as e:
         logger.error(f"Error al procesar el audio '{audio_path}' con Librosa: {e}")
-        return []
+        return None
 
 def _separate_vocals_with_demucs(audio_path: str, output_dir: str) -> str | None:
     """
     Usa Demucs para separar las vocales de un archivo de audio.
-    Ejecuta demucs como un proceso de línea de comandos.
+    Primero lo intenta con el trabajador persistente (modelo ya cargado, ver
+    separador_demucs); si no está disponible, ejecuta demucs como un proceso de
+    línea de comandos.
     """
+    vocals_path = separador_demucs.separar(audio_path, output_dir)
+    if vocals_path and os.path.exists(vocals_path):
+        return vocals_path
+
     try:
         # Comando para ejecutar Demucs. Separa en dos pistas (vocales y no-vocales)
         # y guarda el resultado en el directorio de salida.
@@ -103,40 +103,50 @@ def _separate_vocals_with_demucs(audio_path: str, output_dir: str) -> str | None
         logger.error(f"Error inesperado al separar vocales con Demucs: {e}")
         return None
 
-def _get_original_vocals_pitch(youtube_id: str) -> List[str]:
+def _get_original_vocals_pitch(youtube_id: str) -> cache_pitch.SeriePitch | None:
     """
     Procesa la canción original: la descarga, separa la voz y analiza su pitch.
-    Usa un sistema de caché para no reprocesar la misma canción.
+    Usa la caché de `cache_pitch` (.npy con mmap) para no reprocesar la misma canción.
     """
-    pitch_cache_path = os.path.join(PROCESSED_DIR, f"{youtube_id}_pitch.json")
-    if os.path.exists(pitch_cache_path):
-        with open(pitch_cache_path, 'r') as f:
-            return json.load(f)
+    serie = cache_pitch.cargar(youtube_id, PROCESSED_DIR)
+    if serie is not None:
+        cache_audio.cache.registrar_acceso(youtube_id, acierto=True)
+        return serie
+    # Fallo de caché: el acceso queda anotado para que la expulsión LRU no borre
+    # lo que se descargue y separe ahora antes que canciones más antiguas
+    cache_audio.cache.registrar_acceso(youtube_id, acierto=False)
+
+    # Caché antigua en JSON: se convierte al vuelo (apply_pitch_cache_migration.py las convierte todas)
+    legacy_cache_path = os.path.join(PROCESSED_DIR, f"{youtube_id}_pitch.json")
+    if os.path.exists(legacy_cache_path):
+        with open(legacy_cache_path, 'r') as f:
+            cache_pitch.guardar(youtube_id, cache_pitch.desde_notas(json.load(f)), PROCESSED_DIR, origen="json")
+        return cache_pitch.cargar(youtube_id, PROCESSED_DIR)
 
     audio_path = _download_audio_from_youtube(youtube_id)
     if not audio_path:
-        return []
+        return None
 
     try:
         # Separar la voz del instrumental usando Demucs
         vocals_path = _separate_vocals_with_demucs(audio_path, PROCESSED_DIR)
         
 
-        if not os.path.exists(vocals_path):
+        if not vocals_path or not os.path.exists(vocals_path):
             logger.error(f"Demucs no generó el archivo de vocales para {youtube_id}")
-            return []
+            return None
 
         # Analizar el pitch de la voz original
-        pitch_sequence = _get_pitch_sequence(vocals_path)
+        serie = _get_pitch_sequence(vocals_path)
+        if serie is None:
+            return None
 
         # Guardar en caché para futuras ejecuciones
-        with open(pitch_cache_path, 'w') as f:
-            json.dump(pitch_sequence, f)
-
-        return pitch_sequence
+        cache_pitch.guardar(youtube_id, serie, PROCESSED_DIR)
+        return serie
     except Exception as e:
         logger.error(f"Error en el pipeline de Demucs para {youtube_id}: {e}")
-        return []
+        return None
 
 def calculate_score(original_youtube_id: str, user_audio_path: str) -> int:
     """
@@ -147,28 +157,17 @@ def calculate_score(original_youtube_id: str, user_audio_path: str) -> int:
     original_pitch = _get_original_vocals_pitch(original_youtube_id)
     user_pitch = _get_pitch_sequence(user_audio_path)
 
-    if not original_pitch or not user_pitch:
+    if original_pitch is None or user_pitch is None:
         logger.warning("No se pudo obtener la secuencia de pitch para la canción original o la del usuario. Puntaje: 0")
         return 0
 
-    # --- Lógica de Comparación Simple ---
-    # Usamos una comparación de secuencias simple.
-    # Esto es una aproximación y puede mejorarse con algoritmos más avanzados
-    # como Dynamic Time Warping (DTW), pero es un buen punto de partida.
-    matches = 0
-    len_user = len(user_pitch)
-    len_orig = len(original_pitch)
-    
-    # Recorremos la secuencia más corta para evitar IndexError
-    min_len = min(len_user, len_orig)
-    for i in range(min_len):
-        # Comparamos la nota (ej: 'C#4')
-        if user_pitch[i] == original_pitch[i]:
-            matches += 1
-
-    # El puntaje es el porcentaje de coincidencias sobre la longitud de la secuencia original.
-    # Esto penaliza si el usuario canta mucho menos de lo que debería.
-    score = (matches / len_orig) * 100 if len_orig > 0 else 0
-    
-    logger.info(f"Puntaje calculado: {int(score)}")
-    return int(score)
\ No newline at end of file
+    # --- Comparación con DTW ---
+    # Alineamos ambas series (el cantante puede entrar tarde o ir algo adelantado) y
+    # puntuamos afinación, ritmo y cobertura sobre el camino de alineamiento.
+    desglose = puntuacion_dtw.puntuar(original_pitch, user_pitch)
+
+    logger.info(
+        f"Puntaje calculado: {desglose.total} (afinación {desglose.afinacion}, "
+        f"ritmo {desglose.ritmo}, cobertura {desglose.cobertura})"
+    )
+    return desglose.total
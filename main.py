@@ -2,6 +2,8 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.responses import Response, FileResponse
 from fastapi.staticfiles import StaticFiles
 import os
+import asyncio
+from typing import Optional
 from dotenv import load_dotenv
 import logging
 
@@ -20,7 +22,7 @@ import models
 
 models.Base.metadata.create_all(bind=engine)
 
-import crud, schemas, broadcast, thumbnails
+import crud, schemas, broadcast, thumbnails, config, aprobacion_automatica, reproduccion_automatica, servicio_puntuacion, precarga_pitch, canto_en_vivo, separador_demucs, cache_audio, escritor_unico
 import mesas, canciones, youtube, consumos, usuarios, admin, productos, websocket_manager
 from admin_settings_router import router as settings_router
 from admin_extra_router import router as admin_extra_router
@@ -105,8 +107,119 @@ def startup_event():
         else:
             print(f"[INFO] Mesa ya existente: {mesa_data['nombre']}")
 
+    corregidas = crud.reconciliar_totales_consumo(db)
+    if corregidas["mesas"] or corregidas["cuentas"]:
+        logger.warning(f"Totales de consumo corregidos al arrancar: {corregidas}")
+
     db.close()
 
+async def reconciliar_totales_periodicamente():
+    """Recalcula cada cierto tiempo los totales acumulados de consumo desde la tabla de consumos."""
+    while True:
+        await asyncio.sleep(config.settings.RECONCILIACION_TOTALES_MINUTOS * 60)
+        db = SessionLocal()
+        try:
+            corregidas = crud.reconciliar_totales_consumo(db)
+            if corregidas["mesas"] or corregidas["cuentas"]:
+                logger.warning(f"Totales de consumo desincronizados corregidos: {corregidas}")
+        except Exception:
+            logger.exception("Error al reconciliar los totales de consumo")
+        finally:
+            db.close()
+
+def _recortar_cache_audio():
+    db = SessionLocal()
+    try:
+        expulsadas = cache_audio.cache.recortar_con_cola(db)
+        if any(expulsadas.values()):
+            logger.info(f"Caché de audio recortada al presupuesto: {expulsadas}")
+    finally:
+        db.close()
+
+async def recortar_cache_audio_periodicamente():
+    """Mantiene temp_audio y processed_songs dentro del presupuesto de disco, sin tocar la cola."""
+    while True:
+        try:
+            await asyncio.to_thread(_recortar_cache_audio)
+        except Exception:
+            logger.exception("Error al recortar la caché de audio")
+        await asyncio.sleep(config.settings.CACHE_AUDIO_REVISION_MINUTOS * 60)
+
+@app.on_event("startup")
+async def iniciar_aprobacion_automatica():
+    # Aprueba las canciones pendientes justo cuando cumplen 10 minutos
+    aprobacion_automatica.programador.iniciar()
+
+@app.on_event("shutdown")
+async def detener_aprobacion_automatica():
+    aprobacion_automatica.programador.detener()
+
+@app.on_event("startup")
+async def iniciar_reproduccion_automatica():
+    # El servidor avanza la cola al terminar cada canción; el player solo sigue los play_song
+    reproduccion_automatica.temporizador.iniciar()
+
+@app.on_event("shutdown")
+async def detener_reproduccion_automatica():
+    reproduccion_automatica.temporizador.detener()
+
+@app.on_event("startup")
+async def iniciar_canto_en_vivo():
+    # Cierra y puntúa la sesión en vivo de cada canción que deja de sonar, venga de donde venga
+    canto_en_vivo.gestor.iniciar()
+
+@app.on_event("shutdown")
+async def detener_canto_en_vivo():
+    canto_en_vivo.gestor.detener()
+
+@app.on_event("startup")
+async def iniciar_servicio_puntuacion():
+    # Retoma las puntuaciones que quedaron en scoring_jobs antes del último reinicio
+    servicio_puntuacion.servicio.iniciar()
+
+@app.on_event("shutdown")
+def detener_servicio_puntuacion():
+    servicio_puntuacion.servicio.detener()
+
+@app.on_event("startup")
+def iniciar_trabajador_demucs():
+    # Carga htdemucs una vez en un proceso aparte; ia_scorer le envía las separaciones
+    separador_demucs.trabajador.iniciar()
+
+@app.on_event("shutdown")
+def detener_trabajador_demucs():
+    separador_demucs.trabajador.detener()
+
+@app.on_event("startup")
+async def iniciar_precarga_pitch():
+    # Prepara el pitch de la voz original de las canciones en cola antes de que suenen
+    precarga_pitch.precarga.iniciar()
+
+@app.on_event("shutdown")
+async def detener_precarga_pitch():
+    precarga_pitch.precarga.detener()
+
+@app.on_event("startup")
+async def iniciar_reconciliacion_periodica():
+    if config.settings.RECONCILIACION_TOTALES_MINUTOS > 0:
+        asyncio.create_task(reconciliar_totales_periodicamente())
+
+@app.on_event("startup")
+def iniciar_escritor_unico():
+    # Las mutaciones de las rutas calientes se agrupan en commits de un solo hilo escritor
+    if config.settings.ESCRITOR_UNICO:
+        escritor_unico.escritor.iniciar()
+
+@app.on_event("shutdown")
+def detener_escritor_unico():
+    # Confirma lo que quede en cola antes de salir
+    escritor_unico.detener_todos()
+
+@app.on_event("startup")
+async def iniciar_recorte_cache_audio():
+    if config.settings.CACHE_AUDIO_REVISION_MINUTOS > 0:
+        asyncio.create_task(recortar_cache_audio_periodicamente())
+
 # ===============================
 # FRONTEND
 # ===============================
@@ -134,15 +247,51 @@ async def read_player():
 # WEBSOCKET
 # ===============================
 @app.websocket("/ws/cola")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket_manager.manager.connect(websocket)
-    await websocket_manager.manager.broadcast_queue_update()
+async def websocket_endpoint(websocket: WebSocket, protocolo: Optional[str] = None, topics: Optional[str] = None):
+    manager = websocket_manager.manager
+    await manager.connect(websocket, protocolo, topics)
+    # Los envíos sin cambios se descartan, así que el nuevo cliente recibe su propia copia
+    if manager.recibe(websocket, websocket_manager.TOPIC_COLA):
+        await manager.send_queue_snapshot(websocket)
     try:
         while True:
-            await websocket.receive_text()
+            mensaje = await websocket.receive_text()
+            await websocket_manager.manager.handle_client_message(websocket, mensaje)
     except WebSocketDisconnect:
         websocket_manager.manager.disconnect(websocket)
 
+@app.websocket("/ws/canto/{cancion_id}")
+async def canto_websocket(websocket: WebSocket, cancion_id: int, usuario_id: int, sr: int = 16000):
+    """
+    El dispositivo del cantante envía su voz en trozos binarios de PCM (16 bits,
+    mono, `sr` Hz) mientras suena su canción; ver canto_en_vivo.
+    """
+    db = SessionLocal()
+    try:
+        cancion = db.query(models.Cancion).filter(
+            models.Cancion.id == cancion_id, models.Cancion.usuario_id == usuario_id
+        ).first()
+    finally:
+        db.close()
+    if not cancion or cancion.estado != "reproduciendo" or not 8000 <= sr <= 48000:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    canto_en_vivo.gestor.abrir(cancion, sr)
+    try:
+        while True:
+            pcm = await websocket.receive_bytes()
+            if not await canto_en_vivo.gestor.recibir(cancion_id, pcm):
+                # La canción terminó y su sesión ya se cerró
+                await websocket.close(code=1000)
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Lo cantado hasta aquí se puntúa al terminar la canción (o ya, si terminó)
+        await canto_en_vivo.gestor.desconectar(cancion_id)
+
 # ===============================
 # ROUTERS API
 # ===============================
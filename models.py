@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Boolean, Text, Index, text
 from sqlalchemy.orm import relationship
 import datetime
 
@@ -12,6 +12,7 @@ class Mesa(Base):
     nombre = Column(String, index=True)
     qr_code = Column(String, unique=True, index=True)
     is_active = Column(Boolean, default=True) # Nuevo campo para activar/desactivar
+    consumo_total = Column(Numeric(10, 2), default=0) # Total acumulado de consumos (desnormalizado)
 
     # Relaciones: Una mesa puede tener muchos usuarios y consumos
     usuarios = relationship("Usuario", back_populates="mesa")
@@ -21,12 +22,16 @@ class Mesa(Base):
 
 class Cuenta(Base):
     __tablename__ = "cuentas"
+    __table_args__ = (
+        Index("ix_cuentas_mesa_activa", "mesa_id", "is_active"),  # Cuenta activa (o cerradas) de una mesa
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     mesa_id = Column(Integer, ForeignKey("mesas.id"))
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=now_bogota)
     closed_at = Column(DateTime, nullable=True)
+    consumo_total = Column(Numeric(10, 2), default=0) # Total acumulado de consumos (desnormalizado)
 
     mesa = relationship("Mesa", back_populates="cuentas")
     consumos = relationship("Consumo", back_populates="cuenta")
@@ -34,6 +39,9 @@ class Cuenta(Base):
 
 class Usuario(Base):
     __tablename__ = "usuarios"
+    __table_args__ = (
+        Index("ix_usuarios_mesa_id", "mesa_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     nick = Column(String, index=True)
@@ -52,6 +60,12 @@ class Usuario(Base):
 
 class Cancion(Base):
     __tablename__ = "canciones"
+    __table_args__ = (
+        # La cola y la canción actual filtran por estado en casi cada petición;
+        # la aprobación automática además por antigüedad
+        Index("ix_canciones_estado_created_at", "estado", "created_at"),
+        Index("ix_canciones_usuario_estado", "usuario_id", "estado"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     youtube_id = Column(String, index=True)
@@ -83,6 +97,16 @@ class Producto(Base):
 
 class Consumo(Base):
     __tablename__ = "consumos"
+    __table_args__ = (
+        Index("ix_consumos_usuario_created_at", "usuario_id", "created_at"),
+        Index("ix_consumos_mesa_id", "mesa_id"),
+        Index("ix_consumos_cuenta_id", "cuenta_id"),
+        # Pedidos por despachar (pantalla del bar): índice parcial, solo las filas sin entregar
+        Index(
+            "ix_consumos_por_despachar", "created_at",
+            sqlite_where=text("is_dispatched = 0"), postgresql_where=text("NOT is_dispatched"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     cantidad = Column(Integer, default=1)
@@ -125,6 +149,10 @@ class AdminApiKey(Base):
 
 class Pago(Base):
     __tablename__ = "pagos"
+    __table_args__ = (
+        Index("ix_pagos_mesa_created_at", "mesa_id", "created_at"),
+        Index("ix_pagos_cuenta_created_at", "cuenta_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     monto = Column(Numeric(10, 2), nullable=False)
@@ -145,4 +173,25 @@ class ConfiguracionGlobal(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     clave = Column(String(100), unique=True, nullable=False)
-    valor = Column(String(100), nullable=False)
\ No newline at end of file
+    valor = Column(String(100), nullable=False)
+
+
+class TrabajoPuntuacion(Base):
+    """Cola persistente de puntuaciones por IA (sobrevive a reinicios del servidor)."""
+    __tablename__ = "scoring_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cancion_id = Column(Integer, ForeignKey("canciones.id"), index=True)
+    youtube_id = Column(String)
+    ruta_audio = Column(String)
+    estado = Column(String, default="en_cola", index=True)  # en_cola, en_curso, hecho, fallido
+    prioridad = Column(Integer, default=0)  # Menor = antes (posición en cola del próximo turno del cantante)
+    intentos = Column(Integer, default=0)
+    disponible_desde = Column(DateTime, default=now_bogota)  # Espera entre reintentos
+    trabajador = Column(String, nullable=True)  # Quién tiene la concesión mientras está en curso
+    lease_hasta = Column(DateTime, nullable=True)  # Si vence, otro trabajador puede retomarlo
+    puntuacion = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=now_bogota)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
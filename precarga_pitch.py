@@ -0,0 +1,224 @@
+"""
+Precarga del pitch de la voz original de las canciones en cola.
+
+`ia_scorer._get_original_vocals_pitch` (descarga, Demucs y pYIN) solo se
+ejecutaba al puntuar, es decir, justo cuando termina la canción: la primera
+interpretación de cada canción pagaba todo el coste en el peor momento. Esta
+etapa lo adelanta: cada vez que una canción entra en 'aprobado' o
+'pendiente_lazy' (visto a través de `MotorColaJusta.observar`) se recorre la
+cola en orden (aprobadas y después lazy) y se envían a un pool de procesos, con
+concurrencia limitada, las canciones cuyo pitch no está aún en `processed_songs`.
+
+Al empezar a sonar cada canción se anota si su pitch ya estaba listo: esa es la
+tasa de aciertos de la precarga.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+
+import cola_justa
+import config
+import models
+import servicio_puntuacion
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_EN_COLA = ("aprobado", "pendiente_lazy")
+
+
+def _precalcular_pitch(youtube_id: str) -> bool:
+    """Se ejecuta en un proceso del pool; deja el pitch en la caché de processed_songs."""
+    import ia_scorer
+    return ia_scorer._get_original_vocals_pitch(youtube_id) is not None
+
+
+def _en_cache(youtube_id: str) -> bool:
+    return os.path.exists(servicio_puntuacion.ruta_pitch_original(youtube_id))
+
+
+class PrecargaPitch:
+    """
+    Recorre la cola en orden y precalcula el pitch que falta. `executor`,
+    `precalcular` y `en_cache` se pueden sustituir en las pruebas.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        concurrencia: Optional[int] = None,
+        ventana: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        precalcular: Callable[[str], bool] = _precalcular_pitch,
+        en_cache: Callable[[str], bool] = _en_cache,
+    ):
+        self.session_factory = session_factory
+        self.concurrencia = concurrencia or config.settings.PRECARGA_PITCH_CONCURRENCIA
+        self.ventana = ventana or config.settings.PRECARGA_PITCH_VENTANA
+        self._executor = executor
+        self.precalcular = precalcular
+        self.en_cache = en_cache
+
+        self.en_curso: Dict[str, asyncio.Future] = {}   # youtube_id -> trabajo en el pool
+        self._fallidos: Set[str] = set()               # No se reintentan en esta ejecución
+        self._empezadas: List[int] = []                # Canciones que empezaron a sonar, por comprobar
+        self._sonando: Optional[int] = None
+        self._hay_cambios: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._motor: Optional[cola_justa.MotorColaJusta] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.completadas = 0
+        self.fallidas = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.concurrencia)
+        return self._executor
+
+    def _observar_cambios(self, cambios: List[tuple]):
+        """Recibe los cambios de cada commit (desde cualquier hilo)."""
+        despertar = False
+        for cambio in cambios:
+            if cambio[0] == "invalidar":
+                despertar = True
+            elif cambio[0] == "cancion":
+                estado = cambio[3]
+                if estado in ESTADOS_EN_COLA:
+                    despertar = True
+                elif estado == "reproduciendo" and cambio[1] != self._sonando:
+                    # Cualquier cambio en la canción que suena se vuelve a notificar: solo contamos el primero
+                    self._sonando = cambio[1]
+                    self._empezadas.append(cambio[1])
+                    despertar = True
+        if despertar and self._loop is not None and self._hay_cambios is not None:
+            self._loop.call_soon_threadsafe(self._hay_cambios.set)
+
+    # --- Selección de trabajo ---
+
+    def _youtube_ids_en_orden(self, db) -> List[str]:
+        """youtube_id de las próximas canciones (aprobadas y luego lazy), sin repetir."""
+        motor = cola_justa.motor_para(db)
+        ids = []
+        for estado in ESTADOS_EN_COLA:
+            faltan = self.ventana - len(ids)
+            if faltan <= 0:
+                break
+            ids.extend(motor.ids_en_orden(db, estado, faltan))
+        if not ids:
+            return []
+        por_id = dict(
+            db.query(models.Cancion.id, models.Cancion.youtube_id).filter(models.Cancion.id.in_(ids))
+        )
+        vistos, orden = set(), []
+        for cancion_id in ids:
+            youtube_id = por_id.get(cancion_id)
+            if youtube_id and youtube_id not in vistos:
+                vistos.add(youtube_id)
+                orden.append(youtube_id)
+        return orden
+
+    def _registrar_empezadas(self, db):
+        empezadas, self._empezadas = self._empezadas, []
+        if not empezadas:
+            return
+        filas = db.query(models.Cancion.youtube_id).filter(models.Cancion.id.in_(empezadas))
+        for (youtube_id,) in filas:
+            if self.en_cache(youtube_id):
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+
+    def planificar(self) -> List[str]:
+        """Envía al pool las siguientes canciones sin caché, en orden de cola, hasta llenar la concurrencia."""
+        enviadas = []
+        db = self.session_factory()
+        try:
+            self._registrar_empezadas(db)
+            if len(self.en_curso) >= self.concurrencia:
+                return enviadas
+            for youtube_id in self._youtube_ids_en_orden(db):
+                if len(self.en_curso) >= self.concurrencia:
+                    break
+                if youtube_id in self.en_curso or youtube_id in self._fallidos or self.en_cache(youtube_id):
+                    continue
+                self._enviar(youtube_id)
+                enviadas.append(youtube_id)
+        finally:
+            db.close()
+        return enviadas
+
+    def _enviar(self, youtube_id: str):
+        loop = asyncio.get_running_loop()
+        futuro = loop.run_in_executor(self._pool(), self.precalcular, youtube_id)
+        self.en_curso[youtube_id] = futuro
+        futuro.add_done_callback(lambda f, youtube_id=youtube_id: self._terminado(youtube_id, f))
+
+    def _terminado(self, youtube_id: str, futuro: asyncio.Future):
+        self.en_curso.pop(youtube_id, None)
+        ok = not futuro.cancelled() and futuro.exception() is None and futuro.result()
+        if ok:
+            self.completadas += 1
+        else:
+            self.fallidas += 1
+            self._fallidos.add(youtube_id)
+            if not futuro.cancelled() and futuro.exception() is not None:
+                logger.error(f"Error al precargar el pitch de {youtube_id}: {futuro.exception()}")
+        # Hay un hueco libre: buscamos la siguiente
+        if self._hay_cambios is not None:
+            self._hay_cambios.set()
+
+    # --- Bucle ---
+
+    async def ejecutar(self):
+        while True:
+            self._hay_cambios.clear()
+            try:
+                self.planificar()
+            except Exception:
+                logger.exception("Error al planificar la precarga de pitch")
+            await self._hay_cambios.wait()
+
+    def iniciar(self):
+        """Arranca la tarea en el loop actual y empieza a observar los commits."""
+        if self._tarea is not None:
+            return self._tarea
+        self._loop = asyncio.get_running_loop()
+        self._hay_cambios = asyncio.Event()
+        db = self.session_factory()
+        try:
+            self._motor = cola_justa.motor_para(db)
+        finally:
+            db.close()
+        self._motor.observar(self._observar_cambios)
+        self._tarea = asyncio.create_task(self.ejecutar())
+        return self._tarea
+
+    def detener(self):
+        if self._motor is not None:
+            self._motor.dejar_de_observar(self._observar_cambios)
+        if self._tarea is not None:
+            self._tarea.cancel()
+        self._tarea = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def metricas(self) -> dict:
+        comprobadas = self.aciertos + self.fallos
+        return {
+            "en_curso": sorted(self.en_curso),
+            "completadas": self.completadas,
+            "fallidas": self.fallidas,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / comprobadas, 3) if comprobadas else None,
+        }
+
+
+precarga = PrecargaPitch()
@@ -0,0 +1,178 @@
+"""
+Puntuación por alineamiento temporal dinámico (DTW) sobre arrays de pitch.
+
+La comparación índice a índice que se usaba antes falla en cuanto el
+cantante entra medio segundo tarde: todas las notas quedan desplazadas. Aquí
+ambas series se llevan a un mismo ritmo de frames (FPS_DTW) y se alinean con un
+DTW con banda de Sakoe-Chiba (±`banda_segundos`), vectorizado por filas con
+NumPy, de modo que cada fila cuesta unas pocas operaciones sobre la banda.
+
+Dentro de una fila, D[i, j] = c[i, j] + min(D[i-1, j-1], D[i-1, j], D[i, j-1]).
+El término horizontal D[i, j-1] se resuelve sin bucle: con S la suma acumulada
+de c en la fila y a[j] = min(D[i-1, j-1], D[i-1, j]),
+D[i, j] = S[j] + min_{k<=j}(a[k] - S[k-1]), que es un `np.minimum.accumulate`.
+
+El resultado es un desglose en tres subpuntuaciones (0-100):
+- afinación: frames con voz en ambos donde la nota está dentro de la tolerancia;
+- ritmo: cuánto hubo que desplazar al cantante para alinearlo con el original;
+- cobertura: frames con voz del original acompañados por voz del cantante.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from cache_pitch import SeriePitch
+
+FPS_DTW = 20.0                   # Ritmo de frames común para el alineamiento
+FPS_POR_DEFECTO = 44100 / 512    # pYIN con sr nativo de 44.1 kHz y hop de 512
+BANDA_SEGUNDOS = 5.0
+TOLERANCIA_SEMITONOS = 0.5
+PESOS = {"afinacion": 0.5, "cobertura": 0.3, "ritmo": 0.2}
+
+
+class Desglose(NamedTuple):
+    total: int
+    afinacion: int
+    ritmo: int
+    cobertura: int
+
+
+def _remuestrear(serie: SeriePitch, fps: float) -> tuple:
+    """Agrupa frames en bloques hasta ~FPS_DTW: pitch medio de los frames con voz y voz si la mayoría la tiene."""
+    midi = np.asarray(serie.midi, dtype=np.float64)
+    sonoro = np.asarray(serie.sonoro, dtype=bool)
+    factor = max(1, int(round(fps / FPS_DTW)))
+    n = len(midi) // factor * factor
+    if len(midi) > n:
+        # El último bloque incompleto se rellena con silencio
+        relleno = factor - (len(midi) - n)
+        midi = np.concatenate([midi, np.zeros(relleno)])
+        sonoro = np.concatenate([sonoro, np.zeros(relleno, dtype=bool)])
+    midi = midi.reshape(-1, factor)
+    sonoro = sonoro.reshape(-1, factor)
+    con_voz = sonoro.sum(axis=1)
+    suma = np.where(sonoro, midi, 0).sum(axis=1)
+    media = np.divide(suma, con_voz, out=np.zeros(len(con_voz)), where=con_voz > 0)
+    return media, con_voz * 2 >= factor
+
+
+def _distancia(a: np.ndarray, b: np.ndarray, plegar_octavas: bool) -> np.ndarray:
+    d = np.abs(a - b)
+    if plegar_octavas:
+        # Cantar una octava arriba o abajo cuenta como la misma nota
+        d = np.mod(d, 12.0)
+        d = np.minimum(d, 12.0 - d)
+    return d
+
+
+def alinear(original: tuple, usuario: tuple, banda: int, tolerancia: float, plegar_octavas: bool):
+    """
+    DTW con banda sobre las series remuestreadas. Devuelve los índices (i, j)
+    del camino óptimo, del inicio al final. `usuario` debe tener una longitud
+    a menos de `banda` frames de la del original.
+    """
+    o_midi, o_voz = original
+    u_midi, u_voz = usuario
+    n, m = len(o_midi), len(u_midi)
+    ancho = 2 * banda + 1
+
+    # Matriz de costes en coordenadas de banda: la columna k de la fila i es j = i - banda + k
+    j = np.arange(n)[:, None] - banda + np.arange(ancho)[None, :]
+    validas = (j >= 0) & (j < m)
+    jc = np.clip(j, 0, m - 1)
+    ambos = o_voz[:, None] & u_voz[jc]
+    d = _distancia(o_midi[:, None], u_midi[jc], plegar_octavas)
+    coste = np.where(ambos, np.clip(d - tolerancia, 0.0, 1.0), 0.0)
+    coste = np.where(o_voz[:, None] != u_voz[jc], 1.0, coste)
+    coste[~validas] = 0.0
+
+    acumulado = np.full((n, ancho), np.inf)
+    anterior = np.full(ancho + 1, np.inf)
+    anterior_inicio = np.full(ancho, np.inf)
+    anterior_inicio[banda] = 0.0  # Celda virtual antes de (0, 0)
+    for i in range(n):
+        if i == 0:
+            a = anterior_inicio
+        else:
+            # D[i-1, j-1] está en la misma columna de banda; D[i-1, j] en la siguiente
+            a = np.minimum(anterior[:-1], anterior[1:])
+        a = np.where(validas[i], a, np.inf)
+        s = np.cumsum(coste[i])
+        s_previa = np.concatenate(([0.0], s[:-1]))
+        fila = s + np.minimum.accumulate(a - s_previa)
+        fila[~validas[i]] = np.inf
+        acumulado[i] = fila
+        anterior[:-1] = fila
+
+    # Camino de vuelta desde (n-1, m-1)
+    i, k = n - 1, (m - 1) - (n - 1) + banda
+    camino = [(i, m - 1)]
+    while i > 0 or k != banda:
+        candidatos = []
+        if i > 0:
+            candidatos.append((acumulado[i - 1, k], i - 1, k))              # Diagonal
+            if k + 1 < ancho:
+                candidatos.append((acumulado[i - 1, k + 1], i - 1, k + 1))  # Vertical
+        if k > 0:
+            candidatos.append((acumulado[i, k - 1], i, k - 1))              # Horizontal
+        _, i, k = min(candidatos)
+        camino.append((i, i - banda + k))
+    camino.reverse()
+    return np.array(camino, dtype=np.int64)
+
+
+def puntuar(
+    original: SeriePitch,
+    usuario: SeriePitch,
+    banda_segundos: float = BANDA_SEGUNDOS,
+    tolerancia: float = TOLERANCIA_SEMITONOS,
+    plegar_octavas: bool = True,
+) -> Desglose:
+    fps_original = original.frame_rate or usuario.frame_rate or FPS_POR_DEFECTO
+    fps_usuario = usuario.frame_rate or fps_original
+    o_midi, o_voz = _remuestrear(original, fps_original)
+    u_midi, u_voz = _remuestrear(usuario, fps_usuario)
+    if not o_voz.any() or not u_voz.any():
+        return Desglose(0, 0, 0, 0)
+
+    banda = max(1, int(round(banda_segundos * FPS_DTW)))
+    n = len(o_midi)
+    # El final de ambas debe caer dentro de la banda: lo que el cantante grabó de más
+    # se descarta y lo que le faltó cuenta como silencio
+    u_midi, u_voz = u_midi[: n + banda - 1], u_voz[: n + banda - 1]
+    if len(u_midi) < n - banda + 1:
+        falta = n - banda + 1 - len(u_midi)
+        u_midi = np.concatenate([u_midi, np.zeros(falta)])
+        u_voz = np.concatenate([u_voz, np.zeros(falta, dtype=bool)])
+
+    camino = alinear((o_midi, o_voz), (u_midi, u_voz), banda, tolerancia, plegar_octavas)
+    i, j = camino[:, 0], camino[:, 1]
+    ambos = o_voz[i] & u_voz[j]
+
+    # Afinación: de los frames emparejados con voz en ambos, cuántos están en tono
+    if ambos.any():
+        d = _distancia(o_midi[i[ambos]], u_midi[j[ambos]], plegar_octavas)
+        afinacion = float(np.mean(d <= tolerancia))
+    else:
+        afinacion = 0.0
+
+    # Cobertura: frames con voz del original emparejados con algún frame con voz del cantante
+    cubiertos = np.zeros(n, dtype=bool)
+    cubiertos[i[ambos]] = True
+    cobertura = float(cubiertos[o_voz].mean())
+
+    # Ritmo: desfase medio respecto al original (0 = a tiempo, la banda entera = 0 puntos)
+    if ambos.any():
+        desfase = np.abs(j[ambos] - i[ambos]).mean()
+        ritmo = max(0.0, 1.0 - desfase / banda)
+    else:
+        ritmo = 0.0
+
+    subpuntuaciones = {"afinacion": afinacion, "cobertura": cobertura, "ritmo": ritmo}
+    total = sum(PESOS[nombre] * valor for nombre, valor in subpuntuaciones.items())
+    return Desglose(
+        total=int(round(total * 100)),
+        afinacion=int(round(afinacion * 100)),
+        ritmo=int(round(ritmo * 100)),
+        cobertura=int(round(cobertura * 100)),
+    )
@@ -0,0 +1,503 @@
+"""
+Motor de reportes en lote para el panel de administración.
+
+Cada endpoint /reports/* hace sus propias consultas de agregación y el dashboard
+pide muchos a la vez al cargar, así que la base de datos recorría las mismas
+tablas una y otra vez. Aquí la noche se carga una sola vez en un `Marco`: una
+consulta por tabla (mesas, usuarios, productos, canciones, consumos y pagos),
+solo con las columnas que usan los reportes, guardadas como arrays de NumPy:
+
+- las claves foráneas ya convertidas a la posición de la fila referida (-1 si
+  es nula o no existe), para agrupar con `np.bincount`;
+- el dinero en centavos enteros (sumas exactas, sin pasar por float de SQL);
+- las fechas como datetime64 (NaT si son nulas).
+
+Todas esas columnas salen de SQL ya como enteros o texto y se leen con el
+cursor del driver: con 50 000 consumos, crear un Row de SQLAlchemy y un
+datetime por fila costaba más que todos los reportes juntos.
+
+Un reporte es una función `fn(marco)` registrada con `@reporte("nombre")` que
+devuelve lo mismo que su endpoint con los parámetros por defecto. Los cálculos
+que comparten varios reportes (canciones cantadas y gasto por usuario...) son
+propiedades del marco y se calculan una sola vez por bundle.
+
+`calcular(db, nombres)` construye el marco y calcula los reportes pedidos; lo
+expone GET /admin/reports/bundle.
+"""
+import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from functools import cached_property
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select, true
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from database import microsegundos_epoch
+
+REPORTES: Dict[str, Callable[["Marco"], Any]] = {}
+
+
+def reporte(nombre: str):
+    """Registra `fn(marco)` como el reporte `nombre` del bundle."""
+    def registrar(fn):
+        REPORTES[nombre] = fn
+        return fn
+    return registrar
+
+
+# --- Carga columnar ---
+
+_SIN_FECHA = -(2 ** 63 - 1)  # Fecha nula en SQL; en el marco pasa a NaT
+
+
+class Tabla:
+    """Columnas de una tabla: arrays (o listas, si el dtype es None) del mismo largo, como atributos."""
+
+    def __init__(self, filas, **columnas):
+        self.n = len(filas)
+        for i, (nombre, dtype) in enumerate(columnas.items()):
+            valores = [fila[i] for fila in filas]
+            if dtype is None:
+                setattr(self, nombre, valores)
+            elif dtype == "datetime64[us]":
+                enteros = np.array(valores, dtype=np.int64)
+                enteros[enteros == _SIN_FECHA] = np.iinfo(np.int64).min
+                setattr(self, nombre, enteros.view(dtype))
+            else:
+                setattr(self, nombre, np.array(valores, dtype=dtype))
+
+
+def _filas(db: Session, consulta) -> list:
+    """Tuplas de `consulta` tal como las devuelve el driver, en la transacción de la sesión."""
+    conexion = db.connection()
+    sql = str(consulta.compile(dialect=conexion.dialect, compile_kwargs={"literal_binds": True}))
+    cursor = conexion.connection.cursor()
+    try:
+        cursor.execute(sql)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _centavos(columna):
+    # Numeric(10, 2) -> entero en la base de datos, sin construir un Decimal por fila
+    return func.coalesce(cast(func.round(columna * 100), Integer), 0)
+
+
+def _fecha(columna):
+    return func.coalesce(microsegundos_epoch(columna), _SIN_FECHA)
+
+
+def _posiciones(claves: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Posición en `ids` (ordenado) de cada clave foránea; -1 si es nula o no existe."""
+    if len(ids) == 0:
+        return np.full(len(claves), -1, dtype=np.int64)
+    posiciones = np.minimum(np.searchsorted(ids, claves), len(ids) - 1)
+    return np.where(ids[posiciones] == claves, posiciones, -1)
+
+
+def _mapear(posiciones: np.ndarray, columna: np.ndarray) -> np.ndarray:
+    """`columna[posicion]` para cada fila; -1 donde la posición es -1."""
+    if len(columna) == 0:
+        return np.full(len(posiciones), -1, dtype=np.int64)
+    return np.where(posiciones >= 0, columna[posiciones], -1)
+
+
+def _codificar(valores: List) -> Tuple[np.ndarray, List]:
+    """Códigos enteros por valor distinto (en orden de aparición) y la lista de valores."""
+    categorias: Dict[Any, int] = {}
+    codigos = np.fromiter((categorias.setdefault(v, len(categorias)) for v in valores),
+                          dtype=np.int64, count=len(valores))
+    return codigos, list(categorias)
+
+
+class Marco:
+    """La noche en columnas: una consulta por tabla, claves foráneas resueltas a posiciones."""
+
+    def __init__(self, db: Session):
+        self.ahora_utc = datetime.datetime.utcnow()  # Como crud.get_usuarios_inactivos_consumo
+
+        self.mesas = Tabla(
+            _filas(db, select(models.Mesa.id, models.Mesa.nombre, models.Mesa.qr_code).order_by(models.Mesa.id)),
+            id=np.int64, nombre=None, qr_code=None,
+        )
+        self.mesas.nombre_codigo, self.nombres_mesa = _codificar(self.mesas.nombre)
+
+        self.usuarios = Tabla(
+            _filas(db, select(
+                models.Usuario.id, models.Usuario.nick, func.coalesce(models.Usuario.puntos, 0),
+                models.Usuario.nivel, func.coalesce(models.Usuario.mesa_id, -1),
+                func.coalesce(models.Usuario.is_silenced, False),
+            ).order_by(models.Usuario.id)),
+            id=np.int64, nick=None, puntos=np.int64, nivel=object, mesa_id=np.int64, silenciado=bool,
+        )
+        self.usuarios.mesa = _posiciones(self.usuarios.mesa_id, self.mesas.id)
+        self.usuarios.nick_codigo, self.nicks = _codificar(self.usuarios.nick)
+
+        self.productos = Tabla(
+            _filas(db, select(
+                models.Producto.id, models.Producto.nombre, models.Producto.categoria,
+                _centavos(models.Producto.valor), _centavos(models.Producto.costo), models.Producto.stock,
+                models.Producto.imagen_url, func.coalesce(models.Producto.is_active, true()),
+            ).order_by(models.Producto.id)),
+            id=np.int64, nombre=None, categoria=None, valor=np.int64, costo=np.int64, stock=None,
+            imagen_url=None, is_active=bool,
+        )
+        self.productos.categoria_codigo, self.categorias = _codificar(self.productos.categoria)
+
+        self.canciones = Tabla(
+            _filas(db, select(
+                func.coalesce(models.Cancion.usuario_id, -1), models.Cancion.estado,
+                models.Cancion.titulo, models.Cancion.youtube_id,
+                _fecha(models.Cancion.created_at), _fecha(models.Cancion.started_at), _fecha(models.Cancion.finished_at),
+            )),
+            usuario_id=np.int64, estado=object, titulo=None, youtube_id=None,
+            creada="datetime64[us]", inicio="datetime64[us]", fin="datetime64[us]",
+        )
+        self.canciones.usuario = _posiciones(self.canciones.usuario_id, self.usuarios.id)
+        self.canciones.clave, self.claves_cancion = _codificar(
+            list(zip(self.canciones.titulo, self.canciones.youtube_id))
+        )
+
+        self.consumos = Tabla(
+            _filas(db, select(
+                func.coalesce(models.Consumo.usuario_id, -1), func.coalesce(models.Consumo.producto_id, -1),
+                func.coalesce(models.Consumo.cantidad, 0), _centavos(models.Consumo.valor_total),
+                _fecha(models.Consumo.created_at),
+            )),
+            usuario_id=np.int64, producto_id=np.int64, cantidad=np.int64, valor=np.int64,
+            creado="datetime64[us]",
+        )
+        self.consumos.usuario = _posiciones(self.consumos.usuario_id, self.usuarios.id)
+        self.consumos.producto = _posiciones(self.consumos.producto_id, self.productos.id)
+
+        self.pagos = Tabla(
+            _filas(db, select(func.coalesce(models.Pago.mesa_id, -1), _centavos(models.Pago.monto))),
+            mesa_id=np.int64, monto=np.int64,
+        )
+        self.pagos.mesa = _posiciones(self.pagos.mesa_id, self.mesas.id)
+
+    # --- Cálculos compartidos entre reportes ---
+
+    @cached_property
+    def cantadas(self) -> np.ndarray:
+        return self.canciones.estado == "cantada"
+
+    @cached_property
+    def rechazadas(self) -> np.ndarray:
+        return self.canciones.estado == "rechazada"
+
+    @cached_property
+    def cantadas_por_usuario(self) -> np.ndarray:
+        return _contar(self.canciones.usuario[self.cantadas], self.usuarios.n)
+
+    @cached_property
+    def consumos_por_usuario(self) -> np.ndarray:
+        return _contar(self.consumos.usuario, self.usuarios.n)
+
+    @cached_property
+    def gasto_por_usuario(self) -> np.ndarray:
+        return _sumar(self.consumos.usuario, self.usuarios.n, self.consumos.valor)
+
+    @cached_property
+    def mesa_de_consumo(self) -> np.ndarray:
+        # Como en crud, la mesa de un consumo es la de su usuario
+        return _mapear(self.consumos.usuario, self.usuarios.mesa)
+
+
+# --- Agregación sobre columnas ---
+
+def _contar(grupos: np.ndarray, n: int) -> np.ndarray:
+    """Filas por grupo; las filas con grupo -1 no cuentan."""
+    return np.bincount(grupos[grupos >= 0], minlength=n)
+
+
+def _sumar(grupos: np.ndarray, n: int, valores: np.ndarray) -> np.ndarray:
+    """Suma entera de `valores` por grupo; las filas con grupo -1 no cuentan."""
+    validos = grupos >= 0
+    return np.rint(np.bincount(grupos[validos], weights=valores[validos], minlength=n)).astype(np.int64)
+
+
+def _ranking(totales: np.ndarray, presentes: np.ndarray, limite: Optional[int] = None,
+             ascendente: bool = False) -> np.ndarray:
+    """Posiciones de los grupos presentes ordenadas por total (los empates, en orden de aparición)."""
+    indices = np.flatnonzero(presentes)
+    orden = np.argsort(totales[indices] if ascendente else -totales[indices], kind="stable")
+    return indices[orden][:limite]
+
+
+def _dinero(centavos) -> Decimal:
+    return Decimal(int(centavos)).scaleb(-2)
+
+
+def _usuarios(marco: Marco, posiciones: Iterable[int]) -> List[schemas.UsuarioPublico]:
+    u, m = marco.usuarios, marco.mesas
+    return [
+        schemas.UsuarioPublico(
+            id=int(u.id[i]), nick=u.nick[i], puntos=int(u.puntos[i]), nivel=u.nivel[i],
+            is_silenced=bool(u.silenciado[i]),
+            mesa=schemas.MesaInfo(id=int(m.id[u.mesa[i]]), nombre=m.nombre[u.mesa[i]]) if u.mesa[i] >= 0 else None,
+        )
+        for i in posiciones
+    ]
+
+
+def calcular(db: Session, nombres: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Carga el marco una vez y calcula los reportes `nombres` (todos si no se indican)."""
+    nombres = list(nombres) if nombres else list(REPORTES)
+    marco = Marco(db)
+    return {nombre: REPORTES[nombre](marco) for nombre in nombres}
+
+
+# --- Reportes ---
+
+@reporte("top-songs")
+def canciones_mas_cantadas(marco: Marco, limite: int = 10):
+    claves = marco.canciones.clave[marco.cantadas]
+    veces = np.bincount(claves, minlength=len(marco.claves_cancion))
+    return [
+        schemas.CancionMasCantada(titulo=marco.claves_cancion[i][0], youtube_id=marco.claves_cancion[i][1],
+                                  veces_cantada=int(veces[i]))
+        for i in _ranking(veces, veces > 0, limite)
+    ]
+
+
+@reporte("top-rejected-songs")
+def canciones_mas_rechazadas(marco: Marco, limite: int = 10):
+    claves = marco.canciones.clave[marco.rechazadas]
+    veces = np.bincount(claves, minlength=len(marco.claves_cancion))
+    return [
+        schemas.ReporteCancionesRechazadas(titulo=marco.claves_cancion[i][0], youtube_id=marco.claves_cancion[i][1],
+                                           veces_rechazada=int(veces[i]))
+        for i in _ranking(veces, veces > 0, limite)
+    ]
+
+
+def _productos_por_cantidad(marco: Marco):
+    p = marco.productos
+    return _sumar(marco.consumos.producto, p.n, marco.consumos.cantidad), _contar(marco.consumos.producto, p.n) > 0
+
+
+@reporte("top-products")
+def productos_mas_consumidos(marco: Marco, limite: int = 10):
+    cantidades, presentes = _productos_por_cantidad(marco)
+    return [
+        schemas.ProductoMasConsumido(nombre=marco.productos.nombre[i], cantidad_total=int(cantidades[i]))
+        for i in _ranking(cantidades, presentes, limite)
+    ]
+
+
+@reporte("least-sold-products")
+def productos_menos_consumidos(marco: Marco, limite: int = 5):
+    cantidades, presentes = _productos_por_cantidad(marco)
+    return [
+        schemas.ProductoMasConsumido(nombre=marco.productos.nombre[i], cantidad_total=int(cantidades[i]))
+        for i in _ranking(cantidades, presentes, limite, ascendente=True)
+    ]
+
+
+@reporte("unsold-products")
+def productos_no_consumidos(marco: Marco):
+    p = marco.productos
+    return [
+        schemas.Producto(id=int(p.id[i]), nombre=p.nombre[i], categoria=p.categoria[i], valor=_dinero(p.valor[i]),
+                         costo=_dinero(p.costo[i]), stock=p.stock[i], imagen_url=p.imagen_url[i],
+                         is_active=bool(p.is_active[i]))
+        for i in np.flatnonzero(_contar(marco.consumos.producto, p.n) == 0)
+    ]
+
+
+@reporte("income-by-category")
+def ingresos_por_categoria(marco: Marco):
+    categoria = _mapear(marco.consumos.producto, marco.productos.categoria_codigo)
+    totales = _sumar(categoria, len(marco.categorias), marco.consumos.valor)
+    return [
+        schemas.ReporteIngresosPorCategoria(categoria=marco.categorias[i], ingresos_totales=_dinero(totales[i]))
+        for i in _ranking(totales, _contar(categoria, len(marco.categorias)) > 0)
+    ]
+
+
+@reporte("average-wait-time")
+def tiempo_promedio_espera(marco: Marco):
+    c = marco.canciones
+    validas = marco.cantadas & ~np.isnat(c.creada) & ~np.isnat(c.fin)
+    segundos = (c.fin[validas] - c.creada[validas]) / np.timedelta64(1, "s")
+    promedio = segundos.mean() if len(segundos) else 0
+    return schemas.ReporteTiempoEsperaPromedio(tiempo_espera_promedio_segundos=int(promedio))
+
+
+@reporte("hourly-activity")
+def actividad_por_hora(marco: Marco):
+    inicio = marco.canciones.inicio[marco.cantadas]
+    inicio = inicio[~np.isnat(inicio)]
+    horas = ((inicio - inicio.astype("datetime64[D]")) // np.timedelta64(1, "h")).astype(np.int64)
+    veces = np.bincount(horas, minlength=24)
+    return [
+        schemas.ReporteActividadPorHora(hora=int(hora), canciones_cantadas=int(veces[hora]))
+        for hora in _ranking(veces, veces > 0)
+    ]
+
+
+@reporte("songs-by-user")
+def canciones_cantadas_por_usuario(marco: Marco):
+    nicks = _mapear(marco.canciones.usuario[marco.cantadas], marco.usuarios.nick_codigo)
+    veces = _contar(nicks, len(marco.nicks))
+    return [
+        schemas.ReporteCancionesPorUsuario(nick=marco.nicks[i], canciones_cantadas=int(veces[i]))
+        for i in _ranking(veces, veces > 0)
+    ]
+
+
+@reporte("top-rejected-users")
+def usuarios_mas_rechazados(marco: Marco, limite: int = 10):
+    nicks = _mapear(marco.canciones.usuario[marco.rechazadas], marco.usuarios.nick_codigo)
+    veces = _contar(nicks, len(marco.nicks))
+    return [
+        schemas.ReporteUsuarioRechazado(nick=marco.nicks[i], canciones_rechazadas=int(veces[i]))
+        for i in _ranking(veces, veces > 0, limite)
+    ]
+
+
+@reporte("songs-by-table")
+def canciones_cantadas_por_mesa(marco: Marco):
+    mesas = _mapear(marco.canciones.usuario[marco.cantadas], marco.usuarios.mesa)
+    nombres = _mapear(mesas, marco.mesas.nombre_codigo)
+    veces = _contar(nombres, len(marco.nombres_mesa))
+    return [
+        schemas.ReporteCancionesPorMesa(mesa_nombre=marco.nombres_mesa[i], canciones_cantadas=int(veces[i]))
+        for i in _ranking(veces, veces > 0)
+    ]
+
+
+@reporte("total-income")
+def ingresos_totales(marco: Marco):
+    return schemas.ReporteIngresos(ingresos_totales=_dinero(marco.pagos.monto.sum()))
+
+
+@reporte("income-by-table")
+def ingresos_por_mesa(marco: Marco):
+    nombres = _mapear(marco.pagos.mesa, marco.mesas.nombre_codigo)
+    totales = _sumar(nombres, len(marco.nombres_mesa), marco.pagos.monto)
+    return [
+        schemas.ReporteIngresosPorMesa(mesa_nombre=marco.nombres_mesa[i], ingresos_totales=_dinero(totales[i]))
+        for i in _ranking(totales, _contar(nombres, len(marco.nombres_mesa)) > 0)
+    ]
+
+
+@reporte("average-income-per-user")
+def ingresos_promedio_por_usuario(marco: Marco):
+    # Como en crud: los consumos sin usuario cuentan como un "usuario" más
+    usuarios = int(np.count_nonzero(np.bincount(marco.consumos.usuario_id + 1)))
+    promedio = _dinero(marco.consumos.valor.sum()) / usuarios if usuarios else Decimal(0)
+    return schemas.ReporteIngresosPromedio(
+        ingresos_promedio_por_usuario=promedio.quantize(Decimal("0.01"), ROUND_HALF_UP)
+    )
+
+
+@reporte("average-income-per-table")
+def ingresos_promedio_por_mesa(marco: Marco):
+    n = len(marco.nombres_mesa)
+    nombres = _mapear(marco.mesa_de_consumo, marco.mesas.nombre_codigo)
+    totales = _sumar(nombres, n, marco.consumos.valor)
+    usuarios = np.maximum(_contar(_mapear(marco.usuarios.mesa, marco.mesas.nombre_codigo), n), 1)
+    return [
+        schemas.ReporteIngresosPromedioPorMesa(
+            mesa_nombre=marco.nombres_mesa[i],
+            ingresos_promedio_por_usuario=(_dinero(totales[i]) / int(usuarios[i])).quantize(Decimal("0.01"), ROUND_HALF_UP),
+        )
+        for i in _ranking(totales, np.ones(n, dtype=bool))
+    ]
+
+
+@reporte("empty-tables")
+def mesas_vacias(marco: Marco):
+    m = marco.mesas
+    return [
+        schemas.MesaSimple(id=int(m.id[i]), nombre=m.nombre[i], qr_code=m.qr_code[i])
+        for i in np.flatnonzero(_contar(marco.usuarios.mesa, m.n) == 0)
+    ]
+
+
+@reporte("one-hit-wonders")
+def usuarios_una_cancion(marco: Marco):
+    return _usuarios(marco, np.flatnonzero(marco.cantadas_por_usuario == 1))
+
+
+@reporte("users-without-sung-songs")
+def usuarios_sin_canciones_cantadas(marco: Marco):
+    return _usuarios(marco, np.flatnonzero(marco.cantadas_por_usuario == 0))
+
+
+@reporte("inactive-users")
+def usuarios_sin_consumo(marco: Marco):
+    return _usuarios(marco, np.flatnonzero(marco.consumos_por_usuario == 0))
+
+
+@reporte("inactive-consumers")
+def usuarios_inactivos_consumo(marco: Marco, horas: int = 2):
+    c = marco.consumos
+    nunca = np.iinfo(np.int64).min
+    ultimo = np.full(marco.usuarios.n, nunca, dtype=np.int64)
+    validos = (c.usuario >= 0) & ~np.isnat(c.creado)
+    np.maximum.at(ultimo, c.usuario[validos], c.creado[validos].astype(np.int64))
+    limite = np.datetime64(marco.ahora_utc - datetime.timedelta(hours=horas), "us").astype(np.int64)
+    return _usuarios(marco, np.flatnonzero((ultimo == nunca) | (ultimo < limite)))
+
+
+@reporte("consumers-no-singers")
+def usuarios_consumen_pero_no_cantan(marco: Marco, umbral: float = 100.0):
+    umbral_centavos = int(Decimal(str(umbral)) * 100)
+    return _usuarios(
+        marco, np.flatnonzero((marco.gasto_por_usuario > umbral_centavos) & (marco.cantadas_por_usuario == 0))
+    )
+
+
+@reporte("top-consumers-one-song")
+def top_consumidores_una_cancion(marco: Marco, limite: int = 10):
+    una = marco.cantadas_por_usuario == 1
+    usuarios = marco.consumos.usuario
+    nicks = np.where(_mapear(usuarios, una.astype(np.int64)) == 1, _mapear(usuarios, marco.usuarios.nick_codigo), -1)
+    totales = _sumar(nicks, len(marco.nicks), marco.consumos.valor)
+    return [
+        schemas.ReporteGastoUsuarioPorCategoria(nick=marco.nicks[i], total_gastado=_dinero(totales[i]))
+        for i in _ranking(totales, _contar(nicks, len(marco.nicks)) > 0, limite)
+    ]
+
+
+@reporte("gold-users")
+def usuarios_oro(marco: Marco):
+    return _usuarios(marco, np.flatnonzero(marco.usuarios.nivel == "oro"))
+
+
+@reporte("silver-users")
+def usuarios_plata(marco: Marco):
+    return _usuarios(marco, np.flatnonzero(marco.usuarios.nivel == "plata"))
+
+
+@reporte("active-gold-users")
+def usuarios_oro_activos(marco: Marco):
+    return _usuarios(marco, np.flatnonzero((marco.usuarios.nivel == "oro") & (marco.cantadas_por_usuario > 5)))
+
+
+@reporte("top-points-users")
+def ranking_puntos_usuarios(marco: Marco, limite: int = 10):
+    return _usuarios(marco, np.argsort(-marco.usuarios.puntos, kind="stable")[:limite])
+
+
+@reporte("summary")
+def resumen_noche(marco: Marco):
+    c, p = marco.consumos, marco.productos
+    # Ganancias: (precio - costo) * cantidad de los consumos de las mesas que ya tienen pagos
+    mesas_con_pagos = _contar(marco.pagos.mesa, marco.mesas.n) > 0
+    pagados = (_mapear(marco.mesa_de_consumo, mesas_con_pagos.astype(np.int64)) == 1) & (c.producto >= 0)
+    margen = p.valor - p.costo
+    ganancias = int((margen[c.producto[pagados]] * c.cantidad[pagados]).sum())
+    return schemas.ResumenNoche(
+        ingresos_totales=_dinero(c.valor.sum()),
+        ganancias_totales=_dinero(ganancias),
+        canciones_cantadas=int(marco.cantadas.sum()),
+        usuarios_activos=marco.usuarios.n,
+    )
@@ -0,0 +1,323 @@
+"""
+Temporizadores de reproducción del lado del servidor.
+
+Antes el autoplay dependía de que `player.html` detectara el fin del vídeo y
+llamara a `/canciones/siguiente`; si la pestaña del player quedaba en segundo
+plano o se desconectaba, la sala se quedaba en silencio. Ahora el backend es
+dueño de los tiempos: cuando una canción pasa a 'reproduciendo' se programan
+dos temporizadores a partir de su `duracion_seconds`:
+
+- 'lazy': al llegar a un punto del avance (AUTOPLAY_PROGRESO_LAZY) se aprueba
+  la siguiente canción lazy, para que esté lista antes del final.
+- 'fin': al terminar la canción (más la transición de AUTOPLAY_TRANSICION_SEGUNDOS)
+  se avanza la cola con `crud.avanzar_cola_automaticamente`, que envía `play_song`.
+
+Las órdenes de pausa, reanudación y reinicio del admin desplazan los
+temporizadores. Igual que la aprobación automática, el estado se alimenta de
+los commits a través de `MotorColaJusta.observar`, así que cualquier forma de
+empezar o terminar una canción (autoplay, botón manual, `/play`) queda cubierta.
+También se mide el silencio entre el fin de una canción y el inicio de la siguiente.
+"""
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+import cola_justa
+import config
+import crud
+import database_async
+import escritor_unico
+import models
+from database import SessionLocal
+from timezone_utils import now_bogota
+
+logger = logging.getLogger(__name__)
+
+
+async def _avanzar_cola(session_factory, cancion_id: int):
+    """
+    Avanza la cola solo si sigue sonando la canción cuyo temporizador venció.
+    La comprobación y el avance van en un solo comando del escritor único, fuera del loop.
+    """
+    db = database_async.SesionEnHilo(session_factory)
+    try:
+        await crud.avanzar_cola_automaticamente(db, cancion_id=cancion_id)
+    finally:
+        await db.close()
+
+
+async def _aprobar_lazy(session_factory, cancion_id: int):
+    import websocket_manager
+    db = database_async.SesionEnHilo(session_factory)
+    try:
+        if await escritor_unico.ejecutar(db, crud.check_and_approve_next_lazy_song):
+            await websocket_manager.manager.broadcast_queue_update()
+    finally:
+        await db.close()
+
+
+class TemporizadorReproduccion:
+    """
+    Temporizadores de la canción que suena. `reloj` y `dormir` se pueden
+    sustituir (p. ej. por un reloj falso en las pruebas).
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        transicion: Optional[float] = None,
+        progreso_lazy: Optional[float] = None,
+        reloj: Callable[[], float] = time.monotonic,
+        dormir: Callable[[float], Awaitable] = asyncio.sleep,
+        avanzar: Callable[..., Awaitable] = _avanzar_cola,
+        aprobar_lazy: Callable[..., Awaitable] = _aprobar_lazy,
+    ):
+        self.session_factory = session_factory
+        self.transicion = config.settings.AUTOPLAY_TRANSICION_SEGUNDOS if transicion is None else transicion
+        self.progreso_lazy = config.settings.AUTOPLAY_PROGRESO_LAZY if progreso_lazy is None else progreso_lazy
+        self.reloj = reloj
+        self.dormir = dormir
+        self.avanzar = avanzar
+        self.aprobar_lazy = aprobar_lazy
+
+        self._lock = threading.Lock()
+        self._eventos = []          # [(vence, generacion, tipo, cancion_id)]; las de otra generación están obsoletas
+        self._generacion = 0
+        self.cancion_id: Optional[int] = None
+        self.duracion = 0.0
+        self.inicio: Optional[float] = None     # Instante (del reloj) en que la canción estaría en 0:00
+        self.pausado_en: Optional[float] = None
+        self._lazy_hecho = False
+        self._fin_ultima: Optional[float] = None
+        self._recargar = True
+        self._hay_cambios: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._motor: Optional[cola_justa.MotorColaJusta] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.avances_automaticos = 0
+        self.silencios = 0
+        self.silencio_total = 0.0
+        self.silencio_maximo = 0.0
+
+    # --- Estado de la canción actual ---
+
+    def _reprogramar(self):
+        """Descarta los temporizadores anteriores y programa los de la canción actual."""
+        self._generacion += 1
+        if self.cancion_id is None or self.pausado_en is not None or self.duracion <= 0:
+            return
+        if not self._lazy_hecho:
+            heapq.heappush(self._eventos, (
+                self.inicio + self.duracion * self.progreso_lazy, self._generacion, "lazy", self.cancion_id,
+            ))
+        heapq.heappush(self._eventos, (
+            self.inicio + self.duracion + self.transicion, self._generacion, "fin", self.cancion_id,
+        ))
+
+    def empezar(self, cancion_id: int, duracion: Optional[int], transcurrido: float = 0.0):
+        ahora = self.reloj()
+        with self._lock:
+            if self._fin_ultima is not None:
+                silencio = max(0.0, ahora - self._fin_ultima)
+                self.silencios += 1
+                self.silencio_total += silencio
+                self.silencio_maximo = max(self.silencio_maximo, silencio)
+                self._fin_ultima = None
+            self.cancion_id = cancion_id
+            self.duracion = float(duracion or 0)
+            self.inicio = ahora - transcurrido
+            self.pausado_en = None
+            self._lazy_hecho = False
+            self._reprogramar()
+        self._despertar()
+
+    def terminar(self, cancion_id: int):
+        with self._lock:
+            if cancion_id != self.cancion_id:
+                return
+            # El silencio cuenta desde que acabó el audio (incluye la transición), no desde
+            # que se marcó como cantada; si se cortó antes, desde el corte
+            fin = self.reloj()
+            if self.duracion > 0 and self.pausado_en is None:
+                fin = min(fin, self.inicio + self.duracion)
+            self.cancion_id = None
+            self.pausado_en = None
+            self._fin_ultima = fin
+            self._reprogramar()
+        self._despertar()
+
+    def pausar(self):
+        with self._lock:
+            if self.cancion_id is None or self.pausado_en is not None:
+                return
+            self.pausado_en = self.reloj()
+            self._reprogramar()
+        self._despertar()
+
+    def reanudar(self):
+        with self._lock:
+            if self.pausado_en is None:
+                return
+            self.inicio += self.reloj() - self.pausado_en
+            self.pausado_en = None
+            self._reprogramar()
+        self._despertar()
+
+    def reiniciar(self):
+        with self._lock:
+            if self.cancion_id is None:
+                return
+            self.inicio = self.reloj()
+            self.pausado_en = None
+            self._reprogramar()
+        self._despertar()
+
+    def cargar(self, db):
+        """Retoma la canción que ya estaba sonando (p. ej. tras reiniciar el servidor)."""
+        self._recargar = False
+        actual = db.query(models.Cancion).filter(models.Cancion.estado == "reproduciendo").first()
+        if actual is None:
+            with self._lock:
+                self.cancion_id = None
+                self._reprogramar()
+            return
+        if actual.id == self.cancion_id:
+            return
+        transcurrido = 0.0
+        if actual.started_at is not None:
+            # SQLite guarda started_at sin zona horaria (hora de Bogotá)
+            ahora = now_bogota().replace(tzinfo=None)
+            transcurrido = max(0.0, (ahora - actual.started_at.replace(tzinfo=None)).total_seconds())
+        self.empezar(actual.id, actual.duracion_seconds, transcurrido)
+
+    def _observar_cambios(self, cambios):
+        """Recibe los cambios de cada commit (desde cualquier hilo)."""
+        for cambio in cambios:
+            if cambio[0] == "invalidar":
+                self._recargar = True
+                self._despertar()
+            elif cambio[0] == "cancion":
+                cancion_id, estado, duracion = cambio[1], cambio[3], cambio[5]
+                if estado == "reproduciendo":
+                    if cancion_id != self.cancion_id:
+                        self.empezar(cancion_id, duracion)
+                else:
+                    self.terminar(cancion_id)
+            elif cambio[0] == "cancion_borrada":
+                self.terminar(cambio[1])
+
+    def _despertar(self):
+        if self._loop is not None and self._hay_cambios is not None:
+            self._loop.call_soon_threadsafe(self._hay_cambios.set)
+
+    # --- Bucle ---
+
+    def _sacar_vencido(self):
+        """Devuelve el siguiente temporizador vigente ya vencido, o None."""
+        with self._lock:
+            while self._eventos:
+                vence, generacion, tipo, cancion_id = self._eventos[0]
+                if generacion != self._generacion:
+                    heapq.heappop(self._eventos)
+                    continue
+                if vence > self.reloj():
+                    return None
+                heapq.heappop(self._eventos)
+                if tipo == "lazy":
+                    self._lazy_hecho = True
+                return tipo, cancion_id
+            return None
+
+    def segundos_hasta_vencimiento(self) -> Optional[float]:
+        with self._lock:
+            while self._eventos and self._eventos[0][1] != self._generacion:
+                heapq.heappop(self._eventos)
+            if not self._eventos:
+                return None
+            return max(0.0, self._eventos[0][0] - self.reloj())
+
+    async def procesar_vencidos(self):
+        if self._recargar:
+            db = self.session_factory()
+            try:
+                self.cargar(db)
+            finally:
+                db.close()
+        while True:
+            vencido = self._sacar_vencido()
+            if vencido is None:
+                return
+            tipo, cancion_id = vencido
+            if tipo == "lazy":
+                await self.aprobar_lazy(self.session_factory, cancion_id)
+            else:
+                self.avances_automaticos += 1
+                await self.avanzar(self.session_factory, cancion_id)
+
+    async def ejecutar(self):
+        while True:
+            self._hay_cambios.clear()
+            try:
+                await self.procesar_vencidos()
+            except Exception:
+                logger.exception("Error en los temporizadores de reproducción")
+            await self._esperar(self.segundos_hasta_vencimiento())
+
+    async def _esperar(self, segundos: Optional[float]):
+        cambio = asyncio.ensure_future(self._hay_cambios.wait())
+        esperas = {cambio}
+        if segundos is not None:
+            esperas.add(asyncio.ensure_future(self.dormir(segundos)))
+        try:
+            await asyncio.wait(esperas, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for espera in esperas:
+                espera.cancel()
+
+    def iniciar(self):
+        """Arranca la tarea en el loop actual y empieza a observar los commits."""
+        if self._tarea is not None:
+            return self._tarea
+        self._loop = asyncio.get_running_loop()
+        self._hay_cambios = asyncio.Event()
+        db = self.session_factory()
+        try:
+            self._motor = cola_justa.motor_para(db)
+        finally:
+            db.close()
+        self._motor.observar(self._observar_cambios)
+        self._recargar = True
+        self._tarea = asyncio.create_task(self.ejecutar())
+        return self._tarea
+
+    def detener(self):
+        if self._motor is not None:
+            self._motor.dejar_de_observar(self._observar_cambios)
+        if self._tarea is not None:
+            self._tarea.cancel()
+        self._tarea = None
+
+    def metricas(self) -> dict:
+        with self._lock:
+            posicion = None
+            if self.cancion_id is not None:
+                posicion = round((self.pausado_en or self.reloj()) - self.inicio, 1)
+            return {
+                "cancion_id": self.cancion_id,
+                "posicion_segundos": posicion,
+                "duracion_segundos": self.duracion if self.cancion_id is not None else None,
+                "pausado": self.pausado_en is not None,
+                "avances_automaticos": self.avances_automaticos,
+                "silencios": self.silencios,
+                "silencio_total_segundos": round(self.silencio_total, 1),
+                "silencio_maximo_segundos": round(self.silencio_maximo, 1),
+                "silencio_promedio_segundos": round(self.silencio_total / self.silencios, 1) if self.silencios else 0.0,
+            }
+
+
+temporizador = TemporizadorReproduccion()
@@ -151,6 +151,7 @@ class UsuarioPerfil(Usuario):
 class ColaView(BaseModel):
     now_playing: Optional[CancionAdminView] = None
     upcoming: List[CancionAdminView] = []
+    version: Optional[int] = None  # Versión de la cola con la que se generó
 
 # --- Schema extendido para la cola con lazy approval ---
 class ColaViewExtended(BaseModel):
@@ -158,6 +159,7 @@ class ColaViewExtended(BaseModel):
     upcoming: List[CancionAdminView] = []  # Máximo 1 canción
     lazy_queue: List[CancionAdminView] = []  # Canciones en pendiente_lazy
     pending: List[CancionAdminView] = []  # Canciones pendientes de aprobación manual
+    version: Optional[int] = None  # Versión de la cola con la que se generó
 
 
 # --- Schema para la respuesta de "siguiente canción" ---
@@ -258,6 +260,16 @@ class NickUnban(BaseModel):
 class ReporteTiempoEsperaPromedio(BaseModel):
     tiempo_espera_promedio_segundos: int
 
+# --- Schemas para tiempos de espera por lote ---
+class TiempoEsperaCancion(BaseModel):
+    cancion_id: int
+    posicion: int
+    tiempo_espera_segundos: int
+
+class TiemposEsperaView(BaseModel):
+    tiempo_restante_actual_segundos: int
+    canciones: List[TiempoEsperaCancion]
+
 # --- Schema para ver nicks baneados ---
 class BannedNickView(BaseModel):
     nick: str
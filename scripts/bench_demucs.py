@@ -0,0 +1,100 @@
+"""
+Benchmark de la separación de voces: subproceso `python -m demucs` por canción
+frente al trabajador persistente de separador_demucs (modelo cargado una vez).
+
+Genera N pistas sintéticas (acordes de tonos puros de `segundos` de duración) o
+usa los archivos que se pasen, y mide la latencia por canción de cada camino.
+La primera petición al trabajador incluye la carga del modelo; se muestra aparte.
+
+Uso: python scripts/bench_demucs.py [--canciones N] [--segundos S] [--hilos H] [archivos...]
+Requiere demucs y torch instalados.
+"""
+import argparse
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import separador_demucs
+
+
+def pista_sintetica(ruta: str, segundos: float, semilla: int, sr: int = 44100):
+    rng = np.random.default_rng(semilla)
+    t = np.arange(int(segundos * sr)) / sr
+    audio = np.zeros_like(t)
+    for nota in rng.integers(48, 72, 3):
+        audio += 0.2 * np.sin(2 * np.pi * 440.0 * 2 ** ((nota - 69) / 12) * t)
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2")
+    with wave.open(ruta, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(pcm.tobytes())
+
+
+def por_subproceso(ruta: str, salida: str, hilos: int) -> float:
+    inicio = time.perf_counter()
+    entorno = dict(os.environ, OMP_NUM_THREADS=str(hilos))
+    subprocess.run([sys.executable, "-m", "demucs", "--two-stems", "vocals", "-o", salida, ruta],
+                   check=True, capture_output=True, env=entorno)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--canciones", type=int, default=3)
+    parser.add_argument("--segundos", type=float, default=30.0)
+    parser.add_argument("--hilos", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("archivos", nargs="*")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec("demucs") is None:
+        print("ERROR - demucs no está instalado (pip install demucs)")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archivos = args.archivos
+        if not archivos:
+            archivos = []
+            for i in range(args.canciones):
+                ruta = os.path.join(tmp, f"sintetica_{i}.wav")
+                pista_sintetica(ruta, args.segundos, i)
+                archivos.append(ruta)
+
+        subprocesos = [por_subproceso(r, os.path.join(tmp, "sub"), args.hilos) for r in archivos]
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            direccion = ("127.0.0.1", s.getsockname()[1])
+        clave = b"bench"
+        inicio = time.perf_counter()
+        listo = threading.Event()
+        threading.Thread(target=separador_demucs.servir, args=(direccion, clave, args.hilos),
+                         kwargs={"listo": listo}, daemon=True).start()
+        listo.wait()
+        carga = time.perf_counter() - inicio
+
+        trabajador = []
+        for ruta in archivos:
+            inicio = time.perf_counter()
+            assert separador_demucs.separar(ruta, os.path.join(tmp, "trab"), direccion, clave)
+            trabajador.append(time.perf_counter() - inicio)
+
+    print(f"Canciones: {len(archivos)}  hilos de torch: {args.hilos}")
+    print(f"Subproceso por canción: media {np.mean(subprocesos):.2f} s  (min {min(subprocesos):.2f}, max {max(subprocesos):.2f})")
+    print(f"Trabajador persistente: carga única del modelo {carga:.2f} s, "
+          f"media {np.mean(trabajador):.2f} s por canción  (min {min(trabajador):.2f}, max {max(trabajador):.2f})")
+    print(f"Ahorro por canción: {np.mean(subprocesos) - np.mean(trabajador):.2f} s")
+
+
+if __name__ == "__main__":
+    main()
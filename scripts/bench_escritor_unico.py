@@ -0,0 +1,164 @@
+"""
+Benchmark de una ráfaga de pedidos: sesiones sueltas frente al escritor único.
+
+Simula el momento en que media sala pide a la vez: N pedidos (carritos de dos
+productos) llegan concurrentes.
+
+- antes: cada pedido abre su propia Session y hace su commit (en hilos, como
+  las peticiones que FastAPI atiende en paralelo); compiten por el bloqueo de
+  escritura de SQLite.
+- después: los pedidos son comandos del escritor único, que los agrupa en
+  commits de varios pedidos.
+
+Mide pedidos por segundo, p50/p99 de cada pedido, fallos por "database is
+locked", commits realizados y si el stock final cuadra (las sesiones sueltas
+leen y descuentan el stock a la vez y pueden perder descuentos).
+
+Uso: python scripts/bench_escritor_unico.py [pedidos] [hilos_antes] [perfil]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import escritor_unico
+import models
+import schemas
+from database import PERFIL, Base, crear_engine
+
+STOCK_INICIAL = 100000
+MESAS = 30
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] if ordenados else 0.0
+
+
+def preparar(url, perfil):
+    engine = crear_engine(url, perfil=perfil)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    db.add_all([
+        models.Producto(nombre="Cerveza", valor=8, stock=STOCK_INICIAL, is_active=True),
+        models.Producto(nombre="Papas", valor=5, stock=STOCK_INICIAL, is_active=True),
+    ])
+    for n in range(MESAS):
+        mesa = models.Mesa(nombre=f"Mesa {n}", qr_code=f"bench{n}", is_active=True)
+        db.add(mesa)
+        db.flush()
+        db.add(models.Usuario(nick=f"bench{n}", mesa_id=mesa.id))
+    db.commit()
+    db.close()
+    return engine, Session
+
+
+def contar_commits(engine):
+    commits = [0]
+
+    @event.listens_for(engine, "commit")
+    def _contar(_conexion):
+        commits[0] += 1
+
+    return commits
+
+
+def carrito():
+    return schemas.CarritoCreate(items=[
+        schemas.CarritoItem(producto_id=1, cantidad=2), schemas.CarritoItem(producto_id=2, cantidad=1),
+    ])
+
+
+def stock_descontado(Session):
+    db = Session()
+    try:
+        return sum(STOCK_INICIAL - p.stock for p in db.query(models.Producto))
+    finally:
+        db.close()
+
+
+async def medir_antes(Session, pedidos, hilos):
+    duraciones, bloqueos = [], []
+    limite = asyncio.Semaphore(hilos)
+
+    def pedir(usuario_id):
+        db = Session()
+        try:
+            crud.create_pedido_from_carrito(db, carrito=carrito(), usuario_id=usuario_id)
+        except OperationalError:
+            db.rollback()
+            bloqueos.append(1)
+        finally:
+            db.close()
+
+    async def pedido(n):
+        async with limite:
+            inicio = time.perf_counter()
+            await asyncio.to_thread(pedir, n % MESAS + 1)
+            duraciones.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(pedido(n) for n in range(pedidos)))
+    return time.perf_counter() - inicio, duraciones, len(bloqueos)
+
+
+async def medir_despues(escritor, pedidos):
+    duraciones, fallos = [], []
+
+    async def pedido(n):
+        inicio = time.perf_counter()
+        try:
+            await escritor.ejecutar(crud.create_pedido_from_carrito, carrito(), n % MESAS + 1)
+        except OperationalError:
+            fallos.append(1)
+        duraciones.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(pedido(n) for n in range(pedidos)))
+    return time.perf_counter() - inicio, duraciones, len(fallos)
+
+
+def imprimir(nombre, segundos, duraciones, fallos, commits, descontado, pedidos):
+    print(f"  {nombre:<16} {segundos:6.2f} s  {pedidos / segundos:8.1f} pedidos/s  "
+          f"p50 {percentil(duraciones, 0.5) * 1000:7.1f} ms  p99 {percentil(duraciones, 0.99) * 1000:7.1f} ms  "
+          f"{commits:4d} commits  {fallos} bloqueos  stock descontado {descontado}/{3 * (pedidos - fallos)}")
+
+
+def main():
+    pedidos = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    hilos = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    perfil = sys.argv[3] if len(sys.argv) > 3 else PERFIL
+    print(f"Ráfaga de {pedidos} pedidos concurrentes ({hilos} hilos con sesiones sueltas), perfil {perfil}")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        url = f"sqlite:///{os.path.join(directorio, 'antes.db')}"
+        engine, Session = preparar(url, perfil)
+        commits = contar_commits(engine)
+        segundos, duraciones, fallos = asyncio.run(medir_antes(Session, pedidos, hilos))
+        imprimir("sesiones sueltas", segundos, duraciones, fallos, commits[0], stock_descontado(Session), pedidos)
+        engine.dispose()
+
+        url = f"sqlite:///{os.path.join(directorio, 'despues.db')}"
+        engine, Session = preparar(url, perfil)
+        engine_escritor = escritor_unico._engine_escritor(url, perfil)
+        commits = contar_commits(engine_escritor)
+        escritor = escritor_unico.EscritorUnico(escritor_unico._sesiones_escritor(engine_escritor))
+        segundos, duraciones, fallos = asyncio.run(medir_despues(escritor, pedidos))
+        escritor.detener()
+        imprimir("escritor único", segundos, duraciones, fallos, commits[0], stock_descontado(Session), pedidos)
+        print(f"  {escritor.metricas()}")
+        engine_escritor.dispose()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark de latencia del loop de eventos con la capa síncrona y la asíncrona.
+
+Simula la noche en un solo loop: varios clientes WebSocket reciben un mensaje
+cada pocos milisegundos mientras llegan peticiones concurrentes de "añadir
+canción". Con la Session síncrona (antes) cada consulta y cada commit se hacen
+dentro del loop y los mensajes se retrasan; con database_async (después) la base
+de datos trabaja fuera del loop. Mide p50/p99 del retraso de los mensajes y de
+la duración de las peticiones.
+
+Sin greenlet, "después" usa SesionEnHilo (Session síncrona en un hilo); con
+sqlalchemy[asyncio] instalado usa AsyncSession sobre aiosqlite.
+
+Uso: python scripts/bench_latencia_async.py [clientes_ws] [peticiones_concurrentes] [peticiones_por_cliente]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import crud_async
+import models
+import schemas
+from database import Base, crear_engine
+from database_async import SesionEnHilo, crear_engine_async
+
+INTERVALO_WS = 0.005  # Cada cliente recibe un mensaje cada 5 ms
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] if ordenados else 0.0
+
+
+def preparar(url, usuarios):
+    engine = crear_engine(url, pool_tamano=usuarios, pool_extra=usuarios)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    for n in range(usuarios):
+        mesa = models.Mesa(nombre=f"Mesa {n}", qr_code=f"bench{n}", is_active=True)
+        db.add(mesa)
+        db.flush()
+        db.add(models.Usuario(nick=f"bench{n}", mesa_id=mesa.id))
+    db.commit()
+    db.close()
+    return engine, Session
+
+
+async def anadir_sincrono(Session, usuario_id, cancion):
+    # El flujo de antes: todo en el loop, con dos commits
+    db = Session()
+    try:
+        crud.get_usuario_by_id(db, usuario_id)
+        crud.get_duracion_total_cola_aprobada(db)
+        crud.check_if_song_in_user_list(db, usuario_id=usuario_id, youtube_id=cancion.youtube_id)
+        db_cancion = crud.create_cancion_para_usuario(db, cancion=cancion, usuario_id=usuario_id)
+        db.query(models.Cancion).filter(models.Cancion.estado == "aprobado").count()
+        crud.update_cancion_estado(db, cancion_id=db_cancion.id, nuevo_estado="pendiente_lazy")
+    finally:
+        db.close()
+
+
+async def anadir_asincrono(fabrica, usuario_id, cancion):
+    db = fabrica()
+    try:
+        await crud_async.get_usuario_by_id(db, usuario_id)
+        await crud_async.get_duracion_total_cola_aprobada(db)
+        await crud_async.check_if_song_in_user_list(db, usuario_id=usuario_id, youtube_id=cancion.youtube_id)
+        await crud_async.contar_canciones(db, "aprobado")
+        await crud_async.create_cancion_para_usuario(db, cancion=cancion, usuario_id=usuario_id, estado="pendiente_lazy")
+    finally:
+        await db.close()
+
+
+async def medir(anadir, clientes_ws, concurrentes, por_cliente):
+    retrasos, duraciones = [], []
+    parar = asyncio.Event()
+
+    async def cliente_ws():
+        esperado = time.perf_counter() + INTERVALO_WS
+        while not parar.is_set():
+            await asyncio.sleep(max(0.0, esperado - time.perf_counter()))
+            ahora = time.perf_counter()
+            retrasos.append(ahora - esperado)
+            esperado = ahora + INTERVALO_WS
+
+    async def peticiones(n):
+        for i in range(por_cliente):
+            inicio = time.perf_counter()
+            cancion = schemas.CancionCreate(titulo=f"T{n}-{i}", youtube_id=f"yt{n}-{i}", duracion_seconds=180)
+            await anadir(n + 1, cancion)
+            duraciones.append(time.perf_counter() - inicio)
+            await asyncio.sleep(0)  # Como el broadcast de la cola tras cada petición
+
+    tareas_ws = [asyncio.create_task(cliente_ws()) for _ in range(clientes_ws)]
+    await asyncio.sleep(INTERVALO_WS * 2)
+    inicio = time.perf_counter()
+    await asyncio.gather(*(peticiones(n) for n in range(concurrentes)))
+    segundos = time.perf_counter() - inicio
+    parar.set()
+    await asyncio.gather(*tareas_ws)
+    return {
+        "segundos": segundos,
+        "ws_p50": percentil(retrasos, 0.50) * 1000,
+        "ws_p99": percentil(retrasos, 0.99) * 1000,
+        "peticion_p50": percentil(duraciones, 0.50) * 1000,
+        "peticion_p99": percentil(duraciones, 0.99) * 1000,
+        "peticion_media": statistics.mean(duraciones) * 1000,
+    }
+
+
+def imprimir(nombre, r):
+    print(f"  {nombre:<24} {r['segundos']:6.2f} s  ws p50 {r['ws_p50']:6.2f} ms  p99 {r['ws_p99']:7.2f} ms  |  "
+          f"petición p50 {r['peticion_p50']:7.2f} ms  p99 {r['peticion_p99']:7.2f} ms")
+
+
+def main():
+    clientes_ws = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    concurrentes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    por_cliente = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+    print(f"{clientes_ws} clientes WebSocket, {concurrentes} x {por_cliente} peticiones de añadir canción")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        url = f"sqlite:///{os.path.join(directorio, 'antes.db')}"
+        engine, Session = preparar(url, concurrentes)
+        r = asyncio.run(medir(lambda u, c: anadir_sincrono(Session, u, c), clientes_ws, concurrentes, por_cliente))
+        imprimir("antes (Session en loop)", r)
+        engine.dispose()
+
+        url = f"sqlite:///{os.path.join(directorio, 'despues.db')}"
+        engine, Session = preparar(url, concurrentes)
+        async_engine = crear_engine_async(url, pool_tamano=concurrentes, pool_extra=concurrentes)
+        if async_engine is not None:
+            from sqlalchemy.ext.asyncio import async_sessionmaker
+
+            fabrica, nombre = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False), "después (AsyncSession)"
+        else:
+            fabrica, nombre = (lambda: SesionEnHilo(Session)), "después (SesionEnHilo)"
+        r = asyncio.run(medir(lambda u, c: anadir_asincrono(fabrica, u, c), clientes_ws, concurrentes, por_cliente))
+        imprimir(nombre, r)
+        if async_engine is not None:
+            asyncio.run(async_engine.dispose())
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark de escritura concurrente con cada perfil de almacenamiento de database.py.
+
+Simula la noche: varios hilos (bar, panel de admin, móviles) hacen commits
+pequeños a la vez (añadir canciones y registrar acciones del admin) mientras
+otros leen la cola. Mide commits por segundo y cuántas escrituras fallaron por
+"database is locked" con el perfil `legado` (journal de rollback) y `produccion`
+(WAL, synchronous=NORMAL, busy_timeout...).
+
+Uso: python scripts/bench_perfiles_db.py [escritores] [commits_por_escritor] [lectores]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import models
+from database import Base, PERFILES_SQLITE, crear_engine
+
+
+def preparar(engine):
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    mesa = models.Mesa(nombre="Bench", qr_code="bench", is_active=True)
+    db.add(mesa)
+    db.flush()
+    usuario = models.Usuario(nick="bench", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    usuario_id = usuario.id
+    db.close()
+    return Session, usuario_id
+
+
+def medir(perfil: str, escritores: int, commits: int, lectores: int) -> dict:
+    with tempfile.TemporaryDirectory() as directorio:
+        engine = crear_engine(f"sqlite:///{os.path.join(directorio, 'bench.db')}", perfil=perfil,
+                              pool_tamano=escritores + lectores, pool_extra=0)
+        Session, usuario_id = preparar(engine)
+        errores = []
+        parar = threading.Event()
+
+        def escribir(n):
+            db = Session()
+            try:
+                for i in range(commits):
+                    try:
+                        db.add(models.Cancion(titulo=f"T{n}-{i}", youtube_id=f"yt{n}{i}", usuario_id=usuario_id))
+                        db.add(models.AdminLog(action="BENCH", details=f"{n}-{i}"))
+                        db.commit()
+                    except OperationalError:
+                        db.rollback()
+                        errores.append(1)
+            finally:
+                db.close()
+
+        def leer():
+            db = Session()
+            try:
+                while not parar.is_set():
+                    db.query(models.Cancion).filter(models.Cancion.estado == "pendiente").count()
+                    db.rollback()
+            finally:
+                db.close()
+
+        hilos_lectura = [threading.Thread(target=leer) for _ in range(lectores)]
+        hilos_escritura = [threading.Thread(target=escribir, args=(n,)) for n in range(escritores)]
+        for hilo in hilos_lectura:
+            hilo.start()
+        inicio = time.perf_counter()
+        for hilo in hilos_escritura:
+            hilo.start()
+        for hilo in hilos_escritura:
+            hilo.join()
+        segundos = time.perf_counter() - inicio
+        parar.set()
+        for hilo in hilos_lectura:
+            hilo.join()
+        engine.dispose()
+
+    total = escritores * commits - len(errores)
+    return {"segundos": segundos, "commits_por_segundo": total / segundos, "bloqueos": len(errores)}
+
+
+def main():
+    escritores = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    commits = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    lectores = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(f"{escritores} escritores x {commits} commits, {lectores} lectores en paralelo")
+    for perfil in PERFILES_SQLITE:
+        r = medir(perfil, escritores, commits, lectores)
+        print(f"  {perfil:<11} {r['segundos']:6.2f} s  {r['commits_por_segundo']:8.1f} commits/s  "
+              f"{r['bloqueos']} escrituras fallidas por bloqueo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark de la puntuación DTW (puntuacion_dtw) con pistas sintéticas de tonos puros.
+
+Genera una melodía de tonos senoidales (notas de duración aleatoria), calcula su
+pitch como lo haría pYIN (86 frames por segundo, sin voz entre frases) y una
+interpretación del cantante que entra tarde, desafina algunas notas y se salta
+frases. Mide el tiempo de puntuación por canción para varias duraciones, hasta
+los 10 minutos que permite `_perform_youtube_search`, y compara con la
+comparación índice a índice anterior.
+
+Uso: python scripts/bench_puntuacion_dtw.py [limite_segundos]
+Termina con código 1 si la canción de 10 minutos supera el límite (por defecto 2 s).
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cache_pitch
+import puntuacion_dtw
+
+FPS = 44100 / 512
+DURACIONES = [120, 300, 600]
+
+
+def melodia(segundos: float, rng: np.random.Generator) -> np.ndarray:
+    """Frecuencias (Hz) de una melodía de tonos puros; NaN en los silencios entre frases."""
+    frames = int(segundos * FPS)
+    f0 = np.full(frames, np.nan)
+    i = 0
+    while i < frames:
+        largo = int(rng.uniform(0.2, 0.8) * FPS)
+        if rng.random() < 0.15:
+            i += largo  # Silencio
+            continue
+        nota = rng.integers(55, 76)
+        f0[i:i + largo] = 440.0 * 2 ** ((nota - 69) / 12)
+        i += largo
+    return f0
+
+
+def interpretacion(f0: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """El cantante entra 0,5 s tarde, desafina un 20 % de los frames y omite algunas frases."""
+    retraso = int(0.5 * FPS)
+    cantada = np.concatenate([np.full(retraso, np.nan), f0])
+    desafinado = rng.random(len(cantada)) < 0.2
+    cantada[desafinado] *= 2 ** (rng.choice([-2, -1, 1, 2], desafinado.sum()) / 12)
+    for inicio in rng.integers(0, len(cantada), 5):
+        cantada[inicio:inicio + int(3 * FPS)] = np.nan
+    return cantada
+
+
+def indice_a_indice(original, usuario) -> int:
+    """La comparación anterior: misma nota en el mismo frame con voz, sin alinear."""
+    notas_original, notas_usuario = original.notas(), usuario.notas()
+    if len(notas_original) == 0 or len(notas_usuario) == 0:
+        return 0
+    n = min(len(notas_original), len(notas_usuario))
+    return int(np.count_nonzero(notas_original[:n] == notas_usuario[:n]) / len(notas_original) * 100)
+
+
+def main():
+    limite = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    rng = np.random.default_rng(7)
+    tiempo_10_min = None
+    print(f"{'duración':>9} {'frames':>7} {'DTW (s)':>8} {'total':>6} {'afin.':>6} {'ritmo':>6} {'cob.':>6} {'índice a índice':>16}")
+    for segundos in DURACIONES:
+        f0 = melodia(segundos, rng)
+        original = cache_pitch.desde_frecuencias(f0, None, FPS)
+        usuario = cache_pitch.desde_frecuencias(interpretacion(f0, rng), None, FPS)
+
+        inicio = time.perf_counter()
+        desglose = puntuacion_dtw.puntuar(original, usuario)
+        transcurrido = time.perf_counter() - inicio
+        if segundos == 600:
+            tiempo_10_min = transcurrido
+
+        anterior = indice_a_indice(original, usuario)
+        print(f"{segundos:>8}s {len(f0):>7} {transcurrido:>8.3f} {desglose.total:>6} {desglose.afinacion:>6} "
+              f"{desglose.ritmo:>6} {desglose.cobertura:>6} {anterior:>16}")
+
+    if tiempo_10_min is not None and tiempo_10_min > limite:
+        print(f"ERROR - La canción de 10 minutos tardó {tiempo_10_min:.2f} s (límite {limite} s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
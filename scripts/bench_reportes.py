@@ -0,0 +1,165 @@
+"""
+Benchmark del dashboard de reportes: un endpoint por reporte frente al bundle.
+
+Siembra una noche grande (por defecto 50 000 consumos) y mide:
+
+- antes: los endpoints /reports/* uno tras otro, como los pide el dashboard al
+  cargar (cada uno con sus propias consultas de agregación);
+- después: reportes.calcular, que carga el marco columnar una vez y calcula
+  todos los reportes registrados, separando el tiempo de carga y el de cálculo.
+
+Uso: python scripts/bench_reportes.py [consumos] [repeticiones]
+"""
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+import admin
+import models
+import reportes
+from database import Base, crear_engine
+
+MESAS = 40
+USUARIOS_POR_MESA = 8
+PRODUCTOS = 40
+CANCIONES_POR_USUARIO = 8
+PAGOS_POR_MESA = 10
+
+# Los endpoints que el bundle reemplaza, con sus parámetros por defecto
+ENDPOINTS = {
+    "top-songs": admin.get_top_songs_report,
+    "top-rejected-songs": admin.get_top_rejected_songs_report,
+    "top-products": admin.get_top_products_report,
+    "least-sold-products": admin.get_least_sold_products_report,
+    "unsold-products": admin.get_unsold_products_report,
+    "income-by-category": admin.get_income_by_category_report,
+    "average-wait-time": admin.get_average_wait_time_report,
+    "hourly-activity": admin.get_hourly_activity_report,
+    "songs-by-user": admin.get_songs_by_user_report,
+    "top-rejected-users": admin.get_top_rejected_users_report,
+    "songs-by-table": admin.get_songs_by_table_report,
+    "total-income": admin.get_total_income_report,
+    "income-by-table": admin.get_income_by_table_report,
+    "average-income-per-user": admin.get_average_income_per_user_report,
+    "average-income-per-table": admin.get_average_income_per_table_report,
+    "empty-tables": admin.get_empty_tables_report,
+    "one-hit-wonders": admin.get_one_hit_wonders_report,
+    "users-without-sung-songs": admin.get_users_without_sung_songs_report,
+    "inactive-users": admin.get_inactive_users_report,
+    "inactive-consumers": admin.get_inactive_consumers_report,
+    "consumers-no-singers": admin.get_consumers_no_singers_report,
+    "top-consumers-one-song": admin.get_top_consumers_one_song_report,
+    "gold-users": admin.get_gold_users_report,
+    "silver-users": admin.get_silver_users_report,
+    "active-gold-users": admin.get_active_gold_users_report,
+    "top-points-users": admin.get_top_points_users_report,
+    "summary": admin.get_night_summary,
+}
+
+
+def sembrar(engine, consumos):
+    azar = random.Random(7)
+    inicio = datetime.datetime(2026, 1, 1, 20, 0)
+    with engine.begin() as conexion:
+        conexion.execute(insert(models.Mesa), [
+            {"id": m + 1, "nombre": f"Mesa {m}", "qr_code": f"qr{m}", "is_active": True} for m in range(MESAS + 2)
+        ])
+        conexion.execute(insert(models.Producto), [
+            {"id": p + 1, "nombre": f"Producto {p}", "categoria": f"Categoría {p % 6}",
+             "valor": Decimal(azar.randrange(200, 5000)) / 100, "costo": Decimal(azar.randrange(50, 200)) / 100,
+             "stock": 1000, "is_active": True}
+            for p in range(PRODUCTOS)
+        ])
+        usuarios = MESAS * USUARIOS_POR_MESA
+        conexion.execute(insert(models.Usuario), [
+            {"id": u + 1, "nick": f"u{u}", "mesa_id": u // USUARIOS_POR_MESA + 1, "puntos": azar.randrange(500),
+             "nivel": azar.choice(["bronce", "plata", "oro"]), "is_silenced": False}
+            for u in range(usuarios)
+        ])
+        canciones = []
+        for u in range(usuarios):
+            for k in range(CANCIONES_POR_USUARIO):
+                creada = inicio + datetime.timedelta(minutes=azar.randrange(360))
+                estado = azar.choice(["cantada", "cantada", "cantada", "rechazada", "pendiente", "aprobado"])
+                cantada = estado == "cantada"
+                canciones.append({
+                    "titulo": f"Canción {azar.randrange(300)}", "youtube_id": f"yt{azar.randrange(300)}",
+                    "usuario_id": u + 1, "estado": estado, "created_at": creada,
+                    "started_at": creada + datetime.timedelta(minutes=20) if cantada else None,
+                    "finished_at": creada + datetime.timedelta(minutes=24) if cantada else None,
+                })
+        conexion.execute(insert(models.Cancion), canciones)
+        filas = []
+        for _ in range(consumos):
+            usuario = azar.randrange(usuarios)
+            cantidad = azar.randrange(1, 4)
+            filas.append({
+                "usuario_id": usuario + 1, "mesa_id": usuario // USUARIOS_POR_MESA + 1,
+                "producto_id": azar.randrange(PRODUCTOS - 3) + 1, "cantidad": cantidad,
+                "valor_total": Decimal(azar.randrange(200, 5000) * cantidad) / 100,
+                "created_at": inicio + datetime.timedelta(seconds=azar.randrange(6 * 3600)),
+            })
+        conexion.execute(insert(models.Consumo), filas)
+        conexion.execute(insert(models.Pago), [
+            {"mesa_id": m + 1, "monto": Decimal(azar.randrange(10000, 90000)) / 100}
+            for m in range(MESAS) for _ in range(PAGOS_POR_MESA)
+        ])
+
+
+def medir(fn, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main():
+    consumos = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"Noche de {consumos} consumos, {MESAS * USUARIOS_POR_MESA} usuarios, "
+          f"{MESAS * USUARIOS_POR_MESA * CANCIONES_POR_USUARIO} canciones; {len(ENDPOINTS)} reportes")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        engine = crear_engine(f"sqlite:///{os.path.join(directorio, 'reportes.db')}")
+        Base.metadata.create_all(bind=engine)
+        sembrar(engine, consumos)
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+        def uno_por_uno():
+            for endpoint in ENDPOINTS.values():
+                endpoint(db=db)
+            db.expunge_all()
+
+        def calculo():
+            # Solo los reportes, sobre un marco recién cargado (sin sus cálculos compartidos en caché)
+            marco = reportes.Marco(db)
+            inicio = time.perf_counter()
+            for fn in reportes.REPORTES.values():
+                fn(marco)
+            return (time.perf_counter() - inicio) * 1000
+
+        antes = medir(uno_por_uno, repeticiones)
+        bundle = medir(lambda: reportes.calcular(db), repeticiones)
+        carga = medir(lambda: reportes.Marco(db), repeticiones)
+        calculado = statistics.median(calculo() for _ in range(repeticiones))
+        print(f"  antes:   {len(ENDPOINTS)} endpoints        {antes:8.1f} ms (mediana)")
+        print(f"  después: bundle             {bundle:8.1f} ms (carga del marco {carga:.1f} ms, "
+              f"cálculo {calculado:.1f} ms)  x{antes / bundle:.1f}")
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark del coste de conexión a /ws/cola con N sockets simulados.
+
+Compara el camino anterior (cada conexión relee la cola y la reenvía a TODOS los
+clientes: O(N²) envíos en una tormenta de reconexiones) con el actual (cada
+conexión recibe solo su instantánea en caché por versión).
+
+Uso: python scripts/bench_ws_connect.py [num_sockets]
+"""
+import asyncio
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import models
+import websocket_manager
+from database import Base
+
+
+class SocketSimulado:
+    def __init__(self, contador):
+        self.contador = contador
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.contador["envios"] += 1
+        self.contador["bytes"] += len(data)
+
+
+def preparar_base_de_datos():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    for i in range(30):
+        mesa = models.Mesa(nombre=f"Mesa {i}", qr_code=f"bench-{i}", is_active=True)
+        db.add(mesa)
+        db.flush()
+        usuario = models.Usuario(nick=f"bench_{i}", mesa_id=mesa.id)
+        db.add(usuario)
+        db.flush()
+        for j in range(3):
+            db.add(models.Cancion(
+                titulo=f"Tema {i}-{j}", youtube_id=f"yt{i}{j}", usuario_id=usuario.id,
+                estado="aprobado" if j == 0 else "pendiente", duracion_seconds=200,
+                created_at=datetime.datetime.now(),
+            ))
+    db.commit()
+    db.close()
+    return engine, Session
+
+
+async def conectar_como_antes(manager, websocket, Session):
+    await manager.connect(websocket)
+    db = Session()
+    try:
+        queue_data = jsonable_encoder(crud.get_cola_completa(db))
+    finally:
+        db.close()
+    await manager._broadcast(json.dumps({"type": "queue_update", "payload": queue_data}, default=str))
+
+
+async def medir(nombre, conectar, num_sockets, engine):
+    contador = {"envios": 0, "bytes": 0, "consultas": 0}
+
+    def contar(*args):
+        contador["consultas"] += 1
+
+    event.listen(engine, "before_cursor_execute", contar)
+    manager = websocket_manager.ConnectionManager(ventana_cola=0, max_pendientes=num_sockets * num_sockets)
+    inicio = time.perf_counter()
+    for _ in range(num_sockets):
+        await conectar(manager, SocketSimulado(contador))
+    await manager.esperar_envios()
+    duracion = time.perf_counter() - inicio
+    event.remove(engine, "before_cursor_execute", contar)
+    print(
+        f"{nombre:<22} {duracion * 1000:9.1f} ms  {contador['envios']:8d} envíos  "
+        f"{contador['bytes'] / 1e6:9.2f} MB  {contador['consultas']:6d} consultas"
+    )
+
+
+async def main(num_sockets: int):
+    engine, Session = preparar_base_de_datos()
+    websocket_manager.SessionLocal = Session
+    print(f"{num_sockets} conexiones simuladas")
+    await medir("rebroadcast global", lambda m, ws: conectar_como_antes(m, ws, Session), num_sockets, engine)
+    await medir("instantánea por socket", _conectar, num_sockets, engine)
+
+
+async def _conectar(manager, websocket):
+    await manager.connect(websocket)
+    await manager.send_queue_snapshot(websocket)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,182 @@
+"""
+Trabajador persistente de separación de voces con Demucs.
+
+`ia_scorer._separate_vocals_with_demucs` lanzaba `python -m demucs` por cada
+canción: arrancar el intérprete, importar torch y cargar htdemucs costaba varios
+segundos antes de separar nada. Ahora un proceso de larga duración, arrancado con
+la aplicación, carga el modelo una sola vez y atiende trabajos por una conexión
+local (`multiprocessing.connection`, con clave de autenticación). Los procesos
+del pool de puntuación y de la precarga se conectan como clientes; los trabajos
+se atienden de uno en uno y torch se limita a DEMUCS_HILOS hilos para no dejar sin
+CPU al servidor web.
+
+Si el trabajador no está disponible, `separar` devuelve None y ia_scorer vuelve
+al subproceso de siempre.
+"""
+import importlib.util
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import Client, Listener
+from typing import Callable, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MODELO = "htdemucs"
+
+
+def _direccion() -> Tuple[str, int]:
+    host, _, puerto = config.settings.DEMUCS_DIRECCION.rpartition(":")
+    return host or "127.0.0.1", int(puerto)
+
+
+def _clave() -> bytes:
+    return config.settings.DEMUCS_CLAVE.encode()
+
+
+def ruta_vocales(audio_path: str, output_dir: str) -> str:
+    """Misma ruta que genera `python -m demucs --two-stems vocals -o output_dir`."""
+    base_name = os.path.splitext(os.path.basename(audio_path))[0]
+    return os.path.join(output_dir, MODELO, base_name, "vocals.wav")
+
+
+def _cargar_htdemucs(hilos: int) -> Callable[[str, str], str]:
+    """Carga el modelo y devuelve la función que separa un archivo (solo en el proceso trabajador)."""
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import AudioFile, save_audio
+    from demucs.pretrained import get_model
+
+    torch.set_num_threads(hilos)
+    modelo = get_model(MODELO)
+    modelo.cpu()
+    modelo.eval()
+
+    def separar(audio_path: str, output_dir: str) -> str:
+        # Mismo preproceso que demucs.separate: normalizar, separar y deshacer la normalización
+        wav = AudioFile(audio_path).read(streams=0, samplerate=modelo.samplerate, channels=modelo.audio_channels)
+        ref = wav.mean(0)
+        wav = (wav - ref.mean()) / ref.std()
+        with torch.no_grad():
+            fuentes = apply_model(modelo, wav[None], device="cpu", split=True, overlap=0.25, progress=False)[0]
+        fuentes = fuentes * ref.std() + ref.mean()
+        destino = ruta_vocales(audio_path, output_dir)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        save_audio(fuentes[modelo.sources.index("vocals")], destino, modelo.samplerate)
+        return destino
+
+    return separar
+
+
+def servir(direccion: Tuple[str, int], clave: bytes, hilos: int,
+           cargar_modelo: Callable[[int], Callable[[str, str], str]] = _cargar_htdemucs,
+           listo=None):
+    """
+    Bucle del trabajador: carga el modelo y atiende un trabajo por conexión,
+    en orden de llegada. Cada trabajo es (audio_path, output_dir) y la respuesta
+    ("ok", ruta_vocales) o ("error", mensaje).
+    """
+    os.environ.setdefault("OMP_NUM_THREADS", str(hilos))
+    separar = cargar_modelo(hilos)
+    with Listener(direccion, authkey=clave) as listener:
+        if listo is not None:
+            listo.set()
+        while True:
+            try:
+                conexion = listener.accept()
+            except Exception as e:
+                logger.error(f"Conexión rechazada por el trabajador de Demucs: {e}")
+                continue
+            with conexion:
+                try:
+                    trabajo = conexion.recv()
+                    if trabajo is None:  # Orden de parada
+                        return
+                    audio_path, output_dir = trabajo
+                    conexion.send(("ok", separar(audio_path, output_dir)))
+                except EOFError:
+                    continue
+                except Exception as e:
+                    logger.error(f"Error separando vocales en el trabajador de Demucs: {e}")
+                    try:
+                        conexion.send(("error", str(e)))
+                    except Exception:
+                        pass
+
+
+def _servir_en_proceso(direccion, clave, hilos):
+    logging.basicConfig(level=logging.INFO)
+    servir(direccion, clave, hilos)
+
+
+class TrabajadorDemucs:
+    """Arranca y detiene el proceso trabajador desde la aplicación."""
+
+    def __init__(self):
+        self._proceso: Optional[multiprocessing.Process] = None
+
+    def iniciar(self) -> bool:
+        if self._proceso is not None and self._proceso.is_alive():
+            return True
+        if not config.settings.DEMUCS_TRABAJADOR:
+            return False
+        if importlib.util.find_spec("demucs") is None:
+            logger.warning("Demucs no está instalado: no se arranca el trabajador de separación")
+            return False
+        # spawn: el trabajador no hereda el estado del servidor (loop, conexiones a la base de datos)
+        contexto = multiprocessing.get_context("spawn")
+        self._proceso = contexto.Process(
+            target=_servir_en_proceso,
+            args=(_direccion(), _clave(), config.settings.DEMUCS_HILOS),
+            name="trabajador-demucs",
+            daemon=True,
+        )
+        self._proceso.start()
+        return True
+
+    def detener(self):
+        if self._proceso is None:
+            return
+        if self._proceso.is_alive():
+            try:
+                with Client(_direccion(), authkey=_clave()) as conexion:
+                    conexion.send(None)
+            except Exception:
+                pass
+            self._proceso.join(timeout=5)
+            if self._proceso.is_alive():
+                self._proceso.terminate()
+        self._proceso = None
+
+
+def separar(audio_path: str, output_dir: str, direccion: Optional[Tuple[str, int]] = None,
+            clave: Optional[bytes] = None, espera_conexion: float = 0.0) -> Optional[str]:
+    """
+    Pide una separación al trabajador. Devuelve la ruta de las vocales, o None si
+    el trabajador no está disponible o falló (quien llama usa el subproceso).
+    `espera_conexion` reintenta la conexión ese tiempo (p. ej. mientras carga el modelo).
+    """
+    direccion = direccion or _direccion()
+    clave = clave or _clave()
+    limite = time.monotonic() + espera_conexion
+    while True:
+        try:
+            conexion = Client(direccion, authkey=clave)
+            break
+        except (ConnectionRefusedError, FileNotFoundError):
+            if time.monotonic() >= limite:
+                return None
+            time.sleep(0.2)
+    with conexion:
+        conexion.send((os.path.abspath(audio_path), os.path.abspath(output_dir)))
+        estado, resultado = conexion.recv()
+    if estado != "ok":
+        logger.error(f"El trabajador de Demucs no pudo separar {audio_path}: {resultado}")
+        return None
+    return resultado
+
+
+trabajador = TrabajadorDemucs()
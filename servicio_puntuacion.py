@@ -0,0 +1,448 @@
+"""
+Servicio de puntuación por IA en procesos aparte, con cola persistente.
+
+`ia_scorer.calculate_score` descarga el audio con yt-dlp, separa la voz con
+Demucs y analiza el pitch con librosa: puede tardar minutos. Antes se llamaba
+dentro de `marcar_cancion_actual_como_cantada`, en el loop de eventos, y
+congelaba todas las peticiones HTTP y WebSocket. Ahora la canción se marca como
+cantada al instante (con `puntuacion_ia` a None mientras se calcula) y el
+cálculo se envía a un `ProcessPoolExecutor`. Al terminar se guardan
+`Cancion.puntuacion_ia` y los puntos del usuario y se emite `song_scored`.
+
+Cada puntuación es una fila de `scoring_jobs` (`models.TrabajoPuntuacion`), así
+que un reinicio (reset_night reinicia el servidor a propósito) no pierde el
+trabajo pendiente:
+
+- estados: en_cola -> en_curso -> hecho | fallido;
+- un trabajador reclama un trabajo con un UPDATE condicional y una concesión
+  (`lease_hasta`) que renueva mientras calcula; si el proceso muere, la
+  concesión vence y otro trabajador (o el mismo tras reiniciar) lo retoma;
+- los fallos (p. ej. una descarga de YouTube que falla) se reintentan con
+  espera exponencial hasta PUNTUACION_IA_INTENTOS intentos;
+- prioridad: antes se puntúa a quien tiene su próximo turno más cerca en la
+  cola, para que vea su puntaje antes de volver a cantar;
+- la grabación del cantante se borra cuando el trabajo termina (hecho o fallido).
+
+Todo el trabajo con `scoring_jobs` (encolar, reclamar, renovar concesiones y
+guardar el resultado) se hace en un hilo (`asyncio.to_thread`), nunca en el
+event loop; en el loop solo quedan las tareas y los avisos.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import joinedload
+
+import cache_pitch
+import cola_justa
+import config
+import crud
+import models
+from database import SessionLocal
+from timezone_utils import now_bogota
+
+logger = logging.getLogger(__name__)
+
+# Mismos directorios que ia_scorer.TEMP_DIR y PROCESSED_DIR. No importamos ia_scorer en
+# el proceso del servidor para no cargar librosa y yt-dlp: solo lo importan los procesos del pool.
+DIRECTORIO_GRABACIONES = "temp_audio"
+DIRECTORIO_PROCESADAS = "processed_songs"
+
+PRIORIDAD_SIN_TURNO = 1000    # Cantantes sin más canciones en cola
+VENTANA_PRIORIDAD = 50        # Canciones aprobadas que se miran para calcular la prioridad
+REVISION_SEGUNDOS = 15        # Cada cuánto se buscan reintentos y concesiones vencidas
+ESPERA_REINTENTO_SEGUNDOS = 30
+
+
+def ruta_grabacion(cancion_id: int) -> str:
+    """Ruta donde el frontend sube la grabación del cantante para una canción."""
+    return os.path.join(DIRECTORIO_GRABACIONES, f"user_recording_{cancion_id}.wav")
+
+
+def borrar_grabacion(ruta_audio: Optional[str]):
+    """
+    Borra una grabación de cantante (`user_recording_*`) que ya no hace falta:
+    la canción ya tiene su puntuación guardada o no se va a puntuar.
+    """
+    if not ruta_audio or not os.path.basename(ruta_audio).startswith("user_recording_"):
+        return
+    try:
+        os.remove(ruta_audio)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"No se pudo borrar la grabación {ruta_audio}: {e}")
+
+
+def ruta_pitch_original(youtube_id: str) -> str:
+    """Caché del pitch de la voz original que genera ia_scorer._get_original_vocals_pitch."""
+    return cache_pitch.ruta(youtube_id, DIRECTORIO_PROCESADAS)
+
+
+def _calcular_puntuacion(youtube_id: str, ruta_audio: str) -> int:
+    """Se ejecuta en un proceso del pool."""
+    import ia_scorer
+    # Sin la voz original (descarga o Demucs fallidos) calculate_score daría 0:
+    # lanzamos para que el trabajo se reintente
+    if ia_scorer._get_original_vocals_pitch(youtube_id) is None:
+        raise RuntimeError(f"No se pudo obtener el pitch original de {youtube_id}")
+    return ia_scorer.calculate_score(youtube_id, ruta_audio)
+
+
+async def _broadcast_puntuacion(cancion: models.Cancion):
+    import websocket_manager
+    await websocket_manager.manager.broadcast_song_scored(cancion)
+
+
+def _ahora() -> datetime.datetime:
+    # SQLite devuelve fechas sin zona horaria (hora de Bogotá): comparamos sin zona
+    return now_bogota().replace(tzinfo=None)
+
+
+class ServicioPuntuacion:
+    """
+    Drena `scoring_jobs` con concurrencia limitada y guarda el resultado al terminar.
+    `executor`, `calcular` y `reloj` se pueden sustituir (p. ej. un pool de hilos en las pruebas).
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        procesos: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        calcular: Callable[[str, str], int] = _calcular_puntuacion,
+        al_puntuar: Optional[Callable[[models.Cancion], Awaitable]] = _broadcast_puntuacion,
+        reloj: Callable[[], datetime.datetime] = _ahora,
+    ):
+        self.session_factory = session_factory
+        self.procesos = procesos or config.settings.PUNTUACION_IA_PROCESOS
+        self.intentos_maximos = config.settings.PUNTUACION_IA_INTENTOS
+        self.concesion = datetime.timedelta(seconds=config.settings.PUNTUACION_IA_CONCESION_SEGUNDOS)
+        self._executor = executor
+        self.calcular = calcular
+        self.al_puntuar = al_puntuar
+        self.reloj = reloj
+        self.nombre = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.pendientes: Dict[int, asyncio.Task] = {}  # trabajo_id -> cálculo en curso en este proceso
+        self._hay_trabajo: Optional[asyncio.Event] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._reclamando = False  # Reclamo en curso en un hilo: sus trabajos aún no están en `pendientes`
+
+        # Métricas de este proceso
+        self.enviadas = 0
+        self.completadas = 0
+        self.reintentadas = 0
+        self.fallidas = 0
+
+    def _pool(self) -> Executor:
+        # El pool se crea al primer uso: arrancar procesos tiene coste y muchas noches nadie sube audio
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.procesos)
+        return self._executor
+
+    # --- Encolado ---
+
+    def _prioridad(self, db, cancion_id: int) -> int:
+        """Posición en la cola aprobada del próximo turno del mismo cantante."""
+        usuario_id = db.query(models.Cancion.usuario_id).filter(models.Cancion.id == cancion_id).scalar()
+        ids = cola_justa.motor_para(db).ids_en_orden(db, "aprobado", VENTANA_PRIORIDAD)
+        if usuario_id is None or not ids:
+            return PRIORIDAD_SIN_TURNO
+        duenos = dict(db.query(models.Cancion.id, models.Cancion.usuario_id).filter(models.Cancion.id.in_(ids)))
+        for posicion, id_en_cola in enumerate(ids):
+            if duenos.get(id_en_cola) == usuario_id:
+                return posicion
+        return PRIORIDAD_SIN_TURNO
+
+    async def enviar(self, cancion_id: int, youtube_id: str, ruta_audio: str) -> int:
+        """Encola la puntuación de una canción ya cantada y despierta al trabajador. Devuelve el id del trabajo."""
+        trabajo_id = await asyncio.to_thread(self._encolar, cancion_id, youtube_id, ruta_audio)
+        self.enviadas += 1
+        if self._tarea is None:
+            self.iniciar()
+        self._despertar()
+        return trabajo_id
+
+    def _encolar(self, cancion_id: int, youtube_id: str, ruta_audio: str) -> int:
+        db = self.session_factory()
+        try:
+            trabajo = models.TrabajoPuntuacion(
+                cancion_id=cancion_id,
+                youtube_id=youtube_id,
+                ruta_audio=ruta_audio,
+                estado="en_cola",
+                prioridad=self._prioridad(db, cancion_id),
+                disponible_desde=self.reloj(),
+            )
+            db.add(trabajo)
+            db.commit()
+            return trabajo.id
+        finally:
+            db.close()
+
+    # --- Reclamo y concesiones ---
+
+    def _disponibles(self, ahora: datetime.datetime):
+        T = models.TrabajoPuntuacion
+        return or_(
+            and_(T.estado == "en_cola", T.disponible_desde <= ahora),
+            # Concesión vencida: el trabajador que lo tenía murió o se colgó
+            and_(T.estado == "en_curso", T.lease_hasta < ahora),
+        )
+
+    def _reclamar(self, db) -> Optional[models.TrabajoPuntuacion]:
+        """Reclama el trabajo disponible más prioritario. El UPDATE condicional garantiza un solo dueño."""
+        T = models.TrabajoPuntuacion
+        ahora = self.reloj()
+        candidatos = (
+            db.query(T.id, T.intentos).filter(self._disponibles(ahora))
+            .order_by(T.prioridad, T.id).limit(self.procesos + 5).all()
+        )
+        for trabajo_id, intentos in candidatos:
+            if intentos >= self.intentos_maximos:
+                # Retomado tras agotar los intentos (el proceso murió en el último): se da por fallido
+                agotado = db.query(T).filter(T.id == trabajo_id, self._disponibles(ahora)).update(
+                    {T.estado: "fallido", T.error: "Intentos agotados", T.finished_at: ahora, T.lease_hasta: None},
+                    synchronize_session=False,
+                )
+                ruta_audio = None
+                if agotado:
+                    self.fallidas += 1
+                    trabajo = db.get(T, trabajo_id)
+                    ruta_audio = trabajo.ruta_audio
+                    crud.registrar_puntuacion_ia(db, trabajo.cancion_id, 0)
+                db.commit()
+                borrar_grabacion(ruta_audio)
+                continue
+            reclamado = db.query(T).filter(T.id == trabajo_id, self._disponibles(ahora)).update(
+                {
+                    T.estado: "en_curso",
+                    T.trabajador: self.nombre,
+                    T.lease_hasta: ahora + self.concesion,
+                    T.intentos: T.intentos + 1,
+                    T.started_at: ahora,
+                },
+                synchronize_session=False,
+            )
+            db.commit()
+            if reclamado:
+                return db.get(T, trabajo_id)
+        return None
+
+    async def _renovar_concesion(self, trabajo_id: int):
+        while True:
+            await asyncio.sleep(self.concesion.total_seconds() / 3)
+            try:
+                if not await asyncio.to_thread(self._renovar, trabajo_id):
+                    logger.warning(f"Se perdió la concesión del trabajo de puntuación {trabajo_id}")
+                    return
+            except Exception:
+                logger.exception(f"Error al renovar la concesión del trabajo de puntuación {trabajo_id}")
+
+    def _renovar(self, trabajo_id: int) -> bool:
+        T = models.TrabajoPuntuacion
+        db = self.session_factory()
+        try:
+            renovada = db.query(T).filter(T.id == trabajo_id, T.trabajador == self.nombre).update(
+                {T.lease_hasta: self.reloj() + self.concesion}, synchronize_session=False
+            )
+            db.commit()
+            return bool(renovada)
+        finally:
+            db.close()
+
+    # --- Ejecución ---
+
+    async def _ejecutar(self, trabajo_id: int, cancion_id: int, youtube_id: str, ruta_audio: str):
+        loop = asyncio.get_running_loop()
+        renovacion = loop.create_task(self._renovar_concesion(trabajo_id))
+        error = None
+        try:
+            puntuacion = await loop.run_in_executor(self._pool(), self.calcular, youtube_id, ruta_audio)
+        except Exception as e:
+            logger.exception(f"Error al calcular la puntuación de la canción {cancion_id}")
+            error = e
+        finally:
+            renovacion.cancel()
+
+        try:
+            cancion = await asyncio.to_thread(
+                self._guardar_resultado, trabajo_id, cancion_id, ruta_audio,
+                None if error is not None else puntuacion, error,
+            )
+            if cancion is not None and self.al_puntuar:
+                await self.al_puntuar(cancion)
+        except Exception:
+            logger.exception(f"Error al guardar la puntuación de la canción {cancion_id}")
+
+    def _guardar_resultado(self, trabajo_id: int, cancion_id: int, ruta_audio: str,
+                           puntuacion: Optional[int], error: Optional[Exception]) -> Optional[models.Cancion]:
+        """Guarda el resultado (o programa el reintento). Devuelve la canción puntuada que hay que anunciar."""
+        db = self.session_factory()
+        try:
+            trabajo = db.get(models.TrabajoPuntuacion, trabajo_id)
+            if trabajo is None or trabajo.trabajador != self.nombre or trabajo.estado != "en_curso":
+                # Otro trabajador lo retomó mientras tanto: su resultado es el que vale
+                return None
+            if error is None:
+                self.completadas += 1
+                trabajo.estado = "hecho"
+                trabajo.puntuacion = puntuacion
+                trabajo.finished_at = self.reloj()
+                trabajo.lease_hasta = None
+                crud.registrar_puntuacion_ia(db, cancion_id, puntuacion)
+                db.commit()  # Por si la canción ya no existe (registrar no llega a confirmar)
+                borrar_grabacion(ruta_audio)
+            elif trabajo.intentos < self.intentos_maximos:
+                self.reintentadas += 1
+                espera = ESPERA_REINTENTO_SEGUNDOS * 2 ** (trabajo.intentos - 1)
+                trabajo.estado = "en_cola"
+                trabajo.error = str(error)
+                trabajo.trabajador = None
+                trabajo.lease_hasta = None
+                trabajo.disponible_desde = self.reloj() + datetime.timedelta(seconds=espera)
+                db.commit()
+                return None
+            else:
+                self._finalizar_fallido(db, trabajo_id, str(error))
+            # El aviso se emite en el loop, con la sesión ya cerrada: cargamos lo que lee
+            return (
+                db.query(models.Cancion)
+                .options(joinedload(models.Cancion.usuario).joinedload(models.Usuario.mesa))
+                .filter(models.Cancion.id == cancion_id).first()
+            )
+        finally:
+            db.close()
+
+    def _finalizar_fallido(self, db, trabajo_id: int, error: str):
+        """Sin más intentos la canción se queda con 0 puntos de IA, como antes de la cola."""
+        self.fallidas += 1
+        trabajo = db.get(models.TrabajoPuntuacion, trabajo_id)
+        trabajo.estado = "fallido"
+        trabajo.error = error
+        trabajo.finished_at = self.reloj()
+        trabajo.lease_hasta = None
+        ruta_audio = trabajo.ruta_audio
+        crud.registrar_puntuacion_ia(db, trabajo.cancion_id, 0)
+        db.commit()
+        borrar_grabacion(ruta_audio)
+
+    async def drenar(self) -> int:
+        """Reclama trabajos hasta llenar la concurrencia. Devuelve cuántos arrancó."""
+        self._reclamando = True
+        try:
+            trabajos = await asyncio.to_thread(self._reclamar_varios, self.procesos - len(self.pendientes))
+        finally:
+            self._reclamando = False
+        for trabajo in trabajos:
+            tarea = asyncio.create_task(self._ejecutar(*trabajo))
+            self.pendientes[trabajo[0]] = tarea
+            tarea.add_done_callback(lambda _, trabajo_id=trabajo[0]: self._terminado(trabajo_id))
+        return len(trabajos)
+
+    def _reclamar_varios(self, cuantos: int) -> List[tuple]:
+        """Reclama hasta `cuantos` trabajos: (id, cancion_id, youtube_id, ruta_audio) de cada uno."""
+        trabajos = []
+        db = self.session_factory()
+        try:
+            while len(trabajos) < cuantos:
+                trabajo = self._reclamar(db)
+                if trabajo is None:
+                    break
+                # Se lee ya: el commit del siguiente reclamo lo expira
+                trabajos.append((trabajo.id, trabajo.cancion_id, trabajo.youtube_id, trabajo.ruta_audio))
+        finally:
+            db.close()
+        return trabajos
+
+    def _terminado(self, trabajo_id: int):
+        self.pendientes.pop(trabajo_id, None)
+        # Hay un hueco libre (o un reintento programado): buscamos el siguiente
+        self._despertar()
+
+    def _despertar(self):
+        if self._hay_trabajo is not None:
+            self._hay_trabajo.set()
+
+    # --- Bucle ---
+
+    async def ejecutar(self):
+        while True:
+            self._hay_trabajo.clear()
+            try:
+                await self.drenar()
+            except Exception:
+                logger.exception("Error al reclamar trabajos de puntuación")
+            try:
+                await asyncio.wait_for(self._hay_trabajo.wait(), REVISION_SEGUNDOS)
+            except asyncio.TimeoutError:
+                pass
+
+    def iniciar(self):
+        """Arranca el trabajador en el loop actual; retoma lo que quedó en cola antes de reiniciar."""
+        if self._tarea is None:
+            self._hay_trabajo = asyncio.Event()
+            self._tarea = asyncio.create_task(self.ejecutar())
+        return self._tarea
+
+    def _hay_disponibles(self) -> bool:
+        db = self.session_factory()
+        try:
+            return db.query(models.TrabajoPuntuacion.id).filter(self._disponibles(self.reloj())).first() is not None
+        finally:
+            db.close()
+
+    async def esperar(self):
+        """Espera a que terminen las puntuaciones en curso y las que ya se pueden reclamar."""
+        while True:
+            if self.pendientes:
+                await asyncio.gather(*list(self.pendientes.values()), return_exceptions=True)
+            elif self._reclamando or await asyncio.to_thread(self._hay_disponibles):
+                self._despertar()
+                await asyncio.sleep(0.01)
+            elif not self.pendientes and not self._reclamando:
+                # (Mientras se consultaba pudo empezar un reclamo: entonces se vuelve a mirar)
+                return
+
+    def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def metricas(self) -> dict:
+        """Backlog de la cola persistente y rendimiento de la última hora."""
+        T = models.TrabajoPuntuacion
+        db = self.session_factory()
+        try:
+            por_estado = dict(db.query(T.estado, func.count(T.id)).group_by(T.estado))
+            hace_una_hora = self.reloj() - datetime.timedelta(hours=1)
+            hechos_hora = (
+                db.query(T.started_at, T.finished_at)
+                .filter(T.estado == "hecho", T.finished_at >= hace_una_hora).all()
+            )
+        finally:
+            db.close()
+        duraciones = [(fin - inicio).total_seconds() for inicio, fin in hechos_hora if inicio and fin]
+        return {
+            "pendientes": por_estado.get("en_cola", 0) + por_estado.get("en_curso", 0),
+            "por_estado": {estado: por_estado.get(estado, 0) for estado in ("en_cola", "en_curso", "hecho", "fallido")},
+            "en_curso_aqui": len(self.pendientes),
+            "completadas_ultima_hora": len(hechos_hora),
+            "segundos_medios_por_trabajo": round(sum(duraciones) / len(duraciones), 1) if duraciones else None,
+            "enviadas": self.enviadas,
+            "completadas": self.completadas,
+            "reintentadas": self.reintentadas,
+            "fallidas": self.fallidas,
+        }
+
+
+servicio = ServicioPuntuacion()
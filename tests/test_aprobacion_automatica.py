@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import crud
+import aprobacion_automatica
+from database import Base
+
+
+class RelojFalso:
+    def __init__(self):
+        self.ahora = datetime.datetime(2026, 1, 1, 21, 0, 0)
+        self.esperas = []
+
+    def __call__(self):
+        return self.ahora
+
+    async def dormir(self, segundos):
+        # Solo despierta cuando la prueba mueve el reloj
+        self.esperas.append(segundos)
+        await asyncio.Event().wait()
+
+    def avanzar(self, minutos):
+        self.ahora += datetime.timedelta(minutes=minutos)
+
+
+def preparar(directorio):
+    # En archivo: el programador consulta desde otro hilo (una base :memory: es una por conexión)
+    engine = create_engine(f"sqlite:///{directorio / 'aprobacion.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    mesa = models.Mesa(nombre="A", qr_code="A", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    return Session, db, usuario
+
+
+def pendiente(db, usuario, titulo, creada):
+    cancion = models.Cancion(titulo=titulo, youtube_id=titulo, usuario_id=usuario.id, estado="pendiente", created_at=creada)
+    db.add(cancion)
+    db.commit()
+    return cancion
+
+
+def estados(db):
+    db.expire_all()
+    return {c.titulo: c.estado for c in db.query(models.Cancion)}
+
+
+async def ceder(programador, limite=5.0):
+    """Espera a que el programador termine la pasada que acaba de despertarse (la hace en un hilo)."""
+    previas = programador.revisiones
+    fin = time.monotonic() + limite
+    while programador.revisiones == previas and time.monotonic() < fin:
+        await asyncio.sleep(0.001)
+
+
+def test_aprueba_al_vencer_con_reloj_falso(tmp_path):
+    reloj = RelojFalso()
+    Session, db, usuario = preparar(tmp_path)
+    emitidos = []
+
+    async def al_aprobar(aprobadas):
+        emitidos.append([c.titulo for c in aprobadas])
+
+    programador = aprobacion_automatica.ProgramadorAprobaciones(
+        session_factory=Session, reloj=reloj, dormir=reloj.dormir, al_aprobar=al_aprobar,
+    )
+
+    async def escenario():
+        pendiente(db, usuario, "P1", reloj())
+        programador.iniciar()
+        await ceder(programador)
+        resultados = {"espera_inicial": reloj.esperas[-1]}
+
+        # P2 llega con el programador en marcha: se programa vía observador
+        reloj.avanzar(3)
+        pendiente(db, usuario, "P2", reloj())
+        await ceder(programador)
+
+        reloj.avanzar(6)  # 21:09, nada vencido
+        programador.procesar_vencidas()
+        resultados["a_los_9"] = estados(db)
+
+        reloj.avanzar(1)  # 21:10, vence P1
+        programador._hay_cambios.set()
+        await ceder(programador)
+        resultados["a_los_10"] = estados(db)
+
+        reloj.avanzar(5)  # 21:15, P2 vencida pero sin cupo
+        programador._hay_cambios.set()
+        await ceder(programador)
+        resultados["sin_cupo"] = estados(db)
+
+        # Al empezar a sonar P1 se libera el cupo y P2 se aprueba sin ninguna lectura de la cola
+        crud.marcar_siguiente_como_reproduciendo(db)
+        await ceder(programador)
+        programador.detener()
+        return resultados
+
+    resultados = asyncio.run(escenario())
+
+    assert resultados["espera_inicial"] == 600
+    assert resultados["a_los_9"] == {"P1": "pendiente", "P2": "pendiente"}
+    assert resultados["a_los_10"] == {"P1": "aprobado", "P2": "pendiente"}
+    assert resultados["sin_cupo"] == {"P1": "aprobado", "P2": "pendiente"}
+    assert emitidos == [["P1"], ["P2"]]
+    assert estados(db) == {"P1": "reproduciendo", "P2": "aprobado"}
+
+
+def test_lectura_de_la_cola_no_aprueba(tmp_path):
+    reloj = RelojFalso()
+    Session, db, usuario = preparar(tmp_path)
+    pendiente(db, usuario, "P1", datetime.datetime(2000, 1, 1))
+    crud.get_cola_completa(db)
+    crud.get_cola_completa_con_lazy(db)
+    assert estados(db) == {"P1": "pendiente"}
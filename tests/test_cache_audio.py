@@ -0,0 +1,140 @@
+import os
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import cache_audio
+import cache_pitch
+import models
+from database import Base
+
+
+def crear_cancion_en_cache(base, youtube_id, kb_pistas=100, kb_descarga=40):
+    descargas, procesadas = base / "temp_audio", base / "processed_songs"
+    (procesadas / "htdemucs" / youtube_id).mkdir(parents=True, exist_ok=True)
+    (procesadas / "htdemucs" / youtube_id / "vocals.wav").write_bytes(b"v" * kb_pistas * 1024)
+    descargas.mkdir(exist_ok=True)
+    (descargas / f"{youtube_id}.mp3").write_bytes(b"m" * kb_descarga * 1024)
+    serie = cache_pitch.SeriePitch(np.full(100, 60.0, dtype=np.float32), np.ones(100, dtype=bool), 20.0)
+    cache_pitch.guardar(youtube_id, serie, str(procesadas))
+
+
+def nuevo_cache(base, presupuesto_kb):
+    return cache_audio.CacheAudio(str(base / "temp_audio"), str(base / "processed_songs"), presupuesto_kb * 1024)
+
+
+def test_expulsa_primero_pistas_por_lru_y_respeta_las_fijadas(tmp_path):
+    for youtube_id in ("vieja", "media", "nueva"):
+        crear_cancion_en_cache(tmp_path, youtube_id)
+    (tmp_path / "temp_audio" / "user_recording_1.wav").write_bytes(b"u" * 1024)
+    cache = nuevo_cache(tmp_path, presupuesto_kb=300)
+    for youtube_id in ("vieja", "media", "nueva"):
+        cache.registrar_acceso(youtube_id)
+        time.sleep(0.01)
+
+    # 3 x (100 + 40 + pitch) KB: basta con quitar las pistas de las dos menos usadas,
+    # pero "vieja" está en cola y se salta
+    expulsadas = cache.recortar(fijadas={"vieja"})
+
+    pistas = tmp_path / "processed_songs" / "htdemucs"
+    assert expulsadas == {"pistas": 2, "descargas": 0, "pitch": 0}
+    assert (pistas / "vieja").exists()
+    assert not (pistas / "media").exists() and not (pistas / "nueva").exists()
+    assert all(cache_pitch.existe(y, str(tmp_path / "processed_songs")) for y in ("vieja", "media", "nueva"))
+    assert (tmp_path / "temp_audio" / "user_recording_1.wav").exists()
+    assert cache.estadisticas()["tamano_bytes"] <= 300 * 1024
+
+
+def test_sin_espacio_llega_al_pitch_y_cuenta_aciertos_y_expulsiones(tmp_path):
+    crear_cancion_en_cache(tmp_path, "a")
+    crear_cancion_en_cache(tmp_path, "b")
+    cache = nuevo_cache(tmp_path, presupuesto_kb=0)
+    cache.registrar_acceso("a", acierto=True)
+    cache.registrar_acceso("b", acierto=False)
+
+    cache.recortar(fijadas={"b"})
+
+    procesadas = str(tmp_path / "processed_songs")
+    assert not cache_pitch.existe("a", procesadas)
+    assert not os.path.exists(os.path.join(procesadas, "a_pitch.meta.json"))
+    assert cache_pitch.existe("b", procesadas)
+    estadisticas = cache.estadisticas()
+    assert estadisticas["aciertos"] == 1 and estadisticas["fallos"] == 1
+    assert estadisticas["tasa_aciertos"] == 0.5
+    assert estadisticas["expulsiones"] == {"pistas": 1, "descargas": 1, "pitch": 1}
+    assert estadisticas["por_categoria"]["pitch"]["entradas"] == 1
+
+
+def test_recortar_con_cola_fija_las_canciones_pendientes(tmp_path):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    mesa = models.Mesa(nombre="Mesa 1", qr_code="qr-1", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    db.add_all([
+        models.Cancion(titulo="En cola", youtube_id="cola", usuario_id=usuario.id, estado="aprobado"),
+        models.Cancion(titulo="Cantada", youtube_id="cantada", usuario_id=usuario.id, estado="cantada"),
+    ])
+    db.commit()
+    crear_cancion_en_cache(tmp_path, "cola")
+    crear_cancion_en_cache(tmp_path, "cantada")
+
+    nuevo_cache(tmp_path, presupuesto_kb=0).recortar_con_cola(db)
+
+    assert cache_pitch.existe("cola", str(tmp_path / "processed_songs"))
+    assert not cache_pitch.existe("cantada", str(tmp_path / "processed_songs"))
+    db.close()
+
+
+def test_recortar_con_cola_fija_las_canciones_que_se_estan_puntuando(tmp_path):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    mesa = models.Mesa(nombre="Mesa 1", qr_code="qr-1", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    canciones = [
+        models.Cancion(titulo=youtube_id, youtube_id=youtube_id, usuario_id=usuario.id, estado="cantada")
+        for youtube_id in ("en_cola", "en_curso", "hecho")
+    ]
+    db.add_all(canciones)
+    db.commit()
+    db.add_all([
+        models.TrabajoPuntuacion(cancion_id=cancion.id, youtube_id=cancion.youtube_id, estado=cancion.youtube_id)
+        for cancion in canciones
+    ])
+    db.commit()
+    for cancion in canciones:
+        crear_cancion_en_cache(tmp_path, cancion.youtube_id)
+
+    nuevo_cache(tmp_path, presupuesto_kb=0).recortar_con_cola(db)
+
+    descargas, pistas = tmp_path / "temp_audio", tmp_path / "processed_songs" / "htdemucs"
+    for youtube_id in ("en_cola", "en_curso"):
+        assert (descargas / f"{youtube_id}.mp3").exists() and (pistas / youtube_id).exists()
+    assert not (descargas / "hecho.mp3").exists() and not (pistas / "hecho").exists()
+    db.close()
+
+
+def test_recortar_tolera_archivos_que_desaparecen(tmp_path, monkeypatch):
+    crear_cancion_en_cache(tmp_path, "a")
+    cache = nuevo_cache(tmp_path, presupuesto_kb=0)
+    entradas = cache.entradas()
+    # Otro proceso borra la descarga entre el inventario y el recorte
+    monkeypatch.setattr(cache, "entradas", lambda: entradas + [
+        ("descargas", "borrada", [str(tmp_path / "temp_audio" / "borrada.mp3")]),
+    ])
+
+    expulsadas = cache.recortar()
+
+    assert expulsadas["pistas"] == 1
+    assert not cache_pitch.existe("a", str(tmp_path / "processed_songs"))
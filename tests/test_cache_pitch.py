@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+
+import cache_pitch
+
+
+def test_nota_a_midi():
+    assert cache_pitch.nota_a_midi("A4") == 69
+    assert cache_pitch.nota_a_midi("C#4") == 61
+    assert cache_pitch.nota_a_midi("C♯4") == 61
+    assert cache_pitch.nota_a_midi("Db4") == 61
+    assert cache_pitch.nota_a_midi("C-1") == 0
+    assert cache_pitch.nota_a_midi("nada") is None
+
+
+def test_guardar_y_cargar_con_mmap(tmp_path):
+    f0 = np.array([440.0, np.nan, 261.63, 0.0, 466.16])
+    serie = cache_pitch.desde_frecuencias(f0, None, 86.1)
+    cache_pitch.guardar("abc", serie, str(tmp_path))
+
+    cargada = cache_pitch.cargar("abc", str(tmp_path))
+    assert isinstance(cargada.midi, np.memmap)
+    assert cargada.frame_rate == 86.1
+    assert cargada.sonoro.tolist() == [True, False, True, False, True]
+    assert cargada.notas().tolist() == [69, 60, 70]
+    assert cache_pitch.cargar("otra", str(tmp_path)) is None
+
+
+def test_migrar_json_conserva_las_notas(tmp_path):
+    original = ["C4", "D4", "E4", "F♯4", "G4", "A4"]
+    (tmp_path / "orig_pitch.json").write_text(json.dumps(original))
+    (tmp_path / "roto_pitch.json").write_text("{no es json")
+
+    resultado = cache_pitch.migrar_json(str(tmp_path))
+    assert resultado == {"convertidas": 1, "ya_migradas": 0, "errores": 1}
+    assert cache_pitch.migrar_json(str(tmp_path))["ya_migradas"] == 1
+
+    serie_original = cache_pitch.cargar("orig", str(tmp_path))
+    assert serie_original.notas().tolist() == [60, 62, 64, 66, 67, 69]
+    assert serie_original.frame_rate == 0
@@ -0,0 +1,239 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import cache_pitch
+import canciones
+import canto_en_vivo
+import models
+import servicio_puntuacion
+import websocket_manager
+from database import Base
+
+SR = 16000
+NOTAS = [57, 59, 60, 62, 64, None, 62, 60, 59, 57] * 3  # MIDI; None = silencio
+SEGUNDOS_POR_NOTA = 0.5
+
+
+def tonos(notas, desafinar=0.0):
+    """Audio sintético: un tono puro por nota (con armónico, como una voz sencilla)."""
+    t = np.arange(int(SR * SEGUNDOS_POR_NOTA)) / SR
+    partes = []
+    for nota in notas:
+        if nota is None:
+            partes.append(np.zeros(len(t)))
+            continue
+        f = 440.0 * 2 ** ((nota + desafinar - 69) / 12)
+        partes.append(0.5 * np.sin(2 * np.pi * f * t) + 0.2 * np.sin(4 * np.pi * f * t))
+    return np.concatenate(partes)
+
+
+def referencia(notas):
+    fps = 44100 / 512
+    por_nota = int(SEGUNDOS_POR_NOTA * fps)
+    midi = np.repeat([n or 0 for n in notas], por_nota).astype(np.float32)
+    sonoro = np.repeat([n is not None for n in notas], por_nota)
+    return cache_pitch.SeriePitch(midi, sonoro, fps)
+
+
+@pytest.fixture(autouse=True)
+def sin_reproduccion(monkeypatch):
+    # Sin órdenes de otros tests al player: la posición sale de started_at
+    monkeypatch.setattr(websocket_manager.manager, "reproduccion", None)
+
+
+def en_trozos(audio, tamano=1234):
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+    return [pcm[i:i + tamano * 2] for i in range(0, len(pcm), tamano * 2)]
+
+
+def test_estimador_por_trozos_igual_que_de_una_vez():
+    audio = tonos(NOTAS)
+    de_una_vez = canto_en_vivo.EstimadorPitch(SR).procesar(audio.astype(np.float32))
+    estimador = canto_en_vivo.EstimadorPitch(SR)
+    partes = [estimador.procesar(audio[i:i + 777].astype(np.float32)) for i in range(0, len(audio), 777)]
+    midi = np.concatenate([p[0] for p in partes])
+    sonoro = np.concatenate([p[1] for p in partes])
+    assert np.array_equal(sonoro, de_una_vez[1])
+    assert np.allclose(midi, de_una_vez[0], atol=1e-3)
+    # A mitad de la primera nota se detecta A3 (57)
+    mitad = int(0.25 * estimador.frame_rate)
+    assert sonoro[mitad] and abs(midi[mitad] - 57) < 0.2
+
+
+def preparar():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    mesa = models.Mesa(nombre="A", qr_code="A", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id, puntos=10)
+    db.add(usuario)
+    db.commit()
+    return Session, db, usuario
+
+
+def test_sesion_en_vivo_da_avisos_y_puntuacion_final(tmp_path):
+    Session, db, usuario = preparar()
+    cancion = models.Cancion(titulo="C1", youtube_id="Y1", usuario_id=usuario.id, estado="cantada")
+    desafinada = models.Cancion(titulo="C2", youtube_id="Y1", usuario_id=usuario.id, estado="cantada")
+    db.add_all([cancion, desafinada])
+    db.commit()
+    cache_pitch.guardar("Y1", referencia(NOTAS), str(tmp_path))
+
+    avisos, puntuadas = [], []
+
+    async def al_avisar(aviso):
+        avisos.append(aviso)
+
+    async def al_puntuar(c):
+        puntuadas.append((c.id, c.puntuacion_ia))
+
+    gestor = canto_en_vivo.GestorCanto(
+        session_factory=Session, directorio_cache=str(tmp_path), guardar_wav=False,
+        al_avisar=al_avisar, al_puntuar=al_puntuar,
+    )
+
+    async def cantar(c, audio):
+        gestor.abrir(c, SR)
+        for trozo in en_trozos(audio):
+            await gestor.recibir(c.id, trozo)
+        return await gestor.finalizar(c.id)
+
+    bien = asyncio.run(cantar(cancion, tonos(NOTAS)))
+    mal = asyncio.run(cantar(desafinada, tonos(NOTAS, desafinar=6)))
+
+    assert len(avisos) >= 2 * 14  # Uno por segundo de audio
+    assert avisos[5]["precision_reciente"] >= 90
+    assert bien.afinacion >= 90 and bien.cobertura >= 90
+    assert mal.afinacion <= 10
+    assert puntuadas == [(cancion.id, bien.total), (desafinada.id, mal.total)]
+    assert not gestor.activa(cancion.id)
+    db.expire_all()
+    assert usuario.puntos == 10 + bien.total + mal.total
+
+
+def test_play_de_otra_cancion_cierra_y_puntua_la_sesion(tmp_path, monkeypatch):
+    async def nada(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(websocket_manager.manager, "broadcast_queue_update", nada)
+    monkeypatch.setattr(websocket_manager.manager, "broadcast_play_song", nada)
+    Session, db, usuario = preparar()
+    sonando = models.Cancion(titulo="C1", youtube_id="Y1", usuario_id=usuario.id, estado="reproduciendo")
+    otra = models.Cancion(titulo="C2", youtube_id="Y2", usuario_id=usuario.id, estado="aprobado")
+    db.add_all([sonando, otra])
+    db.commit()
+    cache_pitch.guardar("Y1", referencia(NOTAS), str(tmp_path))
+    puntuadas = []
+
+    async def al_puntuar(c):
+        puntuadas.append((c.id, c.puntuacion_ia))
+
+    gestor = canto_en_vivo.GestorCanto(
+        session_factory=Session, directorio_cache=str(tmp_path), guardar_wav=False,
+        al_avisar=None, al_puntuar=al_puntuar,
+    )
+
+    async def escenario():
+        gestor.iniciar()
+        gestor.abrir(sonando, SR)
+        trozos = en_trozos(tonos(NOTAS))
+        for trozo in trozos[:-1]:
+            assert await gestor.recibir(sonando.id, trozo)
+        # /play de otra canción marca la actual como 'cantada' sin pasar por avanzar_cola_automaticamente
+        await canciones.play_song_now(otra.id, db=db, api_key=None)
+        resultado = {"activa": gestor.activa(sonando.id), "acepta_audio": await gestor.recibir(sonando.id, trozos[-1])}
+        await asyncio.sleep(0)  # La puntuación se lanza en el loop desde el observador del commit
+        await asyncio.gather(*gestor._tareas)
+        gestor.detener()
+        return resultado
+
+    resultado = asyncio.run(escenario())
+
+    assert resultado == {"activa": False, "acepta_audio": False}
+    assert gestor.cantada_en_vivo(sonando.id)
+    assert len(puntuadas) == 1 and puntuadas[0][0] == sonando.id and puntuadas[0][1] >= 90
+    db.expire_all()
+    assert db.get(models.Cancion, sonando.id).puntuacion_ia == puntuadas[0][1]
+
+
+def test_la_grabacion_se_borra_al_puntuar_en_vivo_o_descartar(tmp_path, monkeypatch):
+    Session, db, usuario = preparar()
+    en_vivo = models.Cancion(titulo="C1", youtube_id="Y1", usuario_id=usuario.id, estado="cantada")
+    descartada = models.Cancion(titulo="C2", youtube_id="Y1", usuario_id=usuario.id, estado="rechazada")
+    sin_referencia = models.Cancion(titulo="C3", youtube_id="Y3", usuario_id=usuario.id, estado="cantada")
+    db.add_all([en_vivo, descartada, sin_referencia])
+    db.commit()
+    cache_pitch.guardar("Y1", referencia(NOTAS), str(tmp_path))
+    monkeypatch.setattr(servicio_puntuacion, "DIRECTORIO_GRABACIONES", str(tmp_path / "temp_audio"))
+    por_lotes = []
+
+    async def enviar(*args):
+        por_lotes.append(args)
+
+    monkeypatch.setattr(servicio_puntuacion.servicio, "enviar", enviar)
+
+    gestor = canto_en_vivo.GestorCanto(
+        session_factory=Session, directorio_cache=str(tmp_path), al_avisar=None, al_puntuar=None,
+    )
+
+    async def escenario():
+        for cancion in (en_vivo, descartada, sin_referencia):
+            gestor.abrir(cancion, SR)
+            for trozo in en_trozos(tonos(NOTAS[:4])):
+                await gestor.recibir(cancion.id, trozo)
+        await gestor.finalizar(en_vivo.id)
+        gestor.descartar(descartada.id)
+        await gestor.finalizar(sin_referencia.id)
+
+    asyncio.run(escenario())
+
+    assert not os.path.exists(servicio_puntuacion.ruta_grabacion(en_vivo.id))
+    assert not os.path.exists(servicio_puntuacion.ruta_grabacion(descartada.id))
+    # Sin referencia se puntúa por lotes: el servicio la borra al terminar el trabajo
+    ruta = servicio_puntuacion.ruta_grabacion(sin_referencia.id)
+    assert os.path.exists(ruta)
+    assert por_lotes == [(sin_referencia.id, "Y3", ruta)]
+
+
+def test_dispositivo_que_conecta_a_mitad_se_compara_con_esa_parte(tmp_path):
+    Session, db, usuario = preparar()
+    cancion = models.Cancion(titulo="C1", youtube_id="Y1", usuario_id=usuario.id, estado="cantada")
+    db.add(cancion)
+    db.commit()
+    cache_pitch.guardar("Y1", referencia(NOTAS), str(tmp_path))
+    avisos = []
+
+    async def al_avisar(aviso):
+        avisos.append(aviso)
+
+    posicion = [7.5]  # Conecta con la canción ya en la nota 15
+    gestor = canto_en_vivo.GestorCanto(
+        session_factory=Session, directorio_cache=str(tmp_path), guardar_wav=False,
+        al_avisar=al_avisar, al_puntuar=None, posicion=lambda c: posicion[0],
+    )
+
+    async def escenario():
+        gestor.abrir(cancion, SR)
+        for trozo in en_trozos(tonos(NOTAS[15:20])):
+            await gestor.recibir(cancion.id, trozo)
+        # Se corta y reconecta dos notas después: ese hueco no se cantó
+        posicion[0] = 11.5
+        gestor.abrir(cancion, SR)
+        for trozo in en_trozos(tonos(NOTAS[23:])):
+            await gestor.recibir(cancion.id, trozo)
+        return await gestor.finalizar(cancion.id)
+
+    desglose = asyncio.run(escenario())
+
+    assert 8 <= avisos[0]["segundos"] < 9
+    assert avisos[-1]["segundos"] >= 14
+    assert avisos[-1]["precision"] >= 90
+    assert desglose.afinacion >= 90
@@ -0,0 +1,258 @@
+import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import models
+import crud
+import cola_justa
+import schemas
+from database import Base
+
+
+def make_session():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def crear_mesa(db, nombre, consumo):
+    mesa = models.Mesa(nombre=nombre, qr_code=nombre, is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick=f"user_{nombre}", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    if consumo:
+        db.add(models.Consumo(cantidad=1, valor_total=consumo, mesa_id=mesa.id, usuario_id=usuario.id))
+        db.commit()
+        crud.reconciliar_totales_consumo(db)
+    return usuario
+
+
+def crear_cancion(db, titulo, usuario, estado="aprobado"):
+    cancion = models.Cancion(
+        titulo=titulo, youtube_id=f"yt_{titulo}", usuario_id=usuario.id,
+        estado=estado, duracion_seconds=100, created_at=datetime.datetime.now(),
+    )
+    db.add(cancion)
+    db.commit()
+    return cancion
+
+
+def titulos(canciones):
+    return [c.titulo for c in canciones]
+
+
+def orden_recalculado(db, estado="aprobado"):
+    """Orden calculado desde cero con un motor nuevo."""
+    motor = cola_justa.MotorColaJusta()
+    return motor.ids_en_orden(db, estado)
+
+
+def test_orden_justo_por_tiers():
+    db = make_session()
+    user_a = crear_mesa(db, "A", 200000)  # Oro
+    user_b = crear_mesa(db, "B", 100000)  # Plata
+    user_c = crear_mesa(db, "C", 10000)   # Bronce
+
+    for titulo in ["A1", "B1", "C1", "A2", "B2", "C2", "A3", "B3", "C3", "A4"]:
+        usuario = {"A": user_a, "B": user_b, "C": user_c}[titulo[0]]
+        crear_cancion(db, titulo, usuario)
+
+    expected = ["A1", "A2", "A3", "B1", "B2", "C1", "A4", "B3", "C2", "C3"]
+    assert titulos(crud.get_cola_priorizada(db)) == expected
+    assert titulos(crud.get_cola_priorizada(db, limite=4)) == expected[:4]
+
+
+def test_cambios_incrementales_equivalen_a_recalcular():
+    db = make_session()
+    user_a = crear_mesa(db, "A", 0)
+    user_b = crear_mesa(db, "B", 0)
+    crear_cancion(db, "A1", user_a)
+    crear_cancion(db, "B1", user_b)
+    crear_cancion(db, "A2", user_a)
+    lazy = crear_cancion(db, "B2", user_b, estado="pendiente_lazy")
+
+    # Primera lectura: carga el motor
+    assert titulos(crud.get_cola_priorizada(db)) == ["A1", "B1", "A2"]
+
+    # Un consumo sube a la mesa A a ORO
+    db.add(models.Consumo(cantidad=1, valor_total=200000, mesa_id=user_a.mesa_id, usuario_id=user_a.id))
+    crud.acumular_consumo_en_totales(db, user_a.mesa_id, None, 200000)
+    db.commit()
+    crear_cancion(db, "A3", user_a)
+    assert titulos(crud.get_cola_priorizada(db)) == ["A1", "A2", "A3", "B1"]
+
+    # Aprobación de la lazy, reproducción de la primera y reordenamiento manual
+    crud.update_cancion_estado(db, lazy.id, "aprobado")
+    crud.marcar_siguiente_como_reproduciendo(db)
+    crud.move_song_to_top(db, lazy.id)
+    # A1 ya suena: la mesa B (B1) llegó antes que la siguiente de A (A2)
+    assert titulos(crud.get_cola_priorizada(db)) == ["B2", "B1", "A2", "A3"]
+    assert crud.get_cola_priorizada(db)[0].id == lazy.id
+    assert [c.id for c in crud.get_cola_priorizada(db)] == orden_recalculado(db)
+
+    # Borrado de una canción
+    crud.delete_cancion(db, crud.get_cola_priorizada(db)[1].id)
+    assert [c.id for c in crud.get_cola_priorizada(db)] == orden_recalculado(db)
+
+
+def test_lecturas_no_consultan_la_base_de_datos():
+    db = make_session()
+    usuario = crear_mesa(db, "A", 0)
+    crear_cancion(db, "A1", usuario)
+    motor = cola_justa.motor_para(db)
+    motor.ids_en_orden(db, "aprobado")
+
+    sentencias = []
+
+    def registrar(conn, cursor, statement, *args):
+        sentencias.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", registrar)
+    try:
+        for _ in range(10):
+            motor.ids_en_orden(db, "aprobado")
+            motor.ids_en_orden(db, "pendiente_lazy", limite=5)
+    finally:
+        event.remove(engine, "before_cursor_execute", registrar)
+    assert sentencias == []
+
+
+def test_ordenar_cola_funcion_pura():
+    # (id, mesa_id, orden_manual, llegada)
+    canciones = [
+        (1, 10, None, 1), (2, 20, None, 2), (3, 10, None, 3),
+        (4, 20, None, 4), (5, 0, None, 5), (6, 10, 1, 6),
+    ]
+    totales = {10: 60000, 20: 0}
+
+    assert cola_justa.ordenar_cola(canciones, totales) == [6, 1, 3, 2, 5, 4]
+    assert cola_justa.ordenar_cola(canciones, totales, limite=2) == [6, 1]
+
+    # Sin trato preferente para el DJ y con umbrales más bajos
+    politica = cola_justa.PoliticaCola(umbral_plata=0, cupo_sin_mesa=1)
+    assert cola_justa.ordenar_cola(canciones, totales, politica) == [6, 1, 3, 2, 4, 5]
+
+
+def test_cola_lazy_respeta_created_at():
+    db = make_session()
+    usuario = crear_mesa(db, "A", 0)
+    primera = crear_cancion(db, "L1", usuario, estado="pendiente_lazy")
+    segunda = crear_cancion(db, "L2", usuario, estado="pendiente_lazy")
+    assert titulos(crud.get_cola_lazy(db)) == ["L1", "L2"]
+
+    # Igual que /canciones/lazy/{id}/move-up: intercambiar created_at
+    primera.created_at, segunda.created_at = segunda.created_at, primera.created_at
+    db.commit()
+    assert titulos(crud.get_cola_lazy(db)) == ["L2", "L1"]
+    assert titulos(crud.get_cola_lazy(db, limite=1)) == ["L2"]
+
+
+def test_totales_de_consumo_acumulados_y_reconciliados():
+    db = make_session()
+    usuario = crear_mesa(db, "A", 0)
+    mesa = db.get(models.Mesa, usuario.mesa_id)
+    motor = cola_justa.motor_para(db)
+    motor.ids_en_orden(db, "aprobado")
+
+    db.add(models.Consumo(cantidad=1, valor_total=60000, mesa_id=mesa.id, usuario_id=usuario.id))
+    crud.acumular_consumo_en_totales(db, mesa.id, None, 60000)
+    db.commit()
+    db.refresh(mesa)
+    assert mesa.consumo_total == 60000
+    assert motor.totales_mesa[mesa.id] == 60000
+
+    # Un total desincronizado se corrige desde la tabla de consumos
+    mesa.consumo_total = 1
+    db.commit()
+    assert crud.reconciliar_totales_consumo(db) == {"mesas": [mesa.id], "cuentas": []}
+    db.refresh(mesa)
+    assert mesa.consumo_total == 60000
+    assert crud.reconciliar_totales_consumo(db) == {"mesas": [], "cuentas": []}
+
+
+def test_saldo_de_cuenta_sale_del_libro_de_consumos():
+    db = make_session()
+    usuario = crear_mesa(db, "A", 0)
+    producto = models.Producto(nombre="Cerveza", valor=5000, stock=10)
+    cuenta = models.Cuenta(mesa_id=usuario.mesa_id, consumo_total=1)  # acumulado desincronizado
+    db.add_all([producto, cuenta])
+    db.commit()
+    db.add(models.Consumo(cantidad=2, valor_total=10000, mesa_id=usuario.mesa_id, usuario_id=usuario.id,
+                          producto_id=producto.id, cuenta_id=cuenta.id))
+    db.add(models.Pago(monto=4000, mesa_id=usuario.mesa_id, cuenta_id=cuenta.id))
+    db.commit()
+
+    estado = crud.get_cuenta_payment_status(db, cuenta.id)
+    assert estado["total_consumido"] == 10000
+    assert estado["saldo_pendiente"] == 6000
+
+
+def test_tiempos_de_espera_por_sumas_prefijas():
+    db = make_session()
+    user_a = crear_mesa(db, "A", 0)
+    user_b = crear_mesa(db, "B", 0)
+    a1 = crear_cancion(db, "A1", user_a)
+    b1 = crear_cancion(db, "B1", user_b)
+    a2 = crear_cancion(db, "A2", user_a)
+    b1.duracion_seconds = 40
+    db.commit()
+
+    # A1 (100s), B1 (40s), A2
+    assert crud.get_tiempo_espera_para_cancion(db, a1.id) == 0
+    assert crud.get_tiempo_espera_para_cancion(db, b1.id) == 100
+    assert crud.get_tiempo_espera_para_cancion(db, a2.id) == 140
+
+    lote = crud.get_tiempos_espera(db, mesa_id=user_a.mesa_id)
+    assert lote["tiempo_restante_actual_segundos"] == 0
+    assert lote["canciones"] == [
+        {"cancion_id": a1.id, "posicion": 1, "tiempo_espera_segundos": 0},
+        {"cancion_id": a2.id, "posicion": 3, "tiempo_espera_segundos": 140},
+    ]
+
+    # Al reproducirse A1 deja de estar en la cola y su duración pasa a "restante"
+    crud.marcar_siguiente_como_reproduciendo(db)
+    assert crud.get_tiempo_espera_para_cancion(db, a1.id) == -1
+    assert 99 <= crud.get_tiempo_espera_para_cancion(db, a2.id) - 40 <= 100
+    lote = crud.get_tiempos_espera(db, usuario_id=user_b.id)
+    assert [c["cancion_id"] for c in lote["canciones"]] == [b1.id]
+
+
+def test_pedido_de_varias_lineas_acumula_todas_en_los_totales():
+    db = make_session()
+    usuario = crear_mesa(db, "A", 0)
+    otro = models.Usuario(nick="beto", mesa_id=usuario.mesa_id)
+    cerveza = models.Producto(nombre="Cerveza", valor=1000, stock=10)
+    picada = models.Producto(nombre="Picada", valor=5000, stock=10)
+    db.add_all([otro, cerveza, picada])
+    db.commit()
+
+    carrito = schemas.CarritoCreate(items=[
+        schemas.CarritoItem(producto_id=cerveza.id, cantidad=1),
+        schemas.CarritoItem(producto_id=picada.id, cantidad=2),
+    ])
+    consumos, error = crud.create_pedido_from_carrito(db, carrito, usuario.id)
+    assert error is None and len(consumos) == 2
+    mesa = db.get(models.Mesa, usuario.mesa_id)
+    cuenta = crud.get_active_cuenta(db, mesa.id)
+    db.refresh(mesa)
+    db.refresh(cuenta)
+    assert mesa.consumo_total == 11000
+    assert cuenta.consumo_total == 11000
+
+    # Consumos del mismo usuario en dos cuentas de la mesa: al borrarlo se descuentan ambas
+    cuenta.is_active = False
+    db.commit()
+    crud.create_pedido_from_carrito(db, schemas.CarritoCreate(items=[
+        schemas.CarritoItem(producto_id=cerveza.id, cantidad=3),
+    ]), usuario.id)
+    crud.create_pedido_from_carrito(db, schemas.CarritoCreate(items=[
+        schemas.CarritoItem(producto_id=cerveza.id, cantidad=2),
+    ]), otro.id)
+    crud.delete_usuario(db, usuario.id)
+    db.refresh(mesa)
+    assert mesa.consumo_total == 2000
+    assert crud.reconciliar_totales_consumo(db) == {"mesas": [], "cuentas": []}
@@ -0,0 +1,47 @@
+from fastapi.testclient import TestClient
+import pytest
+
+import main, models
+from database import SessionLocal, engine
+
+client = TestClient(main.app)
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    yield
+
+
+def test_cola_responde_304_mientras_no_cambie_la_version():
+    r = client.get('/api/v1/canciones/cola')
+    assert r.status_code == 200
+    etag = r.headers['etag']
+    version = int(r.headers['x-cola-version'])
+    assert r.json()['version'] == version
+
+    r = client.get('/api/v1/canciones/cola', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.headers['etag'] == etag
+
+    # Añadir una canción es una transición de estado: nueva versión y nuevo ETag
+    db = SessionLocal()
+    try:
+        mesa = models.Mesa(nombre='T1', qr_code='t1')
+        db.add(mesa)
+        db.commit()
+        usuario = models.Usuario(nick='cantante', mesa_id=mesa.id)
+        db.add(usuario)
+        db.commit()
+        db.add(models.Cancion(titulo='Tema', youtube_id='abc123', usuario_id=usuario.id, estado='aprobado'))
+        db.commit()
+    finally:
+        db.close()
+
+    r = client.get('/api/v1/canciones/cola/extended', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert int(r.headers['x-cola-version']) > version
+    r = client.get('/api/v1/canciones/cola', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['etag'] != etag
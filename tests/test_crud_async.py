@@ -0,0 +1,302 @@
+import asyncio
+import datetime
+import threading
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import cola_justa
+import crud
+import crud_async
+import escritor_unico
+import models
+import schemas
+import servicio_puntuacion
+import websocket_manager
+from database import Base, crear_engine
+from database_async import SesionEnHilo, crear_engine_async, url_async
+
+
+def test_url_async_usa_el_driver_asincrono():
+    assert url_async("sqlite:///./karaoke.db") == "sqlite+aiosqlite:///./karaoke.db"
+    assert url_async("postgresql://u:p@db/karaoke") == "postgresql+asyncpg://u:p@db/karaoke"
+
+
+@pytest.fixture(params=["hilo", "asyncsession"])
+def fabrica_sesiones(request, tmp_path):
+    url = f"sqlite:///{tmp_path / 'karaoke.db'}"
+    engine = crear_engine(url, pool_tamano=2, pool_extra=1)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionLocal()
+    mesa = models.Mesa(nombre="Mesa 1", qr_code="m1", is_active=True)
+    db.add(mesa)
+    db.commit()
+    db.add_all([models.Usuario(nick="ana", mesa_id=mesa.id), models.Usuario(nick="beto", mesa_id=mesa.id)])
+    db.commit()
+    db.close()
+
+    if request.param == "hilo":
+        yield lambda: SesionEnHilo(SessionLocal)
+    else:
+        async_engine = crear_engine_async(url, pool_tamano=2, pool_extra=1)
+        if async_engine is None:
+            pytest.skip("SQLAlchemy asíncrono no disponible (falta greenlet o aiosqlite)")
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        yield async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        asyncio.run(async_engine.dispose())
+
+
+def test_anadir_y_mover_canciones(fabrica_sesiones):
+    async def escenario():
+        db = fabrica_sesiones()
+        try:
+            ana = await crud_async.get_usuario_by_id(db, 1)
+            assert ana.nick == "ana"
+
+            inicio = datetime.datetime(2026, 1, 1, 22, 0, 0)
+            ids = []
+            for i, youtube_id in enumerate(["A", "B", "C"]):
+                cancion = await crud_async.create_cancion_para_usuario(
+                    db, schemas.CancionCreate(titulo=youtube_id, youtube_id=youtube_id, duracion_seconds=100),
+                    usuario_id=1, estado="pendiente_lazy" if i else "aprobado",
+                )
+                ids.append(cancion.id)
+
+            def fijar_created_at(sesion):
+                for i, cancion_id in enumerate(ids):
+                    sesion.get(models.Cancion, cancion_id).created_at = inicio + datetime.timedelta(minutes=i)
+                sesion.commit()
+
+            await escritor_unico.ejecutar(db, fijar_created_at)
+
+            assert await crud_async.contar_canciones(db, "aprobado") == 1
+            assert await crud_async.get_duracion_total_cola_aprobada(db) == 100
+            # Duplicado a nivel de mesa: beto no puede repetir la que ya tiene ana
+            assert (await crud_async.check_if_song_in_user_list(db, usuario_id=2, youtube_id="A")).id == ids[0]
+            assert await crud_async.check_if_song_in_user_list(db, usuario_id=2, youtube_id="Z") is None
+
+            movida = await crud_async.mover_en_cola(db, ids[2], estado="pendiente_lazy", hacia_arriba=True)
+            assert movida.created_at == inicio + datetime.timedelta(minutes=1)
+            assert await crud_async.mover_en_cola(db, ids[0], estado="pendiente_lazy", hacia_arriba=True) is None
+
+            aprobada = await crud_async.aprobar_siguiente_cancion_lazy(db)
+            assert aprobada.id == ids[2]
+        finally:
+            await db.close()
+
+    asyncio.run(escenario())
+
+
+def test_escritor_agrupa_comandos_y_aisla_fallos(tmp_path):
+    url = f"sqlite:///{tmp_path / 'karaoke.db'}"
+    engine = crear_engine(url)
+    Base.metadata.create_all(bind=engine)
+    escritor = escritor_unico.EscritorUnico(
+        escritor_unico._sesiones_escritor(escritor_unico._engine_escritor(url)), lote_maximo=100, espera_lote=0.05
+    )
+
+    def registrar(sesion, accion):
+        sesion.add(models.AdminLog(action=accion))
+        sesion.commit()  # Dentro del lote solo hace flush
+        return accion
+
+    def fallar(sesion):
+        sesion.add(models.AdminLog(action="FALLIDO"))
+        sesion.flush()
+        raise ValueError("comando inválido")
+
+    async def escenario():
+        comandos = [escritor.ejecutar(registrar, f"A{i}") for i in range(20)]
+        comandos.insert(10, escritor.ejecutar(fallar))
+        return await asyncio.gather(*comandos, return_exceptions=True)
+
+    try:
+        resultados = asyncio.run(escenario())
+    finally:
+        escritor.detener()
+
+    assert isinstance(resultados[10], ValueError)
+    assert [r for r in resultados if not isinstance(r, Exception)] == [f"A{i}" for i in range(20)]
+    metricas = escritor.metricas()
+    assert metricas["lotes"] < 20  # Commit agrupado
+    assert metricas["comandos_fallidos"] == 1
+
+    db = sessionmaker(bind=engine)()
+    acciones = {accion for (accion,) in db.query(models.AdminLog.action)}
+    db.close()
+    assert acciones == {f"A{i}" for i in range(20)}
+
+
+def test_inicios_y_avances_simultaneos_dejan_una_sola_cancion_sonando(fabrica_sesiones, monkeypatch):
+    reproducidas = []
+
+    async def play_song(youtube_id, duracion):
+        reproducidas.append(youtube_id)
+
+    async def nada(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(websocket_manager.manager, "broadcast_play_song", play_song)
+    monkeypatch.setattr(websocket_manager.manager, "broadcast_queue_update", nada)
+    monkeypatch.setattr(websocket_manager.manager, "broadcast_song_finished", nada)
+    monkeypatch.setattr(servicio_puntuacion.servicio, "enviar", nada)
+
+    async def sonando():
+        db = fabrica_sesiones()
+        try:
+            return await escritor_unico.ejecutar(
+                db, lambda sesion: [c.youtube_id for c in sesion.query(models.Cancion).filter_by(estado="reproduciendo")]
+            )
+        finally:
+            await db.close()
+
+    async def con_sesion(fn):
+        db = fabrica_sesiones()
+        try:
+            return await fn(db)
+        finally:
+            await db.close()
+
+    async def escenario():
+        for youtube_id in ["A", "B", "C", "D"]:
+            await con_sesion(lambda db: crud_async.create_cancion_para_usuario(
+                db, schemas.CancionCreate(titulo=youtube_id, youtube_id=youtube_id, duracion_seconds=100),
+                usuario_id=1, estado="aprobado",
+            ))
+
+        # Varias mesas añaden canciones a la vez con la cola parada: solo una arranca
+        await asyncio.gather(*(con_sesion(crud.start_next_song_if_autoplay_and_idle) for _ in range(4)))
+        assert len(await sonando()) == 1
+        assert len(reproducidas) == 1
+
+        # El temporizador y el botón de siguiente avanzan a la vez: una cantada y una sonando por avance
+        await asyncio.gather(*(con_sesion(crud.avanzar_cola_automaticamente) for _ in range(2)))
+        assert len(await sonando()) == 1
+        assert len(reproducidas) == 3
+
+    asyncio.run(escenario())
+
+
+def test_escritor_salta_comandos_cancelados_sin_colgar_el_lote(tmp_path):
+    url = f"sqlite:///{tmp_path / 'karaoke.db'}"
+    engine = crear_engine(url)
+    Base.metadata.create_all(bind=engine)
+    escritor = escritor_unico.EscritorUnico(
+        escritor_unico._sesiones_escritor(escritor_unico._engine_escritor(url)), lote_maximo=100, espera_lote=0.05
+    )
+    liberar = threading.Event()
+
+    def registrar(sesion, accion):
+        sesion.add(models.AdminLog(action=accion))
+        return accion
+
+    async def escenario():
+        bloqueo = escritor.enviar(lambda sesion: liberar.wait(5))
+        await asyncio.sleep(0.1)  # El escritor queda ocupado con el primer lote
+        # La tarea que espera se cancela (p. ej. al apagar el servidor) antes de que el escritor llegue a su comando
+        cancelada = asyncio.ensure_future(escritor.ejecutar(registrar, "CANCELADO"))
+        otra = asyncio.ensure_future(escritor.ejecutar(registrar, "OTRO"))
+        await asyncio.sleep(0)
+        cancelada.cancel()
+        liberar.set()
+        await asyncio.wrap_future(bloqueo)
+        return await asyncio.wait_for(otra, 5)
+
+    try:
+        assert asyncio.run(escenario()) == "OTRO"
+    finally:
+        escritor.detener()
+
+    db = sessionmaker(bind=engine)()
+    acciones = {accion for (accion,) in db.query(models.AdminLog.action)}
+    db.close()
+    assert acciones == {"OTRO"}
+
+
+def test_escritor_de_otra_base_actualiza_su_propio_motor(tmp_path):
+    engine = crear_engine(f"sqlite:///{tmp_path / 'otra.db'}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+    mesa = models.Mesa(nombre="Mesa 1", qr_code="m1", is_active=True)
+    db.add(mesa)
+    db.commit()
+    db.add(models.Usuario(nick="ana", mesa_id=mesa.id))
+    db.commit()
+    motor = cola_justa.motor_para(db)
+    assert motor.ids_en_orden(db, "aprobado") == []
+
+    async def escenario():
+        sesion = SesionEnHilo(SessionLocal)
+        try:
+            return await crud_async.create_cancion_para_usuario(
+                sesion, schemas.CancionCreate(titulo="A", youtube_id="A", duracion_seconds=100),
+                usuario_id=1, estado="aprobado",
+            )
+        finally:
+            await sesion.close()
+
+    cancion = asyncio.run(escenario())
+    # El commit del escritor llega al motor de esta base sin recargarlo
+    assert motor.ids_en_orden(db, "aprobado") == [cancion.id]
+    db.close()
+
+
+def test_observadores_no_ven_cambios_de_savepoints_deshechos(tmp_path):
+    url = f"sqlite:///{tmp_path / 'karaoke.db'}"
+    engine = crear_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    mesa = models.Mesa(nombre="Mesa 1", qr_code="m1", is_active=True)
+    db.add(mesa)
+    db.commit()
+    db.add(models.Usuario(nick="ana", mesa_id=mesa.id))
+    db.commit()
+    escritor = escritor_unico.EscritorUnico(
+        escritor_unico._sesiones_escritor(escritor_unico._engine_escritor(url, motor_de=engine)),
+        lote_maximo=100, espera_lote=0.05,
+    )
+    notificaciones = []
+    motor = cola_justa.motor_para(db)
+    motor.observar(lambda cambios: notificaciones.append([c[:2] for c in cambios]))
+    liberar = threading.Event()
+
+    def anadir(sesion, titulo):
+        cancion = models.Cancion(titulo=titulo, youtube_id=titulo, usuario_id=1, estado="aprobado")
+        sesion.add(cancion)
+        sesion.flush()
+        return cancion.id
+
+    def anadir_y_fallar(sesion):
+        anadir(sesion, "FALLIDA")
+        raise ValueError("comando inválido")
+
+    def anadir_y_deshacer(sesion):
+        anadir(sesion, "DESHECHA")
+        sesion.rollback()
+        return anadir(sesion, "REHECHA")
+
+    async def escenario():
+        bloqueo = escritor.enviar(lambda sesion: liberar.wait(5))
+        await asyncio.sleep(0.1)  # Los tres comandos siguientes van en el mismo lote
+        comandos = asyncio.gather(
+            escritor.ejecutar(anadir, "A"), escritor.ejecutar(anadir_y_fallar),
+            escritor.ejecutar(anadir_y_deshacer), return_exceptions=True,
+        )
+        await asyncio.sleep(0)
+        liberar.set()
+        await asyncio.wrap_future(bloqueo)
+        return await comandos
+
+    try:
+        a, fallo, rehecha = asyncio.run(escenario())
+    finally:
+        escritor.detener()
+        db.close()
+
+    assert isinstance(fallo, ValueError)
+    # Una sola notificación, en el commit del lote, sin lo de los SAVEPOINT deshechos
+    assert notificaciones == [[("cancion", a), ("cancion", rehecha)]]
+    assert motor.ids_en_orden(sessionmaker(bind=engine)(), "aprobado") == [a, rehecha]
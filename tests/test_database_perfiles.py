@@ -0,0 +1,56 @@
+import datetime
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import models
+from database import Base, crear_engine, hora_del_dia, mayor, segundos_entre
+
+
+def test_perfil_produccion_aplica_wal_y_pragmas(tmp_path):
+    engine = crear_engine(f"sqlite:///{tmp_path / 'karaoke.db'}", perfil="produccion", pool_tamano=2, pool_extra=1)
+    with engine.connect() as conexion:
+        assert conexion.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conexion.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conexion.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    assert engine.pool.size() == 2
+
+    legado = crear_engine(f"sqlite:///{tmp_path / 'legado.db'}", perfil="legado")
+    with legado.connect() as conexion:
+        assert conexion.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+
+
+def test_funciones_de_dialecto_en_sqlite_y_postgresql():
+    engine = crear_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    mesa = models.Mesa(nombre="A", qr_code="A", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    inicio = datetime.datetime(2026, 1, 1, 22, 0, 0)
+    db.add(models.Cancion(
+        titulo="C1", youtube_id="C1", usuario_id=usuario.id, estado="cantada",
+        created_at=inicio, started_at=inicio + datetime.timedelta(minutes=20),
+        finished_at=inicio + datetime.timedelta(minutes=30),
+    ))
+    db.commit()
+
+    assert round(crud.get_tiempo_promedio_espera(db)) == 1800
+    assert [tuple(fila) for fila in crud.get_actividad_por_hora(db)] == [("22", 1)]
+    assert db.scalar(select(mayor(func.count(models.Mesa.id), 5))) == 5
+    db.close()
+
+    consulta = select(
+        segundos_entre(models.Cancion.created_at, models.Cancion.finished_at),
+        hora_del_dia(models.Cancion.started_at),
+        mayor(models.Cancion.duracion_seconds, 1),
+    )
+    sql = str(consulta.compile(dialect=postgresql.dialect()))
+    assert "EXTRACT(EPOCH FROM (canciones.finished_at - canciones.created_at))" in sql
+    assert "to_char(canciones.started_at, 'HH24')" in sql
+    assert "greatest(canciones.duracion_seconds" in sql
@@ -0,0 +1,96 @@
+"""
+Regresión de planes de consulta: ejecuta las consultas calientes de crud sobre
+una base sembrada, les pasa EXPLAIN QUERY PLAN y falla si alguna recorre entera
+una tabla grande (SCAN sin índice).
+"""
+import datetime
+import re
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import models
+from database import Base
+
+TABLAS_CALIENTES = {"canciones", "consumos", "pagos", "cuentas", "usuarios"}
+RECORRIDO_COMPLETO = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+
+@pytest.fixture(scope="module")
+def base():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    inicio = datetime.datetime(2026, 1, 1, 20, 0)
+    productos = [models.Producto(nombre=f"P{i}", valor=Decimal("5000"), categoria="Bebidas") for i in range(10)]
+    db.add_all(productos)
+    for m in range(20):
+        mesa = models.Mesa(nombre=f"Mesa {m}", qr_code=f"qr-{m}", is_active=True)
+        db.add(mesa)
+        db.flush()
+        cuentas = [models.Cuenta(mesa_id=mesa.id, is_active=(c == 2), closed_at=None if c == 2 else inicio) for c in range(3)]
+        db.add_all(cuentas)
+        db.flush()
+        for u in range(5):
+            usuario = models.Usuario(nick=f"u{m}-{u}", mesa_id=mesa.id)
+            db.add(usuario)
+            db.flush()
+            for k in range(20):
+                momento = inicio + datetime.timedelta(minutes=k)
+                db.add(models.Cancion(
+                    titulo=f"T{k}", youtube_id=f"y{k}", usuario_id=usuario.id, created_at=momento,
+                    estado=("cantada", "pendiente", "aprobado", "rechazada")[k % 4],
+                ))
+                db.add(models.Consumo(
+                    cantidad=1, valor_total=Decimal("5000"), created_at=momento, is_dispatched=k % 5 != 0,
+                    producto_id=productos[k % 10].id, mesa_id=mesa.id, usuario_id=usuario.id, cuenta_id=cuentas[k % 3].id,
+                ))
+            db.add(models.Pago(monto=Decimal("1000"), mesa_id=mesa.id, cuenta_id=cuentas[2].id, created_at=inicio))
+    db.commit()
+    yield engine, db
+    db.close()
+
+
+CONSULTAS = {
+    "cancion_actual": lambda db: crud.get_cancion_actual(db),
+    "aprobacion_automatica": lambda db: crud.auto_approve_songs_after_10_minutes(db, ahora=datetime.datetime(2026, 1, 1, 20, 5)),
+    "canciones_por_usuario": lambda db: crud.get_canciones_por_usuario(db, 7),
+    "total_consumido_por_usuario": lambda db: crud.get_total_consumido_por_usuario(db, 7),
+    "consumos_por_usuario": lambda db: crud.get_consumos_por_usuario(db, 7),
+    "pedidos_por_despachar": lambda db: crud.get_recent_consumos(db),
+    "cuenta_activa": lambda db: crud.get_active_cuenta(db, 3),
+    "cuentas_anteriores": lambda db: crud.get_previous_cuentas(db, 3),
+    "estado_de_pago_de_cuenta": lambda db: crud.get_cuenta_payment_status(db, 9),
+    "resumen_mesa": lambda db: crud.get_resumen_mesa(db, 3),
+}
+
+
+@pytest.mark.parametrize("nombre", sorted(CONSULTAS))
+def test_las_consultas_calientes_usan_indices(base, nombre):
+    engine, db = base
+    sentencias = []
+
+    def capturar(conexion, cursor, sentencia, parametros, contexto, executemany):
+        if sentencia.lstrip().upper().startswith("SELECT"):
+            sentencias.append((sentencia, parametros))
+
+    event.listen(engine, "before_cursor_execute", capturar)
+    try:
+        CONSULTAS[nombre](db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capturar)
+        db.rollback()
+    assert sentencias, f"{nombre} no ejecutó ninguna consulta"
+
+    recorridos = []
+    with engine.connect() as conexion:
+        for sentencia, parametros in sentencias:
+            for fila in conexion.exec_driver_sql(f"EXPLAIN QUERY PLAN {sentencia}", parametros):
+                coincidencia = RECORRIDO_COMPLETO.match(fila[3])
+                if coincidencia and coincidencia.group(1) in TABLAS_CALIENTES:
+                    recorridos.append(f"{fila[3]}  <-  {' '.join(sentencia.split())[:160]}")
+    assert not recorridos, "Recorrido completo de tabla:\n" + "\n".join(recorridos)
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import crud
+import precarga_pitch
+from database import Base
+
+
+def preparar():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    mesa = models.Mesa(nombre="A", qr_code="A", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    return Session, db, usuario
+
+
+async def ceder(veces=20):
+    for _ in range(veces):
+        await asyncio.sleep(0)
+
+
+def test_precarga_en_orden_de_cola_con_concurrencia_limitada():
+    Session, db, usuario = preparar()
+    cache = {"Y0"}  # Ya procesada en otra noche
+    procesando, liberar = [], {}
+    lock = threading.Lock()
+
+    def precalcular(youtube_id):
+        with lock:
+            procesando.append(youtube_id)
+            evento = liberar.setdefault(youtube_id, threading.Event())
+        evento.wait(5)
+        cache.add(youtube_id)
+        return True
+
+    def soltar(youtube_id):
+        with lock:
+            liberar.setdefault(youtube_id, threading.Event()).set()
+
+    precarga = precarga_pitch.PrecargaPitch(
+        session_factory=Session, concurrencia=1, ventana=10,
+        executor=ThreadPoolExecutor(max_workers=1), precalcular=precalcular, en_cache=lambda y: y in cache,
+    )
+
+    def anadir(youtube_id, estado):
+        db.add(models.Cancion(titulo=youtube_id, youtube_id=youtube_id, usuario_id=usuario.id, estado=estado))
+        db.commit()
+
+    async def esperar_a(condicion):
+        for _ in range(200):
+            if condicion():
+                return
+            await asyncio.sleep(0.01)
+
+    async def escenario():
+        precarga.iniciar()
+        anadir("Y0", "aprobado")
+        anadir("Y1", "aprobado")
+        anadir("Y2", "pendiente_lazy")
+        anadir("Y3", "pendiente")  # No está en cola todavía: no se precarga
+        await esperar_a(lambda: procesando == ["Y1"])
+        en_paralelo = sorted(precarga.en_curso)
+
+        soltar("Y1")
+        await esperar_a(lambda: procesando == ["Y1", "Y2"])
+        soltar("Y2")
+        await esperar_a(lambda: not precarga.en_curso)
+
+        # La primera en sonar ya tenía su pitch listo
+        crud.marcar_siguiente_como_reproduciendo(db)
+        await ceder()
+        metricas = precarga.metricas()
+        precarga.detener()
+        return en_paralelo, metricas
+
+    en_paralelo, metricas = asyncio.run(escenario())
+
+    assert en_paralelo == ["Y1"]
+    assert procesando == ["Y1", "Y2"]
+    assert metricas["completadas"] == 2
+    assert metricas["aciertos"] == 1 and metricas["fallos"] == 0
+    assert metricas["tasa_aciertos"] == 1.0
@@ -0,0 +1,68 @@
+import numpy as np
+
+import cache_pitch
+import puntuacion_dtw
+
+FPS = 44100 / 512
+
+
+def serie(notas, segundos_por_nota=0.5, retraso=0.0, silencio_final=0.0):
+    """Serie de pitch con una nota MIDI (o None = silencio) por tramo."""
+    por_nota = int(segundos_por_nota * FPS)
+    midi = [0.0] * int(retraso * FPS)
+    sonoro = [False] * int(retraso * FPS)
+    for nota in notas:
+        midi += [nota or 0.0] * por_nota
+        sonoro += [nota is not None] * por_nota
+    midi += [0.0] * int(silencio_final * FPS)
+    sonoro += [False] * int(silencio_final * FPS)
+    return cache_pitch.SeriePitch(np.array(midi, dtype=np.float32), np.array(sonoro), FPS)
+
+
+def puntuar_indice_a_indice(original, usuario):
+    """La puntuación anterior: misma nota en el mismo frame con voz, sin alinear."""
+    notas_original, notas_usuario = original.notas(), usuario.notas()
+    if len(notas_original) == 0 or len(notas_usuario) == 0:
+        return 0
+    n = min(len(notas_original), len(notas_usuario))
+    return int(np.count_nonzero(notas_original[:n] == notas_usuario[:n]) / len(notas_original) * 100)
+
+
+MELODIA = [60, 62, 64, 65, 67, None, 69, 71, 72, 71, 69, 67, None, 65, 64, 62, 60] * 4
+
+
+def test_entrar_tarde_no_hunde_la_puntuacion():
+    original = serie(MELODIA, silencio_final=1.0)
+    # Entra medio segundo tarde tras tararear una nota que no está en el original
+    tarde = serie([57] + MELODIA, retraso=0.5, silencio_final=0.0)
+
+    desglose = puntuacion_dtw.puntuar(original, tarde)
+    assert desglose.afinacion >= 95
+    assert desglose.cobertura >= 95
+    assert 70 <= desglose.ritmo < 100  # Un segundo de desfase sobre una banda de cinco
+    # La comparación índice a índice penaliza el retraso casi por completo
+    assert puntuar_indice_a_indice(original, tarde) < desglose.total
+
+
+def test_a_tiempo_y_afinado_es_perfecto():
+    original = serie(MELODIA)
+    assert puntuacion_dtw.puntuar(original, serie(MELODIA)) == puntuacion_dtw.Desglose(100, 100, 100, 100)
+
+
+def test_octavas_y_tolerancia():
+    original = serie(MELODIA)
+    octava_abajo = serie([n - 12 if n else None for n in MELODIA])
+    assert puntuacion_dtw.puntuar(original, octava_abajo).afinacion == 100
+    assert puntuacion_dtw.puntuar(original, octava_abajo, plegar_octavas=False).afinacion == 0
+
+    un_poco_bajo = serie([n - 0.3 if n else None for n in MELODIA])
+    assert puntuacion_dtw.puntuar(original, un_poco_bajo).afinacion == 100
+    assert puntuacion_dtw.puntuar(original, un_poco_bajo, tolerancia=0.2).afinacion <= 5
+
+
+def test_cantar_la_mitad_reduce_la_cobertura():
+    original = serie(MELODIA)
+    mitad = serie(MELODIA[: len(MELODIA) // 2] + [None] * (len(MELODIA) - len(MELODIA) // 2))
+    desglose = puntuacion_dtw.puntuar(original, mitad)
+    assert 40 <= desglose.cobertura <= 75  # La banda deja estirar un poco lo cantado
+    assert puntuacion_dtw.puntuar(original, serie([None] * 10)).total == 0
@@ -0,0 +1,357 @@
+import asyncio
+import copy
+import json
+import re
+import time
+from pathlib import Path
+
+import crud
+import websocket_manager
+from websocket_manager import ConnectionManager, calcular_parche
+
+
+def aplicar_parche(cola, ops):
+    """Aplica las operaciones como lo haría un cliente."""
+    cola = copy.deepcopy(cola)
+    for op in ops:
+        if op["op"] == "set":
+            cola[op["list"]] = op["item"]
+            continue
+        lista = cola[op["list"]]
+        if op["op"] == "remove":
+            lista[:] = [c for c in lista if c["id"] != op["id"]]
+        elif op["op"] == "insert":
+            lista.insert(op["index"], op["item"])
+        elif op["op"] == "move":
+            item = next(c for c in lista if c["id"] == op["id"])
+            lista.remove(item)
+            lista.insert(op["index"], item)
+        elif op["op"] == "update":
+            next(c for c in lista if c["id"] == op["id"]).update(op["fields"])
+    return cola
+
+
+def cancion(cancion_id, estado="aprobado"):
+    return {"id": cancion_id, "titulo": f"T{cancion_id}", "estado": estado}
+
+
+def test_parche_reconstruye_la_cola():
+    anterior = {
+        "now_playing": cancion(1, "reproduciendo"),
+        "upcoming": [cancion(2), cancion(3), cancion(4)],
+        "pending": [cancion(5, "pendiente"), cancion(6, "pendiente")],
+    }
+    nuevo = {
+        "now_playing": cancion(2, "reproduciendo"),
+        "upcoming": [cancion(4), cancion(3), cancion(5)],
+        "pending": [cancion(6, "pendiente"), cancion(7, "pendiente")],
+    }
+    ops = calcular_parche(anterior, nuevo)
+    assert aplicar_parche(anterior, ops) == nuevo
+
+    # Solo cambia el estado de una canción: una única operación
+    cambiado = copy.deepcopy(nuevo)
+    cambiado["pending"][0]["estado"] = "rechazada"
+    assert calcular_parche(nuevo, cambiado) == [
+        {"op": "update", "list": "pending", "id": 6, "fields": {"estado": "rechazada"}}
+    ]
+
+
+def usar_cola_falsa(monkeypatch, version):
+    """Sin caché por versión ni base de datos: cada lectura llama a crud.get_cola_completa."""
+    def instantanea(db, vista, construir):
+        valor = construir(None)
+        return None, version(), valor
+
+    monkeypatch.setattr(crud, "get_instantanea_cola", instantanea)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.mensajes = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.mensajes.append(json.loads(data))
+
+
+def test_clientes_parche_reciben_deltas_con_secuencia(monkeypatch):
+    pendientes = [cancion(i, "pendiente") for i in range(10, 30)]
+    colas = [
+        {"now_playing": None, "upcoming": [cancion(1), cancion(2)], "pending": pendientes},
+        {"now_playing": cancion(1, "reproduciendo"), "upcoming": [cancion(2)], "pending": pendientes},
+    ]
+    lecturas = []
+
+    def cola(db):
+        lecturas.append(1)
+        return colas[min(len(lecturas), len(colas)) - 1]
+
+    monkeypatch.setattr(crud, "get_cola_completa", cola)
+    usar_cola_falsa(monkeypatch, lambda: 10 + min(len(lecturas), len(colas)))
+    manager = ConnectionManager(ventana_cola=0)
+    parche, clasico = FakeWebSocket(), FakeWebSocket()
+
+    async def escenario():
+        await manager.connect(parche, websocket_manager.PROTOCOLO_PARCHE)
+        await manager.connect(clasico)
+        await manager.broadcast_queue_update()
+        await manager.esperar_envios()
+        await manager.broadcast_queue_update()
+        await manager.esperar_envios()
+        # El cliente detecta un salto y pide la cola completa
+        await manager.handle_client_message(parche, json.dumps({"type": "queue_snapshot_request"}))
+        await manager.esperar_envios()
+
+    asyncio.run(escenario())
+
+    assert [m["type"] for m in clasico.mensajes] == ["queue_update", "queue_update"]
+    assert [m["type"] for m in parche.mensajes] == ["queue_update", "queue_patch", "queue_update"]
+    inicial, delta, snapshot = parche.mensajes
+    assert (inicial["seq"], delta["seq"], snapshot["seq"]) == (1, 2, 2)
+    assert delta["base_version"] == inicial["version"]
+    assert aplicar_parche(inicial["payload"], delta["ops"]) == snapshot["payload"]
+
+
+def test_cliente_que_conecta_entre_cambios_aplica_el_parche(monkeypatch):
+    pendientes = [cancion(i, "pendiente") for i in range(10, 30)]
+    colas = [
+        {"now_playing": None, "upcoming": [cancion(1), cancion(2)], "pending": pendientes},
+        {"now_playing": None, "upcoming": [cancion(1), cancion(2), cancion(3)], "pending": pendientes},
+        {"now_playing": cancion(1, "reproduciendo"), "upcoming": [cancion(2), cancion(3)], "pending": pendientes},
+    ]
+    actual = [0]
+    monkeypatch.setattr(crud, "get_cola_completa", lambda db: colas[actual[0]])
+    usar_cola_falsa(monkeypatch, lambda: 20 + actual[0])
+    manager = ConnectionManager(ventana_cola=0)
+    antiguo, nuevo = FakeWebSocket(), FakeWebSocket()
+
+    async def escenario():
+        await manager.connect(antiguo, websocket_manager.PROTOCOLO_PARCHE)
+        await manager.broadcast_queue_update()
+        await manager.esperar_envios()
+        # La cola cambia y el cliente nuevo conecta antes de que salga el broadcast
+        actual[0] = 1
+        await manager.connect(nuevo, websocket_manager.PROTOCOLO_PARCHE)
+        await manager.send_queue_snapshot(nuevo)
+        await manager.esperar_envios()
+        await manager.broadcast_queue_update()
+        actual[0] = 2
+        await manager.broadcast_queue_update()
+        await manager.esperar_envios()
+
+    asyncio.run(escenario())
+
+    def reconstruir(mensajes):
+        cola, version, secuencias = None, None, []
+        for mensaje in mensajes:
+            secuencias.append(mensaje["seq"])
+            if mensaje["type"] == "queue_update":
+                cola = mensaje["payload"]
+            else:
+                assert mensaje["base_version"] == version
+                cola = aplicar_parche(cola, mensaje["ops"])
+            version = mensaje["version"]
+        return cola, secuencias
+
+    assert [m["type"] for m in nuevo.mensajes] == ["queue_update", "queue_patch"]
+    assert reconstruir(antiguo.mensajes) == (colas[2], [1, 2, 3])
+    assert reconstruir(nuevo.mensajes) == (colas[2], [2, 3])
+
+
+def test_peticiones_agrupadas_en_un_solo_envio(monkeypatch):
+    lecturas = []
+
+    def cola(db):
+        lecturas.append(1)
+        return {"now_playing": None, "upcoming": [cancion(len(lecturas))], "pending": []}
+
+    monkeypatch.setattr(crud, "get_cola_completa", cola)
+    usar_cola_falsa(monkeypatch, lambda: len(lecturas))
+    manager = ConnectionManager(ventana_cola=0.02, espera_maxima_cola=0.1)
+    socket = FakeWebSocket()
+
+    async def escenario():
+        await manager.connect(socket)
+        for _ in range(5):
+            await manager.broadcast_queue_update()
+        await asyncio.sleep(0.05)
+        # Una ráfaga continua se envía como mucho tras la espera máxima
+        for _ in range(15):
+            await manager.broadcast_queue_update()
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.15)
+        await manager.esperar_envios()
+
+    asyncio.run(escenario())
+
+    metricas = manager.metricas()
+    assert metricas["broadcasts_cola_solicitados"] == 20
+    assert 2 <= metricas["broadcasts_cola_enviados"] <= 4
+    assert len(socket.mensajes) == metricas["broadcasts_cola_enviados"] == len(lecturas)
+
+
+def test_conexion_nueva_recibe_su_instantanea_sin_tocar_a_los_demas(monkeypatch):
+    sonando = dict(cancion(1, "reproduciendo"), youtube_id="yt1", duracion_seconds=200)
+    monkeypatch.setattr(crud, "get_cola_completa", lambda db: {"now_playing": sonando, "upcoming": [], "pending": []})
+    usar_cola_falsa(monkeypatch, lambda: 3)
+    manager = ConnectionManager(ventana_cola=0)
+    existente, nuevo = FakeWebSocket(), FakeWebSocket()
+
+    async def escenario():
+        await manager.connect(existente)
+        await manager.broadcast_play_song("yt1", 200)
+        await manager.broadcast_pause()
+        await manager.esperar_envios()
+        existente.mensajes.clear()
+        await manager.connect(nuevo)
+        await manager.send_queue_snapshot(nuevo)
+        await manager.esperar_envios()
+
+    asyncio.run(escenario())
+
+    assert existente.mensajes == []
+    cola, reproduccion = nuevo.mensajes
+    assert cola["type"] == "queue_update" and cola["version"] == 3
+    assert cola["payload"]["now_playing"]["id"] == 1
+    assert reproduccion["type"] == "playback_state"
+    assert reproduccion["payload"]["pausado"] is True
+    assert 0 <= reproduccion["payload"]["posicion_segundos"] < 5
+
+
+def test_player_maneja_la_secuencia_que_recibe_al_conectar(monkeypatch):
+    sonando = dict(cancion(1, "reproduciendo"), youtube_id="yt1", duracion_seconds=200)
+    monkeypatch.setattr(crud, "get_cola_completa", lambda db: {"now_playing": sonando, "upcoming": [], "pending": []})
+    usar_cola_falsa(monkeypatch, lambda: 3)
+    manager = ConnectionManager(ventana_cola=0)
+    player = FakeWebSocket()
+
+    async def escenario():
+        await manager.broadcast_play_song("yt1", 200)
+        # Como /ws/cola: el player se conecta sin topics y recibe su instantánea
+        await manager.connect(player)
+        await manager.send_queue_snapshot(player)
+        await manager.handle_client_message(player, json.dumps({"type": "subscribe", "topics": ["player", "queue"]}))
+        await manager.esperar_envios()
+
+    asyncio.run(escenario())
+
+    tipos = [m["type"] for m in player.mensajes]
+    assert tipos == ["queue_update", "playback_state", "subscribed"]
+    cola, reproduccion = player.mensajes[0]["payload"], player.mensajes[1]["payload"]
+    assert reproduccion["youtube_id"] == cola["now_playing"]["youtube_id"] == "yt1"
+
+    # Ninguno de estos mensajes puede caer en el fallback que trata el mensaje como la cola
+    # (y la borra de la pantalla): o tienen su manejador o están en la lista de excluidos
+    html = (Path(__file__).resolve().parent.parent / "static" / "player.html").read_text(encoding="utf-8")
+    excluidos = re.search(r"if \(!\[([^\]]*)\]\.includes\(data\.type\)\)", html).group(1)
+    excluidos = set(re.findall(r"'(\w+)'", excluidos))
+    manejados = set(re.findall(r"data\.type === '(\w+)'", html))
+    assert {"playback_state", "queue_update"} <= manejados
+    assert set(tipos) | {"queue_patch"} <= excluidos
+
+
+class SlowWebSocket(FakeWebSocket):
+    async def send_text(self, data: str):
+        await asyncio.sleep(10)
+
+    async def close(self, code=1000):
+        pass
+
+
+def test_cliente_lento_no_bloquea_y_es_expulsado(monkeypatch):
+    colas = [{"now_playing": None, "upcoming": [cancion(i)], "pending": []} for i in range(5)]
+    lecturas = []
+
+    def cola(db):
+        lecturas.append(1)
+        return colas[len(lecturas) - 1]
+
+    monkeypatch.setattr(crud, "get_cola_completa", cola)
+    usar_cola_falsa(monkeypatch, lambda: len(lecturas))
+    manager = ConnectionManager(ventana_cola=0, timeout_envio=0.05)
+    rapido, lento = FakeWebSocket(), SlowWebSocket()
+
+    async def escenario():
+        await manager.connect(rapido)
+        await manager.connect(lento)
+        for _ in range(5):
+            await manager.broadcast_queue_update()
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        # El rápido ya tiene la última versión aunque el lento siga atascado en su primer envío
+        assert rapido.mensajes[-1]["payload"]["upcoming"][0]["id"] == 4
+        # Las actualizaciones pendientes del lento se agruparon en una sola
+        assert len(manager._clientes[lento].pendientes) == 1
+        await asyncio.sleep(0.1)
+
+    asyncio.run(escenario())
+
+    metricas = manager.metricas()
+    assert metricas["expulsados_por_lentitud"] == 1
+    assert metricas["mensajes_agrupados"] >= 3
+    assert lento not in manager.active_connections
+    assert rapido in manager.active_connections
+
+
+class CierreLentoWebSocket(SlowWebSocket):
+    async def close(self, code=1000):
+        await asyncio.sleep(10)
+
+
+def test_expulsar_por_desborde_no_bloquea_el_broadcast():
+    manager = ConnectionManager(ventana_cola=0, max_pendientes=2, timeout_envio=30)
+    muertos = [CierreLentoWebSocket() for _ in range(5)]
+    desconectado = FakeWebSocket()
+
+    async def escenario():
+        for socket in muertos:
+            await manager.connect(socket)
+        inicio = time.perf_counter()
+        for n in range(4):
+            await manager._broadcast(json.dumps({"type": "notification", "n": n}))
+        duracion = time.perf_counter() - inicio
+        # Un socket que ya no está conectado no recibe una tarea escritora nueva
+        await manager._broadcast(json.dumps({"type": "notification"}), [desconectado])
+        for tarea in list(manager._expulsiones):
+            tarea.cancel()
+        return duracion
+
+    duracion = asyncio.run(escenario())
+
+    assert duracion < 0.5
+    assert manager.expulsados_por_desborde == 5
+    assert manager.active_connections == [] and manager._clientes == {}
+    assert desconectado.mensajes == []
+
+
+def test_topics_limitan_los_destinatarios():
+    manager = ConnectionManager(ventana_cola=0)
+    player, bar, mesa, antiguo = FakeWebSocket(), FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+
+    async def escenario():
+        await manager.connect(player, topics="player")
+        await manager.connect(bar, topics="bar,desconocido")
+        await manager.connect(mesa)
+        await manager.handle_client_message(mesa, json.dumps({"type": "subscribe", "topics": ["queue", "mesa:7"]}))
+        await manager.connect(antiguo)
+        await manager.esperar_envios()
+        mesa.mensajes.clear()
+
+        await manager.broadcast_consumo_created({"id": 1, "mesa_id": 7})
+        await manager.broadcast_play_song("yt1", 100)
+        await manager.broadcast_reaction({"emoji": "x"})
+        await manager.esperar_envios()
+
+    asyncio.run(escenario())
+
+    tipos = lambda ws: [m["type"] for m in ws.mensajes]
+    assert tipos(player) == ["play_song", "reaction"]
+    assert tipos(bar) == ["consumo_created"]
+    assert tipos(mesa) == ["consumo_created"]
+    # Sin suscripción recibe todo, como antes
+    assert tipos(antiguo) == ["consumo_created", "play_song", "reaction"]
+    assert manager.recibe(mesa, "queue") and not manager.recibe(bar, "queue")
+    assert manager._suscripciones[bar] == {"bar"}
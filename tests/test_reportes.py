@@ -0,0 +1,145 @@
+"""
+El bundle de reportes debe devolver lo mismo que cada endpoint /reports/* por
+separado. La noche sembrada evita empates en los rankings (su orden no está
+definido en SQL).
+"""
+import datetime
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import admin
+import models
+import reportes
+from database import Base
+
+ENDPOINTS = {
+    "top-songs": admin.get_top_songs_report,
+    "top-rejected-songs": admin.get_top_rejected_songs_report,
+    "top-products": admin.get_top_products_report,
+    "least-sold-products": admin.get_least_sold_products_report,
+    "unsold-products": admin.get_unsold_products_report,
+    "income-by-category": admin.get_income_by_category_report,
+    "average-wait-time": admin.get_average_wait_time_report,
+    "hourly-activity": admin.get_hourly_activity_report,
+    "songs-by-user": admin.get_songs_by_user_report,
+    "top-rejected-users": admin.get_top_rejected_users_report,
+    "songs-by-table": admin.get_songs_by_table_report,
+    "total-income": admin.get_total_income_report,
+    "income-by-table": admin.get_income_by_table_report,
+    "average-income-per-user": admin.get_average_income_per_user_report,
+    "average-income-per-table": admin.get_average_income_per_table_report,
+    "empty-tables": admin.get_empty_tables_report,
+    "one-hit-wonders": admin.get_one_hit_wonders_report,
+    "users-without-sung-songs": admin.get_users_without_sung_songs_report,
+    "inactive-users": admin.get_inactive_users_report,
+    "inactive-consumers": admin.get_inactive_consumers_report,
+    "consumers-no-singers": admin.get_consumers_no_singers_report,
+    "top-consumers-one-song": admin.get_top_consumers_one_song_report,
+    "gold-users": admin.get_gold_users_report,
+    "silver-users": admin.get_silver_users_report,
+    "active-gold-users": admin.get_active_gold_users_report,
+    "top-points-users": admin.get_top_points_users_report,
+    "summary": admin.get_night_summary,
+}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    m1, m2, m3 = (models.Mesa(nombre=f"Mesa {n}", qr_code=f"qr{n}", is_active=True) for n in (1, 2, 3))
+    cerveza = models.Producto(nombre="Cerveza", categoria="Licores", valor=Decimal("8.50"), costo=Decimal("3"), stock=50)
+    papas = models.Producto(nombre="Papas", categoria="Snacks", valor=Decimal("5.25"), costo=Decimal("2"), stock=50)
+    agua = models.Producto(nombre="Agua", categoria="Bebidas", valor=Decimal("2"), costo=Decimal("1"), stock=50)
+    db.add_all([m1, m2, m3, cerveza, papas, agua])
+    db.flush()
+    ana = models.Usuario(nick="ana", mesa_id=m1.id, nivel="oro", puntos=50)
+    beto = models.Usuario(nick="beto", mesa_id=m1.id, nivel="plata", puntos=30)
+    caro = models.Usuario(nick="caro", mesa_id=m2.id, nivel="oro", puntos=80)
+    dani = models.Usuario(nick="dani", mesa_id=m2.id, nivel="bronce", puntos=10)
+    db.add_all([ana, beto, caro, dani])
+    db.flush()
+
+    noche = datetime.datetime(2026, 1, 1, 22, 0)
+    cantadas = [(ana, "S1", 22), (ana, "S1", 22), (ana, "S1", 22), (caro, "S1", 22),
+                (ana, "S2", 23), (ana, "S2", 23), (ana, "S3", 0)]
+    for n, (usuario, titulo, hora) in enumerate(cantadas):
+        inicio = noche.replace(hour=hora) + datetime.timedelta(days=hora < 12)
+        db.add(models.Cancion(titulo=titulo, youtube_id=f"yt{titulo}", usuario_id=usuario.id, estado="cantada",
+                              created_at=inicio - datetime.timedelta(seconds=600 + n), started_at=inicio,
+                              finished_at=inicio))
+    for usuario, titulo in [(beto, "S4"), (beto, "S4"), (dani, "S5")]:
+        db.add(models.Cancion(titulo=titulo, youtube_id=f"yt{titulo}", usuario_id=usuario.id, estado="rechazada"))
+    db.add(models.Cancion(titulo="S6", youtube_id="ytS6", usuario_id=dani.id, estado="pendiente"))
+
+    ahora = datetime.datetime.utcnow()
+    for usuario, producto, cantidad, hace in [(ana, cerveza, 3, 5), (beto, papas, 20, 0), (caro, cerveza, 1, 0),
+                                                (caro, papas, 4, 0)]:
+        db.add(models.Consumo(usuario_id=usuario.id, mesa_id=usuario.mesa_id, producto_id=producto.id,
+                              cantidad=cantidad, valor_total=producto.valor * cantidad,
+                              created_at=ahora - datetime.timedelta(hours=hace)))
+    db.add_all([models.Pago(mesa_id=m1.id, monto=Decimal("100")), models.Pago(mesa_id=m1.id, monto=Decimal("30.50")),
+                models.Pago(mesa_id=m2.id, monto=Decimal("20"))])
+    db.commit()
+    yield db
+    db.close()
+
+
+def _respuesta(endpoint, resultado):
+    """Lo que devolvería la ruta: el resultado validado con su response_model."""
+    ruta = next(r for r in admin.router.routes if getattr(r, "endpoint", None) is endpoint)
+    adaptador = TypeAdapter(ruta.response_model)
+    return _normalizar(adaptador.dump_python(adaptador.validate_python(resultado, from_attributes=True)))
+
+
+def _normalizar(valor):
+    # SQL promedia en float y el motor en Decimal: se comparan al centavo
+    if isinstance(valor, (Decimal, float)):
+        return round(float(valor), 2)
+    if isinstance(valor, dict):
+        return {k: _normalizar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_normalizar(v) for v in valor]
+    return valor
+
+
+def test_cada_reporte_registrado_tiene_su_endpoint():
+    assert set(reportes.REPORTES) == set(ENDPOINTS)
+
+
+def test_bundle_coincide_con_los_endpoints(db):
+    bundle = admin.get_reports_bundle(names=None, db=db)
+    assert list(bundle) == list(reportes.REPORTES)
+    for nombre, endpoint in ENDPOINTS.items():
+        esperado = _respuesta(endpoint, endpoint(db=db))
+        assert _respuesta(endpoint, bundle[nombre]) == esperado, nombre
+        assert esperado not in ([], None), f"{nombre}: la noche sembrada no ejercita el reporte"
+
+
+def test_bundle_con_subconjunto_y_nombres_desconocidos(db):
+    bundle = admin.get_reports_bundle(names="total-income, top-songs", db=db)
+    assert list(bundle) == ["total-income", "top-songs"]
+    assert bundle["total-income"].ingresos_totales == Decimal("150.50")
+
+    with pytest.raises(HTTPException) as error:
+        admin.get_reports_bundle(names="top-songs,no-existe", db=db)
+    assert error.value.status_code == 400
+
+
+def test_bundle_sobre_una_noche_vacia():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        bundle = reportes.calcular(db)
+    finally:
+        db.close()
+    assert bundle["top-songs"] == [] and bundle["total-income"].ingresos_totales == 0
+    assert bundle["average-wait-time"].tiempo_espera_promedio_segundos == 0
@@ -0,0 +1,136 @@
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import crud
+import reproduccion_automatica
+import servicio_puntuacion
+import websocket_manager
+from database import Base
+
+
+class RelojFalso:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+    async def dormir(self, segundos):
+        # Solo despierta cuando la prueba mueve el reloj
+        await asyncio.Event().wait()
+
+
+async def ceder(veces=20):
+    # Con pausas reales: la aprobación lazy pasa por el hilo del escritor único
+    for _ in range(veces):
+        await asyncio.sleep(0.005)
+
+
+def preparar(directorio):
+    # En archivo: el escritor único abre su propia conexión a la misma base
+    engine = create_engine(f"sqlite:///{directorio / 'karaoke.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    mesa = models.Mesa(nombre="A", qr_code="A", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id)
+    db.add(usuario)
+    db.commit()
+    for titulo, estado in [("C1", "aprobado"), ("C2", "aprobado"), ("C3", "pendiente_lazy")]:
+        db.add(models.Cancion(titulo=titulo, youtube_id=titulo, usuario_id=usuario.id, estado=estado, duracion_seconds=200))
+        db.commit()
+    return Session, db
+
+
+def estados(db):
+    db.expire_all()
+    return {c.titulo: c.estado for c in db.query(models.Cancion)}
+
+
+async def avanzar(session_factory, cancion_id):
+    # Como crud.avanzar_cola_automaticamente, sin la puntuación por IA ni los broadcasts
+    db = session_factory()
+    try:
+        crud._avanzar_cola(db, cancion_id)
+    finally:
+        db.close()
+
+
+def test_el_servidor_avanza_la_cola_y_respeta_la_pausa(tmp_path):
+    reloj = RelojFalso()
+    Session, db = preparar(tmp_path)
+    temporizador = reproduccion_automatica.TemporizadorReproduccion(
+        session_factory=Session, transicion=5, progreso_lazy=0.5, reloj=reloj, dormir=reloj.dormir, avanzar=avanzar,
+    )
+
+    async def mover(segundos):
+        reloj.ahora += segundos
+        temporizador._hay_cambios.set()
+        await ceder()
+        return estados(db)
+
+    async def escenario():
+        temporizador.iniciar()
+        await ceder()
+        crud.marcar_siguiente_como_reproduciendo(db)  # C1 empieza a sonar
+        await ceder()
+        resultados = {"inicio": estados(db)}
+        # A mitad de canción queda libre el cupo (C2 sigue aprobada): C3 aún no entra
+        resultados["mitad"] = await mover(100)
+
+        temporizador.pausar()
+        resultados["pausada"] = await mover(300)  # En pausa no vence nada
+        temporizador.reanudar()
+
+        resultados["antes_del_fin"] = await mover(104)  # 204 s de canción: dentro de la transición
+        resultados["fin"] = await mover(1)             # 200 s + 5 s de transición
+        # C2 suena; al llegar a su mitad se aprueba la lazy C3
+        resultados["lazy"] = await mover(100)
+        resultados["metricas"] = temporizador.metricas()
+        temporizador.detener()
+        return resultados
+
+    resultados = asyncio.run(escenario())
+
+    assert resultados["inicio"] == {"C1": "reproduciendo", "C2": "aprobado", "C3": "pendiente_lazy"}
+    assert resultados["mitad"] == resultados["inicio"]
+    assert resultados["pausada"] == resultados["inicio"]
+    assert resultados["antes_del_fin"] == resultados["inicio"]
+    assert resultados["fin"] == {"C1": "cantada", "C2": "reproduciendo", "C3": "pendiente_lazy"}
+    assert resultados["lazy"] == {"C1": "cantada", "C2": "reproduciendo", "C3": "aprobado"}
+    metricas = resultados["metricas"]
+    assert metricas["avances_automaticos"] == 1
+    assert metricas["silencios"] == 1
+    assert metricas["silencio_total_segundos"] == 5.0  # La transición
+    assert metricas["posicion_segundos"] == 100.0
+
+
+def test_un_temporizador_atrasado_no_salta_canciones(tmp_path, monkeypatch):
+    async def nada(*args, **kwargs):
+        pass
+
+    for metodo in ("broadcast_play_song", "broadcast_queue_update", "broadcast_song_finished"):
+        monkeypatch.setattr(websocket_manager.manager, metodo, nada)
+    monkeypatch.setattr(servicio_puntuacion.servicio, "enviar", nada)
+    Session, db = preparar(tmp_path)
+    crud.marcar_siguiente_como_reproduciendo(db)
+    c1 = db.query(models.Cancion).filter_by(titulo="C1").one()
+
+    async def escenario():
+        # Por el escritor único: el avance se comprueba y se hace en un solo comando
+        await reproduccion_automatica._avanzar_cola(Session, c1.id)
+        despues_del_fin = estados(db)
+        # El temporizador de C1 vence otra vez (p. ej. el botón de siguiente ya avanzó): no toca a C2
+        await reproduccion_automatica._avanzar_cola(Session, c1.id)
+        return despues_del_fin, estados(db)
+
+    despues_del_fin, repetido = asyncio.run(escenario())
+    # Al avanzar se aprueba la lazy C3 (la cola de aprobadas quedó vacía)
+    assert despues_del_fin == {"C1": "cantada", "C2": "reproduciendo", "C3": "aprobado"}
+    assert repetido == despues_del_fin
+    db.close()
@@ -0,0 +1,55 @@
+import socket
+import threading
+from multiprocessing.connection import Client
+
+import separador_demucs
+
+CLAVE = b"prueba"
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_el_modelo_se_carga_una_vez_y_atiende_varios_trabajos(tmp_path):
+    direccion = ("127.0.0.1", puerto_libre())
+    cargas, trabajos = [], []
+
+    def cargar_modelo(hilos):
+        cargas.append(hilos)
+
+        def separar(audio_path, output_dir):
+            if audio_path.endswith("roto.mp3"):
+                raise RuntimeError("audio corrupto")
+            trabajos.append(audio_path)
+            destino = separador_demucs.ruta_vocales(audio_path, output_dir)
+            return destino
+
+        return separar
+
+    # Sin trabajador: quien llama debe usar el subproceso
+    assert separador_demucs.separar("a.mp3", str(tmp_path), direccion, CLAVE) is None
+
+    listo = threading.Event()
+    hilo = threading.Thread(
+        target=separador_demucs.servir, args=(direccion, CLAVE, 2),
+        kwargs={"cargar_modelo": cargar_modelo, "listo": listo}, daemon=True,
+    )
+    hilo.start()
+    assert listo.wait(5)
+
+    primera = separador_demucs.separar("temp_audio/abc.mp3", str(tmp_path), direccion, CLAVE)
+    segunda = separador_demucs.separar("temp_audio/def.mp3", str(tmp_path), direccion, CLAVE)
+    fallida = separador_demucs.separar("temp_audio/roto.mp3", str(tmp_path), direccion, CLAVE)
+
+    assert primera == str(tmp_path / "htdemucs" / "abc" / "vocals.wav")
+    assert segunda.endswith("def/vocals.wav")
+    assert fallida is None
+    assert cargas == [2] and len(trabajos) == 2
+
+    with Client(direccion, authkey=CLAVE) as conexion:
+        conexion.send(None)
+    hilo.join(5)
+    assert not hilo.is_alive()
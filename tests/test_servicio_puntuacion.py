@@ -0,0 +1,214 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import crud
+import servicio_puntuacion
+from database import Base
+
+
+def preparar(directorio):
+    # En archivo: el servicio usa la base desde otros hilos (una base :memory: es una por conexión)
+    engine = create_engine(f"sqlite:///{directorio / 'puntuacion.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    mesa = models.Mesa(nombre="A", qr_code="A", is_active=True)
+    db.add(mesa)
+    db.commit()
+    usuario = models.Usuario(nick="ana", mesa_id=mesa.id, puntos=0)
+    db.add(usuario)
+    db.commit()
+    for titulo, estado in [("C1", "reproduciendo"), ("C2", "aprobado")]:
+        db.add(models.Cancion(titulo=titulo, youtube_id=titulo, usuario_id=usuario.id, estado=estado))
+        db.commit()
+    return Session, db
+
+
+def test_la_cola_avanza_sin_esperar_a_la_puntuacion(monkeypatch, tmp_path):
+    Session, db = preparar(tmp_path)
+    c1 = db.query(models.Cancion).filter_by(titulo="C1").one()
+    monkeypatch.setattr(servicio_puntuacion, "DIRECTORIO_GRABACIONES", str(tmp_path))
+    open(servicio_puntuacion.ruta_grabacion(c1.id), "wb").close()
+
+    liberar = threading.Event()
+    llamadas, puntuadas = [], []
+
+    def calcular(youtube_id, ruta):
+        llamadas.append(youtube_id)
+        liberar.wait(5)  # Simula Demucs + librosa
+        return 80
+
+    async def al_puntuar(cancion):
+        puntuadas.append((cancion.id, cancion.puntuacion_ia))
+
+    servicio = servicio_puntuacion.ServicioPuntuacion(
+        session_factory=Session, executor=ThreadPoolExecutor(max_workers=1),
+        calcular=calcular, al_puntuar=al_puntuar,
+    )
+    monkeypatch.setattr(servicio_puntuacion, "servicio", servicio)
+
+    async def escenario():
+        siguiente = await crud.avanzar_cola_automaticamente(db)
+        # La cola ya avanzó con la IA todavía calculando
+        db.expire_all()
+        antes = (siguiente.titulo, c1.estado, c1.puntuacion_ia, c1.usuario.puntos, servicio.metricas()["pendientes"])
+        liberar.set()
+        await servicio.esperar()
+        servicio.detener()
+        return antes
+
+    antes = asyncio.run(escenario())
+
+    assert antes == ("C2", "cantada", None, 10, 1)
+    assert llamadas == ["C1"]
+    assert puntuadas == [(c1.id, 80)]
+    db.expire_all()
+    assert c1.puntuacion_ia == 80
+    assert c1.usuario.puntos == 90
+    # Ya puntuada: la grabación se borra
+    assert not os.path.exists(servicio_puntuacion.ruta_grabacion(c1.id))
+
+
+def test_sin_grabacion_no_se_envia_nada(monkeypatch, tmp_path):
+    Session, db = preparar(tmp_path)
+    monkeypatch.setattr(servicio_puntuacion, "DIRECTORIO_GRABACIONES", str(tmp_path))
+    cancion = crud.marcar_cancion_actual_como_cantada(db)
+    assert cancion.puntuacion_ia == 0
+    assert cancion.usuario.puntos == 10
+
+
+def test_reintenta_los_fallos_y_retoma_concesiones_vencidas(monkeypatch, tmp_path):
+    Session, db = preparar(tmp_path)
+    c1 = db.query(models.Cancion).filter_by(titulo="C1").one()
+    c2 = db.query(models.Cancion).filter_by(titulo="C2").one()
+    ahora = [datetime.datetime(2026, 1, 1, 22, 0)]
+    # Trabajo que dejó a medias un proceso que murió: su concesión ya venció
+    db.add(models.TrabajoPuntuacion(
+        cancion_id=c2.id, youtube_id="C2", ruta_audio="c2.wav", estado="en_curso", intentos=1,
+        trabajador="proceso-muerto", lease_hasta=ahora[0] - datetime.timedelta(seconds=1),
+    ))
+    db.commit()
+
+    llamadas = []
+
+    def calcular(youtube_id, ruta):
+        llamadas.append(youtube_id)
+        if youtube_id == "C1" and llamadas.count("C1") == 1:
+            raise RuntimeError("Falló la descarga de YouTube")
+        return 70
+
+    servicio = servicio_puntuacion.ServicioPuntuacion(
+        session_factory=Session, executor=ThreadPoolExecutor(max_workers=1),
+        calcular=calcular, al_puntuar=None, reloj=lambda: ahora[0],
+    )
+
+    async def escenario():
+        await servicio.enviar(c1.id, "C1", "c1.wav")
+        await servicio.esperar()
+        # C1 falló una vez y espera su reintento; C2 se retomó y terminó
+        en_espera = servicio.metricas()["por_estado"]
+        ahora[0] += datetime.timedelta(seconds=servicio_puntuacion.ESPERA_REINTENTO_SEGUNDOS)
+        await servicio.esperar()
+        servicio.detener()
+        return en_espera
+
+    en_espera = asyncio.run(escenario())
+
+    assert en_espera == {"en_cola": 1, "en_curso": 0, "hecho": 1, "fallido": 0}
+    assert llamadas == ["C2", "C1", "C1"]
+    trabajos = {t.youtube_id: t for t in db.query(models.TrabajoPuntuacion)}
+    assert (trabajos["C1"].estado, trabajos["C1"].intentos, trabajos["C1"].puntuacion) == ("hecho", 2, 70)
+    assert (trabajos["C2"].estado, trabajos["C2"].intentos) == ("hecho", 2)
+    assert servicio.metricas()["reintentadas"] == 1
+    db.expire_all()
+    assert (c1.puntuacion_ia, c2.puntuacion_ia) == (70, 70)
+
+
+def test_la_grabacion_se_conserva_para_reintentar_y_se_borra_al_fallar(monkeypatch, tmp_path):
+    Session, db = preparar(tmp_path)
+    c1 = db.query(models.Cancion).filter_by(titulo="C1").one()
+    monkeypatch.setattr(servicio_puntuacion, "DIRECTORIO_GRABACIONES", str(tmp_path))
+    ruta = servicio_puntuacion.ruta_grabacion(c1.id)
+    open(ruta, "wb").close()
+    ahora = [datetime.datetime(2026, 1, 1, 22, 0)]
+
+    def calcular(youtube_id, ruta):
+        raise RuntimeError("Falló la descarga de YouTube")
+
+    servicio = servicio_puntuacion.ServicioPuntuacion(
+        session_factory=Session, executor=ThreadPoolExecutor(max_workers=1),
+        calcular=calcular, al_puntuar=None, reloj=lambda: ahora[0],
+    )
+    servicio.intentos_maximos = 2
+
+    async def escenario():
+        await servicio.enviar(c1.id, "C1", ruta)
+        await servicio.esperar()
+        tras_el_primer_fallo = os.path.exists(ruta)
+        ahora[0] += datetime.timedelta(seconds=servicio_puntuacion.ESPERA_REINTENTO_SEGUNDOS)
+        await servicio.esperar()
+        servicio.detener()
+        return tras_el_primer_fallo
+
+    assert asyncio.run(escenario())
+    assert db.query(models.TrabajoPuntuacion.estado).scalar() == "fallido"
+    assert not os.path.exists(ruta)
+
+
+def test_el_trabajo_con_la_base_no_bloquea_el_loop(tmp_path):
+    Session, db = preparar(tmp_path)
+    c1 = db.query(models.Cancion).filter_by(titulo="C1").one()
+    hilos, puntuadas = set(), []
+
+    def sesion():
+        hilos.add(threading.get_ident())
+        return Session()
+
+    def calcular(youtube_id, ruta):
+        time.sleep(0.2)  # Da tiempo a renovar la concesión
+        return 60
+
+    async def al_puntuar(cancion):
+        puntuadas.append((cancion.id, cancion.puntuacion_ia, cancion.usuario.mesa.nombre))
+
+    servicio = servicio_puntuacion.ServicioPuntuacion(
+        session_factory=sesion, executor=ThreadPoolExecutor(max_workers=1),
+        calcular=calcular, al_puntuar=al_puntuar,
+    )
+    servicio.concesion = datetime.timedelta(seconds=0.05)
+
+    async def escenario():
+        await servicio.enviar(c1.id, "C1", "c1.wav")
+        await servicio.esperar()
+        servicio.detener()
+        return threading.get_ident()
+
+    hilo_del_loop = asyncio.run(escenario())
+
+    assert puntuadas == [(c1.id, 60, "A")]
+    assert hilos and hilo_del_loop not in hilos
+
+
+def test_prioridad_segun_el_proximo_turno_del_cantante(tmp_path):
+    Session, db = preparar(tmp_path)
+    mesa = db.query(models.Mesa).one()
+    luis = models.Usuario(nick="luis", mesa_id=mesa.id, puntos=0)
+    db.add(luis)
+    db.commit()
+    db.add(models.Cancion(titulo="L1", youtube_id="L1", usuario_id=luis.id, estado="cantada"))
+    db.commit()
+    c1 = db.query(models.Cancion).filter_by(titulo="C1").one()
+    l1 = db.query(models.Cancion).filter_by(titulo="L1").one()
+
+    servicio = servicio_puntuacion.ServicioPuntuacion(session_factory=Session, executor=ThreadPoolExecutor(max_workers=1))
+    # Ana vuelve a cantar en el primer turno (C2 aprobada); Luis no tiene más canciones
+    assert servicio._prioridad(db, c1.id) == 0
+    assert servicio._prioridad(db, l1.id) == servicio_puntuacion.PRIORIDAD_SIN_TURNO
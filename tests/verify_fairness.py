@@ -58,6 +58,8 @@ def test_fair_queue():
     db.add(models.Consumo(cantidad=1, valor_total=10000, mesa_id=mesa_c.id, usuario_id=user_c.id))
     
     db.commit()
+    # Los consumos se insertaron directamente: recalcular los totales acumulados
+    crud.reconciliar_totales_consumo(db)
     
     # 2. Add Songs (Approved)
     # Order of arrival: A1, B1, C1, A2, B2, C2, A3, B3, C3, A4
@@ -1,95 +1,533 @@
+import asyncio
+import datetime
 import json
-from typing import List
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
 from fastapi import WebSocket
 import models
 from fastapi.encoders import jsonable_encoder
 
-import schemas, crud
-from database import SessionLocal
+import schemas, crud, config
+from database import SessionLectura
+from timezone_utils import now_bogota
+
+# Protocolo opcional de la cola: los clientes que se conectan con ?protocolo=parche
+# reciben `queue_patch` (operaciones contra la versión anterior) en lugar de la cola
+# completa. Todos los mensajes de cola llevan `seq`; si un cliente detecta un salto
+# envía {"type": "queue_snapshot_request"} y recibe la cola completa.
+PROTOCOLO_PARCHE = "parche"
+
+# Topics a los que puede suscribirse un cliente (?topics=queue,mesa:3 al conectar, o
+# {"type": "subscribe"|"unsubscribe", "topics": [...]}). Quien no se suscribe a nada
+# recibe todos los eventos, como antes.
+TOPIC_COLA = "queue"
+TOPIC_PLAYER = "player"
+TOPIC_ADMIN = "admin"
+TOPIC_BAR = "bar"
+TOPIC_PRODUCTOS = "productos"
+TOPIC_REACCIONES = "reactions"
+TOPICS = {TOPIC_COLA, TOPIC_PLAYER, TOPIC_ADMIN, TOPIC_BAR, TOPIC_PRODUCTOS, TOPIC_REACCIONES}
+
+
+def topic_mesa(mesa_id: int) -> str:
+    return f"mesa:{mesa_id}"
+
+
+def normalizar_topics(topics) -> set:
+    """Filtra los topics válidos (los de TOPICS y mesa:{id})."""
+    if isinstance(topics, str):
+        topics = topics.split(",")
+    validos = set()
+    for topic in topics or []:
+        topic = str(topic).strip()
+        nombre, _, mesa_id = topic.partition(":")
+        if topic in TOPICS or (nombre == "mesa" and mesa_id.isdigit()):
+            validos.add(topic)
+    return validos
+
+
+def calcular_parche(anterior: dict, nuevo: dict) -> list:
+    """
+    Operaciones que transforman el payload de cola `anterior` en `nuevo`.
+    Las listas (upcoming, pending...) se comparan por id de canción con
+    remove/move/insert/update; el resto de claves (now_playing) con set.
+    Las operaciones se aplican en orden.
+    """
+    ops = []
+    for lista, actual in nuevo.items():
+        previo = anterior.get(lista)
+        if isinstance(actual, list) and isinstance(previo, list):
+            ops.extend(_parche_lista(lista, previo, actual))
+        elif previo != actual:
+            ops.append({"op": "set", "list": lista, "item": actual})
+    return ops
+
+
+def _parche_lista(lista: str, previa: list, actual: list) -> list:
+    ops = []
+    anteriores = {item["id"]: item for item in previa}
+    ids_actuales = {item["id"] for item in actual}
+
+    trabajo = []
+    for item in previa:
+        if item["id"] in ids_actuales:
+            trabajo.append(item["id"])
+        else:
+            ops.append({"op": "remove", "list": lista, "id": item["id"]})
+
+    for indice, item in enumerate(actual):
+        cancion_id = item["id"]
+        if cancion_id not in anteriores:
+            trabajo.insert(indice, cancion_id)
+            ops.append({"op": "insert", "list": lista, "index": indice, "item": item})
+            continue
+        if trabajo[indice] != cancion_id:
+            trabajo.remove(cancion_id)
+            trabajo.insert(indice, cancion_id)
+            ops.append({"op": "move", "list": lista, "id": cancion_id, "index": indice})
+        # Cambios de estado (u otros campos) de una canción que sigue en la lista
+        campos = {k: v for k, v in item.items() if anteriores[cancion_id].get(k) != v}
+        if campos:
+            ops.append({"op": "update", "list": lista, "id": cancion_id, "fields": campos})
+    return ops
+
+
+def _mensaje_cola(seq: int, version: int, payload_json: str) -> str:
+    """Mensaje queue_update completo a partir del payload ya serializado."""
+    return f'{{"type": "queue_update", "seq": {seq}, "version": {version}, "payload": {payload_json}}}'
+
+
+def _topics_bar(payload: dict) -> List[str]:
+    """Los pedidos y consumos van a la barra, al admin y a la mesa que los pidió."""
+    topics = [TOPIC_BAR, TOPIC_ADMIN]
+    if payload.get("mesa_id") is not None:
+        topics.append(topic_mesa(payload["mesa_id"]))
+    return topics
+
+
+class _Cliente:
+    """
+    Cola de salida acotada de una conexión. La vacía su propia tarea escritora,
+    así que un teléfono con mala señal no retrasa a los demás.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.pendientes = deque()   # [(texto, es_cola)]
+        self.hay_pendientes = asyncio.Event()
+        self.enviando = False
+        self.tarea: Optional[asyncio.Task] = None
+
+    def encolar(self, texto: str, cola_completa: Optional[str] = None) -> bool:
+        """
+        Añade un mensaje. Los mensajes de cola (`cola_completa` indica el
+        queue_update completo equivalente) sustituyen al de cola aún sin enviar:
+        el cliente recibe directamente la cola completa más reciente.
+        Devuelve True si el mensaje sustituyó a otro.
+        """
+        agrupado = False
+        if cola_completa is not None:
+            previos = len(self.pendientes)
+            self.pendientes = deque(m for m in self.pendientes if not m[1])
+            if len(self.pendientes) < previos:
+                agrupado = True
+                texto = cola_completa
+        self.pendientes.append((texto, cola_completa is not None))
+        self.hay_pendientes.set()
+        return agrupado
+
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(
+        self,
+        ventana_cola: Optional[float] = None,
+        espera_maxima_cola: Optional[float] = None,
+        max_pendientes: Optional[int] = None,
+        timeout_envio: Optional[float] = None,
+    ):
         self.active_connections: List[WebSocket] = []
+        self._clientes: Dict[WebSocket, _Cliente] = {}
+        # Índices de suscripción: topic -> conexiones, y conexión -> topics
+        self._por_topic: Dict[str, Set[WebSocket]] = {}
+        self._suscripciones: Dict[WebSocket, Set[str]] = {}
+        # Cola de salida por conexión: tamaño máximo y tiempo máximo por envío antes de expulsar
+        self.max_pendientes = max_pendientes or config.settings.WS_MAX_MENSAJES_PENDIENTES
+        self.timeout_envio = timeout_envio or config.settings.WS_TIMEOUT_ENVIO_SEGUNDOS
+        self.mensajes_agrupados = 0
+        self.expulsados_por_lentitud = 0
+        self.expulsados_por_desborde = 0
+        self._expulsiones: Set[asyncio.Task] = set()  # Cierres en curso (referencia para que no los recoja el GC)
+        self.clientes_parche = set()  # Conexiones que aceptan queue_patch
+        self.secuencia_cola = 0
+        self._ultima_cola = None      # (version, payload) del último mensaje de cola
+
+        # Agrupación de broadcast_queue_update (segundos; ventana 0 = enviar en el acto)
+        if ventana_cola is None:
+            ventana_cola = config.settings.COLA_BROADCAST_VENTANA_MS / 1000
+        if espera_maxima_cola is None:
+            espera_maxima_cola = config.settings.COLA_BROADCAST_ESPERA_MAXIMA_MS / 1000
+        self.ventana_cola = ventana_cola
+        self.espera_maxima_cola = max(espera_maxima_cola, ventana_cola)
+        self._tarea_cola = None
+        self._primera_solicitud = 0.0
+        self._ultima_solicitud = 0.0
+        self.broadcasts_cola_solicitados = 0
+        self.broadcasts_cola_enviados = 0
+        self.broadcasts_cola_sin_cambios = 0
+
+        # Última orden de reproducción enviada al player, para dar la posición a quien se conecta
+        self.reproduccion = None  # {"youtube_id", "inicio", "pausado_en"} (tiempos de time.time())
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, protocolo: Optional[str] = None, topics: Optional[str] = None):
         await websocket.accept()
         self.active_connections.append(websocket)
+        self._cliente(websocket)
+        if protocolo == PROTOCOLO_PARCHE:
+            self.clientes_parche.add(websocket)
+        if topics is not None:
+            self.subscribe(websocket, topics)
+
+    def subscribe(self, websocket: WebSocket, topics) -> Set[str]:
+        """Suscribe la conexión a los topics indicados; desde ese momento solo recibe esos."""
+        actuales = self._suscripciones.setdefault(websocket, set())
+        for topic in normalizar_topics(topics):
+            actuales.add(topic)
+            self._por_topic.setdefault(topic, set()).add(websocket)
+        return actuales
+
+    def unsubscribe(self, websocket: WebSocket, topics) -> Set[str]:
+        actuales = self._suscripciones.setdefault(websocket, set())
+        for topic in normalizar_topics(topics):
+            actuales.discard(topic)
+            self._quitar_de_topic(topic, websocket)
+        return actuales
+
+    def recibe(self, websocket: WebSocket, topic: str) -> bool:
+        """True si la conexión recibe los eventos del topic (las no suscritas reciben todos)."""
+        topics = self._suscripciones.get(websocket)
+        return topics is None or topic in topics
+
+    def _quitar_de_topic(self, topic: str, websocket: WebSocket):
+        conexiones = self._por_topic.get(topic)
+        if conexiones is not None:
+            conexiones.discard(websocket)
+            if not conexiones:
+                del self._por_topic[topic]
+
+    def _destinos(self, topics: Iterable[str]) -> List[WebSocket]:
+        """Conexiones interesadas en alguno de los topics (y las que no se suscribieron)."""
+        destinos = {}
+        for topic in topics:
+            for connection in self._por_topic.get(topic, ()):
+                destinos[connection] = None
+        # Solo recorremos la lista si quedan clientes sin suscripción (reciben todo)
+        if len(self._suscripciones) < len(self.active_connections):
+            for connection in self.active_connections:
+                if connection not in self._suscripciones:
+                    destinos[connection] = None
+        return list(destinos)
 
     def disconnect(self, websocket: WebSocket):
+        self.clientes_parche.discard(websocket)
+        for topic in self._suscripciones.pop(websocket, ()):
+            self._quitar_de_topic(topic, websocket)
+        cliente = self._clientes.pop(websocket, None)
+        if cliente and cliente.tarea and cliente.tarea is not asyncio.current_task():
+            cliente.tarea.cancel()
         try:
             self.active_connections.remove(websocket)
         except ValueError:
             # already removed
             pass
 
-    async def _broadcast(self, message: str):
-        """Método auxiliar para enviar un mensaje a todas las conexiones activas."""
-        dead_connections = []
+    def _cliente(self, websocket: WebSocket) -> _Cliente:
+        cliente = self._clientes.get(websocket)
+        if cliente is None:
+            cliente = self._clientes[websocket] = _Cliente(websocket)
+            cliente.tarea = asyncio.create_task(self._escribir(cliente))
+        return cliente
+
+    async def _escribir(self, cliente: _Cliente):
+        """Tarea escritora de una conexión: envía sus mensajes en orden, con timeout."""
+        while True:
+            await cliente.hay_pendientes.wait()
+            cliente.hay_pendientes.clear()
+            while cliente.pendientes:
+                texto, _ = cliente.pendientes.popleft()
+                cliente.enviando = True
+                try:
+                    # asyncio.timeout y no wait_for: wait_for puede tragarse la cancelación en 3.11
+                    async with asyncio.timeout(self.timeout_envio):
+                        await cliente.websocket.send_text(texto)
+                except TimeoutError:
+                    self.expulsados_por_lentitud += 1
+                    await self._expulsar(cliente.websocket)
+                    return
+                except Exception:
+                    # Si el envío falla, la conexión está muerta
+                    self.disconnect(cliente.websocket)
+                    return
+                finally:
+                    cliente.enviando = False
+
+    async def _expulsar(self, websocket: WebSocket):
+        """Desconecta a un cliente demasiado lento; al reconectar recibirá la cola completa."""
+        self.disconnect(websocket)
+        try:
+            async with asyncio.timeout(1):
+                await websocket.close(code=1008)
+        except Exception:
+            pass
+
+    async def esperar_envios(self):
+        """Espera a que se vacíen las colas de salida (pruebas, benchmarks o apagado)."""
+        while any(c.pendientes or c.enviando for c in self._clientes.values()):
+            await asyncio.sleep(0.001)
+
+    async def handle_client_message(self, websocket: WebSocket, texto: str):
+        """Procesa los mensajes que envían los clientes por el socket."""
+        try:
+            mensaje = json.loads(texto)
+        except ValueError:
+            return
+        if not isinstance(mensaje, dict):
+            return
+        tipo = mensaje.get("type")
+        if tipo == "queue_snapshot_request":
+            await self.send_queue_snapshot(websocket)
+        elif tipo in ("subscribe", "unsubscribe"):
+            if tipo == "subscribe":
+                topics = self.subscribe(websocket, mensaje.get("topics"))
+            else:
+                topics = self.unsubscribe(websocket, mensaje.get("topics"))
+            await self._broadcast(json.dumps({"type": "subscribed", "topics": sorted(topics)}), [websocket])
+
+    async def send_queue_snapshot(self, websocket: WebSocket):
+        """
+        Envía solo a este cliente la cola de la versión actual (serializada una vez
+        por versión) y, si algo suena, la posición de reproducción. No toca la base
+        de datos si la versión ya está en caché. Si la cola cambió desde el último
+        envío, el cambio se envía en ese momento a todos para que los seq y las
+        versiones base de los queue_patch sigan siendo los mismos para todos.
+        """
+        version, queue_data, texto = self._instantanea_cola()
+        if self._ultima_cola is None:
+            # Aún no se ha enviado ninguna cola: esta es la base de los próximos parches
+            self._ultima_cola = (version, queue_data)
+        anterior = self._ultima_cola
+        if anterior[1] == queue_data:
+            # La misma cola que ya tienen los demás: mismo seq y misma versión base,
+            # así el siguiente queue_patch se aplica también sobre esta instantánea
+            mensaje = _mensaje_cola(self.secuencia_cola, anterior[0], texto)
+            await self._broadcast(mensaje, [websocket], cola_completa=mensaje)
+        else:
+            # La cola cambió desde el último envío: se envía ya a todos (con un seq
+            # nuevo) y este cliente la recibe completa
+            await self._enviar_cola((version, queue_data, texto), completa_a=websocket)
+        estado = self.estado_reproduccion(queue_data.get("now_playing"))
+        if estado:
+            await self._broadcast(json.dumps({"type": "playback_state", "payload": estado}), [websocket])
+
+    def estado_reproduccion(self, now_playing: Optional[dict]) -> Optional[dict]:
+        """Posición actual de la canción que suena, según las órdenes enviadas al player."""
+        if not now_playing:
+            return None
+        reproduccion = self.reproduccion
+        if reproduccion and reproduccion["youtube_id"] == now_playing.get("youtube_id"):
+            fin = reproduccion["pausado_en"] or time.time()
+            posicion = fin - reproduccion["inicio"]
+            pausado = reproduccion["pausado_en"] is not None
+        else:
+            # Sin órdenes registradas (p. ej. tras reiniciar el servidor): usamos started_at
+            if not now_playing.get("started_at"):
+                return None
+            inicio = datetime.datetime.fromisoformat(str(now_playing["started_at"])).replace(tzinfo=None)
+            posicion = (now_bogota().replace(tzinfo=None) - inicio).total_seconds()
+            pausado = False
+        return {
+            "cancion_id": now_playing.get("id"),
+            "youtube_id": now_playing.get("youtube_id"),
+            "duracion_seconds": now_playing.get("duracion_seconds") or 0,
+            "posicion_segundos": max(0, round(posicion, 1)),
+            "pausado": pausado,
+        }
+
+    async def _broadcast(
+        self,
+        message: str,
+        conexiones: Optional[Iterable[WebSocket]] = None,
+        cola_completa: Optional[str] = None,
+        topics: Optional[Iterable[str]] = None,
+    ):
+        """
+        Método auxiliar para enviar un mensaje a todas las conexiones activas, a las
+        suscritas a `topics` o a las indicadas. Solo encola en la cola de salida de
+        cada conexión: O(N) sin esperar a la red. `cola_completa` marca los mensajes
+        de cola, que pueden agruparse.
+        """
         # Hacemos una copia de la lista para poder modificarla mientras iteramos
-        for connection in self.active_connections[:]:
-            try:
-                await connection.send_text(message)
-            except Exception:
-                # Si el envío falla, marcamos la conexión para eliminarla.
-                dead_connections.append(connection)
-
-        # Eliminamos las conexiones muertas de la lista activa.
-        for connection in dead_connections:
-            try:
-                self.active_connections.remove(connection)
-            except ValueError:
-                # La conexión ya fue eliminada, lo ignoramos.
-                pass
+        if conexiones is not None:
+            destinos = list(conexiones)
+        elif topics is not None:
+            destinos = self._destinos(topics)
+        else:
+            destinos = self.active_connections[:]
+        for connection in destinos:
+            cliente = self._clientes.get(connection)
+            if cliente is None:
+                # Una conexión ya desconectada (o expulsada) no vuelve a tener tarea escritora
+                if connection not in self.active_connections:
+                    continue
+                cliente = self._cliente(connection)
+            if cliente.encolar(message, cola_completa):
+                self.mensajes_agrupados += 1
+            if len(cliente.pendientes) > self.max_pendientes:
+                # Un cliente que acumula demasiados mensajes no está leyendo: lo expulsamos.
+                # Se desconecta ya y el cierre (hasta 1 s) se hace en otra tarea.
+                self.expulsados_por_desborde += 1
+                self.disconnect(connection)
+                tarea = asyncio.create_task(self._expulsar(connection))
+                self._expulsiones.add(tarea)
+                tarea.add_done_callback(self._expulsiones.discard)
 
     async def broadcast_queue_update(self):
-        """Obtiene la cola actualizada y la envía a todos los clientes."""
-        db = SessionLocal()
+        """
+        Pide que se envíe la cola actualizada a todos los clientes. Las peticiones
+        que llegan dentro de la ventana de agrupación se funden en una sola lectura
+        de la base de datos y un solo envío, que nunca se retrasa más de
+        `espera_maxima_cola` desde la primera petición pendiente.
+        """
+        self.broadcasts_cola_solicitados += 1
+        if self.ventana_cola <= 0:
+            await self._enviar_cola()
+            return
+        ahora = asyncio.get_running_loop().time()
+        self._ultima_solicitud = ahora
+        if self._tarea_cola is None:
+            self._primera_solicitud = ahora
+            self._tarea_cola = asyncio.create_task(self._enviar_cola_agrupada())
+
+    async def _enviar_cola_agrupada(self):
+        loop = asyncio.get_running_loop()
         try:
-            # Usamos crud.get_cola_completa para obtener la cola real (aprobada y priorizada)
-            # Esto corrige el error donde se mostraban solo canciones pendientes o se borraba la cola
-            cola_data = crud.get_cola_completa(db)
-            
-            queue_data = jsonable_encoder(cola_data)
-            
-            payload = {"type": "queue_update", "payload": queue_data}
-            await self._broadcast(json.dumps(payload, default=str))
-        except Exception as e:
-            print(f"Error broadcasting queue update: {e}")
+            while True:
+                limite = self._primera_solicitud + self.espera_maxima_cola
+                espera = min(self._ultima_solicitud + self.ventana_cola, limite) - loop.time()
+                if espera <= 0:
+                    break
+                await asyncio.sleep(espera)
+        finally:
+            # Las peticiones que lleguen a partir de aquí necesitan una lectura posterior
+            self._tarea_cola = None
+        await self._enviar_cola()
+
+    def _instantanea_cola(self):
+        """Devuelve (version, payload, payload serializado) de la cola, en caché por versión."""
+        db = SessionLectura()
+        try:
+            def construir(version):
+                # Usamos crud.get_cola_completa para obtener la cola real (aprobada y priorizada)
+                # Esto corrige el error donde se mostraban solo canciones pendientes o se borraba la cola
+                queue_data = jsonable_encoder(crud.get_cola_completa(db))
+                return queue_data, json.dumps(queue_data, default=str)
+
+            _, version, (queue_data, texto) = crud.get_instantanea_cola(db, "ws_cola", construir)
+            return version, queue_data, texto
         finally:
             db.close()
 
+    async def _enviar_cola(self, instantanea=None, completa_a: Optional[WebSocket] = None):
+        """
+        Lee la cola y la envía a todos los clientes (si cambió desde el último envío).
+        `completa_a` recibe siempre la cola completa, aunque no esté suscrito a la cola
+        (es quien pidió la instantánea).
+        """
+        try:
+            version, queue_data, texto = instantanea or self._instantanea_cola()
+            anterior = self._ultima_cola
+            if anterior is not None and anterior[1] == queue_data:
+                # Por ejemplo, un consumo que no cambia el orden: nada que enviar
+                self.broadcasts_cola_sin_cambios += 1
+                return
+
+            self.broadcasts_cola_enviados += 1
+            self.secuencia_cola += 1
+            self._ultima_cola = (version, queue_data)
+            completo = _mensaje_cola(self.secuencia_cola, version, texto)
+
+            destinos = self._destinos([TOPIC_COLA])
+            if completa_a is not None and completa_a not in destinos:
+                destinos.append(completa_a)
+            clientes_parche = [c for c in destinos if c in self.clientes_parche and c is not completa_a]
+            if anterior is None or not clientes_parche:
+                await self._broadcast(completo, destinos, cola_completa=completo)
+                return
+
+            parche = json.dumps({
+                "type": "queue_patch",
+                "seq": self.secuencia_cola,
+                "base_version": anterior[0],
+                "version": version,
+                "ops": calcular_parche(anterior[1], queue_data),
+            }, default=str)
+            if len(parche) >= len(completo):
+                parche = completo
+            clientes_completos = [c for c in destinos if c not in clientes_parche]
+            await self._broadcast(parche, clientes_parche, cola_completa=completo)
+            await self._broadcast(completo, clientes_completos, cola_completa=completo)
+        except Exception as e:
+            print(f"Error broadcasting queue update: {e}")
+
+    def metricas(self) -> dict:
+        """Contadores de los envíos de la cola, para ver cuánto ahorra la agrupación."""
+        profundidades = [len(c.pendientes) for c in self._clientes.values()]
+        return {
+            "conexiones": len(self.active_connections),
+            "conexiones_sin_suscripcion": len(self.active_connections) - len(self._suscripciones),
+            "conexiones_por_topic": {topic: len(c) for topic, c in self._por_topic.items()},
+            "mensajes_pendientes": sum(profundidades),
+            "max_mensajes_pendientes": max(profundidades, default=0),
+            "mensajes_agrupados": self.mensajes_agrupados,
+            "expulsados_por_lentitud": self.expulsados_por_lentitud,
+            "expulsados_por_desborde": self.expulsados_por_desborde,
+            "broadcasts_cola_solicitados": self.broadcasts_cola_solicitados,
+            "broadcasts_cola_enviados": self.broadcasts_cola_enviados,
+            "broadcasts_cola_sin_cambios": self.broadcasts_cola_sin_cambios,
+        }
+
     async def broadcast_product_update(self):
         """Envía una notificación para que los clientes recarguen el catálogo de productos."""
         payload = {"type": "product_update"}
-        await self._broadcast(json.dumps(payload))
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PRODUCTOS, TOPIC_BAR, TOPIC_ADMIN])
 
     async def broadcast_consumo_created(self, consumo_payload: dict):
         """
         Envía un evento indicando que se creó un nuevo consumo.
         """
         payload = {"type": "consumo_created", "payload": consumo_payload}
-        await self._broadcast(json.dumps(payload, default=str))
+        await self._broadcast(json.dumps(payload, default=str), topics=_topics_bar(consumo_payload))
 
     async def broadcast_pedido_created(self, pedido_payload: dict):
         """
         Envía un evento indicando que se creó un nuevo pedido consolidado.
         """
         payload = {"type": "pedido_created", "payload": pedido_payload}
-        await self._broadcast(json.dumps(payload, default=str))
+        await self._broadcast(json.dumps(payload, default=str), topics=_topics_bar(pedido_payload))
 
     async def broadcast_consumo_deleted(self, consumo_payload: dict):
         """
         Envía un evento indicando que un consumo fue eliminado.
         """
         payload = {"type": "consumo_deleted", "payload": consumo_payload}
-        await self._broadcast(json.dumps(payload))
+        await self._broadcast(json.dumps(payload), topics=_topics_bar(consumo_payload))
 
     async def broadcast_reaction(self, reaction_payload: dict):
         """
         Envía una reacción (emoticono) a todos los clientes.
         """
         payload = {"type": "reaction", "payload": reaction_payload}
-        await self._broadcast(json.dumps(payload))
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_REACCIONES, TOPIC_PLAYER])
 
     async def broadcast_song_finished(self, cancion: models.Cancion):
         """
@@ -105,7 +543,30 @@ class ConnectionManager:
                 "puntuacion_ia": cancion.puntuacion_ia
             }
         }
-        await self._broadcast(json.dumps(payload))
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PLAYER, TOPIC_COLA])
+
+    async def broadcast_song_scored(self, cancion: models.Cancion):
+        """
+        Envía la puntuación de la IA de una canción ya cantada, cuando termina de calcularse.
+        """
+        cantante = cancion.usuario.mesa.nombre if (cancion.usuario and cancion.usuario.mesa) else (cancion.usuario.nick if cancion.usuario else "N/A")
+        payload = {
+            "type": "song_scored",
+            "payload": {
+                "cancion_id": cancion.id,
+                "titulo": cancion.titulo,
+                "usuario_nick": cantante,
+                "puntuacion_ia": cancion.puntuacion_ia
+            }
+        }
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PLAYER, TOPIC_COLA])
+
+    async def broadcast_live_score(self, aviso: dict):
+        """
+        Envía la precisión en vivo del cantante mientras canta (ver canto_en_vivo).
+        """
+        payload = {"type": "live_score", "payload": aviso}
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PLAYER])
 
     async def broadcast_play_song(self, youtube_id: str, duration_seconds: int = 0):
         """
@@ -119,28 +580,36 @@ class ConnectionManager:
                 "duracion_seconds": duration_seconds
             }
         }
-        await self._broadcast(json.dumps(payload))
+        self.reproduccion = {"youtube_id": youtube_id, "inicio": time.time(), "pausado_en": None}
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PLAYER, TOPIC_ADMIN])
 
     async def broadcast_restart_song(self):
         """
         Envía un evento para reiniciar la canción actual en el reproductor.
         """
         payload = {"type": "restart_song"}
-        await self._broadcast(json.dumps(payload))
+        if self.reproduccion:
+            self.reproduccion.update(inicio=time.time(), pausado_en=None)
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PLAYER, TOPIC_ADMIN])
 
     async def broadcast_pause(self):
         """
         Envía un evento para pausar la reproducción actual.
         """
         payload = {"type": "pause_playback"}
-        await self._broadcast(json.dumps(payload))
+        if self.reproduccion and self.reproduccion["pausado_en"] is None:
+            self.reproduccion["pausado_en"] = time.time()
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PLAYER, TOPIC_ADMIN])
 
     async def broadcast_resume(self):
         """
         Envía un evento para reanudar la reproducción.
         """
         payload = {"type": "resume_playback"}
-        await self._broadcast(json.dumps(payload))
+        if self.reproduccion and self.reproduccion["pausado_en"] is not None:
+            self.reproduccion["inicio"] += time.time() - self.reproduccion["pausado_en"]
+            self.reproduccion["pausado_en"] = None
+        await self._broadcast(json.dumps(payload), topics=[TOPIC_PLAYER, TOPIC_ADMIN])
 
     async def broadcast_notification(self, mensaje: str):
         """